@@ -0,0 +1,356 @@
+"""
+Cubo columnar en memoria para el drill-down del dashboard (``/analytics/cube/``).
+
+Los hechos de una clínica se cargan una vez por generación del ETL en
+arreglos de NumPy: cada dimensión como códigos enteros más su diccionario
+(código -> etiqueta) y cada medida como una columna numérica. Un pedido
+(dimensiones, medidas, filtros) se resuelve sin volver a la base:
+
+- los filtros se evalúan sobre las etiquetas de cada dimensión (pocas) y se
+  expanden a las filas indexando por código;
+- el group-by combina los códigos de las dimensiones pedidas en un solo
+  índice (``np.ravel_multi_index``) y cada medida es un ``np.bincount`` con
+  pesos sobre ese índice.
+
+Los cubos se guardan por (clínica, generación) en un LRU chico del proceso:
+cuando termina otra corrida del ETL la clave cambia y el cubo viejo se
+descarta. NumPy es opcional: sin él el endpoint responde que el cubo no
+está disponible y el dashboard sigue funcionando como siempre.
+"""
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from django.conf import settings
+from django.db.models.functions import ExtractHour
+
+from . import dashboard
+from .models import DimEspecialidad, DimEstadoCita, DimMedico, DimTiempo, FactCitas
+
+try:
+    import numpy as np
+except ImportError:
+    print("ADVERTENCIA: NumPy no está instalado; el cubo de BI queda desactivado.")
+    np = None
+
+
+_CONFIG_POR_DEFECTO = {
+    'ACTIVO': True,
+    'MAX_CUBOS': 4,         # clínicas en memoria por proceso
+    'MAX_FILAS': 1000000,   # hechos por clínica; más grandes no se cargan
+}
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'BI_CUBO', {}) or {})
+    return config
+
+
+DIMENSIONES = (
+    'fecha', 'anio', 'mes', 'dia_semana', 'hora',
+    'medico', 'especialidad', 'estado', 'grupo_etario', 'genero_paciente',
+)
+MEDIDAS = ('citas', 'realizadas', 'canceladas', 'tasa_cancelacion', 'duracion_promedio')
+
+# Group-by con bincount directo mientras el producto de las cardinalidades
+# sea razonable; si no, se compactan los grupos con np.unique.
+_MAX_CELDAS_DENSAS = 1000000
+
+
+class CuboNoDisponible(Exception):
+    """El cubo no se puede usar: sin NumPy, desactivado o la clínica es demasiado grande."""
+
+
+class ConsultaCuboInvalida(Exception):
+    """Dimensiones, medidas o filtros que el cubo no entiende."""
+
+
+def _clave_orden(valor):
+    return (valor is None, valor if valor is not None else 0)
+
+
+def _codificar(valores):
+    """Códigos enteros de una columna y sus etiquetas ordenadas (los None al final)."""
+    indice = {}
+    codigos = np.fromiter((indice.setdefault(v, len(indice)) for v in valores), dtype=np.int32, count=len(valores))
+    etiquetas = sorted(indice, key=_clave_orden)
+    recodificar = np.empty(len(etiquetas), dtype=np.int32)
+    for nuevo, etiqueta in enumerate(etiquetas):
+        recodificar[indice[etiqueta]] = nuevo
+    return (recodificar[codigos] if len(codigos) else codigos), etiquetas
+
+
+class _Dimension:
+    """Códigos por fila, clave de mart por código y etiqueta mostrada por código."""
+
+    def __init__(self, codigos, claves, etiquetas=None):
+        self.codigos = codigos
+        self.claves = claves
+        self.etiquetas = etiquetas if etiquetas is not None else list(claves)
+
+    def __len__(self):
+        return len(self.claves)
+
+
+class Cubo:
+    """Hechos de una clínica (o de todas) en columnas de NumPy, para una generación del ETL."""
+
+    def __init__(self, grupo_id, generacion):
+        self.grupo_id = grupo_id
+        self.generacion = generacion
+        self.dimensiones = {}
+        self._cargar()
+
+    def _cargar(self):
+        hechos = FactCitas.objects.order_by()
+        if self.grupo_id:
+            hechos = hechos.filter(grupo_id=self.grupo_id)
+        limite = _config()['MAX_FILAS']
+        filas = list(
+            hechos.annotate(hora=ExtractHour('hora_inicio')).values_list(
+                'fecha_cita_id', 'medico_id', 'especialidad_id', 'estado_id',
+                'paciente__grupo_etario', 'paciente__genero', 'hora', 'duracion_minutos', 'cantidad_citas',
+            )[:limite + 1]
+        )
+        if len(filas) > limite:
+            raise CuboNoDisponible(f"La clínica tiene más de {limite} hechos; usar /dashboard/.")
+        self.filas = len(filas)
+        columnas = list(zip(*filas)) if filas else [()] * 9
+        fechas, medicos, especialidades, estados, grupos_etarios, generos, horas, duraciones, cantidades = columnas
+
+        # Dimensiones con clave en el mart: la etiqueta sale de la tabla de dimensión
+        codigos, claves = _codificar(fechas)
+        tiempo = {
+            t.fecha_key: t
+            for t in DimTiempo.objects.filter(fecha_key__range=(min(claves), max(claves)))
+        } if claves else {}
+        self.dimensiones['fecha'] = _Dimension(codigos, claves, [tiempo[k].fecha.isoformat() for k in claves])
+        for atributo in ('anio', 'mes', 'dia_semana'):
+            # Atributos de la fecha: códigos por fecha indexados con los códigos de fecha de cada fila
+            por_fecha, etiquetas = _codificar([getattr(tiempo[k], atributo) for k in claves])
+            self.dimensiones[atributo] = _Dimension(por_fecha[codigos] if len(claves) else codigos, etiquetas)
+
+        nombres = dict(DimMedico.objects.values_list('medico_key', 'nombre_completo'))
+        codigos, claves = _codificar(medicos)
+        self.dimensiones['medico'] = _Dimension(codigos, claves, [nombres.get(k) for k in claves])
+
+        nombres = dict(DimEspecialidad.objects.values_list('especialidad_key', 'nombre_especialidad'))
+        codigos, claves = _codificar(especialidades)
+        self.dimensiones['especialidad'] = _Dimension(codigos, claves, [nombres.get(k) for k in claves])
+
+        dim_estados = {e.estado_key: e for e in DimEstadoCita.objects.all()}
+        codigos, claves = _codificar(estados)
+        self.dimensiones['estado'] = _Dimension(codigos, claves, [dim_estados[k].descripcion_estado for k in claves])
+        realizada = np.array([dim_estados[k].codigo_estado == 'REALIZADA' for k in claves], dtype=bool)[codigos]
+        cancelada = np.array([dim_estados[k].es_cancelacion for k in claves], dtype=bool)[codigos]
+
+        for nombre, valores in (('grupo_etario', grupos_etarios), ('genero_paciente', generos), ('hora', horas)):
+            codigos, claves = _codificar(valores)
+            self.dimensiones[nombre] = _Dimension(codigos, claves)
+
+        # Pesos por fila de cada medida aditiva
+        n = np.fromiter(cantidades, dtype=np.float64, count=self.filas)
+        duracion = np.fromiter((d or 0 for d in duraciones), dtype=np.float64, count=self.filas)
+        con_duracion = np.fromiter((d is not None for d in duraciones), dtype=np.float64, count=self.filas)
+        self.pesos = {
+            'citas': n,
+            'realizadas': n * realizada,
+            'canceladas': n * cancelada,
+            'duracion_suma': duracion * realizada,
+            'duracion_n': con_duracion * realizada,
+        }
+
+    def _mascara(self, filtros, seleccion):
+        """Filas que pasan los filtros del dashboard y las selecciones ``dimension:valor``."""
+        mascara = np.ones(self.filas, dtype=bool)
+        diccionario = dashboard.diccionario(self.generacion)
+
+        def por_etiqueta(nombre, incluidas):
+            dimension = self.dimensiones[nombre]
+            return np.asarray(incluidas, dtype=bool).reshape(len(dimension))[dimension.codigos]
+
+        start_date = filtros.get('start_date')
+        end_date = filtros.get('end_date')
+        if start_date and end_date:
+            try:
+                desde, hasta = (int(date.fromisoformat(f).strftime('%Y%m%d')) for f in (start_date, end_date))
+            except ValueError:
+                raise ConsultaCuboInvalida("start_date y end_date deben tener formato AAAA-MM-DD.")
+            claves = np.array(self.dimensiones['fecha'].claves, dtype=np.int64)
+            mascara &= por_etiqueta('fecha', (claves >= desde) & (claves <= hasta))
+
+        if filtros.get('especialidad'):
+            claves = diccionario.especialidades(filtros['especialidad'])
+            mascara &= por_etiqueta('especialidad', np.isin(self.dimensiones['especialidad'].claves, claves))
+
+        if filtros.get('medico') or filtros.get('sexo_medico'):
+            claves = diccionario.medicos(filtros.get('medico'), filtros.get('sexo_medico'))
+            mascara &= por_etiqueta('medico', np.isin(self.dimensiones['medico'].claves, claves))
+
+        for nombre, valor in seleccion:
+            etiquetas = self.dimensiones[nombre].etiquetas
+            mascara &= por_etiqueta(nombre, [_texto(e) == valor for e in etiquetas])
+        return mascara
+
+    def consultar(self, dimensiones, medidas, filtros=None, seleccion=(), orden=None, limite=None):
+        inicio = time.perf_counter()
+        mascara = self._mascara(filtros or {}, seleccion)
+        filas = np.flatnonzero(mascara)
+        codigos = [self.dimensiones[d].codigos[filas] for d in dimensiones]
+        tamanos = tuple(len(self.dimensiones[d]) for d in dimensiones)
+
+        # Índice de grupo de cada fila. Con pocas celdas posibles se suma
+        # directo sobre todas y se toman las no vacías; si no, np.unique
+        # compacta los grupos presentes.
+        if not dimensiones:
+            indice, celdas = np.zeros(len(filas), dtype=np.int64), 1
+            grupos = tomar = np.zeros(1, dtype=np.int64)
+        else:
+            combinado = np.ravel_multi_index(codigos, tamanos) if len(filas) else np.zeros(0, dtype=np.int64)
+            if np.prod(tamanos, dtype=np.float64) <= _MAX_CELDAS_DENSAS:
+                celdas = int(np.prod(tamanos))
+                indice = combinado
+                grupos = tomar = np.flatnonzero(np.bincount(combinado, minlength=celdas))
+            else:
+                grupos, indice = np.unique(combinado, return_inverse=True)
+                celdas = len(grupos)
+                tomar = np.arange(celdas)
+
+        sumas = {}
+
+        def suma(nombre):
+            if nombre not in sumas:
+                sumas[nombre] = np.bincount(indice, weights=self.pesos[nombre][filas], minlength=celdas)[tomar]
+            return sumas[nombre]
+
+        valores = {}
+        for medida in medidas:
+            if medida in ('citas', 'realizadas', 'canceladas'):
+                valores[medida] = suma(medida)
+            elif medida == 'tasa_cancelacion':
+                citas = suma('citas')
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    valores[medida] = np.round(suma('canceladas') / citas * 100, 1)
+            elif medida == 'duracion_promedio':
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    valores[medida] = np.round(suma('duracion_suma') / suma('duracion_n'), 1)
+
+        codigos_grupo = np.unravel_index(grupos, tamanos) if dimensiones else ()
+        posiciones = np.arange(len(grupos))
+        if orden:
+            campo = orden.lstrip('-')
+            clave = (
+                valores[campo].astype(np.float64) if campo in valores
+                else codigos_grupo[dimensiones.index(campo)].astype(np.float64)
+            )
+            if orden.startswith('-'):
+                clave = -clave
+            posiciones = np.argsort(np.where(np.isnan(clave), np.inf, clave), kind='stable')
+        total_grupos = len(posiciones)
+        if limite:
+            posiciones = posiciones[:limite]
+
+        resultado = []
+        for posicion in posiciones.tolist():
+            fila = {
+                nombre: self.dimensiones[nombre].etiquetas[int(codigos_grupo[i][posicion])]
+                for i, nombre in enumerate(dimensiones)
+            }
+            for medida, columna in valores.items():
+                valor = float(columna[posicion])
+                if np.isnan(valor):
+                    valor = None
+                elif medida in ('citas', 'realizadas', 'canceladas'):
+                    valor = int(valor)
+                fila[medida] = valor
+            resultado.append(fila)
+
+        return {
+            'dimensiones': list(dimensiones),
+            'medidas': list(medidas),
+            'filas': resultado,
+            'total_grupos': total_grupos,
+            'hechos_filtrados': len(filas),
+            'hechos_cubo': self.filas,
+            'generacion': self.generacion,
+            'milisegundos': round((time.perf_counter() - inicio) * 1000, 2),
+        }
+
+
+def _texto(etiqueta):
+    return '' if etiqueta is None else str(etiqueta)
+
+
+def _lista(query_params, nombre, validos, por_defecto):
+    valores = [v.strip() for v in (query_params.get(nombre) or '').split(',') if v.strip()] or list(por_defecto)
+    invalidos = [v for v in valores if v not in validos]
+    if invalidos:
+        raise ConsultaCuboInvalida(f"{nombre} no válidas: {', '.join(invalidos)}. Opciones: {', '.join(validos)}.")
+    return list(dict.fromkeys(valores))
+
+
+def parsear_consulta(query_params):
+    """
+    Convierte los QueryParams del endpoint en argumentos de ``Cubo.consultar``:
+    ``dimensiones=mes,medico``, ``medidas=citas,realizadas``, los filtros del
+    dashboard, ``filtro=dimension:valor`` (repetible), ``orden=-citas`` y
+    ``limite=N``.
+    """
+    dimensiones = _lista(query_params, 'dimensiones', DIMENSIONES, ())
+    medidas = _lista(query_params, 'medidas', MEDIDAS, ('citas',))
+
+    seleccion = []
+    for filtro in query_params.getlist('filtro'):
+        nombre, separador, valor = filtro.partition(':')
+        if not separador or nombre not in DIMENSIONES:
+            raise ConsultaCuboInvalida(f"filtro '{filtro}' no válido: se espera dimension:valor.")
+        seleccion.append((nombre, valor))
+
+    orden = (query_params.get('orden') or '').strip() or None
+    if orden and orden.lstrip('-') not in set(dimensiones) | set(medidas):
+        raise ConsultaCuboInvalida("orden debe ser una de las dimensiones o medidas pedidas.")
+
+    limite = query_params.get('limite')
+    try:
+        limite = int(limite) if limite else None
+    except ValueError:
+        raise ConsultaCuboInvalida("limite debe ser un entero.")
+
+    return {
+        'dimensiones': dimensiones,
+        'medidas': medidas,
+        'filtros': dashboard.filtros(query_params),
+        'seleccion': seleccion,
+        'orden': orden,
+        'limite': limite,
+    }
+
+
+_cubos = OrderedDict()
+_cubos_lock = threading.Lock()
+
+
+def obtener(grupo_id, generacion):
+    """Cubo de la clínica para la generación dada, cargándolo si hace falta."""
+    if np is None:
+        raise CuboNoDisponible("NumPy no está instalado en el servidor.")
+    config = _config()
+    if not config['ACTIVO']:
+        raise CuboNoDisponible("El cubo de BI está desactivado (BI_CUBO['ACTIVO']).")
+
+    clave = (grupo_id, generacion)
+    with _cubos_lock:
+        cubo = _cubos.get(clave)
+        if cubo is not None:
+            _cubos.move_to_end(clave)
+            return cubo
+        # Los cubos de generaciones anteriores de la misma clínica ya no se piden
+        for vieja in [c for c in _cubos if c[0] == grupo_id]:
+            del _cubos[vieja]
+        cubo = Cubo(grupo_id, generacion)
+        _cubos[clave] = cubo
+        while len(_cubos) > config['MAX_CUBOS']:
+            _cubos.popitem(last=False)
+        return cubo
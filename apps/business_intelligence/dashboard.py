@@ -0,0 +1,281 @@
+"""
+Cálculo del dashboard de BI en dos consultas, y su clave de caché.
+
+1. ``kpis``: un único ``aggregate()`` con agregados condicionales
+   (``filter=Q(...)``) para total, realizadas, canceladas y duración.
+2. ``desgloses``: todos los desgloses (tendencia, médicos, edad, sexo,
+   heatmap, especialidades, estados) en una sola pasada sobre el conjunto
+   filtrado. En PostgreSQL es un ``GROUP BY GROUPING SETS``; en otras bases,
+   la misma consulta base en un ``WITH`` y un ``GROUP BY`` por desglose unidos
+   con ``UNION ALL``. Cada fila trae además los conteos de realizadas y
+   canceladas, así que los desgloses de solo realizadas o solo canceladas
+   salen de las mismas filas.
+
+La consulta base es el queryset ya filtrado (clínica y filtros del request)
+convertido a SQL por el ORM, así que las dos fuentes (hechos crudos y rollup
+diario) y todos los filtros usan el mismo camino.
+
+La respuesta completa se cachea (caché de reportes, ``apps.reportes.cache``)
+por clínica, filtros normalizados y generación del ETL (``etl.generacion``):
+mientras no termine otra corrida, el mismo pedido es un acierto, y la clave
+hace de ETag para que el polling del frontend reciba 304.
+
+Los filtros de texto (especialidad, médico) se resuelven contra un
+diccionario de las dimensiones en memoria del proceso (``diccionario``),
+que se recarga cuando cambia la generación del ETL.
+"""
+import hashlib
+import threading
+
+from django.db import connections
+from django.db.models import Case, F, IntegerField, Q, Sum, Value, When
+from django.db.models.functions import ExtractHour
+
+from .models import DimEspecialidad, DimMedico, FactCitas, RollupCitasDiario
+
+
+REALIZADA = Q(estado__codigo_estado='REALIZADA')
+CANCELADA = Q(estado__es_cancelacion=True)
+
+# Cada fuente describe cómo obtener, por fila, la cantidad de citas, la suma
+# de duraciones y cuántas citas tienen duración (para promedios exactos).
+FUENTE_HECHOS = {
+    'nombre': 'hechos',
+    'modelo': FactCitas,
+    'n': Value(1, output_field=IntegerField()),
+    'duracion_suma': F('duracion_minutos'),
+    'duracion_n': Case(When(duracion_minutos__isnull=False, then=Value(1)), default=Value(0), output_field=IntegerField()),
+    'grupo_etario': F('paciente__grupo_etario'),
+    'genero': F('paciente__genero'),
+    'hora': ExtractHour('hora_inicio'),
+}
+
+FUENTE_ROLLUP = {
+    'nombre': 'rollup',
+    'modelo': RollupCitasDiario,
+    'n': F('cantidad'),
+    'duracion_suma': F('duracion_suma'),
+    'duracion_n': F('duracion_n'),
+    'grupo_etario': F('grupo_etario'),
+    'genero': F('genero_paciente'),
+    'hora': F('hora'),
+}
+
+
+# Parámetros que cambian la respuesta; cualquier otro (p. ej. un cache-buster) se ignora.
+FILTROS = ('start_date', 'end_date', 'especialidad', 'medico', 'sexo_medico', 'fuente')
+
+
+def filtros(query_params):
+    """Filtros del request sin espacios ni vacíos."""
+    valores = {clave: (query_params.get(clave) or '').strip() for clave in FILTROS}
+    return {clave: valor for clave, valor in valores.items() if valor}
+
+
+def clave_cache(grupo_id, filtros, generacion):
+    ambito = f'grupo:{grupo_id}' if grupo_id else 'global'
+    params = '&'.join(f'{k}={filtros[k]}' for k in sorted(filtros))
+    return hashlib.sha256(f'bi-dashboard|{ambito}|{params}|{generacion}'.encode()).hexdigest()
+
+
+class DiccionarioDimensiones:
+    """
+    Nombres de especialidades y médicos del mart con sus claves. Resuelve los
+    filtros de texto del dashboard con la misma semántica que ``icontains``.
+    """
+
+    def __init__(self, generacion):
+        self.generacion = generacion
+        self._especialidades = [
+            (clave, nombre.casefold())
+            for clave, nombre in DimEspecialidad.objects.values_list('especialidad_key', 'nombre_especialidad')
+        ]
+        self._medicos = [
+            (clave, nombre.casefold(), genero)
+            for clave, nombre, genero in DimMedico.objects.values_list('medico_key', 'nombre_completo', 'genero')
+        ]
+
+    def especialidades(self, texto):
+        texto = texto.casefold()
+        return [clave for clave, nombre in self._especialidades if texto in nombre]
+
+    def medicos(self, texto=None, genero=None):
+        texto = texto.casefold() if texto else ''
+        return [
+            clave for clave, nombre, genero_medico in self._medicos
+            if texto in nombre and (not genero or genero_medico == genero)
+        ]
+
+
+_diccionario = None
+_diccionario_lock = threading.Lock()
+
+
+def diccionario(generacion):
+    """Diccionario de dimensiones del proceso, recargado si cambió la generación del ETL."""
+    global _diccionario
+    actual = _diccionario
+    if actual is None or actual.generacion != generacion:
+        with _diccionario_lock:
+            if _diccionario is None or _diccionario.generacion != generacion:
+                _diccionario = DiccionarioDimensiones(generacion)
+            actual = _diccionario
+    return actual
+
+
+def _promedio(suma, n):
+    return round(float(suma) / n, 1) if suma is not None and n else None
+
+
+def kpis(queryset, fuente):
+    """Resumen ejecutivo en una consulta."""
+    n = fuente['n']
+    fila = queryset.aggregate(
+        total=Sum(n),
+        realizadas=Sum(n, filter=REALIZADA),
+        canceladas=Sum(n, filter=CANCELADA),
+        duracion_suma=Sum(fuente['duracion_suma'], filter=REALIZADA),
+        duracion_n=Sum(fuente['duracion_n'], filter=REALIZADA),
+    )
+    total = int(fila['total'] or 0)
+    canceladas = int(fila['canceladas'] or 0)
+    return {
+        "total_citas": total,
+        "realizadas": int(fila['realizadas'] or 0),
+        "canceladas": canceladas,
+        "tasa_cancelacion": round((canceladas / total) * 100, 1) if total > 0 else 0,
+        "duracion_promedio": _promedio(fila['duracion_suma'], fila['duracion_n']) or 0,
+    }
+
+
+# Desglose -> columnas que agrupa. La primera columna de cada desglose no
+# aparece en ningún otro: GROUPING() sobre ella identifica la fila.
+DESGLOSES = [
+    ('tendencia', ['mes', 'nombre_mes']),
+    ('medicos', ['medico']),
+    ('edad', ['grupo_etario']),
+    ('sexo', ['genero']),
+    ('heatmap', ['dia_semana', 'nombre_dia', 'hora']),
+    ('especialidades', ['especialidad']),
+    ('estados', ['estado']),
+]
+_COLUMNAS = [columna for _, columnas in DESGLOSES for columna in columnas]
+_METRICAS = ['total', 'realizadas', 'canceladas', 'duracion_suma', 'duracion_n']
+
+
+def _consulta_base(queryset, fuente):
+    """Una fila por hecho (o fila del rollup) con las columnas de todos los desgloses."""
+    columnas = {
+        'd_mes': F('fecha_cita__mes'),
+        'd_nombre_mes': F('fecha_cita__nombre_mes'),
+        'd_medico': F('medico__nombre_completo'),
+        'd_grupo_etario': fuente['grupo_etario'],
+        'd_genero': fuente['genero'],
+        'd_dia_semana': F('fecha_cita__dia_semana'),
+        'd_nombre_dia': F('fecha_cita__nombre_dia'),
+        'd_hora': fuente['hora'],
+        'd_especialidad': F('especialidad__nombre_especialidad'),
+        'd_estado': F('estado__descripcion_estado'),
+        'm_n': fuente['n'],
+        'm_realizada': Case(When(REALIZADA, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        'm_cancelada': Case(When(CANCELADA, then=Value(1)), default=Value(0), output_field=IntegerField()),
+        'm_duracion_suma': fuente['duracion_suma'],
+        'm_duracion_n': fuente['duracion_n'],
+    }
+    return queryset.order_by().annotate(**columnas).values(*columnas).query.sql_with_params()
+
+
+def _sql_desgloses(base_sql, vendor, quote):
+    agregados = (
+        f"SUM({quote('m_n')}) AS total, "
+        f"SUM({quote('m_n')} * {quote('m_realizada')}) AS realizadas, "
+        f"SUM({quote('m_n')} * {quote('m_cancelada')}) AS canceladas, "
+        f"SUM({quote('m_duracion_suma')} * {quote('m_realizada')}) AS duracion_suma, "
+        f"SUM({quote('m_duracion_n')} * {quote('m_realizada')}) AS duracion_n"
+    )
+    if vendor == 'postgresql':
+        cols = ', '.join(quote(f'd_{c}') for c in _COLUMNAS)
+        conjunto = ' '.join(
+            f"WHEN GROUPING({quote(f'd_{columnas[0]}')}) = 0 THEN '{nombre}'" for nombre, columnas in DESGLOSES
+        )
+        sets = ', '.join(
+            '(' + ', '.join(quote(f'd_{c}') for c in columnas) + ')' for _, columnas in DESGLOSES
+        )
+        return (
+            f"SELECT CASE {conjunto} END AS conjunto, {cols}, {agregados} "
+            f"FROM ({base_sql}) AS b GROUP BY GROUPING SETS ({sets})"
+        )
+
+    partes = []
+    for nombre, columnas in DESGLOSES:
+        cols = ', '.join(quote(f'd_{c}') if c in columnas else 'NULL' for c in _COLUMNAS)
+        grupo = ', '.join(quote(f'd_{c}') for c in columnas)
+        partes.append(f"SELECT '{nombre}' AS conjunto, {cols}, {agregados} FROM b GROUP BY {grupo}")
+    return f"WITH b AS ({base_sql}) " + ' UNION ALL '.join(partes)
+
+
+def _ordenar(filas, *claves, desc=False):
+    """Ordena por las claves dejando al final las filas con alguna clave nula."""
+    completas = [f for f in filas if all(f[c] is not None for c in claves)]
+    completas.sort(key=lambda f: tuple(f[c] for c in claves), reverse=desc)
+    return completas + [f for f in filas if any(f[c] is None for c in claves)]
+
+
+def desgloses(queryset, fuente):
+    """Todos los desgloses del dashboard en una consulta, con las claves de respuesta de siempre."""
+    base_sql, params = _consulta_base(queryset, fuente)
+    connection = connections[queryset.db]
+    sql = _sql_desgloses(base_sql, connection.vendor, connection.ops.quote_name)
+    por_conjunto = {nombre: [] for nombre, _ in DESGLOSES}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for fila in cursor.fetchall():
+            datos = dict(zip(['conjunto', *_COLUMNAS, *_METRICAS], fila))
+            for metrica in ('total', 'realizadas', 'canceladas', 'duracion_n'):
+                datos[metrica] = int(datos[metrica] or 0)
+            por_conjunto[datos['conjunto']].append(datos)
+
+    tendencia = [
+        {'fecha_cita__nombre_mes': f['nombre_mes'], 'fecha_cita__mes': f['mes'], 'total': f['total']}
+        for f in _ordenar(por_conjunto['tendencia'], 'mes')
+    ]
+    top_medicos = [
+        {'medico__nombre_completo': f['medico'], 'citas': f['realizadas']}
+        for f in _ordenar([f for f in por_conjunto['medicos'] if f['realizadas']], 'realizadas', desc=True)[:5]
+    ]
+    dist_edad = [
+        {'paciente__grupo_etario': f['grupo_etario'], 'total': f['total']}
+        for f in _ordenar(por_conjunto['edad'], 'total', desc=True)
+    ]
+    dist_sexo = [{'paciente__genero': f['genero'], 'total': f['total']} for f in por_conjunto['sexo']]
+    heatmap = [
+        {'fecha_cita__nombre_dia': f['nombre_dia'], 'fecha_cita__dia_semana': f['dia_semana'], 'hora': f['hora'],
+         'cantidad': f['total']}
+        for f in _ordenar(por_conjunto['heatmap'], 'dia_semana', 'hora')
+    ]
+    duracion_especialidad = _ordenar(
+        [
+            {'especialidad__nombre_especialidad': f['especialidad'],
+             'promedio_min': float(f['duracion_suma']) / f['duracion_n'] if f['duracion_n'] else None}
+            for f in por_conjunto['especialidades'] if f['realizadas']
+        ],
+        'promedio_min', desc=True,
+    )
+    cancelaciones_motivo = [
+        {'estado__descripcion_estado': f['estado'], 'total': f['canceladas']}
+        for f in _ordenar([f for f in por_conjunto['estados'] if f['canceladas']], 'canceladas', desc=True)
+    ]
+    cancelaciones_especialidad = [
+        {'especialidad__nombre_especialidad': f['especialidad'], 'total': f['canceladas']}
+        for f in _ordenar([f for f in por_conjunto['especialidades'] if f['canceladas']], 'canceladas', desc=True)[:5]
+    ]
+    return {
+        'tendencia': tendencia,
+        'top_medicos': top_medicos,
+        'distribucion_edad': dist_edad,
+        'distribucion_sexo': dist_sexo,
+        'heatmap': heatmap,
+        'duracion_por_especialidad': duracion_especialidad,
+        'cancelaciones_por_motivo': cancelaciones_motivo,
+        'cancelaciones_por_especialidad': cancelaciones_especialidad,
+    }
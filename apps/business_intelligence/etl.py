@@ -1,20 +1,611 @@
-from django.db import transaction
+"""
+ETL incremental del DataMart de citas.
+
+Cada corrida lee solo lo que cambió desde la anterior (``EtlWatermark``,
+menos ``MARGEN_SEGUNDOS`` para transacciones que confirmaron tarde):
+
+- Dimensiones: médicos y pacientes modificados desde la marca (``ultimo_login``
+  del usuario, que es ``auto_now``, y ``fecha_modificacion`` del paciente), más
+  los pacientes que cambiaron de grupo etario desde la última corrida. Se
+  escriben por lotes con ``bulk_create(update_conflicts=True)`` sobre las
+  columnas únicas ``id_*_sistema``. Especialidades y estados son catálogos
+  chicos y se sincronizan completos, en una consulta cada uno.
+- Hechos: citas modificadas desde la marca (``fecha_modificacion``; los
+  cambios de estado por lote también la actualizan). Las que no están en
+  ``fact_citas`` se insertan y las que ya están se actualizan con
+  ``bulk_update``, así un cambio de estado (PENDIENTE→COMPLETADA,
+  cancelación) llega al DataMart sin reconstruirlo. La clave del hecho
+  existente y las de médico, paciente y especialidad se resuelven con
+  subconsultas en la misma consulta; la fecha es directamente la clave de
+  ``dim_tiempo``.
+
+La carga de hechos se parte en rangos de ids (``PARTICION``) que procesan
+``HILOS`` hilos, cada uno con su conexión y confirmando cada partición en su
+propia transacción. ``EtlEjecucion`` guarda el historial de corridas (avance,
+filas/s, rechazos); ``EtlCheckpoint``, las particiones de cada una, así una
+corrida caída se reanuda en la siguiente sin repetir lo ya confirmado; y
+``EtlRechazo``, las citas que no se pudieron cargar y por qué. La marca de
+agua de las citas solo avanza cuando todas las particiones terminaron.
+
+Al final, ``RollupCitasDiario`` (hechos agregados por día, clínica, médico,
+especialidad, estado, grupo etario, género y hora, que lee el dashboard) se
+recalcula solo para los días que la corrida tocó: las particiones anotan en
+``EtlRollupPendiente`` el día viejo y el nuevo de cada hecho escrito, y el
+paso de pacientes los días de los pacientes que cambiaron.
+
+Con ``completo=True`` se ignoran las marcas (carga inicial o reconstrucción).
+
+Las corridas no se ejecutan en el request: ``encolar`` crea una
+``EtlEjecucion`` PENDIENTE (o devuelve la que ya espera) y, según ``MODO``,
+la corre un hilo del proceso web, el comando ``programar_etl`` o el mismo
+request (``'sincrono'``, para tests). ``bloqueo_etl`` (advisory lock en
+PostgreSQL) garantiza una sola corrida a la vez entre todos los procesos.
+"""
 from django.apps import apps
-from datetime import date, datetime
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, connection, transaction
+from django.db.models import Count, F, Max, Min, OuterRef, Q, Subquery, Sum
+from django.db.models.functions import ExtractHour
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from itertools import islice
 import locale
 import sys
+import threading
 import time
+import traceback
 
 # Imports locales
-from .models import DimTiempo, DimMedico, DimEspecialidad, DimPaciente, DimEstadoCita, FactCitas
+from .models import (
+    DimTiempo, DimMedico, DimEspecialidad, DimPaciente, DimEstadoCita, FactCitas,
+    EtlCheckpoint, EtlEjecucion, EtlRechazo, EtlRollupPendiente, EtlWatermark, RollupCitasDiario,
+)
+
+
+_CONFIG_POR_DEFECTO = {
+    'MARGEN_SEGUNDOS': 300,   # solapamiento entre corridas; los upserts absorben lo repetido
+    'LOTE': 2000,
+    'PARTICION': 20000,       # ids de cita por partición de la carga de hechos
+    'HILOS': 4,               # particiones en paralelo (1 en SQLite)
+    'MODO': 'hilos',          # 'hilos' | 'proceso' (comando programar_etl) | 'sincrono'
+    'CADA_MINUTOS': 60,       # corrida periódica del comando programar_etl
+    'INTERVALO_SONDEO': 5.0,  # segundos entre consultas de programar_etl
+}
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'BI_ETL', {}) or {})
+    return config
+
+
+ID_ESPECIALIDAD_GENERAL = 9999
+
+ESTADOS = [
+    ('REALIZADA', 'Cita Realizada', False, True),
+    ('CONFIRMADA', 'Confirmada', False, False),
+    ('EN_PROCESO', 'En Atención', False, True),
+    ('PENDIENTE', 'Pendiente', False, False),
+    ('CANCELADA', 'Cancelada', True, False),
+    ('NO_ASISTIO', 'No Asistió', True, False),
+]
+
+# Estados de Cita_Medica que en el DataMart tienen otro código
+ESTADOS_ORIGEN = {'COMPLETADA': 'REALIZADA'}
+
+# Columnas del hecho que dependen de la cita (todas menos las claves propias)
+CAMPOS_HECHO = [
+    'fecha_cita', 'medico', 'paciente', 'especialidad', 'estado', 'grupo_id',
+    'hora_inicio', 'duracion_minutos', 'tiempo_anticipacion_dias',
+]
+
+# Edad (en días, como la calcula grupo_etario) en la que un paciente cambia de grupo
+_LIMITES_GRUPO_ETARIO = [13 * 365, 19 * 365, 61 * 365]
+
+
+def grupo_etario(fecha_nacimiento, hoy=None):
+    edad = ((hoy or date.today()) - fecha_nacimiento).days // 365 if fecha_nacimiento else 0
+    if edad <= 12:
+        return 'Niño'
+    if edad <= 18:
+        return 'Adolescente'
+    if edad > 60:
+        return 'Senior'
+    return 'Adulto'
+
+
+def _en_lotes(iterable, tamano):
+    iterador = iter(iterable)
+    while lote := list(islice(iterador, tamano)):
+        yield lote
+
+
+def _marca(paso, completo):
+    """Desde cuándo leer cambios para ``paso`` (None: todo)."""
+    if completo:
+        return None
+    marca = EtlWatermark.objects.filter(paso=paso).values_list('marca', flat=True).first()
+    if marca is None:
+        return None
+    return marca - timedelta(seconds=_config()['MARGEN_SEGUNDOS'])
+
+
+def _guardar_marca(paso, inicio):
+    EtlWatermark.objects.update_or_create(paso=paso, defaults={'marca': inicio})
+
+
+def _upsert(modelo, objetos, unique_field, update_fields):
+    """Inserta o actualiza por lotes sobre la columna única. Devuelve cuántas filas escribió."""
+    total = 0
+    for lote in _en_lotes(objetos, _config()['LOTE']):
+        modelo.objects.bulk_create(
+            lote, update_conflicts=True, unique_fields=[unique_field], update_fields=update_fields
+        )
+        total += len(lote)
+    return total
+
+
+def _cargar_tiempo(fechas):
+    objs_tiempo = []
+    for fecha in fechas:
+        objs_tiempo.append(DimTiempo(
+            fecha_key=int(fecha.strftime('%Y%m%d')), fecha=fecha, anio=fecha.year,
+            semestre=1 if fecha.month <= 6 else 2,
+            trimestre=(fecha.month - 1) // 3 + 1, mes=fecha.month, dia=fecha.day,
+            nombre_mes=fecha.strftime('%B').capitalize(),
+            dia_semana=fecha.weekday() + 1,
+            nombre_dia=fecha.strftime('%A').capitalize(),
+            es_fin_de_semana=fecha.weekday() >= 5
+        ))
+    DimTiempo.objects.bulk_create(objs_tiempo, ignore_conflicts=True, batch_size=_config()['LOTE'])
+    return len(objs_tiempo)
+
+
+def _cargar_medicos(Medico, marca):
+    medicos = Medico.objects.order_by()
+    if marca:
+        medicos = medicos.filter(ultimo_login__gt=marca)
+    filas = medicos.values_list('usuario_ptr_id', 'nombre', 'numero_colegiado', 'sexo', 'fecha_registro')
+    return _upsert(
+        DimMedico,
+        (
+            DimMedico(id_medico_sistema=pk, nombre_completo=nombre, numero_colegiado=colegiado or 'S/N',
+                      genero=sexo or 'X', fecha_registro=registro)
+            for pk, nombre, colegiado, sexo, registro in filas.iterator(chunk_size=_config()['LOTE'])
+        ),
+        'id_medico_sistema',
+        ['nombre_completo', 'numero_colegiado', 'genero', 'fecha_registro'],
+    )
+
+
+def _cargar_especialidades(Especialidad):
+    especialidades = [
+        DimEspecialidad(id_especialidad_sistema=pk, nombre_especialidad=nombre)
+        for pk, nombre in Especialidad.objects.order_by().values_list('id', 'nombre')
+    ]
+    especialidades.append(DimEspecialidad(id_especialidad_sistema=ID_ESPECIALIDAD_GENERAL, nombre_especialidad='General'))
+    return _upsert(DimEspecialidad, especialidades, 'id_especialidad_sistema', ['nombre_especialidad'])
+
+
+def _pacientes_cambiados(Paciente, marca, hoy):
+    pacientes = Paciente.objects.order_by()
+    if marca:
+        cambios = Q(fecha_modificacion__gt=marca) | Q(usuario__ultimo_login__gt=marca)
+        # Sin tocar la fila, el grupo etario cambia al cumplir años
+        for limite in _LIMITES_GRUPO_ETARIO:
+            cambios |= Q(
+                usuario__fecha_nacimiento__gt=marca.date() - timedelta(days=limite),
+                usuario__fecha_nacimiento__lte=hoy - timedelta(days=limite),
+            )
+        pacientes = pacientes.filter(cambios)
+    return pacientes
+
+
+def _cargar_pacientes(pacientes, hoy):
+    filas = pacientes.values_list(
+        'id', 'numero_historia_clinica', 'usuario__nombre', 'usuario__sexo', 'usuario__fecha_nacimiento'
+    )
+    return _upsert(
+        DimPaciente,
+        (
+            DimPaciente(id_paciente_sistema=pk, numero_historia_clinica=historia, nombre_completo=nombre,
+                        genero=sexo or 'X', fecha_nacimiento=nacimiento or date(2000, 1, 1),
+                        grupo_etario=grupo_etario(nacimiento, hoy))
+            for pk, historia, nombre, sexo, nacimiento in filas.iterator(chunk_size=_config()['LOTE'])
+        ),
+        'id_paciente_sistema',
+        ['numero_historia_clinica', 'nombre_completo', 'genero', 'fecha_nacimiento', 'grupo_etario'],
+    )
+
+
+def _cargar_estados():
+    _upsert(
+        DimEstadoCita,
+        [
+            DimEstadoCita(codigo_estado=cod, descripcion_estado=desc, es_cancelacion=es_cancel, es_asistencia=es_asist)
+            for cod, desc, es_cancel, es_asist in ESTADOS
+        ],
+        'codigo_estado',
+        ['descripcion_estado', 'es_cancelacion', 'es_asistencia'],
+    )
+    return dict(DimEstadoCita.objects.values_list('codigo_estado', 'estado_key'))
+
+
+def _citas_cambiadas(CitaMedica, Especialidad, marca):
+    """Citas modificadas desde ``marca``, con la clave de su hecho (si existe) y de sus dimensiones."""
+    citas = CitaMedica.objects.order_by()
+    if marca:
+        citas = citas.filter(fecha_modificacion__gt=marca)
+    return citas.annotate(
+        cita_key=Subquery(
+            FactCitas.objects.filter(id_cita_sistema=OuterRef('pk')).values('cita_key')[:1]
+        ),
+        medico_key=Subquery(
+            DimMedico.objects.filter(id_medico_sistema=OuterRef('bloque_horario__medico')).values('medico_key')[:1]
+        ),
+        paciente_key=Subquery(
+            DimPaciente.objects.filter(id_paciente_sistema=OuterRef('paciente')).values('paciente_key')[:1]
+        ),
+        # Primera especialidad del médico en el orden del modelo (por nombre)
+        especialidad_sistema=Subquery(
+            Especialidad.objects.filter(medicos=OuterRef('bloque_horario__medico')).order_by('nombre').values('id')[:1]
+        ),
+    )
+
+
+class _Contexto:
+    """Lo que cada partición necesita y no cambia durante la corrida (se comparte entre hilos)."""
+
+    def __init__(self, CitaMedica, Especialidad, marca, mapa_estados):
+        self.CitaMedica = CitaMedica
+        self.Especialidad = Especialidad
+        self.marca = marca
+        self.mapa_estados = mapa_estados
+        self.estado_default = mapa_estados['PENDIENTE']
+        self.mapa_especialidad = dict(
+            DimEspecialidad.objects.values_list('id_especialidad_sistema', 'especialidad_key')
+        )
+        self.esp_general = self.mapa_especialidad[ID_ESPECIALIDAD_GENERAL]
+
+
+def _hecho(ctx, fila):
+    """Arma el hecho de una fila de ``_citas_cambiadas``; lanza ValueError si no se puede cargar."""
+    (cita_id, fecha, hora_inicio, hora_fin, estado_cita, fecha_creacion, grupo_id,
+     cita_key, medico_key, paciente_key, especialidad_sistema) = fila
+    if medico_key is None:
+        raise ValueError("La cita no tiene médico en el DataMart (¿bloque horario sin médico?).")
+    if paciente_key is None:
+        raise ValueError("El paciente de la cita no está en el DataMart.")
+
+    duracion = 30
+    if hora_inicio and hora_fin:
+        dummy = date.today()
+        duracion = (datetime.combine(dummy, hora_fin) - datetime.combine(dummy, hora_inicio)).seconds // 60
+
+    estado_cita = ESTADOS_ORIGEN.get(estado_cita, estado_cita) or 'PENDIENTE'
+    return FactCitas(
+        cita_key=cita_key,
+        fecha_cita_id=int(fecha.strftime('%Y%m%d')),
+        medico_id=medico_key,
+        paciente_id=paciente_key,
+        especialidad_id=ctx.mapa_especialidad.get(especialidad_sistema, ctx.esp_general),
+        estado_id=ctx.mapa_estados.get(estado_cita, ctx.estado_default),
+        id_cita_sistema=cita_id,
+        grupo_id=grupo_id,
+        hora_inicio=hora_inicio,
+        cantidad_citas=1,
+        duracion_minutos=duracion,
+        tiempo_anticipacion_dias=(fecha - fecha_creacion.date()).days if fecha_creacion else 0
+    )
+
+
+def _crear_particiones(ejecucion, CitaMedica):
+    """Divide las citas a leer en rangos de ``PARTICION`` ids y los registra como checkpoints."""
+    citas = CitaMedica.objects.order_by()
+    if ejecucion.marca_desde:
+        citas = citas.filter(fecha_modificacion__gt=ejecucion.marca_desde)
+    rango = citas.aggregate(desde=Min('id'), hasta=Max('id'))
+    particiones = []
+    if rango['desde'] is not None:
+        tamano = _config()['PARTICION']
+        for desde in range(rango['desde'], rango['hasta'] + 1, tamano):
+            particiones.append(EtlCheckpoint(ejecucion=ejecucion, desde_id=desde, hasta_id=desde + tamano))
+    EtlCheckpoint.objects.bulk_create(particiones)
+    ejecucion.particiones_total = len(particiones)
+    ejecucion.save(update_fields=['particiones_total'])
+
+
+def _insertar_hechos(hechos, dias):
+    if not hechos:
+        return 0
+    FactCitas.objects.bulk_create(hechos)
+    dias.update((h.grupo_id, h.fecha_cita_id) for h in hechos)
+    return len(hechos)
+
+
+def _actualizar_hechos(hechos, dias):
+    if not hechos:
+        return 0
+    # El rollup del día (y clínica) del que sale la cita también cambia
+    dias.update(
+        FactCitas.objects.filter(cita_key__in=[h.cita_key for h in hechos])
+        .order_by().values_list('grupo_id', 'fecha_cita_id').distinct()
+    )
+    FactCitas.objects.bulk_update(hechos, CAMPOS_HECHO)
+    dias.update((h.grupo_id, h.fecha_cita_id) for h in hechos)
+    return len(hechos)
+
+
+def _marcar_dias(dias):
+    """Anota los días (por clínica) cuyo rollup hay que recalcular al final de la corrida."""
+    EtlRollupPendiente.objects.bulk_create(
+        [EtlRollupPendiente(grupo_id=grupo_id, fecha_key=fecha_key) for grupo_id, fecha_key in dias],
+        ignore_conflicts=True, batch_size=_config()['LOTE'],
+    )
+
+
+def _cargar_particion(ctx, ejecucion_id, checkpoint):
+    """Carga los hechos de un rango de ids en su propia transacción. Devuelve las filas leídas."""
+    inicio = time.time()
+    lote = _config()['LOTE']
+    citas = _citas_cambiadas(ctx.CitaMedica, ctx.Especialidad, ctx.marca).filter(
+        id__gte=checkpoint.desde_id, id__lt=checkpoint.hasta_id
+    )
+    filas = citas.values_list(
+        'id', 'fecha', 'hora_inicio', 'hora_fin', 'estado_cita', 'fecha_creacion', 'grupo_id',
+        'cita_key', 'medico_key', 'paciente_key', 'especialidad_sistema',
+    )
+    with transaction.atomic():
+        nuevos_hechos, hechos_cambiados, rechazos = [], [], []
+        dias = set()
+        leidas = insertados = actualizados = 0
+        for fila in filas.iterator(chunk_size=lote):
+            leidas += 1
+            try:
+                hecho = _hecho(ctx, fila)
+            except Exception as e:
+                rechazos.append(EtlRechazo(ejecucion_id=ejecucion_id, id_cita_sistema=fila[0], motivo=str(e)[:1000]))
+                continue
+            if hecho.cita_key is None:
+                nuevos_hechos.append(hecho)
+            else:
+                hechos_cambiados.append(hecho)
+
+            if len(nuevos_hechos) >= lote:
+                insertados += _insertar_hechos(nuevos_hechos, dias)
+                nuevos_hechos = []
+            if len(hechos_cambiados) >= lote:
+                actualizados += _actualizar_hechos(hechos_cambiados, dias)
+                hechos_cambiados = []
+
+        insertados += _insertar_hechos(nuevos_hechos, dias)
+        actualizados += _actualizar_hechos(hechos_cambiados, dias)
+        EtlRechazo.objects.bulk_create(rechazos, batch_size=lote)
+        _marcar_dias(dias)
+
+        EtlCheckpoint.objects.filter(pk=checkpoint.pk).update(
+            completada=True, filas_leidas=leidas, segundos=round(time.time() - inicio, 3), fecha_fin=timezone.now()
+        )
+        EtlEjecucion.objects.filter(pk=ejecucion_id).update(
+            particiones_hechas=F('particiones_hechas') + 1,
+            filas_leidas=F('filas_leidas') + leidas,
+            filas_insertadas=F('filas_insertadas') + insertados,
+            filas_actualizadas=F('filas_actualizadas') + actualizados,
+            filas_rechazadas=F('filas_rechazadas') + len(rechazos),
+        )
+    return leidas
+
+
+def _cargar_particion_en_hilo(ctx, ejecucion_id, checkpoint):
+    try:
+        return _cargar_particion(ctx, ejecucion_id, checkpoint)
+    finally:
+        close_old_connections()
+
+
+def _cargar_hechos(ejecucion, ctx):
+    """
+    Procesa las particiones pendientes de la corrida con ``HILOS`` hilos. Cada
+    una confirma por separado: si algo falla, las completadas no se repiten
+    al reanudar. Devuelve la primera excepción (o None).
+    """
+    pendientes = list(ejecucion.checkpoints.filter(completada=False).order_by('desde_id'))
+    if not pendientes:
+        return None
+    # SQLite serializa las escrituras: más hilos solo agregan bloqueos
+    hilos = 1 if connection.vendor == 'sqlite' else max(1, _config()['HILOS'])
+    inicio = time.time()
+    leidas = hechas = 0
+    primer_error = None
+
+    def avance(filas):
+        nonlocal leidas, hechas
+        leidas += filas
+        hechas += 1
+        por_segundo = round(leidas / max(time.time() - inicio, 1e-6), 1)
+        EtlEjecucion.objects.filter(pk=ejecucion.pk).update(filas_por_segundo=por_segundo)
+        print(f"   Partición {hechas}/{len(pendientes)} ({leidas} filas, {por_segundo:.0f} filas/s)", end='\r')
+
+    if hilos == 1:
+        for checkpoint in pendientes:
+            try:
+                avance(_cargar_particion(ctx, ejecucion.pk, checkpoint))
+            except Exception as e:
+                traceback.print_exc()
+                primer_error = primer_error or e
+        return primer_error
+
+    with ThreadPoolExecutor(max_workers=hilos, thread_name_prefix='etl') as executor:
+        futuros = [executor.submit(_cargar_particion_en_hilo, ctx, ejecucion.pk, c) for c in pendientes]
+        for futuro in as_completed(futuros):
+            try:
+                avance(futuro.result())
+            except Exception as e:
+                traceback.print_exc()
+                primer_error = primer_error or e
+    return primer_error
+
+
+# ---------------------------------------------------------------------------
+# Rollup diario
+# ---------------------------------------------------------------------------
+
+def _insertar_rollup(hechos):
+    """Agrega ``hechos`` al grano del rollup y lo inserta. Devuelve las filas escritas."""
+    filas = (
+        hechos.order_by()
+        .annotate(
+            rollup_grupo_etario=F('paciente__grupo_etario'),
+            rollup_genero=F('paciente__genero'),
+            rollup_hora=ExtractHour('hora_inicio'),
+        )
+        .values(
+            'grupo_id', 'fecha_cita_id', 'medico_id', 'especialidad_id', 'estado_id',
+            'rollup_grupo_etario', 'rollup_genero', 'rollup_hora',
+        )
+        .annotate(cantidad=Sum('cantidad_citas'), duracion_suma=Sum('duracion_minutos'), duracion_n=Count('duracion_minutos'))
+    )
+    total = 0
+    for lote in _en_lotes(filas.iterator(chunk_size=_config()['LOTE']), _config()['LOTE']):
+        RollupCitasDiario.objects.bulk_create([
+            RollupCitasDiario(
+                grupo_id=f['grupo_id'], fecha_cita_id=f['fecha_cita_id'], medico_id=f['medico_id'],
+                especialidad_id=f['especialidad_id'], estado_id=f['estado_id'],
+                grupo_etario=f['rollup_grupo_etario'], genero_paciente=f['rollup_genero'], hora=f['rollup_hora'],
+                cantidad=f['cantidad'] or 0, duracion_suma=f['duracion_suma'] or 0, duracion_n=f['duracion_n'],
+            )
+            for f in lote
+        ])
+        total += len(lote)
+    return total
+
+
+def generacion():
+    """
+    Generación del mart: el id de la última corrida completada. Solo cambia
+    cuando una corrida termina bien (en la misma transacción que la marca
+    COMPLETADA), así que sirve de versión para cachear lecturas del mart.
+    """
+    return EtlEjecucion.objects.filter(estado='COMPLETADA').order_by('-id').values_list('id', flat=True).first() or 0
+
+
+def rollup_disponible():
+    """Si el rollup está construido (lo marca la primera corrida que lo arma completo)."""
+    return EtlWatermark.objects.filter(paso='rollup').exists()
+
+
+def _actualizar_rollup(completo):
+    """
+    Recalcula el rollup de los días marcados en ``EtlRollupPendiente``, o
+    entero si es una corrida completa o todavía no se construyó. Devuelve
+    cuántos días (por clínica) recalculó; -1 si lo reconstruyó entero.
+    """
+    inicio = timezone.now()
+    if completo or not rollup_disponible():
+        with transaction.atomic():
+            EtlRollupPendiente.objects.all().delete()
+            RollupCitasDiario.objects.all().delete()
+            _insertar_rollup(FactCitas.objects.all())
+            _guardar_marca('rollup', inicio)
+        return -1
+
+    pendientes = EtlRollupPendiente.objects.order_by('grupo_id', 'fecha_key').values_list('id', 'grupo_id', 'fecha_key')
+    dias = 0
+    for lote in _en_lotes(pendientes.iterator(chunk_size=500), 500):
+        with transaction.atomic():
+            por_grupo = {}
+            for _, grupo_id, fecha_key in lote:
+                por_grupo.setdefault(grupo_id, []).append(fecha_key)
+            for grupo_id, fechas in por_grupo.items():
+                RollupCitasDiario.objects.filter(grupo_id=grupo_id, fecha_cita_id__in=fechas).delete()
+                _insertar_rollup(FactCitas.objects.filter(grupo_id=grupo_id, fecha_cita_id__in=fechas))
+            EtlRollupPendiente.objects.filter(id__in=[pk for pk, _, _ in lote]).delete()
+        dias += len(lote)
+    _guardar_marca('rollup', inicio)
+    return dias
+
+
+# ---------------------------------------------------------------------------
+# Corridas: bloqueo, cola y ejecución
+# ---------------------------------------------------------------------------
+
+class EtlOcupado(Exception):
+    """Otra corrida del ETL tiene el bloqueo."""
+
+
+_CLAVE_BLOQUEO = 0x45544C   # 'ETL', clave del advisory lock de PostgreSQL
+_bloqueo_local = threading.Lock()
+
+
+@contextmanager
+def bloqueo_etl():
+    """
+    Bloqueo exclusivo de las corridas, sin esperar: entrega True si se obtuvo.
+    En PostgreSQL es un advisory lock de sesión, que vale entre procesos y se
+    libera solo si el proceso muere; en otras bases (desarrollo) un lock del
+    proceso.
+    """
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_try_advisory_lock(%s)', [_CLAVE_BLOQUEO])
+            obtenido = cursor.fetchone()[0]
+        try:
+            yield obtenido
+        finally:
+            if obtenido:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT pg_advisory_unlock(%s)', [_CLAVE_BLOQUEO])
+        return
+
+    obtenido = _bloqueo_local.acquire(blocking=False)
+    try:
+        yield obtenido
+    finally:
+        if obtenido:
+            _bloqueo_local.release()
+
+
+@contextmanager
+def _cronometro(pasos, nombre):
+    inicio = time.time()
+    try:
+        yield
+    finally:
+        pasos[nombre] = round(time.time() - inicio, 3)
+
 
-def run_etl():
+def _ejecucion_a_reanudar(actual):
+    """
+    La última corrida anterior a ``actual``, si quedó a medias (worker caído o
+    partición fallida). Se llama con el bloqueo tomado: lo que figure
+    EN_PROCESO es de un worker que ya no existe.
+    """
+    ultima = (
+        EtlEjecucion.objects.exclude(pk=actual.pk).exclude(estado='PENDIENTE')
+        .order_by('-fecha_creacion', '-id').first()
+    )
+    if ultima is None or ultima.estado == 'COMPLETADA':
+        return None
+    if ultima.checkpoints.filter(completada=False).exists():
+        return ultima
+    if ultima.estado == 'EN_PROCESO':
+        # Murió antes de crear sus particiones: no hay nada que reanudar
+        EtlEjecucion.objects.filter(pk=ultima.pk).update(
+            estado='FALLIDA', error='Corrida interrumpida.', fecha_fin=timezone.now()
+        )
+    return None
+
+
+def _correr(ejecucion, reanudar=False):
+    """Ejecuta (o reanuda) una corrida. La deja COMPLETADA o FALLIDA."""
     start_time = time.time()
-    print("--- INICIO ETL (MODO TURBO FINAL) ---")
-    
+    hoy = timezone.localdate()
+
     # 1. OBTENER MODELOS
     try:
-        CitaMedica = apps.get_model('citas_pagos', 'Cita_Medica') 
+        CitaMedica = apps.get_model('citas_pagos', 'Cita_Medica')
         Medico = apps.get_model('doctores', 'Medico')
         Especialidad = apps.get_model('doctores', 'Especialidad')
         Paciente = apps.get_model('historiasDiagnosticos', 'Paciente')
@@ -24,170 +615,211 @@ def run_etl():
 
     # Configuración Idioma
     try:
-        locale.setlocale(locale.LC_TIME, 'es_ES' if sys.platform == 'win32' else 'es_ES.UTF-8') 
-    except: pass
+        locale.setlocale(locale.LC_TIME, 'es_ES' if sys.platform == 'win32' else 'es_ES.UTF-8')
+    except locale.Error:
+        pass
 
-    # Usamos atomic para velocidad
-    with transaction.atomic():
-        
-        # --- PASO 1: TIEMPO ---
-        print("1. Procesando Tiempo...")
-        fechas_origen = set(CitaMedica.objects.values_list('fecha', flat=True))
-        fechas_destino = set(DimTiempo.objects.values_list('fecha', flat=True))
-        fechas_nuevas = fechas_origen - fechas_destino
-        
-        if fechas_nuevas:
-            objs_tiempo = []
-            for fecha in fechas_nuevas:
-                fecha_key = int(fecha.strftime('%Y%m%d'))
-                es_finde = fecha.weekday() >= 5
-                semestre = 1 if fecha.month <= 6 else 2
-                trimestre = (fecha.month - 1) // 3 + 1
-                objs_tiempo.append(DimTiempo(
-                    fecha_key=fecha_key, fecha=fecha, anio=fecha.year, semestre=semestre,
-                    trimestre=trimestre, mes=fecha.month, dia=fecha.day,
-                    nombre_mes=fecha.strftime('%B').capitalize(),
-                    dia_semana=fecha.weekday() + 1,
-                    nombre_dia=fecha.strftime('%A').capitalize(),
-                    es_fin_de_semana=es_finde
-                ))
-            DimTiempo.objects.bulk_create(objs_tiempo)
-        
-        mapa_tiempo = {d.fecha_key: d for d in DimTiempo.objects.all()}
-
-
-        # --- PASO 2: MÉDICOS ---
-        print("2. Procesando Médicos...")
-        medicos_origen = Medico.objects.select_related('usuario_ptr').all()
-        for m in medicos_origen:
-            DimMedico.objects.update_or_create(
-                id_medico_sistema=m.usuario_ptr_id,
-                defaults={
-                    'nombre_completo': m.usuario_ptr.nombre,
-                    'numero_colegiado': getattr(m, 'numero_colegiado', 'S/N'),
-                    'genero': getattr(m.usuario_ptr, 'sexo', 'X'),
-                    'fecha_registro': m.usuario_ptr.fecha_registro
-                }
-            )
-        mapa_medicos = {d.id_medico_sistema: d for d in DimMedico.objects.all()}
+    completo = ejecucion.completo
+    if reanudar:
+        print(f"--- REANUDANDO ETL #{ejecucion.id} ---")
+        ejecucion.reanudaciones += 1
+        ejecucion.estado = 'EN_PROCESO'
+        ejecucion.error = ''
+        ejecucion.save(update_fields=['reanudaciones', 'estado', 'error'])
+    else:
+        print(f"--- INICIO ETL #{ejecucion.id} ({'COMPLETO' if completo else 'INCREMENTAL'}) ---")
+        ejecucion.estado = 'EN_PROCESO'
+        ejecucion.fecha_inicio = timezone.now()
+        ejecucion.marca_desde = _marca('citas', completo)
+        ejecucion.save(update_fields=['estado', 'fecha_inicio', 'marca_desde'])
 
+    pasos = {}
+    try:
+        inicio_dimensiones = timezone.now()
+        resumen = {}
+        with transaction.atomic():
+            citas = _citas_cambiadas(CitaMedica, Especialidad, ejecucion.marca_desde)
 
-        # --- PASO 3: ESPECIALIDADES ---
-        print("3. Procesando Especialidades...")
-        for e in Especialidad.objects.all():
-            DimEspecialidad.objects.update_or_create(
-                id_especialidad_sistema=e.id, defaults={'nombre_especialidad': e.nombre}
-            )
-        mapa_especialidad = {d.id_especialidad_sistema: d for d in DimEspecialidad.objects.all()}
-        esp_general, _ = DimEspecialidad.objects.get_or_create(id_especialidad_sistema=9999, defaults={'nombre_especialidad':'General'})
-
-
-        # --- PASO 4: PACIENTES ---
-        print("4. Procesando Pacientes...")
-        for p in Paciente.objects.select_related('usuario').all():
-            edad = (date.today() - p.usuario.fecha_nacimiento).days // 365 if p.usuario.fecha_nacimiento else 0
-            grupo = 'Adulto'
-            if edad <= 12: grupo = 'Niño'
-            elif edad <= 18: grupo = 'Adolescente'
-            elif edad > 60: grupo = 'Senior'
-
-            DimPaciente.objects.update_or_create(
-                id_paciente_sistema=p.id,
-                defaults={
-                    'numero_historia_clinica': p.numero_historia_clinica,
-                    'nombre_completo': p.usuario.nombre,
-                    'genero': getattr(p.usuario, 'sexo', 'X'),
-                    'fecha_nacimiento': p.usuario.fecha_nacimiento or date(2000,1,1),
-                    'grupo_etario': grupo
-                }
-            )
-        mapa_pacientes = {d.id_paciente_sistema: d for d in DimPaciente.objects.all()}
-
-
-        # --- PASO 5: ESTADOS ---
-        print("5. Procesando Estados...")
-        estados = [
-            ('REALIZADA', 'Cita Realizada', False, True),  # <--- CAMBIADO DE 'COMPLETADA' A 'REALIZADA'
-            ('CONFIRMADA', 'Confirmada', False, False),
-            ('EN_PROCESO', 'En Atención', False, True),
-            ('PENDIENTE', 'Pendiente', False, False),
-            ('CANCELADA', 'Cancelada', True, False),
-            ('NO_ASISTIO', 'No Asistió', True, False),
-        ]
-        for cod, desc, es_cancel, es_asist in estados:
-            DimEstadoCita.objects.update_or_create(
-                codigo_estado=cod, defaults={'descripcion_estado': desc, 'es_cancelacion': es_cancel, 'es_asistencia': es_asist}
-            )
-        mapa_estados = {d.codigo_estado: d for d in DimEstadoCita.objects.all()}
-        estado_default = mapa_estados.get('PENDIENTE')
+            print("1. Procesando Tiempo...")
+            with _cronometro(pasos, 'tiempo'):
+                resumen['fechas'] = _cargar_tiempo(citas.values_list('fecha', flat=True).distinct())
 
+            print("2. Procesando Médicos...")
+            with _cronometro(pasos, 'medicos'):
+                resumen['medicos'] = _cargar_medicos(Medico, _marca('medicos', completo))
+
+            print("3. Procesando Especialidades...")
+            with _cronometro(pasos, 'especialidades'):
+                resumen['especialidades'] = _cargar_especialidades(Especialidad)
+
+            print("4. Procesando Pacientes...")
+            with _cronometro(pasos, 'pacientes'):
+                pacientes = _pacientes_cambiados(Paciente, _marca('pacientes', completo), hoy)
+                resumen['pacientes'] = _cargar_pacientes(pacientes, hoy)
+                if not completo:
+                    # Grupo etario y género del paciente están desnormalizados en el rollup
+                    _marcar_dias(
+                        FactCitas.objects.filter(paciente__id_paciente_sistema__in=pacientes.values('id'))
+                        .order_by().values_list('grupo_id', 'fecha_cita_id').distinct()
+                    )
+
+            print("5. Procesando Estados...")
+            with _cronometro(pasos, 'estados'):
+                mapa_estados = _cargar_estados()
+
+            for paso in ('medicos', 'pacientes'):
+                _guardar_marca(paso, inicio_dimensiones)
+            with _cronometro(pasos, 'particiones'):
+                if not ejecucion.particiones_total:
+                    _crear_particiones(ejecucion, CitaMedica)
+            ejecucion.resumen = resumen
+            ejecucion.pasos = pasos
+            ejecucion.save(update_fields=['resumen', 'pasos'])
 
-        # --- PASO 6: FACT CITAS ---
         print("6. Procesando Tabla de Hechos (FACT)...")
-        
-        ids_existentes = set(FactCitas.objects.values_list('id_cita_sistema', flat=True))
-        
-        citas_queryset = CitaMedica.objects.exclude(id__in=ids_existentes).select_related(
-            'bloque_horario__medico', 'paciente', 'bloque_horario'
-        ).prefetch_related('bloque_horario__medico__especialidades')
-
-        nuevos_hechos = []
-        BATCH_SIZE = 2000 
-        total_citas = citas_queryset.count()
-        print(f"-> {total_citas} citas nuevas detectadas.")
-
-        # AQUÍ ESTABA EL ERROR: Agregamos chunk_size=2000
-        for i, c in enumerate(citas_queryset.iterator(chunk_size=2000), 1):
-            try:
-                fecha_key = int(c.fecha.strftime('%Y%m%d'))
-                obj_tiempo = mapa_tiempo.get(fecha_key)
-                
-                medico_id = c.bloque_horario.medico.usuario_ptr_id
-                obj_medico = mapa_medicos.get(medico_id)
-                
-                obj_paciente = mapa_pacientes.get(c.paciente.id)
-                
-                estado_code = c.estado_cita if c.estado_cita else 'PENDIENTE'
-                obj_estado = mapa_estados.get(estado_code, estado_default)
-
-                obj_especialidad = esp_general
-                esps = c.bloque_horario.medico.especialidades.all()
-                if esps:
-                    first_esp_id = esps[0].id
-                    obj_especialidad = mapa_especialidad.get(first_esp_id, esp_general)
-
-                duracion = 30
-                if c.hora_inicio and c.hora_fin:
-                    dummy = date.today()
-                    duracion = (datetime.combine(dummy, c.hora_fin) - datetime.combine(dummy, c.hora_inicio)).seconds // 60
-                
-                anticipacion = (c.fecha - c.fecha_creacion.date()).days if c.fecha_creacion else 0
-
-                if obj_tiempo and obj_medico and obj_paciente:
-                    nuevos_hechos.append(FactCitas(
-                        fecha_cita=obj_tiempo,
-                        medico=obj_medico,
-                        paciente=obj_paciente,
-                        especialidad=obj_especialidad,
-                        estado=obj_estado,
-                        id_cita_sistema=c.id,
-                        grupo_id=c.grupo_id,
-                        hora_inicio=c.hora_inicio,
-                        cantidad_citas=1,
-                        duracion_minutos=duracion,
-                        tiempo_anticipacion_dias=anticipacion
-                    ))
-
-                if len(nuevos_hechos) >= BATCH_SIZE:
-                    FactCitas.objects.bulk_create(nuevos_hechos)
-                    print(f"   Guardado lote de {BATCH_SIZE} registros... (Progreso: {i}/{total_citas})", end='\r')
-                    nuevos_hechos = [] 
+        ctx = _Contexto(CitaMedica, Especialidad, ejecucion.marca_desde, mapa_estados)
+        with _cronometro(pasos, 'hechos'):
+            error = _cargar_hechos(ejecucion, ctx)
+        if error:
+            raise error
+
+        print("\n7. Actualizando Rollup Diario...")
+        with _cronometro(pasos, 'rollup'):
+            resumen['rollup_dias'] = _actualizar_rollup(completo)
+        EtlEjecucion.objects.filter(pk=ejecucion.pk).update(resumen=resumen)
+    except Exception as e:
+        EtlEjecucion.objects.filter(pk=ejecucion.pk).update(
+            estado='FALLIDA', error=str(e)[:2000], fecha_fin=timezone.now(), pasos=pasos
+        )
+        raise
+
+    with transaction.atomic():
+        _guardar_marca('citas', ejecucion.fecha_inicio)
+        EtlEjecucion.objects.filter(pk=ejecucion.pk).update(
+            estado='COMPLETADA', fecha_fin=timezone.now(), pasos=pasos
+        )
+    ejecucion.refresh_from_db()
 
+    segundos = round(time.time() - start_time, 2)
+    print(f"\n--- FIN ETL #{ejecucion.id} EXITOSO EN {segundos:.2f} SEGUNDOS: "
+          f"{ejecucion.filas_insertadas} nuevos, {ejecucion.filas_actualizadas} actualizados, "
+          f"{ejecucion.filas_rechazadas} rechazados ---")
+    return {
+        'ejecucion': ejecucion.id,
+        'completo': ejecucion.completo,
+        **ejecucion.resumen,
+        'hechos_nuevos': ejecucion.filas_insertadas,
+        'hechos_actualizados': ejecucion.filas_actualizadas,
+        'citas_rechazadas': ejecucion.filas_rechazadas,
+        'filas_por_segundo': ejecucion.filas_por_segundo,
+        'pasos': pasos,
+        'segundos': segundos,
+    }
+
+
+def _ejecutar(ejecucion):
+    """Reanuda la corrida anterior si quedó a medias y después corre ``ejecucion``."""
+    if not ejecucion.completo:
+        anterior = _ejecucion_a_reanudar(ejecucion)
+        if anterior:
+            try:
+                _correr(anterior, reanudar=True)
             except Exception as e:
-                continue
+                EtlEjecucion.objects.filter(pk=ejecucion.pk).update(
+                    estado='FALLIDA', error=f"No se pudo reanudar la corrida #{anterior.id}: {e}"[:2000],
+                    fecha_fin=timezone.now(),
+                )
+                raise
+    return _correr(ejecucion)
+
+
+def encolar(completo=False, solicitado_por='', despertar=True):
+    """
+    Pide una corrida. Devuelve ``(ejecucion, creada)``: si ya hay una
+    pendiente se comparte (la restricción única parcial cubre dos pedidos
+    simultáneos); un pedido completo la vuelve completa.
+    """
+    pendiente = EtlEjecucion.objects.filter(estado='PENDIENTE').first()
+    creada = False
+    if pendiente is None:
+        try:
+            with transaction.atomic():
+                pendiente = EtlEjecucion.objects.create(completo=completo, solicitado_por=solicitado_por[:150])
+            creada = True
+        except IntegrityError:
+            pendiente = EtlEjecucion.objects.filter(estado='PENDIENTE').first()
+            if pendiente is None:
+                raise
+    if not creada and completo and not pendiente.completo:
+        EtlEjecucion.objects.filter(pk=pendiente.pk, estado='PENDIENTE').update(completo=True)
+        pendiente.completo = True
+    if despertar:
+        # También si ya existía: puede haber quedado huérfana (reinicio del
+        # proceso con la corrida en el executor en memoria). Si otro worker
+        # tiene el bloqueo, despertar no hace nada.
+        transaction.on_commit(_despertar)
+    return pendiente, creada
+
+
+def procesar_pendientes():
+    """
+    Corre las corridas pendientes si este proceso obtiene el bloqueo; si otro
+    lo tiene, no hace nada (las tomará él). Devuelve cuántas corrió.
+    """
+    procesadas = 0
+    while True:
+        with bloqueo_etl() as obtenido:
+            if not obtenido:
+                return procesadas
+            while True:
+                pendiente = EtlEjecucion.objects.filter(estado='PENDIENTE').order_by('fecha_creacion', 'id').first()
+                if pendiente is None:
+                    break
+                try:
+                    _ejecutar(pendiente)
+                except Exception as e:
+                    # Queda FALLIDA con su error; sus particiones se reanudan en la próxima
+                    traceback.print_exc()
+                    EtlEjecucion.objects.filter(pk=pendiente.pk, estado='PENDIENTE').update(
+                        estado='FALLIDA', error=str(e)[:2000], fecha_fin=timezone.now()
+                    )
+                procesadas += 1
+        # Un pedido que llegó entre la última consulta y la liberación del
+        # bloqueo encontró el bloqueo tomado y su despertar no hizo nada
+        if not EtlEjecucion.objects.filter(estado='PENDIENTE').exists():
+            return procesadas
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _procesar_en_hilo():
+    try:
+        procesar_pendientes()
+    finally:
+        close_old_connections()
+
+
+def _despertar():
+    modo = _config()['MODO']
+    if modo == 'sincrono':
+        procesar_pendientes()
+    elif modo == 'hilos':
+        global _executor
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='etl-corrida')
+        _executor.submit(_procesar_en_hilo)
+
 
-        if nuevos_hechos:
-            FactCitas.objects.bulk_create(nuevos_hechos)
-    
-    total_time = time.time() - start_time
-    print(f"\n--- FIN ETL EXITOSO EN {total_time:.2f} SEGUNDOS ---")
\ No newline at end of file
+def run_etl(completo=False, solicitado_por='manual'):
+    """
+    Corre el ETL en este hilo (reanudando antes la corrida anterior si quedó a
+    medias) y devuelve su resumen. Lanza ``EtlOcupado`` si hay otra en curso.
+    """
+    with bloqueo_etl() as obtenido:
+        if not obtenido:
+            raise EtlOcupado("Ya hay una corrida del ETL en curso.")
+        ejecucion, _ = encolar(completo, solicitado_por, despertar=False)
+        return _ejecutar(ejecucion)
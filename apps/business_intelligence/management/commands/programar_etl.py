@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.business_intelligence import etl
+
+
+class Command(BaseCommand):
+    help = (
+        "Programador del ETL de BI: corre las corridas pedidas por run-etl "
+        "(BI_ETL['MODO']='proceso') y encola una incremental cada CADA_MINUTOS. "
+        "El advisory lock evita corridas simultáneas aunque haya varios."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help="Corre lo pendiente (o una incremental si no hay nada) y termina (para cron).")
+        parser.add_argument('--completo', action='store_true',
+                            help="Con --una-vez, la corrida ignora las marcas de agua.")
+        parser.add_argument('--cada', type=float, default=None,
+                            help="Minutos entre corridas periódicas (0: solo las pedidas).")
+        parser.add_argument('--intervalo', type=float, default=None,
+                            help="Segundos entre consultas de corridas pendientes.")
+
+    def handle(self, *args, **options):
+        config = etl._config()
+        if options['una_vez']:
+            etl.encolar(options['completo'], 'programador', despertar=False)
+            procesadas = etl.procesar_pendientes()
+            if not procesadas:
+                self.stdout.write("Otra corrida del ETL tiene el bloqueo; la pendiente queda para ella.")
+                return
+            self.stdout.write(self.style.SUCCESS(f"{procesadas} corridas del ETL procesadas."))
+            return
+
+        cada = (options['cada'] if options['cada'] is not None else config['CADA_MINUTOS']) * 60
+        intervalo = options['intervalo'] or config['INTERVALO_SONDEO']
+        self.stdout.write(
+            f"Programador del ETL: corrida cada {cada / 60:g} min, pendientes cada {intervalo}s..."
+            if cada else f"Programador del ETL: pendientes cada {intervalo}s..."
+        )
+        ultima_programada = None
+        try:
+            while True:
+                close_old_connections()
+                if cada and (ultima_programada is None or time.monotonic() - ultima_programada >= cada):
+                    etl.encolar(False, 'programador', despertar=False)
+                    ultima_programada = time.monotonic()
+                procesadas = etl.procesar_pendientes()
+                if procesadas:
+                    self.stdout.write(f"{procesadas} corridas del ETL procesadas.")
+                time.sleep(intervalo)
+        except KeyboardInterrupt:
+            self.stdout.write("Programador detenido.")
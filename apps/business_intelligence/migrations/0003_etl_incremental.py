@@ -0,0 +1,86 @@
+# Generated by Django 5.2.6 on 2026-10-17 05:22
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def unificar_duplicados(apps, schema_editor):
+    """
+    ``update_or_create`` sin restricción única pudo dejar dimensiones
+    repetidas: los hechos pasan a la de menor clave y se borran las demás.
+    Los hechos repetidos de una misma cita se reducen al primero.
+    """
+    FactCitas = apps.get_model('business_intelligence', 'FactCitas')
+    dimensiones = [
+        ('DimMedico', 'id_medico_sistema', 'medico'),
+        ('DimEspecialidad', 'id_especialidad_sistema', 'especialidad'),
+        ('DimPaciente', 'id_paciente_sistema', 'paciente'),
+        ('DimEstadoCita', 'codigo_estado', 'estado'),
+    ]
+    for nombre, campo, fk in dimensiones:
+        modelo = apps.get_model('business_intelligence', nombre)
+        pk = modelo._meta.pk.name
+        duplicados = (
+            modelo.objects.values(campo)
+            .annotate(total=Count(pk), primera=Min(pk))
+            .filter(total__gt=1)
+        )
+        for dup in duplicados:
+            sobrantes = modelo.objects.filter(**{campo: dup[campo]}).exclude(pk=dup['primera'])
+            FactCitas.objects.filter(**{f'{fk}__in': sobrantes}).update(**{f'{fk}_id': dup['primera']})
+            sobrantes.delete()
+
+    duplicados = (
+        FactCitas.objects.values('id_cita_sistema')
+        .annotate(total=Count('cita_key'), primera=Min('cita_key'))
+        .filter(total__gt=1)
+    )
+    for dup in duplicados:
+        FactCitas.objects.filter(id_cita_sistema=dup['id_cita_sistema']).exclude(cita_key=dup['primera']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_intelligence', '0002_factcitas_grupo_id_and_more'),
+    ]
+
+    operations = [
+        migrations.RunPython(unificar_duplicados, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='EtlWatermark',
+            fields=[
+                ('paso', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('marca', models.DateTimeField(help_text='Inicio de la última corrida exitosa del paso')),
+                ('fecha_actualizacion', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'etl_watermark',
+            },
+        ),
+        migrations.AlterField(
+            model_name='dimespecialidad',
+            name='id_especialidad_sistema',
+            field=models.IntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='dimestadocita',
+            name='codigo_estado',
+            field=models.CharField(max_length=50, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='dimmedico',
+            name='id_medico_sistema',
+            field=models.IntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='dimpaciente',
+            name='id_paciente_sistema',
+            field=models.IntegerField(unique=True),
+        ),
+        migrations.AlterField(
+            model_name='factcitas',
+            name='id_cita_sistema',
+            field=models.BigIntegerField(unique=True),
+        ),
+    ]
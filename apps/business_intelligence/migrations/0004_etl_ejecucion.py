@@ -0,0 +1,70 @@
+# Generated by Django 5.2.6 on 2026-10-17 05:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_intelligence', '0003_etl_incremental'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EtlEjecucion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('estado', models.CharField(choices=[('EN_PROCESO', 'En proceso'), ('COMPLETADA', 'Completada'), ('FALLIDA', 'Fallida')], default='EN_PROCESO', max_length=20)),
+                ('completo', models.BooleanField(default=False, help_text='Ignora las marcas de agua')),
+                ('marca_desde', models.DateTimeField(blank=True, help_text='Citas modificadas después de esta fecha', null=True)),
+                ('fecha_inicio', models.DateTimeField(help_text='Se guarda como marca de agua de las citas al completar')),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('reanudaciones', models.PositiveIntegerField(default=0)),
+                ('particiones_total', models.PositiveIntegerField(default=0)),
+                ('particiones_hechas', models.PositiveIntegerField(default=0)),
+                ('filas_leidas', models.PositiveIntegerField(default=0)),
+                ('filas_insertadas', models.PositiveIntegerField(default=0)),
+                ('filas_actualizadas', models.PositiveIntegerField(default=0)),
+                ('filas_rechazadas', models.PositiveIntegerField(default=0)),
+                ('filas_por_segundo', models.FloatField(blank=True, null=True)),
+                ('resumen', models.JSONField(blank=True, default=dict, help_text='Filas escritas por paso de dimensiones')),
+                ('error', models.TextField(blank=True)),
+            ],
+            options={
+                'db_table': 'etl_ejecucion',
+                'ordering': ['-fecha_inicio'],
+            },
+        ),
+        migrations.CreateModel(
+            name='EtlCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('desde_id', models.BigIntegerField()),
+                ('hasta_id', models.BigIntegerField(help_text='Exclusivo')),
+                ('completada', models.BooleanField(default=False)),
+                ('filas_leidas', models.PositiveIntegerField(default=0)),
+                ('segundos', models.FloatField(blank=True, null=True)),
+                ('fecha_fin', models.DateTimeField(blank=True, null=True)),
+                ('ejecucion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='business_intelligence.etlejecucion')),
+            ],
+            options={
+                'db_table': 'etl_checkpoint',
+                'constraints': [models.UniqueConstraint(fields=('ejecucion', 'desde_id'), name='etl_checkpoint_particion_unica')],
+            },
+        ),
+        migrations.CreateModel(
+            name='EtlRechazo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('id_cita_sistema', models.BigIntegerField()),
+                ('motivo', models.TextField()),
+                ('fecha', models.DateTimeField(auto_now_add=True)),
+                ('ejecucion', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rechazos', to='business_intelligence.etlejecucion')),
+            ],
+            options={
+                'db_table': 'etl_rechazo',
+                'indexes': [models.Index(fields=['ejecucion', 'id_cita_sistema'], name='etl_rechazo_ejecuci_75bc71_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.6 on 2026-10-17 05:29
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_intelligence', '0004_etl_ejecucion'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='etlejecucion',
+            options={'ordering': ['-fecha_creacion']},
+        ),
+        migrations.AddField(
+            model_name='etlejecucion',
+            name='fecha_creacion',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='etlejecucion',
+            name='pasos',
+            field=models.JSONField(blank=True, default=dict, help_text='Segundos de cada paso'),
+        ),
+        migrations.AddField(
+            model_name='etlejecucion',
+            name='solicitado_por',
+            field=models.CharField(blank=True, help_text="Usuario o 'programador'", max_length=150),
+        ),
+        migrations.AlterField(
+            model_name='etlejecucion',
+            name='estado',
+            field=models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En proceso'), ('COMPLETADA', 'Completada'), ('FALLIDA', 'Fallida')], default='PENDIENTE', max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='etlejecucion',
+            name='fecha_inicio',
+            field=models.DateTimeField(blank=True, help_text='Se guarda como marca de agua de las citas al completar', null=True),
+        ),
+        migrations.AddConstraint(
+            model_name='etlejecucion',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado', 'PENDIENTE')), fields=('estado',), name='etl_ejecucion_pendiente_unica'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.6 on 2026-10-17 05:31
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_intelligence', '0005_etl_ejecucion_asincrona'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EtlRollupPendiente',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grupo_id', models.IntegerField()),
+                ('fecha_key', models.IntegerField()),
+            ],
+            options={
+                'db_table': 'etl_rollup_pendiente',
+                'constraints': [models.UniqueConstraint(fields=('grupo_id', 'fecha_key'), name='etl_rollup_pendiente_unico')],
+            },
+        ),
+        migrations.CreateModel(
+            name='RollupCitasDiario',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('grupo_id', models.IntegerField(help_text='ID de la Clínica (Tenant)')),
+                ('grupo_etario', models.CharField(max_length=20)),
+                ('genero_paciente', models.CharField(max_length=1, null=True)),
+                ('hora', models.SmallIntegerField(null=True)),
+                ('cantidad', models.IntegerField()),
+                ('duracion_suma', models.BigIntegerField(default=0)),
+                ('duracion_n', models.IntegerField(default=0, help_text='Citas con duración, para el promedio')),
+                ('especialidad', models.ForeignKey(db_column='especialidad_key', on_delete=django.db.models.deletion.CASCADE, to='business_intelligence.dimespecialidad')),
+                ('estado', models.ForeignKey(db_column='estado_key', on_delete=django.db.models.deletion.CASCADE, to='business_intelligence.dimestadocita')),
+                ('fecha_cita', models.ForeignKey(db_column='fecha_cita_key', on_delete=django.db.models.deletion.CASCADE, to='business_intelligence.dimtiempo')),
+                ('medico', models.ForeignKey(db_column='medico_key', on_delete=django.db.models.deletion.CASCADE, to='business_intelligence.dimmedico')),
+            ],
+            options={
+                'db_table': 'rollup_citas_diario',
+                'indexes': [models.Index(fields=['grupo_id', 'fecha_cita'], name='rollup_cita_grupo_i_2bcea4_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.6 on 2026-10-17 05:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('business_intelligence', '0006_rollup_citas_diario'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='factcitas',
+            name='fact_citas_grupo_i_f860a5_idx',
+        ),
+        migrations.RemoveIndex(
+            model_name='rollupcitasdiario',
+            name='rollup_cita_grupo_i_2bcea4_idx',
+        ),
+        migrations.AddIndex(
+            model_name='factcitas',
+            index=models.Index(fields=['grupo_id', 'fecha_cita', 'especialidad', 'medico'], name='fact_citas_grupo_i_61c881_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='rollupcitasdiario',
+            index=models.Index(fields=['grupo_id', 'fecha_cita', 'especialidad', 'medico'], name='rollup_cita_grupo_i_3b7446_idx'),
+        ),
+    ]
@@ -22,7 +22,7 @@ class DimTiempo(models.Model):
 
 class DimMedico(models.Model):
     medico_key = models.AutoField(primary_key=True)
-    id_medico_sistema = models.IntegerField()  # ID original
+    id_medico_sistema = models.IntegerField(unique=True)  # ID original
     nombre_completo = models.CharField(max_length=200)
     numero_colegiado = models.CharField(max_length=50)
     genero = models.CharField(max_length=1, null=True)
@@ -33,7 +33,7 @@ class DimMedico(models.Model):
 
 class DimEspecialidad(models.Model):
     especialidad_key = models.AutoField(primary_key=True)
-    id_especialidad_sistema = models.IntegerField()
+    id_especialidad_sistema = models.IntegerField(unique=True)
     nombre_especialidad = models.CharField(max_length=100)
 
     class Meta:
@@ -41,7 +41,7 @@ class DimEspecialidad(models.Model):
 
 class DimPaciente(models.Model):
     paciente_key = models.AutoField(primary_key=True)
-    id_paciente_sistema = models.IntegerField()
+    id_paciente_sistema = models.IntegerField(unique=True)
     numero_historia_clinica = models.CharField(max_length=50)
     nombre_completo = models.CharField(max_length=200)
     genero = models.CharField(max_length=1, null=True)
@@ -53,7 +53,7 @@ class DimPaciente(models.Model):
 
 class DimEstadoCita(models.Model):
     estado_key = models.AutoField(primary_key=True)
-    codigo_estado = models.CharField(max_length=50) # REALIZADA, CANCELADA...
+    codigo_estado = models.CharField(max_length=50, unique=True) # REALIZADA, CANCELADA...
     descripcion_estado = models.CharField(max_length=100)
     es_cancelacion = models.BooleanField(default=False)
     es_asistencia = models.BooleanField(default=False)
@@ -61,6 +61,88 @@ class DimEstadoCita(models.Model):
     class Meta:
         db_table = 'dim_estado_cita'
 
+# ==========================================
+# CONTROL DEL ETL
+# ==========================================
+
+class EtlWatermark(models.Model):
+    """Hasta dónde llegó cada paso del ETL; la siguiente corrida lee solo lo posterior."""
+    paso = models.CharField(max_length=50, primary_key=True)
+    marca = models.DateTimeField(help_text="Inicio de la última corrida exitosa del paso")
+    fecha_actualizacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'etl_watermark'
+
+class EtlEjecucion(models.Model):
+    """Historial de corridas del ETL, con su avance y rendimiento."""
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_PROCESO', 'En proceso'),
+        ('COMPLETADA', 'Completada'),
+        ('FALLIDA', 'Fallida'),
+    ]
+
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='PENDIENTE')
+    completo = models.BooleanField(default=False, help_text="Ignora las marcas de agua")
+    solicitado_por = models.CharField(max_length=150, blank=True, help_text="Usuario o 'programador'")
+    marca_desde = models.DateTimeField(null=True, blank=True, help_text="Citas modificadas después de esta fecha")
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio = models.DateTimeField(null=True, blank=True, help_text="Se guarda como marca de agua de las citas al completar")
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+    reanudaciones = models.PositiveIntegerField(default=0)
+    particiones_total = models.PositiveIntegerField(default=0)
+    particiones_hechas = models.PositiveIntegerField(default=0)
+    filas_leidas = models.PositiveIntegerField(default=0)
+    filas_insertadas = models.PositiveIntegerField(default=0)
+    filas_actualizadas = models.PositiveIntegerField(default=0)
+    filas_rechazadas = models.PositiveIntegerField(default=0)
+    filas_por_segundo = models.FloatField(null=True, blank=True)
+    resumen = models.JSONField(default=dict, blank=True, help_text="Filas escritas por paso de dimensiones")
+    pasos = models.JSONField(default=dict, blank=True, help_text="Segundos de cada paso")
+    error = models.TextField(blank=True)
+
+    class Meta:
+        db_table = 'etl_ejecucion'
+        ordering = ['-fecha_creacion']
+        constraints = [
+            # Dos pedidos simultáneos de run-etl comparten la misma corrida pendiente
+            models.UniqueConstraint(
+                fields=['estado'],
+                condition=models.Q(estado='PENDIENTE'),
+                name='etl_ejecucion_pendiente_unica',
+            ),
+        ]
+
+class EtlCheckpoint(models.Model):
+    """Partición de citas (rango de ids) de una corrida; las completadas no se repiten al reanudar."""
+    ejecucion = models.ForeignKey(EtlEjecucion, on_delete=models.CASCADE, related_name='checkpoints')
+    desde_id = models.BigIntegerField()
+    hasta_id = models.BigIntegerField(help_text="Exclusivo")
+    completada = models.BooleanField(default=False)
+    filas_leidas = models.PositiveIntegerField(default=0)
+    segundos = models.FloatField(null=True, blank=True)
+    fecha_fin = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'etl_checkpoint'
+        constraints = [
+            models.UniqueConstraint(fields=['ejecucion', 'desde_id'], name='etl_checkpoint_particion_unica'),
+        ]
+
+class EtlRechazo(models.Model):
+    """Cita que el ETL no pudo cargar y por qué."""
+    ejecucion = models.ForeignKey(EtlEjecucion, on_delete=models.CASCADE, related_name='rechazos')
+    id_cita_sistema = models.BigIntegerField()
+    motivo = models.TextField()
+    fecha = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        db_table = 'etl_rechazo'
+        indexes = [
+            models.Index(fields=['ejecucion', 'id_cita_sistema']),
+        ]
+
 # ==========================================
 # TABLA DE HECHOS
 # ==========================================
@@ -81,7 +163,7 @@ class FactCitas(models.Model):
     estado = models.ForeignKey(DimEstadoCita, on_delete=models.CASCADE, db_column='estado_key')
     
     # Degenerate Dimensions
-    id_cita_sistema = models.BigIntegerField()
+    id_cita_sistema = models.BigIntegerField(unique=True)
     hora_inicio = models.TimeField(null=True)
     
     # Métricas
@@ -91,7 +173,46 @@ class FactCitas(models.Model):
 
     class Meta:
         db_table = 'fact_citas'
-        # Opcional: Índice compuesto por si filtras mucho por grupo y fecha
+        # Índice compuesto por grupo y fecha que además cubre los filtros del
+        # dashboard por especialidad y médico (IN sobre las claves)
+        indexes = [
+            models.Index(fields=['grupo_id', 'fecha_cita', 'especialidad', 'medico']),
+        ]
+# ==========================================
+# AGREGADOS (ROLLUPS)
+# ==========================================
+
+class RollupCitasDiario(models.Model):
+    """
+    Hechos pre-agregados por día con el detalle que usa el dashboard. Lo
+    mantiene el ETL recalculando los días (por clínica) que tocó cada corrida.
+    """
+    grupo_id = models.IntegerField(help_text="ID de la Clínica (Tenant)")
+    fecha_cita = models.ForeignKey(DimTiempo, on_delete=models.CASCADE, db_column='fecha_cita_key')
+    medico = models.ForeignKey(DimMedico, on_delete=models.CASCADE, db_column='medico_key')
+    especialidad = models.ForeignKey(DimEspecialidad, on_delete=models.CASCADE, db_column='especialidad_key')
+    estado = models.ForeignKey(DimEstadoCita, on_delete=models.CASCADE, db_column='estado_key')
+    grupo_etario = models.CharField(max_length=20)
+    genero_paciente = models.CharField(max_length=1, null=True)
+    hora = models.SmallIntegerField(null=True)
+
+    cantidad = models.IntegerField()
+    duracion_suma = models.BigIntegerField(default=0)
+    duracion_n = models.IntegerField(default=0, help_text="Citas con duración, para el promedio")
+
+    class Meta:
+        db_table = 'rollup_citas_diario'
         indexes = [
-            models.Index(fields=['grupo_id', 'fecha_cita']),
-        ]
\ No newline at end of file
+            models.Index(fields=['grupo_id', 'fecha_cita', 'especialidad', 'medico']),
+        ]
+
+class EtlRollupPendiente(models.Model):
+    """Día de una clínica cuyos hechos cambiaron y cuyo rollup hay que recalcular."""
+    grupo_id = models.IntegerField()
+    fecha_key = models.IntegerField()
+
+    class Meta:
+        db_table = 'etl_rollup_pendiente'
+        constraints = [
+            models.UniqueConstraint(fields=['grupo_id', 'fecha_key'], name='etl_rollup_pendiente_unico'),
+        ]
@@ -1,5 +1,5 @@
 from rest_framework import serializers
-from .models import FactCitas
+from .models import FactCitas, EtlEjecucion, EtlRechazo
 
 class KPISerializer(serializers.Serializer):
     total_citas = serializers.IntegerField()
@@ -13,4 +13,26 @@ class RankingMedicoSerializer(serializers.Serializer):
 
 class TendenciaMensualSerializer(serializers.Serializer):
     mes = serializers.CharField()
-    total = serializers.IntegerField()
\ No newline at end of file
+    total = serializers.IntegerField()
+
+class EtlRechazoSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = EtlRechazo
+        fields = ['id_cita_sistema', 'motivo', 'fecha']
+
+class EtlEjecucionSerializer(serializers.ModelSerializer):
+    avance = serializers.SerializerMethodField()
+
+    class Meta:
+        model = EtlEjecucion
+        fields = [
+            'id', 'estado', 'completo', 'solicitado_por', 'marca_desde', 'fecha_creacion', 'fecha_inicio',
+            'fecha_fin', 'reanudaciones', 'particiones_total', 'particiones_hechas', 'avance', 'filas_leidas',
+            'filas_insertadas', 'filas_actualizadas', 'filas_rechazadas', 'filas_por_segundo', 'resumen',
+            'pasos', 'error',
+        ]
+
+    def get_avance(self, obj):
+        if not obj.particiones_total:
+            return 100.0 if obj.estado == 'COMPLETADA' else 0.0
+        return round(obj.particiones_hechas * 100 / obj.particiones_total, 1)
@@ -1,3 +1,133 @@
-from django.test import TestCase
+from datetime import date, time, timedelta
 
-# Create your tests here.
+from django.db.models import Count, Sum
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from apps.citas_pagos.models import Cita_Medica
+from apps.cuentas.models import Grupo, Rol, Usuario
+from apps.doctores.models import Bloque_Horario, Especialidad, Medico
+from apps.historiasDiagnosticos.models import Paciente
+
+from . import dashboard
+from .etl import encolar, run_etl
+from .models import EtlCheckpoint, EtlEjecucion, FactCitas, RollupCitasDiario
+
+
+def sembrar_clinica(citas=6):
+    """Una clínica con un médico, dos pacientes y ``citas`` citas futuras en su bloque."""
+    rol_medico = Rol.objects.create(nombre='medico')
+    rol_paciente = Rol.objects.create(nombre='paciente')
+    grupo = Grupo.objects.create(nombre='Clínica Test')
+    especialidad = Especialidad.objects.create(nombre='Retina')
+    medico = Medico.objects.create(
+        grupo=grupo, nombre='Dr Test', password='x', correo='medico@test.com', sexo='M',
+        fecha_nacimiento=date(1980, 1, 1), rol=rol_medico, numero_colegiado='C-1',
+    )
+    medico.especialidades.add(especialidad)
+    pacientes = []
+    for i, nacimiento in enumerate((date(1950, 1, 1), date(2000, 1, 1))):
+        usuario = Usuario.objects.create(
+            grupo=grupo, nombre=f'Paciente {i}', password='x', correo=f'paciente{i}@test.com', sexo='F',
+            fecha_nacimiento=nacimiento, rol=rol_paciente,
+        )
+        pacientes.append(Paciente.objects.create(usuario=usuario, numero_historia_clinica=f'HC-TEST-{i}'))
+    bloque = Bloque_Horario.objects.create(
+        dia_semana='LUNES', hora_inicio=time(9), hora_fin=time(12), duracion_cita_minutos=30,
+        max_citas_por_bloque=6, medico=medico, grupo=grupo,
+    )
+    hoy = timezone.localdate()
+    lunes = hoy + timedelta(days=7 - hoy.weekday())
+    for i in range(citas):
+        Cita_Medica.objects.create(
+            fecha=lunes + timedelta(weeks=i // 3), hora_inicio=time(9 + i % 3), hora_fin=time(9 + i % 3, 30),
+            estado_cita='PENDIENTE', paciente=pacientes[i % 2], bloque_horario=bloque, grupo=grupo,
+        )
+    return grupo
+
+
+class EtlIncrementalTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.grupo = sembrar_clinica()
+
+    def assertRollupIgualAHechos(self):
+        hechos = dict(FactCitas.objects.values_list('estado__codigo_estado').annotate(n=Count('cita_key')))
+        rollup = dict(RollupCitasDiario.objects.values_list('estado__codigo_estado').annotate(n=Sum('cantidad')))
+        self.assertEqual(hechos, rollup)
+
+    def test_cambio_de_estado_actualiza_el_hecho_y_el_rollup(self):
+        run_etl(completo=True)
+        self.assertEqual(FactCitas.objects.count(), 6)
+        self.assertRollupIgualAHechos()
+
+        cita = Cita_Medica.objects.order_by('id').first()
+        cita.estado_cita = 'COMPLETADA'
+        cita.save()
+        resumen = run_etl()
+
+        # El hecho existente se actualiza (COMPLETADA -> REALIZADA), no se duplica
+        self.assertEqual(FactCitas.objects.count(), 6)
+        self.assertEqual(FactCitas.objects.filter(id_cita_sistema=cita.id).count(), 1)
+        self.assertEqual(
+            FactCitas.objects.get(id_cita_sistema=cita.id).estado.codigo_estado, 'REALIZADA'
+        )
+        self.assertEqual(resumen['hechos_nuevos'], 0)
+        self.assertGreaterEqual(resumen['hechos_actualizados'], 1)
+        self.assertRollupIgualAHechos()
+
+    def test_reanuda_la_particion_pendiente_de_una_corrida_fallida(self):
+        run_etl(completo=True)
+        cita = Cita_Medica.objects.order_by('id').last()
+        FactCitas.objects.filter(id_cita_sistema=cita.id).delete()
+
+        # Corrida que se cayó con una partición sin terminar
+        fallida = EtlEjecucion.objects.create(
+            estado='FALLIDA', fecha_inicio=timezone.now(), particiones_total=1, error='Worker caído',
+        )
+        checkpoint = EtlCheckpoint.objects.create(ejecucion=fallida, desde_id=cita.id, hasta_id=cita.id + 1)
+
+        run_etl()
+
+        fallida.refresh_from_db()
+        checkpoint.refresh_from_db()
+        self.assertEqual(fallida.estado, 'COMPLETADA')
+        self.assertEqual(fallida.reanudaciones, 1)
+        self.assertTrue(checkpoint.completada)
+        self.assertEqual(FactCitas.objects.filter(id_cita_sistema=cita.id).count(), 1)
+        self.assertEqual(FactCitas.objects.count(), 6)
+        self.assertRollupIgualAHechos()
+
+    @override_settings(BI_ETL={'MODO': 'sincrono'})
+    def test_pedido_nuevo_despierta_una_corrida_pendiente_huerfana(self):
+        # Quedó PENDIENTE en el executor de un proceso que se reinició
+        huerfana = EtlEjecucion.objects.create(solicitado_por='antes del reinicio')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ejecucion, creada = encolar(solicitado_por='admin')
+
+        self.assertFalse(creada)
+        self.assertEqual(ejecucion.pk, huerfana.pk)
+        huerfana.refresh_from_db()
+        self.assertEqual(huerfana.estado, 'COMPLETADA')
+        self.assertEqual(FactCitas.objects.count(), 6)
+
+
+class DashboardConsultasTests(TestCase):
+    """KPIs y desgloses del dashboard cuestan dos agregaciones, sea cual sea la fuente."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.grupo = sembrar_clinica()
+        run_etl(completo=True)
+
+    def test_dos_consultas_por_fuente(self):
+        for fuente in (dashboard.FUENTE_HECHOS, dashboard.FUENTE_ROLLUP):
+            with self.subTest(fuente=fuente['nombre']):
+                queryset = fuente['modelo'].objects.filter(grupo_id=self.grupo.id)
+                with self.assertNumQueries(2):
+                    kpis = dashboard.kpis(queryset, fuente)
+                    desgloses = dashboard.desgloses(queryset, fuente)
+                self.assertEqual(kpis['total_citas'], 6)
+                self.assertTrue(desgloses)
@@ -13,5 +13,6 @@ urlpatterns = [
     # Esto genera automáticamente las URLs:
     # /analytics/run-etl/ (POST)
     # /analytics/dashboard/ (GET)
+    # /analytics/cube/ (GET)
     path('', include(router.urls)),
 ]
\ No newline at end of file
@@ -2,223 +2,256 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.authentication import TokenAuthentication
+from rest_framework.reverse import reverse
+from rest_framework.renderers import JSONRenderer
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags
 from django.db.models import Count, Avg, Sum, F, Case, When, IntegerField
 from django.db.models.functions import ExtractHour, ExtractWeekDay
 import traceback 
 from django.apps import apps 
-from datetime import datetime
+from datetime import date, datetime
 
 # Imports locales
-from .models import FactCitas
-from .etl import run_etl 
+from apps.cuentas.tenant import get_tenant_context
+from apps.cuentas.authentication import CachedTokenAuthentication
+from apps.reportes import cache as cache_reportes
+from .models import FactCitas, EtlEjecucion
+from .serializers import EtlEjecucionSerializer, EtlRechazoSerializer
+from .etl import encolar, generacion, rollup_disponible
+from . import cubo, dashboard
 
 class AnalyticsViewSet(viewsets.ViewSet):
     """
     Motor de Inteligencia de Negocios 'Clinical Intelligence'.
     Soporta filtrado dinámico y agregaciones complejas.
     """
-    authentication_classes = [TokenAuthentication]
+    authentication_classes = [CachedTokenAuthentication]
     permission_classes = [IsAuthenticated]
 
     def _get_usuario_sistema(self, request):
         try:
-            Usuario = apps.get_model('cuentas', 'Usuario') 
-            return Usuario.objects.get(correo=request.user.email)
+            return get_tenant_context(request).usuario
         except Exception:
             return None
 
-    def _aplicar_filtros(self, request, queryset):
+    def _aplicar_filtros(self, filtros, queryset, generacion):
         """
-        Aplica filtros dinámicos basados en los QueryParams de la URL.
+        Aplica filtros dinámicos basados en los QueryParams de la URL
+        (ya normalizados por ``dashboard.filtros``). Los textos se resuelven a
+        claves con el diccionario de dimensiones en memoria, así los hechos se
+        filtran por sus columnas ``*_key`` con IN, sin joins ni LIKE.
         """
-        # 1. Rango de Fechas
-        start_date = request.query_params.get('start_date')
-        end_date = request.query_params.get('end_date')
+        dimensiones = dashboard.diccionario(generacion)
+
+        # 1. Rango de Fechas (fecha_key es YYYYMMDD: el rango de fechas es un rango de claves)
+        start_date = filtros.get('start_date')
+        end_date = filtros.get('end_date')
         if start_date and end_date:
-            queryset = queryset.filter(fecha_cita__fecha__range=[start_date, end_date])
+            try:
+                desde, hasta = (int(date.fromisoformat(f).strftime('%Y%m%d')) for f in (start_date, end_date))
+            except ValueError:
+                queryset = queryset.filter(fecha_cita__fecha__range=[start_date, end_date])
+            else:
+                queryset = queryset.filter(fecha_cita__gte=desde, fecha_cita__lte=hasta)
 
         # 2. Especialidad
-        especialidad = request.query_params.get('especialidad')
+        especialidad = filtros.get('especialidad')
         if especialidad:
-            queryset = queryset.filter(especialidad__nombre_especialidad__icontains=especialidad)
-
-        # 3. Médico (Nombre)
-        medico = request.query_params.get('medico')
-        if medico:
-            queryset = queryset.filter(medico__nombre_completo__icontains=medico)
+            queryset = queryset.filter(especialidad_id__in=dimensiones.especialidades(especialidad))
 
-        # 4. Género del Médico
-        sexo_medico = request.query_params.get('sexo_medico')
-        if sexo_medico:
-            queryset = queryset.filter(medico__genero=sexo_medico)
+        # 3. Médico (Nombre) y 4. Género del Médico
+        medico = filtros.get('medico')
+        sexo_medico = filtros.get('sexo_medico')
+        if medico or sexo_medico:
+            queryset = queryset.filter(medico_id__in=dimensiones.medicos(medico, sexo_medico))
 
         return queryset
 
+    def _puede_ejecutar_etl(self, request):
+        if request.user.is_superuser:
+            return True
+        usuario = self._get_usuario_sistema(request)
+        return bool(usuario and usuario.rol and usuario.rol.nombre in ['superAdmin', 'administrador'])
+
     @action(detail=False, methods=['post'], url_path='run-etl')
     def ejecutar_etl(self, request):
-        usuario = self._get_usuario_sistema(request)
-        tiene_permiso = False
-        
-        if request.user.is_superuser:
-            tiene_permiso = True
-        
-        if usuario and usuario.rol:
-            if usuario.rol.nombre in ['superAdmin', 'administrador']:
-                tiene_permiso = True
-            
-        if not tiene_permiso:
+        if not self._puede_ejecutar_etl(request):
              return Response({"error": "No tienes permisos para ejecutar el ETL."}, status=status.HTTP_403_FORBIDDEN)
 
         try:
-            run_etl()
-            return Response({"mensaje": "DataMart actualizado exitosamente."}, status=status.HTTP_200_OK)
+            completo = str(request.data.get('completo', '')).lower() in ('1', 'true')
+            usuario = self._get_usuario_sistema(request)
+            ejecucion, creada = encolar(completo, usuario.nombre if usuario else request.user.username)
+            ejecucion.refresh_from_db()  # con MODO='sincrono' ya terminó
+            return Response({
+                "mensaje": "Actualización del DataMart en cola." if creada else "Ya hay una actualización en cola.",
+                "reutilizada": not creada,
+                "ejecucion": EtlEjecucionSerializer(ejecucion).data,
+                "url_estado": reverse('analytics-ejecucion-etl', kwargs={'ejecucion_id': ejecucion.id}, request=request),
+            }, status=status.HTTP_202_ACCEPTED)
         except Exception as e:
             print(f"Error ETL: {e}")
             traceback.print_exc()
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    @action(detail=False, methods=['get'], url_path='etl-runs')
+    def ejecuciones_etl(self, request):
+        """Historial de corridas del ETL (las últimas ``limite``, 20 por defecto)."""
+        if not self._puede_ejecutar_etl(request):
+            return Response({"error": "No tienes permisos para ver el ETL."}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            limite = min(max(int(request.query_params.get('limite', 20)), 1), 200)
+        except ValueError:
+            return Response({"error": "limite debe ser un número."}, status=status.HTTP_400_BAD_REQUEST)
+        ejecuciones = EtlEjecucion.objects.order_by('-fecha_inicio', '-id')[:limite]
+        return Response(EtlEjecucionSerializer(ejecuciones, many=True).data)
+
+    @action(detail=False, methods=['get'], url_path=r'etl-runs/(?P<ejecucion_id>[0-9]+)')
+    def ejecucion_etl(self, request, ejecucion_id=None):
+        """Estado de una corrida (avance, tiempos por paso) con sus primeras citas rechazadas."""
+        if not self._puede_ejecutar_etl(request):
+            return Response({"error": "No tienes permisos para ver el ETL."}, status=status.HTTP_403_FORBIDDEN)
+        ejecucion = EtlEjecucion.objects.filter(pk=ejecucion_id).first()
+        if ejecucion is None:
+            return Response({"error": "Ejecución no encontrada."}, status=status.HTTP_404_NOT_FOUND)
+        data = EtlEjecucionSerializer(ejecucion).data
+        data['rechazos'] = EtlRechazoSerializer(ejecucion.rechazos.order_by('id')[:100], many=True).data
+        return Response(data)
+
+    def _fuente_dashboard(self, filtros):
+        """
+        De dónde lee el dashboard. El rollup diario responde todos los filtros
+        de ``_aplicar_filtros`` (tiene las mismas claves a las dimensiones), así
+        que se usa siempre que el ETL ya lo haya construido; ``?fuente=hechos``
+        fuerza los hechos crudos.
+        """
+        if filtros.get('fuente') != 'hechos' and rollup_disponible():
+            return dashboard.FUENTE_ROLLUP
+        return dashboard.FUENTE_HECHOS
+
+    def _alcance_dashboard(self, request):
+        """
+        Clínica cuyos datos ve el usuario: ``(grupo_id, None)``, con grupo_id
+        None para superuser/superAdmin (todas), o ``(None, respuesta 403)``.
+        """
+        if request.user.is_superuser:
+            return None, None
+        usuario = self._get_usuario_sistema(request)
+        if not usuario:
+            return None, Response({"detail": "Perfil no encontrado."}, status=status.HTTP_403_FORBIDDEN)
+        if usuario.rol and usuario.rol.nombre == 'superAdmin':
+            return None, None
+        if not usuario.grupo_id:
+            return None, Response({"detail": "Usuario sin clínica asignada."}, status=status.HTTP_403_FORBIDDEN)
+        return usuario.grupo_id, None
+
     @action(detail=False, methods=['get'], url_path='dashboard')
     def dashboard_kpi(self, request):
         try:
             # --- 1. SEGURIDAD & MULTI-TENANCY ---
-            usuario = self._get_usuario_sistema(request)
-            base_queryset = FactCitas.objects.none() 
-
-            if request.user.is_superuser:
-                base_queryset = FactCitas.objects.all()
-            elif usuario:
-                if usuario.rol and usuario.rol.nombre == 'superAdmin':
-                    base_queryset = FactCitas.objects.all()
-                elif usuario.grupo:
-                    base_queryset = FactCitas.objects.filter(grupo_id=usuario.grupo.id)
-                else:
-                    return Response({"detail": "Usuario sin clínica asignada."}, status=status.HTTP_403_FORBIDDEN)
-            else:
-                return Response({"detail": "Perfil no encontrado."}, status=status.HTTP_403_FORBIDDEN)
+            grupo_id, error = self._alcance_dashboard(request)
+            if error:
+                return error
 
-            # --- 2. APLICAR FILTROS GLOBALES ---
-            queryset = self._aplicar_filtros(request, base_queryset)
-            total_citas = queryset.count()
+            # --- 2. CACHÉ: el mart solo cambia cuando termina una corrida del ETL ---
+            filtros = dashboard.filtros(request.query_params)
+            generacion_etl = generacion()
+            clave = dashboard.clave_cache(grupo_id, filtros, generacion_etl)
+            etag = f'"{clave}"'
+            if etag in parse_etags(request.headers.get('If-None-Match', '')):
+                return _con_etag(HttpResponseNotModified(), etag)
+            entrada = cache_reportes.obtener(clave)
+            if entrada is not None:
+                return _con_etag(HttpResponse(entrada.contenido, content_type=entrada.content_type), etag)
 
-            # Estructura de respuesta vacía si no hay datos
-            if total_citas == 0:
-                 return Response({"kpis": {"total_citas": 0}, "mensaje": "No hay datos con estos filtros"}, status=status.HTTP_200_OK)
+            # --- 3. APLICAR FILTROS GLOBALES ---
+            fuente = self._fuente_dashboard(filtros)
+            modelo = fuente['modelo']
+            base_queryset = modelo.objects.all()
+            if grupo_id:
+                base_queryset = base_queryset.filter(grupo_id=grupo_id)
+            queryset = self._aplicar_filtros(filtros, base_queryset, generacion_etl)
 
             # ==========================================================
             # SECCIÓN 1: RESUMEN EJECUTIVO (KPIs Principales)
             # ==========================================================
-            citas_realizadas = queryset.filter(estado__codigo_estado='REALIZADA').count()
-            citas_canceladas = queryset.filter(estado__es_cancelacion=True).count()
-            tasa_cancelacion = round((citas_canceladas / total_citas) * 100, 1) if total_citas > 0 else 0
-            
-            duracion_avg = queryset.filter(estado__codigo_estado='REALIZADA').aggregate(p=Avg('duracion_minutos'))['p']
-            duracion_prom = round(duracion_avg, 1) if duracion_avg else 0
-
-            tendencia = (
-                queryset
-                .values('fecha_cita__nombre_mes', 'fecha_cita__mes')
-                .annotate(total=Count('cita_key'))
-                .order_by('fecha_cita__mes')
-            )
-
-            top_medicos = (
-                queryset.filter(estado__codigo_estado='REALIZADA')
-                .values('medico__nombre_completo')
-                .annotate(citas=Count('cita_key'))
-                .order_by('-citas')[:5]
-            )
-
-            # ==========================================================
-            # SECCIÓN 2: DEMOGRAFÍA (Radiografía del Paciente)
-            # ==========================================================
-            # Distribución por Grupo Etario
-            dist_edad = (
-                queryset
-                .values('paciente__grupo_etario')
-                .annotate(total=Count('cita_key'))
-                .order_by('-total')
-            )
-
-            # Pirámide Poblacional (Sexo vs Edad)
-            # Esto cuenta cuántos Hombres y Mujeres hay
-            dist_sexo = (
-                queryset
-                .values('paciente__genero')
-                .annotate(total=Count('cita_key'))
-            )
+            # Un solo aggregate() con agregados condicionales.
+            kpis = dashboard.kpis(queryset, fuente)
 
-            # ==========================================================
-            # SECCIÓN 3: EFICIENCIA OPERATIVA (Heatmaps)
-            # ==========================================================
-            # Mapa de Calor: Día de la semana + Hora
-            # Nota: ExtractHour saca la hora del TimeField
-            heatmap_data = (
-                queryset
-                .annotate(hora=ExtractHour('hora_inicio'))
-                .values('fecha_cita__nombre_dia', 'fecha_cita__dia_semana', 'hora')
-                .annotate(cantidad=Count('cita_key'))
-                .order_by('fecha_cita__dia_semana', 'hora')
-            )
-
-            # Duración por Especialidad (Para ver cuál tarda más)
-            duracion_especialidad = (
-                queryset.filter(estado__codigo_estado='REALIZADA')
-                .values('especialidad__nombre_especialidad')
-                .annotate(promedio_min=Avg('duracion_minutos'))
-                .order_by('-promedio_min')
-            )
+            # Estructura de respuesta vacía si no hay datos
+            if kpis['total_citas'] == 0:
+                return _respuesta_dashboard(clave, etag, {"kpis": {"total_citas": 0}, "mensaje": "No hay datos con estos filtros"})
 
             # ==========================================================
-            # SECCIÓN 4: ANÁLISIS DE FUGAS (Cancelaciones)
+            # SECCIONES 2-4: DEMOGRAFÍA, OPERACIONES Y FUGAS
             # ==========================================================
-            cancelaciones_queryset = queryset.filter(estado__es_cancelacion=True)
-            
-            cancelaciones_por_motivo = (
-                cancelaciones_queryset
-                .values('estado__descripcion_estado') # Ej: Cancelada, No Asistió
-                .annotate(total=Count('cita_key'))
-                .order_by('-total')
-            )
-
-            cancelaciones_por_especialidad = (
-                cancelaciones_queryset
-                .values('especialidad__nombre_especialidad')
-                .annotate(total=Count('cita_key'))
-                .order_by('-total')[:5]
-            )
+            # Todos los desgloses salen de una sola consulta (GROUPING SETS).
+            desgloses = dashboard.desgloses(queryset, fuente)
 
             # --- ARMADO DE LA RESPUESTA ---
             response_data = {
-                "filtros_aplicados": request.query_params,
+                "filtros_aplicados": filtros,
+                "fuente": fuente['nombre'],
                 "resumen": {
-                    "kpis": {
-                        "total_citas": total_citas,
-                        "realizadas": citas_realizadas,
-                        "canceladas": citas_canceladas,
-                        "tasa_cancelacion": tasa_cancelacion,
-                        "duracion_promedio": duracion_prom
-                    },
-                    "tendencia": list(tendencia),
-                    "top_medicos": list(top_medicos)
+                    "kpis": kpis,
+                    "tendencia": desgloses['tendencia'],
+                    "top_medicos": desgloses['top_medicos']
                 },
                 "demografia": {
-                    "distribucion_edad": list(dist_edad),
-                    "distribucion_sexo": list(dist_sexo)
+                    "distribucion_edad": desgloses['distribucion_edad'],
+                    "distribucion_sexo": desgloses['distribucion_sexo']
                 },
                 "operaciones": {
-                    "heatmap": list(heatmap_data),
-                    "duracion_por_especialidad": list(duracion_especialidad)
+                    "heatmap": desgloses['heatmap'],
+                    "duracion_por_especialidad": desgloses['duracion_por_especialidad']
                 },
                 "fugas": {
-                    "por_motivo": list(cancelaciones_por_motivo),
-                    "por_especialidad": list(cancelaciones_por_especialidad)
+                    "por_motivo": desgloses['cancelaciones_por_motivo'],
+                    "por_especialidad": desgloses['cancelaciones_por_especialidad']
                 }
             }
-            
-            return Response(response_data, status=status.HTTP_200_OK)
+
+            return _respuesta_dashboard(clave, etag, response_data)
 
         except Exception as e:
             print("Error en Dashboard:", str(e))
             traceback.print_exc()
-            return Response({"detail": "Error interno", "error_tecnico": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+            return Response({"detail": "Error interno", "error_tecnico": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    @action(detail=False, methods=['get'], url_path='cube')
+    def consultar_cubo(self, request):
+        """
+        Drill-down sobre el cubo en memoria (ver cubo.py), p. ej.
+        ``?dimensiones=dia_semana,hora&medidas=citas,canceladas&orden=-citas&limite=10``.
+        Acepta los filtros del dashboard y ``filtro=dimension:valor`` (repetible).
+        """
+        grupo_id, error = self._alcance_dashboard(request)
+        if error:
+            return error
+        try:
+            consulta = cubo.parsear_consulta(request.query_params)
+            resultado = cubo.obtener(grupo_id, generacion()).consultar(**consulta)
+        except cubo.ConsultaCuboInvalida as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except cubo.CuboNoDisponible as e:
+            return Response({"error": str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        except Exception as e:
+            print("Error en Cubo BI:", str(e))
+            traceback.print_exc()
+            return Response({"detail": "Error interno", "error_tecnico": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        return Response(resultado)
+
+
+def _con_etag(response, etag):
+    # no-cache: el navegador guarda la respuesta pero revalida siempre con If-None-Match
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def _respuesta_dashboard(clave, etag, data):
+    """Renderiza el dashboard una vez y lo guarda en la caché de reportes."""
+    entrada = cache_reportes.Entrada(JSONRenderer().render(data), 'application/json', None)
+    cache_reportes.guardar(clave, entrada)
+    return _con_etag(HttpResponse(entrada.contenido, content_type=entrada.content_type), etag)
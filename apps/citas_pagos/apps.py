@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class CitasConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.citas_pagos'
+
+    def ready(self):
+        from . import signals  # noqa: F401
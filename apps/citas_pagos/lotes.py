@@ -0,0 +1,328 @@
+# apps/citas_pagos/lotes.py
+"""
+Alta y cambio de estado de citas en lote (recepción agendando controles o
+cancelando la agenda de un médico ausente).
+
+En lugar de validar y guardar cita por cita:
+
+- Pacientes y bloques se cargan con una consulta cada uno.
+- Los choques de turno y cupo se validan contra una sola ``Instantanea`` de
+  la ocupación (una consulta), que se actualiza en memoria a medida que se
+  aceptan elementos, así también se detectan choques dentro del mismo lote.
+- Lo aceptado se escribe en una transacción: contadores de cupo agrupados
+  por bloque y fecha, y ``bulk_create``/``bulk_update`` de las citas.
+
+Si al escribir otra reserva concurrente ganó un turno o el cupo (la base lo
+rechaza, ver reservas.py), se deshace solo esa escritura y se reintenta cita
+por cita para informar qué elementos fallaron. Cada elemento del lote tiene
+su propio resultado; un elemento inválido no impide guardar los demás.
+"""
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from apps.cuentas import versiones
+from apps.doctores.disponibilidad import PlantillaBloque, cargar_ocupacion
+from apps.doctores.models import Bloque_Horario
+from apps.historiasDiagnosticos.models import Paciente
+
+from . import ocupacion
+from .models import Cita_Medica
+from .reservas import (
+    MENSAJE_CUPO, MENSAJE_OCUPADO, TurnoNoDisponible, guardar_instancia, liberar_cupo, reservar_cupo,
+)
+from .serializers import (
+    CambioEstadoLoteSerializer, CitaLoteSerializer, calcular_hora_fin,
+    validar_dia_del_bloque, validar_hora_del_bloque,
+)
+
+
+# Elementos máximos por request
+MAX_LOTE = 200
+
+CAMPOS_CAMBIO_ESTADO = ['estado_cita', 'motivo_cancelacion', 'fecha_modificacion']
+
+
+def _errores(detalle):
+    """Normaliza un mensaje al formato de errores de DRF ({campo: [mensajes]})."""
+    detalle = serializers.ValidationError(detalle).detail
+    if isinstance(detalle, list):
+        return {api_settings.NON_FIELD_ERRORS_KEY: detalle}
+    return detalle
+
+
+class Instantanea:
+    """
+    Ocupación de los bloques de los médicos involucrados en el lote, leída de
+    la base con una consulta y mantenida en memoria mientras se procesa.
+    """
+
+    def __init__(self, bloques, fechas):
+        plantillas = {p.bloque_id: p for p in ocupacion.plantillas_de_medicos({b.medico_id for b in bloques})}
+        # Los bloques del lote pueden estar inactivos (citas existentes)
+        plantillas.update({b.pk: PlantillaBloque.desde_bloque(b) for b in bloques})
+        self.por_medico = defaultdict(list)
+        for plantilla in plantillas.values():
+            self.por_medico[plantilla.medico_id].append(plantilla)
+        self.plantillas = plantillas
+        self.ocupacion = cargar_ocupacion(list(plantillas.values()), min(fechas), max(fechas)) if fechas else {}
+
+    def error(self, bloque, fecha, hora):
+        """Mensaje de error si el turno no se puede tomar, o None."""
+        _, total = self.ocupacion.get((bloque.pk, fecha), (0, 0))
+        if bloque.max_citas_por_bloque is not None and total >= bloque.max_citas_por_bloque:
+            return MENSAJE_CUPO
+        # El mismo horario puede estar tomado en otro bloque del médico que se solape con este
+        dia = fecha.weekday()
+        for plantilla in self.por_medico[bloque.medico_id]:
+            if plantilla.dia != dia:
+                continue
+            i = plantilla.indice(hora)
+            if i is not None and self.ocupacion.get((plantilla.bloque_id, fecha), (0, 0))[0] & (1 << i):
+                return MENSAJE_OCUPADO
+        return None
+
+    def aplicar(self, turno, delta):
+        bloque_id, fecha, hora = turno
+        plantilla = self.plantillas.get(bloque_id)
+        if plantilla is None:
+            return
+        entrada = self.ocupacion.setdefault((bloque_id, fecha), [0, 0])
+        i = plantilla.indice(hora)
+        if delta > 0:
+            entrada[1] += 1
+            if i is not None:
+                entrada[0] |= 1 << i
+        else:
+            entrada[1] = max(0, entrada[1] - 1)
+            if i is not None:
+                entrada[0] &= ~(1 << i)
+
+
+def _validar_elementos(items, serializer_class):
+    """Valida la forma de cada elemento. Devuelve (validos, resultados)."""
+    resultados = [None] * len(items)
+    validos = []
+    for i, item in enumerate(items):
+        serializer = serializer_class(data=item)
+        if serializer.is_valid():
+            validos.append((i, serializer.validated_data))
+        else:
+            resultados[i] = serializer.errors
+    return validos, resultados
+
+
+# ---------------------------------------------------------------------------
+# Alta
+# ---------------------------------------------------------------------------
+
+def crear_citas(items, grupo=None, medico=None, serie=None):
+    """
+    Crea las citas de ``items`` (dicts con paciente, bloque_horario, fecha,
+    hora_inicio y opcionalmente tipo y notas). Con ``grupo``/``medico`` solo se
+    aceptan pacientes y bloques de esa clínica/médico. ``serie`` se asigna a
+    todas las citas creadas (ver series.py).
+
+    Devuelve una lista paralela a ``items`` con la ``Cita_Medica`` creada o
+    el detalle de errores de cada elemento.
+    """
+    validos, resultados = _validar_elementos(items, CitaLoteSerializer)
+
+    pacientes = Paciente.objects.filter(usuario__estado=True).select_related('usuario')
+    bloques = Bloque_Horario.objects.filter(estado=True).select_related('medico')
+    if grupo:
+        pacientes = pacientes.filter(usuario__grupo=grupo)
+        bloques = bloques.filter(medico__grupo=grupo)
+    if medico:
+        bloques = bloques.filter(medico=medico)
+    pacientes = pacientes.in_bulk({datos['paciente'] for _, datos in validos})
+    bloques = bloques.in_bulk({datos['bloque_horario'] for _, datos in validos})
+
+    candidatas = []
+    for i, datos in validos:
+        paciente = pacientes.get(datos['paciente'])
+        bloque = bloques.get(datos['bloque_horario'])
+        try:
+            if paciente is None:
+                raise serializers.ValidationError({"paciente": "Paciente no encontrado."})
+            if bloque is None:
+                raise serializers.ValidationError({"bloque_horario": "Bloque horario no encontrado."})
+            if paciente.usuario.grupo_id != bloque.medico.grupo_id:
+                raise serializers.ValidationError({"detail": "El paciente y el médico no pertenecen a la misma clínica/grupo."})
+            validar_dia_del_bloque(bloque, datos['fecha'])
+            validar_hora_del_bloque(bloque, datos['hora_inicio'])
+        except serializers.ValidationError as e:
+            resultados[i] = _errores(e.detail)
+            continue
+        candidatas.append((i, Cita_Medica(
+            paciente=paciente,
+            bloque_horario=bloque,
+            grupo_id=bloque.medico.grupo_id,
+            fecha=datos['fecha'],
+            hora_inicio=datos['hora_inicio'],
+            hora_fin=calcular_hora_fin(bloque, datos['fecha'], datos['hora_inicio']),
+            tipo=datos['tipo'],
+            notas=datos['notas'],
+            serie=serie,
+        )))
+
+    instantanea = Instantanea(
+        list({cita.bloque_horario_id: cita.bloque_horario for _, cita in candidatas}.values()),
+        [cita.fecha for _, cita in candidatas],
+    )
+    aceptadas = []
+    for i, cita in candidatas:
+        error = instantanea.error(cita.bloque_horario, cita.fecha, cita.hora_inicio)
+        if error:
+            resultados[i] = _errores(error)
+            continue
+        instantanea.aplicar(cita.turno_ocupado(), +1)
+        aceptadas.append((i, cita))
+
+    if aceptadas:
+        for i, resultado in _escribir_altas(aceptadas).items():
+            resultados[i] = resultado
+    return resultados
+
+
+def _escribir_altas(aceptadas):
+    citas = [cita for _, cita in aceptadas]
+    cupos = Counter((cita.bloque_horario_id, cita.fecha) for cita in citas)
+    bloques = {cita.bloque_horario_id: cita.bloque_horario for cita in citas}
+    try:
+        with transaction.atomic():
+            for (bloque_id, fecha), cantidad in cupos.items():
+                reservar_cupo(bloques[bloque_id], fecha, cantidad)
+            Cita_Medica.objects.bulk_create(citas)
+    except (TurnoNoDisponible, IntegrityError):
+        # Una reserva concurrente ganó algún turno o cupo: cita por cita
+        return _guardar_una_por_una(aceptadas)
+
+    # bulk_create no emite post_save: se actualizan la caché de ocupación y la versión de datos aquí
+    for cita in citas:
+        cita._turno_original = cita.turno_ocupado()
+        ocupacion.registrar_cambio(None, cita._turno_original)
+    versiones.incrementar({cita.grupo_id for cita in citas})
+    return {i: cita for i, cita in aceptadas}
+
+
+# ---------------------------------------------------------------------------
+# Cambio de estado
+# ---------------------------------------------------------------------------
+
+def cambiar_estados(queryset, items):
+    """
+    Aplica ``items`` (dicts con id, estado_cita y opcionalmente
+    motivo_cancelacion) a las citas de ``queryset``, que ya debe estar
+    filtrado por clínica/médico.
+
+    Devuelve una lista paralela a ``items`` con ``(cita, estado_anterior)`` o
+    el detalle de errores de cada elemento.
+    """
+    validos, resultados = _validar_elementos(items, CambioEstadoLoteSerializer)
+    citas = queryset.in_bulk({datos['id'] for _, datos in validos})
+
+    # Solo hace falta mirar la ocupación si alguna cita cancelada vuelve a ocupar turno
+    reactivaciones = [
+        citas[datos['id']] for _, datos in validos
+        if datos['id'] in citas and datos['estado_cita'] != 'CANCELADA'
+        and citas[datos['id']].estado_cita == 'CANCELADA'
+    ]
+    instantanea = None
+    if reactivaciones:
+        instantanea = Instantanea(
+            list({c.bloque_horario_id: c.bloque_horario for c in citas.values()}.values()),
+            [c.fecha for c in citas.values()],
+        )
+
+    vistas = set()
+    aceptadas = []
+    for i, datos in validos:
+        cita = citas.get(datos['id'])
+        if cita is None:
+            resultados[i] = _errores({"id": "Cita no encontrada."})
+            continue
+        if cita.pk in vistas:
+            resultados[i] = _errores({"id": "La cita aparece más de una vez en el lote."})
+            continue
+        vistas.add(cita.pk)
+
+        anterior = cita.turno_ocupado()
+        nuevo = None if datos['estado_cita'] == 'CANCELADA' else (cita.bloque_horario_id, cita.fecha, cita.hora_inicio)
+        if instantanea and anterior is None and nuevo is not None:
+            error = instantanea.error(cita.bloque_horario, cita.fecha, cita.hora_inicio)
+            if error:
+                resultados[i] = _errores(error)
+                continue
+        if instantanea and anterior != nuevo:
+            if anterior:
+                instantanea.aplicar(anterior, -1)
+            if nuevo:
+                instantanea.aplicar(nuevo, +1)
+
+        estado_anterior = cita.estado_cita
+        cita.estado_cita = datos['estado_cita']
+        if datos['estado_cita'] == 'CANCELADA':
+            cita.motivo_cancelacion = datos.get('motivo_cancelacion') or 'Sin motivo especificado.'
+        aceptadas.append((i, cita, estado_anterior))
+
+    if aceptadas:
+        escritas = _escribir_estados([(i, cita) for i, cita, _ in aceptadas])
+        for i, cita, estado_anterior in aceptadas:
+            resultado = escritas[i]
+            resultados[i] = (cita, estado_anterior) if isinstance(resultado, Cita_Medica) else resultado
+    return resultados
+
+
+def _escribir_estados(aceptadas):
+    citas = [cita for _, cita in aceptadas]
+    liberar = Counter()
+    reservar = Counter()
+    bloques = {}
+    for cita in citas:
+        anterior, nuevo = getattr(cita, '_turno_original', None), cita.turno_ocupado()
+        if anterior and (not nuevo or anterior[:2] != nuevo[:2]):
+            liberar[anterior[:2]] += 1
+        if nuevo and (not anterior or anterior[:2] != nuevo[:2]):
+            reservar[nuevo[:2]] += 1
+            bloques[cita.bloque_horario_id] = cita.bloque_horario
+
+    ahora = timezone.now()
+    for cita in citas:
+        # bulk_update no aplica auto_now
+        cita.fecha_modificacion = ahora
+    try:
+        with transaction.atomic():
+            for (bloque_id, fecha), cantidad in liberar.items():
+                liberar_cupo(bloque_id, fecha, cantidad)
+            for (bloque_id, fecha), cantidad in reservar.items():
+                reservar_cupo(bloques[bloque_id], fecha, cantidad)
+            Cita_Medica.objects.bulk_update(citas, CAMPOS_CAMBIO_ESTADO)
+    except (TurnoNoDisponible, IntegrityError):
+        return _guardar_una_por_una(aceptadas)
+
+    # bulk_update no emite post_save: se actualizan la caché de ocupación y la versión de datos aquí
+    for cita in citas:
+        nuevo = cita.turno_ocupado()
+        ocupacion.registrar_cambio(getattr(cita, '_turno_original', None), nuevo)
+        cita._turno_original = nuevo
+    versiones.incrementar({cita.grupo_id for cita in citas})
+    return {i: cita for i, cita in aceptadas}
+
+
+def _guardar_una_por_una(aceptadas):
+    """Camino lento: cada cita en su propia transacción, con su propio resultado."""
+    resultados = {}
+    for i, cita in aceptadas:
+        if not hasattr(cita, '_turno_original'):
+            # Alta: bulk_create pudo haber asignado la pk antes de fallar
+            cita.pk = None
+            cita._state.adding = True
+        try:
+            resultados[i] = guardar_instancia(cita)
+        except TurnoNoDisponible as e:
+            resultados[i] = _errores(e.detalle)
+    return resultados
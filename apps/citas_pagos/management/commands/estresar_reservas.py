@@ -0,0 +1,153 @@
+import random
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError, connection, transaction
+
+from apps.citas_pagos import ocupacion
+from apps.citas_pagos.models import Cita_Medica, OcupacionBloque
+from apps.citas_pagos.reservas import TurnoNoDisponible, guardar_cita
+from apps.doctores.disponibilidad import DIAS_SEMANA, PlantillaBloque
+from apps.doctores.models import Bloque_Horario
+from apps.historiasDiagnosticos.models import Paciente
+
+
+class Command(BaseCommand):
+    help = (
+        "Prueba de carga de reservas concurrentes sobre un bloque: compara el flujo "
+        "anterior (contar + exists + create) con el chequeo en caché + servicio de "
+        "reservas atómico. "
+        "Usa una fecha lejana y borra las citas creadas al terminar. "
+        "Pensado para PostgreSQL; en SQLite las escrituras se serializan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--bloque', type=int, help='Bloque_Horario a usar (por defecto el primero activo)')
+        parser.add_argument('--hilos', type=int, default=16)
+        parser.add_argument('--intentos', type=int, default=50, help='Intentos de reserva por hilo')
+        parser.add_argument('--modo', choices=['anterior', 'servicio', 'ambos'], default='ambos')
+
+    def handle(self, *args, **options):
+        bloque = (
+            Bloque_Horario.objects.select_related('medico').filter(pk=options['bloque']).first()
+            if options['bloque'] else
+            Bloque_Horario.objects.select_related('medico').filter(estado=True).first()
+        )
+        if bloque is None:
+            raise CommandError('No hay un bloque horario para la prueba.')
+        paciente = Paciente.objects.filter(usuario__grupo_id=bloque.grupo_id).first()
+        if paciente is None:
+            raise CommandError('El grupo del bloque no tiene pacientes.')
+
+        plantilla = PlantillaBloque.desde_bloque(bloque)
+        # Primera fecha del día del bloque dentro de ~10 años: no choca con datos reales
+        base = date.today() + timedelta(days=3650)
+        fecha = base + timedelta(days=(plantilla.dia - base.weekday()) % 7)
+        horas = [plantilla.hora(i) for i in range(plantilla.turnos)]
+        self.stdout.write(
+            f"Bloque {bloque.pk} ({DIAS_SEMANA[plantilla.dia]}), {len(horas)} turnos, "
+            f"cupo {bloque.max_citas_por_bloque}, fecha {fecha}, "
+            f"{options['hilos']} hilos x {options['intentos']} intentos"
+        )
+
+        modos = ['anterior', 'servicio'] if options['modo'] == 'ambos' else [options['modo']]
+        for modo in modos:
+            self._limpiar(bloque, fecha)
+            try:
+                self._correr(modo, bloque, paciente, fecha, horas, options['hilos'], options['intentos'])
+            finally:
+                self._limpiar(bloque, fecha)
+
+    def _limpiar(self, bloque, fecha):
+        Cita_Medica.objects.filter(bloque_horario=bloque, fecha=fecha).delete()
+        OcupacionBloque.objects.filter(bloque_horario=bloque, fecha=fecha).delete()
+
+    def _datos_cita(self, bloque, paciente, fecha, hora):
+        fin = (datetime.combine(fecha, hora) + timedelta(minutes=bloque.duracion_cita_minutos)).time()
+        return dict(
+            fecha=fecha, hora_inicio=hora, hora_fin=fin, paciente=paciente,
+            bloque_horario=bloque, grupo_id=bloque.grupo_id, notas='estresar_reservas',
+        )
+
+    def _reservar_anterior(self, bloque, paciente, fecha, hora):
+        # Réplica de las comprobaciones que hacía CitaMedicaSerializer.validate
+        activas = Cita_Medica.objects.filter(bloque_horario__medico=bloque.medico, fecha=fecha).exclude(estado_cita='CANCELADA')
+        if activas.filter(bloque_horario=bloque).count() >= bloque.max_citas_por_bloque:
+            return 'cupo'
+        if activas.filter(hora_inicio=hora).exists():
+            return 'ocupado'
+        try:
+            with transaction.atomic():
+                Cita_Medica.objects.create(**self._datos_cita(bloque, paciente, fecha, hora))
+        except IntegrityError:
+            # Sin la restricción de turno único esto habría sido una doble reserva
+            return 'doble_evitada'
+        return 'ok'
+
+    def _reservar_servicio(self, bloque, paciente, fecha, hora):
+        # Chequeo previo contra la caché de ocupación, igual que el serializer
+        plantilla = PlantillaBloque.desde_bloque(bloque)
+        mascara, total = ocupacion.ocupacion_de(plantilla, fecha)
+        if total >= bloque.max_citas_por_bloque:
+            return 'cupo'
+        i = plantilla.indice(hora)
+        if i is not None and mascara & (1 << i):
+            return 'ocupado'
+
+        datos = self._datos_cita(bloque, paciente, fecha, hora)
+        try:
+            guardar_cita(
+                lambda: Cita_Medica.objects.create(**datos),
+                None, (bloque.pk, fecha, hora), bloque,
+            )
+        except TurnoNoDisponible as e:
+            return 'cupo' if 'detail' in e.detalle else 'ocupado'
+        return 'ok'
+
+    def _correr(self, modo, bloque, paciente, fecha, horas, hilos, intentos):
+        reservar = self._reservar_anterior if modo == 'anterior' else self._reservar_servicio
+        resultados = Counter()
+        lock = threading.Lock()
+        barrera = threading.Barrier(hilos)
+
+        def trabajar():
+            locales = Counter()
+            try:
+                barrera.wait()
+                for _ in range(intentos):
+                    try:
+                        locales[reservar(bloque, paciente, fecha, random.choice(horas))] += 1
+                    except Exception as e:
+                        locales[f'error:{type(e).__name__}'] += 1
+            finally:
+                connection.close()
+                with lock:
+                    resultados.update(locales)
+
+        hilos_activos = [threading.Thread(target=trabajar) for _ in range(hilos)]
+        inicio = time.perf_counter()
+        for hilo in hilos_activos:
+            hilo.start()
+        for hilo in hilos_activos:
+            hilo.join()
+        duracion = time.perf_counter() - inicio
+
+        activas = Cita_Medica.objects.filter(bloque_horario=bloque, fecha=fecha).exclude(estado_cita='CANCELADA')
+        por_turno = Counter(activas.values_list('hora_inicio', flat=True))
+        dobles = sum(n - 1 for n in por_turno.values() if n > 1)
+        total = sum(por_turno.values())
+        sobrecupo = max(0, total - bloque.max_citas_por_bloque)
+        contador = OcupacionBloque.objects.filter(bloque_horario=bloque, fecha=fecha).values_list('citas', flat=True).first()
+
+        intentos_totales = sum(resultados.values())
+        self.stdout.write(
+            f"[{modo}] {intentos_totales / duracion:.0f} intentos/s, "
+            f"{resultados['ok'] / duracion:.1f} reservas/s, resultados={dict(resultados)}, "
+            f"citas activas={total}, dobles reservas={dobles}, sobrecupo={sobrecupo}"
+            + (f", contador={contador}" if modo == 'servicio' else '')
+        )
+        if dobles or sobrecupo or (modo == 'servicio' and contador not in (None, total)):
+            self.stdout.write(self.style.ERROR(f"[{modo}] inconsistencia detectada"))
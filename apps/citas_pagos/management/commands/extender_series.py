@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from apps.citas_pagos import series
+
+
+class Command(BaseCommand):
+    help = (
+        "Genera las citas de las series recurrentes activas hasta el fin de la "
+        "ventana (SERIES_CITAS['SEMANAS_VENTANA']). Programarlo una vez al día."
+    )
+
+    def handle(self, *args, **options):
+        total_creadas = total_omitidas = 0
+        resultados = series.extender_series()
+        for serie_id, creadas, omitidas in resultados:
+            total_creadas += creadas
+            total_omitidas += omitidas
+            if creadas or omitidas:
+                self.stdout.write(f"Serie {serie_id}: {creadas} citas generadas, {omitidas} fechas omitidas")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(resultados)} series revisadas: {total_creadas} citas generadas, {total_omitidas} omitidas."
+        ))
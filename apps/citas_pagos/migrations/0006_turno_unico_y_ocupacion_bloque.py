@@ -0,0 +1,94 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:44
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def cancelar_turnos_duplicados(apps, schema_editor):
+    """
+    La restricción de turno único no se puede crear si ya hay dos citas
+    activas en el mismo turno: se conserva la más antigua y se cancelan las demás.
+    """
+    Cita_Medica = apps.get_model('citas_pagos', 'Cita_Medica')
+    duplicados = (
+        Cita_Medica.objects
+        .exclude(estado_cita='CANCELADA')
+        .values('bloque_horario_id', 'fecha', 'hora_inicio')
+        .annotate(total=Count('id'), primera=Min('id'))
+        .filter(total__gt=1)
+    )
+    for turno in duplicados:
+        (
+            Cita_Medica.objects
+            .filter(
+                bloque_horario_id=turno['bloque_horario_id'],
+                fecha=turno['fecha'],
+                hora_inicio=turno['hora_inicio'],
+            )
+            .exclude(estado_cita='CANCELADA')
+            .exclude(id=turno['primera'])
+            .update(
+                estado_cita='CANCELADA',
+                motivo_cancelacion='Cancelada automáticamente: turno duplicado.',
+            )
+        )
+
+
+def poblar_ocupacion(apps, schema_editor):
+    Cita_Medica = apps.get_model('citas_pagos', 'Cita_Medica')
+    OcupacionBloque = apps.get_model('citas_pagos', 'OcupacionBloque')
+    filas = (
+        Cita_Medica.objects
+        .exclude(estado_cita='CANCELADA')
+        .values('bloque_horario_id', 'fecha')
+        .annotate(total=Count('id'))
+        .order_by()
+    )
+    OcupacionBloque.objects.bulk_create(
+        (
+            OcupacionBloque(bloque_horario_id=f['bloque_horario_id'], fecha=f['fecha'], citas=f['total'])
+            for f in filas.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas_pagos', '0005_cita_medica_tipo'),
+        ('cuentas', '0006_bitacora_indices'),
+        ('doctores', '0001_initial'),
+        ('historiasDiagnosticos', '0007_remove_resultadoexamenes_cita_medica'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OcupacionBloque',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('fecha', models.DateField()),
+                ('citas', models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Ocupación de bloque',
+                'verbose_name_plural': 'Ocupaciones de bloques',
+            },
+        ),
+        migrations.RunPython(cancelar_turnos_duplicados, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cita_medica',
+            constraint=models.UniqueConstraint(condition=models.Q(('estado_cita', 'CANCELADA'), _negated=True), fields=('bloque_horario', 'fecha', 'hora_inicio'), name='cita_turno_unico_activo'),
+        ),
+        migrations.AddField(
+            model_name='ocupacionbloque',
+            name='bloque_horario',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ocupaciones', to='doctores.bloque_horario'),
+        ),
+        migrations.AddConstraint(
+            model_name='ocupacionbloque',
+            constraint=models.UniqueConstraint(fields=('bloque_horario', 'fecha'), name='ocupacion_bloque_fecha_unica'),
+        ),
+        migrations.RunPython(poblar_ocupacion, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas_pagos', '0006_turno_unico_y_ocupacion_bloque'),
+        ('cuentas', '0006_bitacora_indices'),
+        ('doctores', '0001_initial'),
+        ('historiasDiagnosticos', '0007_remove_resultadoexamenes_cita_medica'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SerieCitas',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('hora_inicio', models.TimeField(help_text='Hora de inicio de cada cita')),
+                ('fecha_inicio', models.DateField(help_text='Primera fecha posible de la serie')),
+                ('intervalo_semanas', models.PositiveSmallIntegerField(default=1, help_text='Cada cuántas semanas se repite')),
+                ('repeticiones', models.PositiveSmallIntegerField(blank=True, help_text='Cantidad total de citas', null=True)),
+                ('fecha_fin', models.DateField(blank=True, help_text='Última fecha posible de la serie', null=True)),
+                ('tipo', models.CharField(choices=[('CONSULTA', 'Consulta'), ('EMERGENCIA', 'Emergencia'), ('CONTROL', 'Control'), ('OTRO', 'Otro')], default='CONTROL', max_length=30)),
+                ('notas', models.TextField(blank=True)),
+                ('estado', models.BooleanField(default=True, help_text='Activa = True, Cancelada = False')),
+                ('completa', models.BooleanField(default=False, help_text='Ya se generaron todas sus citas')),
+                ('materializada_hasta', models.DateField(blank=True, help_text='Última fecha con cita generada', null=True)),
+                ('omitidas', models.JSONField(blank=True, default=list, help_text='Fechas no generadas por conflicto de turno')),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_modificacion', models.DateTimeField(auto_now=True)),
+                ('bloque_horario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_citas', to='doctores.bloque_horario')),
+                ('grupo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_citas', to='cuentas.grupo')),
+                ('paciente', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='series_citas', to='historiasDiagnosticos.paciente')),
+            ],
+            options={
+                'verbose_name': 'Serie de citas',
+                'verbose_name_plural': 'Series de citas',
+                'ordering': ['-fecha_creacion'],
+            },
+        ),
+        migrations.AddField(
+            model_name='cita_medica',
+            name='serie',
+            field=models.ForeignKey(blank=True, help_text='Serie recurrente que generó la cita, si aplica', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='citas', to='citas_pagos.seriecitas'),
+        ),
+        migrations.AddIndex(
+            model_name='seriecitas',
+            index=models.Index(fields=['estado', 'completa', 'materializada_hasta'], name='citas_pagos_estado_d0feea_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 5.2.6 on 2026-10-17 05:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('citas_pagos', '0007_serie_citas'),
+        ('cuentas', '0007_versiondatos'),
+        ('doctores', '0001_initial'),
+        ('historiasDiagnosticos', '0007_remove_resultadoexamenes_cita_medica'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='cita_medica',
+            index=models.Index(fields=['fecha_modificacion'], name='citas_pagos_fecha_m_41c80a_idx'),
+        ),
+    ]
@@ -50,6 +50,14 @@ class Cita_Medica(models.Model):
         default='CONSULTA',
         help_text="Tipo de cita médica"
     )
+    serie = models.ForeignKey(
+        'SerieCitas',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='citas',
+        help_text="Serie recurrente que generó la cita, si aplica",
+    )
     class Meta:
         verbose_name = "Cita Médica"
         verbose_name_plural = "Citas Médicas"
@@ -58,7 +66,89 @@ class Cita_Medica(models.Model):
             models.Index(fields=['fecha_creacion']),
             models.Index(fields=['estado']),
             models.Index(fields=['estado_cita']),
+            # Marca de agua del ETL de BI (business_intelligence/etl.py)
+            models.Index(fields=['fecha_modificacion']),
+        ]
+        constraints = [
+            # Un turno solo puede tener una cita no cancelada (ver reservas.py)
+            models.UniqueConstraint(
+                fields=['bloque_horario', 'fecha', 'hora_inicio'],
+                condition=~models.Q(estado_cita='CANCELADA'),
+                name='cita_turno_unico_activo',
+            ),
         ]
     
+    # Campos que definen qué turno ocupa la cita (ver ocupacion.py)
+    CAMPOS_OCUPACION = ('bloque_horario_id', 'fecha', 'hora_inicio', 'estado_cita')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Se recuerda el turno original para actualizar la caché de ocupación al guardar
+        if not instancia.get_deferred_fields().intersection(cls.CAMPOS_OCUPACION):
+            instancia._turno_original = instancia.turno_ocupado()
+        return instancia
+
+    def turno_ocupado(self):
+        """(bloque_horario_id, fecha, hora_inicio) si la cita ocupa un turno; None si está cancelada."""
+        if self.estado_cita == 'CANCELADA' or not self.bloque_horario_id:
+            return None
+        return (self.bloque_horario_id, self.fecha, self.hora_inicio)
+
+    def __str__(self):
+        return f"Cita {self.id} - {self.paciente} - {self.fecha} {self.hora_inicio}"
+
+class OcupacionBloque(models.Model):
+    """
+    Citas no canceladas de un bloque horario en una fecha. Se incrementa con
+    un UPDATE condicionado al cupo del bloque al reservar (ver reservas.py).
+    """
+    bloque_horario = models.ForeignKey(Bloque_Horario, on_delete=models.CASCADE, related_name='ocupaciones')
+    fecha = models.DateField()
+    citas = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Ocupación de bloque"
+        verbose_name_plural = "Ocupaciones de bloques"
+        constraints = [
+            models.UniqueConstraint(fields=['bloque_horario', 'fecha'], name='ocupacion_bloque_fecha_unica'),
+        ]
+
+    def __str__(self):
+        return f"Bloque {self.bloque_horario_id} - {self.fecha}: {self.citas}"
+
+
+class SerieCitas(models.Model):
+    """
+    Citas recurrentes: el mismo turno de un bloque horario cada
+    ``intervalo_semanas`` semanas, hasta ``repeticiones`` citas o hasta
+    ``fecha_fin``. Las citas se generan por ventanas (ver series.py):
+    ``materializada_hasta`` es la última fecha ya generada.
+    """
+    paciente = models.ForeignKey(Paciente, on_delete=models.CASCADE, related_name='series_citas')
+    bloque_horario = models.ForeignKey(Bloque_Horario, on_delete=models.CASCADE, related_name='series_citas')
+    grupo = models.ForeignKey(Grupo, on_delete=models.CASCADE, related_name='series_citas')
+    hora_inicio = models.TimeField(help_text="Hora de inicio de cada cita")
+    fecha_inicio = models.DateField(help_text="Primera fecha posible de la serie")
+    intervalo_semanas = models.PositiveSmallIntegerField(default=1, help_text="Cada cuántas semanas se repite")
+    repeticiones = models.PositiveSmallIntegerField(null=True, blank=True, help_text="Cantidad total de citas")
+    fecha_fin = models.DateField(null=True, blank=True, help_text="Última fecha posible de la serie")
+    tipo = models.CharField(max_length=30, choices=Cita_Medica.TIPO_CITA, default='CONTROL')
+    notas = models.TextField(blank=True)
+    estado = models.BooleanField(default=True, help_text="Activa = True, Cancelada = False")
+    completa = models.BooleanField(default=False, help_text="Ya se generaron todas sus citas")
+    materializada_hasta = models.DateField(null=True, blank=True, help_text="Última fecha con cita generada")
+    omitidas = models.JSONField(default=list, blank=True, help_text="Fechas no generadas por conflicto de turno")
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_modificacion = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Serie de citas"
+        verbose_name_plural = "Series de citas"
+        ordering = ['-fecha_creacion']
+        indexes = [
+            models.Index(fields=['estado', 'completa', 'materializada_hasta']),
+        ]
+
     def __str__(self):
-        return f"Cita {self.id} - {self.paciente} - {self.fecha} {self.hora_inicio}"
\ No newline at end of file
+        return f"Serie {self.id} - {self.paciente} - {self.bloque_horario.dia_semana} {self.hora_inicio}"
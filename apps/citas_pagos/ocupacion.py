@@ -0,0 +1,238 @@
+# apps/citas_pagos/ocupacion.py
+"""
+Caché de ocupación de turnos por ``(bloque_horario_id, fecha)``.
+
+Cada entrada es ``(mascara, total, construida)``: la máscara de bits de
+turnos tomados (ver ``apps.doctores.disponibilidad.PlantillaBloque``), el
+número de citas no canceladas del bloque ese día y el instante en que se
+empezó a leer de la base para armarla. La clave incluye la versión del bloque
+(su ``fecha_modificacion``), así que editar un bloque deja obsoletas sus
+entradas sin tener que recorrerlas.
+
+- Lectura: ``ocupacion_rango`` hace un ``get_many`` y reconstruye lo que
+  falte con una sola consulta.
+- Escritura: las señales de ``Cita_Medica`` llaman a ``registrar_cambio``,
+  que al confirmar la transacción actualiza la entrada (si existe) en vez
+  de borrarla. Si la entrada se armó después de la escritura puede que ya
+  incluya la cita, y si otro proceso está actualizando la misma clave
+  tampoco se sabe en qué estado queda: en ambos casos se borra y se
+  reconstruye en la próxima lectura.
+
+También se cachean las plantillas de los bloques activos de cada médico.
+El backend es cualquier alias de ``CACHES`` (``OCUPACION_CACHE['ALIAS']``);
+para compartirlo entre workers debe ser Redis/Memcached. Con el locmem por
+defecto cada proceso tiene su propia copia y el TTL acota el desfase.
+"""
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from apps.doctores.disponibilidad import (
+    CAMPOS_PLANTILLA, PlantillaBloque, cargar_ocupacion,
+)
+
+
+_CONFIG_POR_DEFECTO = {
+    'ALIAS': 'default',
+    'TTL': 300,
+}
+
+_PREFIJO = 'ocupacion:v2'
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'OCUPACION_CACHE', {}) or {})
+    return config
+
+
+def _cache():
+    return caches[_config()['ALIAS']]
+
+
+def _ttl():
+    return _config()['TTL']
+
+
+def _clave_ocupacion(plantilla, fecha):
+    return f'{_PREFIJO}:{plantilla.bloque_id}:{plantilla.version}:{fecha.isoformat()}'
+
+
+def _clave_plantilla(bloque_id):
+    return f'{_PREFIJO}:plantilla:{bloque_id}'
+
+
+def _clave_bloques_medico(medico_id):
+    return f'{_PREFIJO}:medico:{medico_id}'
+
+
+# ---------------------------------------------------------------------------
+# Plantillas
+# ---------------------------------------------------------------------------
+
+def plantillas_de_medicos(medico_ids):
+    """Plantillas de los bloques activos de los médicos (desde caché si es posible)."""
+    from apps.doctores.models import Bloque_Horario
+
+    medico_ids = list(medico_ids)
+    cache = _cache()
+    claves = {m: _clave_bloques_medico(m) for m in medico_ids}
+    en_cache = cache.get_many(list(claves.values()))
+    filas = {m: en_cache[c] for m, c in claves.items() if c in en_cache}
+
+    faltan = [m for m in medico_ids if m not in filas]
+    if faltan:
+        for m in faltan:
+            filas[m] = []
+        consulta = (
+            Bloque_Horario.objects
+            .filter(medico_id__in=faltan, estado=True)
+            .order_by('medico_id', 'hora_inicio', 'id')
+            .values_list(*CAMPOS_PLANTILLA)
+        )
+        for fila in consulta:
+            filas[fila[1]].append(fila)
+        cache.set_many({claves[m]: filas[m] for m in faltan}, _ttl())
+
+    return [PlantillaBloque(*fila) for m in medico_ids for fila in filas[m]]
+
+
+def plantilla_de_bloque(bloque_id):
+    """Plantilla de un bloque (activo o no), o None si no existe."""
+    from apps.doctores.models import Bloque_Horario
+
+    cache = _cache()
+    clave = _clave_plantilla(bloque_id)
+    fila = cache.get(clave)
+    if fila is None:
+        fila = Bloque_Horario.objects.filter(pk=bloque_id).values_list(*CAMPOS_PLANTILLA).first()
+        if fila is None:
+            return None
+        cache.set(clave, fila, _ttl())
+    return PlantillaBloque(*fila)
+
+
+def invalidar_bloque(bloque_id, medico_id):
+    """Olvida la plantilla del bloque y la lista de bloques de su médico."""
+    def _invalidar():
+        _cache().delete_many([_clave_plantilla(bloque_id), _clave_bloques_medico(medico_id)])
+    transaction.on_commit(_invalidar)
+
+
+# ---------------------------------------------------------------------------
+# Ocupación
+# ---------------------------------------------------------------------------
+
+def ocupacion_rango(plantillas, desde, hasta):
+    """
+    ``{(bloque_id, fecha): (mascara, total)}`` para los días del rango en que
+    aplica cada plantilla. Lo que no está en caché se arma con una consulta.
+    """
+    claves = {}
+    for plantilla in plantillas:
+        if plantilla.dia is None:
+            continue
+        fecha = desde + timedelta(days=(plantilla.dia - desde.weekday()) % 7)
+        while fecha <= hasta:
+            claves[_clave_ocupacion(plantilla, fecha)] = (plantilla, fecha)
+            fecha += timedelta(days=7)
+
+    cache = _cache()
+    en_cache = cache.get_many(list(claves))
+    resultado = {}
+    faltantes = {}
+    for clave, (plantilla, fecha) in claves.items():
+        valor = en_cache.get(clave)
+        if valor is None:
+            faltantes[clave] = (plantilla, fecha)
+        else:
+            resultado[(plantilla.bloque_id, fecha)] = tuple(valor[:2])
+
+    if faltantes:
+        plantillas_faltantes = list({p.bloque_id: p for p, _ in faltantes.values()}.values())
+        fechas = [f for _, f in faltantes.values()]
+        construida = time.time()
+        reconstruida = cargar_ocupacion(plantillas_faltantes, min(fechas), max(fechas))
+        nuevas = {}
+        for clave, (plantilla, fecha) in faltantes.items():
+            valor = tuple(reconstruida.get((plantilla.bloque_id, fecha), (0, 0)))
+            resultado[(plantilla.bloque_id, fecha)] = valor
+            nuevas[clave] = (*valor, construida)
+        cache.set_many(nuevas, _ttl())
+
+    return resultado
+
+
+def ocupacion_de(plantilla, fecha):
+    """``(mascara, total)`` de un bloque en una fecha."""
+    return ocupacion_rango([plantilla], fecha, fecha).get((plantilla.bloque_id, fecha), (0, 0))
+
+
+def _aplicar(bloque_id, fecha, hora, delta, escrita):
+    plantilla = plantilla_de_bloque(bloque_id)
+    if plantilla is None:
+        return
+    cache = _cache()
+    clave = _clave_ocupacion(plantilla, fecha)
+    candado = f'{clave}:lock'
+    if not cache.add(candado, 1, 5):
+        # Otro proceso está tocando la misma entrada: mejor reconstruirla luego
+        cache.delete(clave)
+        return
+    try:
+        valor = cache.get(clave)
+        if valor is None:
+            return
+        mascara, total, construida = valor
+        if construida >= escrita:
+            # Se leyó de la base después de la escritura: quizá ya la incluye
+            cache.delete(clave)
+            return
+        i = plantilla.indice(hora)
+        if delta > 0:
+            total += 1
+            if i is not None:
+                mascara |= 1 << i
+        else:
+            total = max(0, total - 1)
+            if i is not None:
+                mascara &= ~(1 << i)
+        cache.set(clave, (mascara, total, construida), _ttl())
+    finally:
+        cache.delete(candado)
+
+
+def registrar_cambio(anterior, actual):
+    """
+    Refleja en la caché que una cita pasó de ocupar ``anterior`` a ocupar
+    ``actual``. Cada uno es ``(bloque_id, fecha, hora_inicio)`` o None si la
+    cita no ocupa turno (no existe o está cancelada).
+    """
+    if anterior == actual:
+        return
+    # Antes del commit: una entrada armada antes de este instante no ve el cambio
+    escrita = time.time()
+
+    def _actualizar():
+        if anterior is not None:
+            # La restricción cita_turno_unico_activo garantiza una sola cita
+            # activa por turno, así que liberar el bit es seguro.
+            _aplicar(*anterior, delta=-1, escrita=escrita)
+        if actual is not None:
+            _aplicar(*actual, delta=+1, escrita=escrita)
+
+    transaction.on_commit(_actualizar)
+
+
+def _borrar(bloque_id, fecha, hora=None):
+    plantilla = plantilla_de_bloque(bloque_id)
+    if plantilla is not None:
+        _cache().delete(_clave_ocupacion(plantilla, fecha))
+
+
+def invalidar(bloque_id, fecha):
+    """Borra la entrada de un bloque en una fecha (se reconstruye al leerla)."""
+    transaction.on_commit(lambda: _borrar(bloque_id, fecha))
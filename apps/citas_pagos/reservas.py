@@ -0,0 +1,139 @@
+# apps/citas_pagos/reservas.py
+"""
+Reserva atómica de turnos.
+
+Dos garantías en la base de datos, sin lecturas previas:
+
+- Turno único: la restricción parcial ``cita_turno_unico_activo`` impide
+  dos citas no canceladas con el mismo ``(bloque_horario, fecha, hora_inicio)``.
+- Cupo del bloque: ``OcupacionBloque`` guarda cuántas citas no canceladas
+  tiene cada bloque por fecha y se incrementa con un único
+  ``UPDATE ... SET citas = citas + 1 WHERE citas < max``; si no se actualiza
+  ninguna fila, el cupo está lleno.
+
+Ambas cosas ocurren en la misma transacción que guarda la cita, así que una
+reserva rechazada no deja el contador modificado. Las validaciones del
+serializer siguen existiendo como chequeo previo barato (caché de
+ocupación), pero la decisión final la toma la base.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+
+from .models import Cita_Medica, OcupacionBloque
+
+
+RESTRICCION_TURNO = 'cita_turno_unico_activo'
+
+MENSAJE_CUPO = {"detail": "El cupo máximo de citas para este bloque y fecha ya ha sido alcanzado."}
+MENSAJE_OCUPADO = {"hora_inicio": "Este horario específico ya se encuentra ocupado."}
+
+
+class TurnoNoDisponible(Exception):
+    """El turno ya está tomado o el bloque no tiene cupo para esa fecha."""
+
+    def __init__(self, detalle):
+        super().__init__(detalle)
+        self.detalle = detalle
+
+
+def _es_turno_duplicado(error):
+    mensaje = str(error)
+    # PostgreSQL nombra la restricción; SQLite lista las columnas del índice único
+    return RESTRICCION_TURNO in mensaje or (
+        'UNIQUE' in mensaje and 'hora_inicio' in mensaje and 'cita_medica' in mensaje
+    )
+
+
+def reservar_cupo(bloque, fecha, cantidad=1):
+    """
+    Ocupa ``cantidad`` lugares del cupo del bloque en la fecha o lanza
+    TurnoNoDisponible (todos o ninguno). Debe llamarse dentro de una transacción.
+    """
+    maximo = bloque.max_citas_por_bloque
+    filtro = OcupacionBloque.objects.filter(bloque_horario_id=bloque.pk, fecha=fecha)
+    if maximo is not None:
+        filtro = filtro.filter(citas__lte=maximo - cantidad)
+    if filtro.update(citas=F('citas') + cantidad):
+        return
+
+    # Cupo lleno o primera reserva del bloque en esa fecha: en el segundo caso
+    # se crea la fila partiendo de las citas que ya existan y se reintenta.
+    ocupacion, creada = OcupacionBloque.objects.get_or_create(
+        bloque_horario_id=bloque.pk,
+        fecha=fecha,
+        defaults={'citas': _contar_citas(bloque.pk, fecha)},
+    )
+    hay_lugar = maximo is None or ocupacion.citas + cantidad <= maximo
+    if hay_lugar and filtro.update(citas=F('citas') + cantidad):
+        return
+    raise TurnoNoDisponible(MENSAJE_CUPO)
+
+
+def liberar_cupo(bloque_id, fecha, cantidad=1):
+    """Devuelve ``cantidad`` lugares del cupo del bloque en la fecha."""
+    OcupacionBloque.objects.filter(
+        bloque_horario_id=bloque_id, fecha=fecha, citas__gt=0
+    ).update(citas=Greatest(F('citas') - cantidad, 0))
+
+
+def _contar_citas(bloque_id, fecha):
+    return (
+        Cita_Medica.objects
+        .filter(bloque_horario_id=bloque_id, fecha=fecha)
+        .exclude(estado_cita='CANCELADA')
+        .count()
+    )
+
+
+def ajustar_cupos(anterior, nuevo, bloque):
+    """
+    Ajusta los contadores cuando una cita pasa del turno ``anterior`` al
+    ``nuevo`` (tuplas ``(bloque_id, fecha, hora_inicio)`` o None si la cita
+    no ocupa turno). ``bloque`` es el Bloque_Horario del turno nuevo.
+    """
+    mismo_cupo = anterior and nuevo and anterior[:2] == nuevo[:2]
+    if anterior and not mismo_cupo:
+        liberar_cupo(anterior[0], anterior[1])
+    if nuevo and not mismo_cupo:
+        reservar_cupo(bloque, nuevo[1])
+
+
+def guardar_cita(guardar, anterior, nuevo, bloque):
+    """
+    Ejecuta ``guardar()`` (que guarda y devuelve la cita) en una transacción
+    junto con el ajuste de cupos. Si el turno ya fue tomado por otra reserva
+    concurrente lanza TurnoNoDisponible y no queda nada modificado.
+    """
+    try:
+        with transaction.atomic():
+            ajustar_cupos(anterior, nuevo, bloque)
+            return guardar()
+    except IntegrityError as e:
+        if _es_turno_duplicado(e):
+            raise TurnoNoDisponible(MENSAJE_OCUPADO)
+        raise
+
+
+def guardar_instancia(cita, **kwargs):
+    """Guarda una cita ya modificada en memoria (cancelar, restaurar, cambiar estado)."""
+    anterior = getattr(cita, '_turno_original', None) if cita.pk else None
+    nuevo = cita.turno_ocupado()
+
+    def guardar():
+        cita.save(**kwargs)
+        return cita
+
+    return guardar_cita(guardar, anterior, nuevo, cita.bloque_horario)
+
+
+def turno_de_datos(validated_data, instancia=None):
+    """Turno que ocupará una cita creada/editada con ``validated_data``."""
+    def valor(campo):
+        return validated_data.get(campo, getattr(instancia, campo, None))
+
+    bloque = valor('bloque_horario')
+    estado_cita = valor('estado_cita') or 'PENDIENTE'
+    if bloque is None or estado_cita == 'CANCELADA':
+        return None, bloque
+    return (bloque.pk, valor('fecha'), valor('hora_inicio')), bloque
@@ -7,7 +7,10 @@ from apps.historiasDiagnosticos.models import Paciente
 from apps.cuentas.models import Grupo
 from apps.doctores.models import Medico
 from django.db.models import Q
+from django.utils import timezone
 from apps.doctores.serializers import MedicoResumenSerializer
+from apps.doctores.disponibilidad import PlantillaBloque
+from . import ocupacion
 from datetime import datetime, timedelta
 
 
@@ -16,6 +19,47 @@ class HorarioDisponibleSerializer(serializers.Serializer):
     bloque_horario_id = serializers.IntegerField()
     hora_inicio = serializers.TimeField(format='%H:%M')
 
+def validar_dia_del_bloque(bloque, fecha):
+    """La fecha debe caer en el día de la semana del bloque horario."""
+    DIAS_SEMANA_MAP = {0: 'LUNES', 1: 'MARTES', 2: 'MIERCOLES', 3: 'JUEVES', 4: 'VIERNES', 5: 'SABADO', 6: 'DOMINGO'}
+    dia_semana_cita = DIAS_SEMANA_MAP.get(fecha.weekday())
+
+    if dia_semana_cita != bloque.dia_semana:
+        nombre_dia_bloque = getattr(bloque, 'get_dia_semana_display', lambda: bloque.dia_semana)()
+        raise serializers.ValidationError(
+            f"La fecha seleccionada corresponde a un {dia_semana_cita}, pero el bloque horario es para los {nombre_dia_bloque}."
+        )
+
+
+def validar_hora_del_bloque(bloque, hora_inicio):
+    """La hora debe estar dentro del bloque y coincidir con el inicio de un turno."""
+    if not (bloque.hora_inicio <= hora_inicio < bloque.hora_fin):
+        raise serializers.ValidationError({
+            "hora_inicio": f"La hora {hora_inicio.strftime('%H:%M')} está fuera del rango del bloque horario ({bloque.hora_inicio.strftime('%H:%M')} - {bloque.hora_fin.strftime('%H:%M')})."
+        })
+
+    # Asegurarse que duracion_cita_minutos no sea None o 0 antes de la división
+    if bloque.duracion_cita_minutos and bloque.duracion_cita_minutos > 0:
+        minutos_desde_inicio_bloque = (
+            (hora_inicio.hour - bloque.hora_inicio.hour) * 60 +
+            (hora_inicio.minute - bloque.hora_inicio.minute)
+        )
+
+        if minutos_desde_inicio_bloque % bloque.duracion_cita_minutos != 0:
+            raise serializers.ValidationError({
+                "hora_inicio": f"La hora de inicio {hora_inicio.strftime('%H:%M')} no es un intervalo válido. Los intervalos deben ser cada {bloque.duracion_cita_minutos} minutos."
+            })
+    elif bloque.duracion_cita_minutos is None or bloque.duracion_cita_minutos <= 0:
+         # Si la duración es inválida, no se puede validar el intervalo. Lanza error.
+         raise serializers.ValidationError({"bloque_horario": "La duración de la cita para este bloque horario no es válida."})
+
+
+def calcular_hora_fin(bloque, fecha, hora_inicio):
+    # Asegurarse que duracion_cita_minutos tiene un valor (30 por defecto si es None)
+    duracion_minutos = bloque.duracion_cita_minutos if bloque.duracion_cita_minutos else 30
+    return (datetime.combine(fecha, hora_inicio) + timedelta(minutes=duracion_minutos)).time()
+
+
 class CitaMedicaSerializer(serializers.ModelSerializer):
     paciente_nombre = serializers.CharField(source='paciente.usuario.nombre', read_only=True)
     medico_nombre = serializers.CharField(source='bloque_horario.medico.nombre', read_only=True)
@@ -42,6 +86,10 @@ class CitaMedicaSerializer(serializers.ModelSerializer):
             'reporte', 'tipo'
         ]
         read_only_fields = ['grupo', 'hora_fin', 'paciente_nombre', 'medico_nombre']
+        # El turno único lo validan validate() (chequeo previo) y reservas.py
+        # (restricción en la base); el validador automático de DRF para la
+        # restricción parcial falla en PATCH y duplica la consulta.
+        validators = []
 
     def validate(self, data):
         """
@@ -89,7 +137,7 @@ class CitaMedicaSerializer(serializers.ModelSerializer):
         # --- 1. Validación de Grupo ---
         # (Asegurarnos que paciente y bloque tengan usuario y médico cargados)
         if hasattr(paciente, 'usuario') and hasattr(bloque, 'medico') and paciente.usuario and bloque.medico:
-            if paciente.usuario.grupo != bloque.medico.grupo:
+            if paciente.usuario.grupo_id != bloque.medico.grupo_id:
                 raise serializers.ValidationError({"detail": "El paciente y el médico no pertenecen a la misma clínica/grupo."})
         else:
              # Si no podemos validar el grupo por falta de datos, podríamos lanzar error o simplemente continuar
@@ -100,51 +148,38 @@ class CitaMedicaSerializer(serializers.ModelSerializer):
                  raise serializers.ValidationError({"bloque_horario": "No se pudo determinar el grupo del médico."})
 
 
-        DIAS_SEMANA_MAP = {0: 'LUNES', 1: 'MARTES', 2: 'MIERCOLES', 3: 'JUEVES', 4: 'VIERNES', 5: 'SABADO', 6: 'DOMINGO'}
-        dia_semana_cita = DIAS_SEMANA_MAP.get(fecha.weekday())
-
-        if dia_semana_cita != bloque.dia_semana:
-            nombre_dia_bloque = getattr(bloque, 'get_dia_semana_display', lambda: bloque.dia_semana)()
-            raise serializers.ValidationError(
-                f"La fecha seleccionada corresponde a un {dia_semana_cita}, pero el bloque horario es para los {nombre_dia_bloque}."
-            )
+        validar_dia_del_bloque(bloque, fecha)
 
         # --- Validación de conflictos de horario ---
-        citas_en_conflicto = Cita_Medica.objects.filter(
-            bloque_horario__medico=bloque.medico,
-            fecha=fecha
-        ).exclude(estado_cita='CANCELADA')
-        
-        # Si estamos editando una cita existente, excluirla de la validación
-        if self.instance:
-            citas_en_conflicto = citas_en_conflicto.exclude(pk=self.instance.pk)
-
-        if bloque.max_citas_por_bloque is not None and citas_en_conflicto.filter(bloque_horario=bloque).count() >= bloque.max_citas_por_bloque:
+        # Se consulta la caché de ocupación (ver ocupacion.py) en lugar de contar citas en la base.
+        plantilla = PlantillaBloque.desde_bloque(bloque)
+        # Si estamos editando una cita existente, se descuenta su propio turno
+        turno_propio = getattr(self.instance, '_turno_original', None) if self.instance else None
+
+        def ocupacion_sin_propia(p):
+            mascara, total = ocupacion.ocupacion_de(p, fecha)
+            if turno_propio and turno_propio[0] == p.bloque_id and turno_propio[1] == fecha:
+                total -= 1
+                j = p.indice(turno_propio[2])
+                if j is not None:
+                    mascara &= ~(1 << j)
+            return mascara, total
+
+        mascara, total = ocupacion_sin_propia(plantilla)
+        if bloque.max_citas_por_bloque is not None and total >= bloque.max_citas_por_bloque:
             raise serializers.ValidationError({"detail": "El cupo máximo de citas para este bloque y fecha ya ha sido alcanzado."})
 
-        if citas_en_conflicto.filter(hora_inicio=hora_inicio).exists():
-            raise serializers.ValidationError({"hora_inicio": "Este horario específico ya se encuentra ocupado."})
-
-        if not (bloque.hora_inicio <= hora_inicio < bloque.hora_fin):
-            raise serializers.ValidationError({
-                "hora_inicio": f"La hora {hora_inicio.strftime('%H:%M')} está fuera del rango del bloque horario ({bloque.hora_inicio.strftime('%H:%M')} - {bloque.hora_fin.strftime('%H:%M')})."
-            })
-
-        # Asegurarse que duracion_cita_minutos no sea None o 0 antes de la división
-        if bloque.duracion_cita_minutos and bloque.duracion_cita_minutos > 0:
-            minutos_desde_inicio_bloque = (
-                (hora_inicio.hour - bloque.hora_inicio.hour) * 60 +
-                (hora_inicio.minute - bloque.hora_inicio.minute)
-            )
-
-            if minutos_desde_inicio_bloque % bloque.duracion_cita_minutos != 0:
-                raise serializers.ValidationError({
-                    "hora_inicio": f"La hora de inicio {hora_inicio.strftime('%H:%M')} no es un intervalo válido. Los intervalos deben ser cada {bloque.duracion_cita_minutos} minutos."
-                })
-        elif bloque.duracion_cita_minutos is None or bloque.duracion_cita_minutos <= 0:
-             # Si la duración es inválida, no se puede validar el intervalo. Lanza error.
-             raise serializers.ValidationError({"bloque_horario": "La duración de la cita para este bloque horario no es válida."})
+        # El mismo horario puede estar tomado en otro bloque del médico que se solape con este
+        for p in ocupacion.plantillas_de_medicos([bloque.medico_id]):
+            if p.bloque_id == plantilla.bloque_id:
+                p = plantilla
+            elif p.dia != plantilla.dia:
+                continue
+            i = p.indice(hora_inicio)
+            if i is not None and ocupacion_sin_propia(p)[0] & (1 << i):
+                raise serializers.ValidationError({"hora_inicio": "Este horario específico ya se encuentra ocupado."})
 
+        validar_hora_del_bloque(bloque, hora_inicio)
 
         return data
 
@@ -157,12 +192,7 @@ class CitaMedicaSerializer(serializers.ModelSerializer):
         hora_inicio = validated_data.get('hora_inicio')
         fecha_cita = validated_data.get('fecha')
 
-        # Calcular la hora de fin (asegurarse que duracion_cita_minutos tiene un valor)
-        duracion_minutos = bloque_horario.duracion_cita_minutos if bloque_horario.duracion_cita_minutos else 30 # Valor por defecto si es None
-        hora_inicio_dt = datetime.combine(fecha_cita, hora_inicio)
-        hora_fin_dt = hora_inicio_dt + timedelta(minutes=duracion_minutos)
-
-        validated_data['hora_fin'] = hora_fin_dt.time()
+        validated_data['hora_fin'] = calcular_hora_fin(bloque_horario, fecha_cita, hora_inicio)
         validated_data['grupo'] = bloque_horario.medico.grupo
 
         return super().create(validated_data)
@@ -183,4 +213,75 @@ class CitaMedicaDetalleSerializer(serializers.ModelSerializer):
             hora_fin_dt = hora_inicio_dt + timedelta(minutes=duracion_minutos)
             validated_data['hora_fin'] = hora_fin_dt.time()
 
-        return super().update(instance, validated_data)
\ No newline at end of file
+        return super().update(instance, validated_data)
+
+# --- Operaciones en lote (ver lotes.py) ---
+class CitaLoteSerializer(serializers.Serializer):
+    """Un elemento de bulk-create. Los ids se resuelven en bloque, no uno por uno."""
+    paciente = serializers.IntegerField()
+    bloque_horario = serializers.IntegerField()
+    fecha = serializers.DateField()
+    hora_inicio = serializers.TimeField()
+    tipo = serializers.ChoiceField(choices=Cita_Medica.TIPO_CITA, default='CONSULTA')
+    notas = serializers.CharField(required=False, allow_blank=True, default='')
+
+
+class CambioEstadoLoteSerializer(serializers.Serializer):
+    """Un elemento de bulk-cambiar-estado."""
+    id = serializers.IntegerField()
+    estado_cita = serializers.ChoiceField(choices=Cita_Medica.ESTADOS_CITA)
+    motivo_cancelacion = serializers.CharField(required=False, allow_blank=True)
+
+
+class SerieCitasSerializer(serializers.ModelSerializer):
+    paciente_nombre = serializers.CharField(source='paciente.usuario.nombre', read_only=True)
+    medico_nombre = serializers.CharField(source='bloque_horario.medico.nombre', read_only=True)
+    paciente = serializers.PrimaryKeyRelatedField(queryset=Paciente.objects.filter(usuario__estado=True))
+    bloque_horario = serializers.PrimaryKeyRelatedField(queryset=Bloque_Horario.objects.filter(estado=True))
+    # Si es True, las fechas ya ocupadas se saltan en lugar de rechazar la serie
+    omitir_conflictos = serializers.BooleanField(write_only=True, default=False)
+
+    class Meta:
+        model = SerieCitas
+        fields = [
+            'id', 'paciente', 'paciente_nombre', 'bloque_horario', 'medico_nombre', 'hora_inicio',
+            'fecha_inicio', 'intervalo_semanas', 'repeticiones', 'fecha_fin', 'tipo', 'notas',
+            'grupo', 'estado', 'completa', 'materializada_hasta', 'omitidas', 'fecha_creacion',
+            'omitir_conflictos',
+        ]
+        read_only_fields = ['grupo', 'estado', 'completa', 'materializada_hasta', 'omitidas', 'fecha_creacion']
+
+    def validate(self, data):
+        from .series import max_ocurrencias
+
+        paciente = data['paciente']
+        bloque = data['bloque_horario']
+        fecha_inicio = data['fecha_inicio']
+        fecha_fin = data.get('fecha_fin')
+        repeticiones = data.get('repeticiones')
+        intervalo = data.get('intervalo_semanas', 1)
+
+        if paciente.usuario.grupo_id != bloque.medico.grupo_id:
+            raise serializers.ValidationError({"detail": "El paciente y el médico no pertenecen a la misma clínica/grupo."})
+        if not intervalo:
+            raise serializers.ValidationError({"intervalo_semanas": "Debe ser al menos 1."})
+        if fecha_inicio < timezone.localdate():
+            raise serializers.ValidationError({"fecha_inicio": "La serie no puede empezar en el pasado."})
+        if repeticiones is None and fecha_fin is None:
+            raise serializers.ValidationError("Debe indicar la cantidad de repeticiones o la fecha de fin.")
+        if fecha_fin and fecha_fin < fecha_inicio:
+            raise serializers.ValidationError({"fecha_fin": "La fecha de fin es anterior a la de inicio."})
+
+        total = repeticiones if repeticiones is not None else (fecha_fin - fecha_inicio).days // (7 * intervalo) + 1
+        if fecha_fin and repeticiones is not None:
+            total = min(total, (fecha_fin - fecha_inicio).days // (7 * intervalo) + 1)
+        if total > max_ocurrencias():
+            raise serializers.ValidationError(f"La serie no puede tener más de {max_ocurrencias()} citas.")
+
+        validar_hora_del_bloque(bloque, data['hora_inicio'])
+        return data
+
+    def create(self, validated_data):
+        validated_data.pop('omitir_conflictos', None)
+        validated_data['grupo'] = validated_data['bloque_horario'].medico.grupo
+        return super().create(validated_data)
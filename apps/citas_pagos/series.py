@@ -0,0 +1,166 @@
+# apps/citas_pagos/series.py
+"""
+Series de citas recurrentes ("cada martes a las 09:00 durante 12 semanas").
+
+Una ``SerieCitas`` guarda la regla y no se expande entera al crearla:
+
+- Al crearla se validan todas sus ocurrencias de una vez contra la ocupación
+  (``lotes.Instantanea``: una consulta para todo el rango de fechas).
+- Solo se generan las citas de las próximas ``SEMANAS_VENTANA`` semanas, con
+  el mismo camino de escritura que el alta en lote.
+- El comando ``extender_series`` (programado, p. ej. una vez al día) corre la
+  ventana de cada serie activa. Las fechas que para entonces estén ocupadas
+  no se generan y quedan registradas en ``omitidas``.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from apps.doctores.disponibilidad import DIAS_SEMANA
+
+from .lotes import Instantanea, cambiar_estados, crear_citas
+from .models import Cita_Medica, SerieCitas
+
+
+_CONFIG_POR_DEFECTO = {
+    'SEMANAS_VENTANA': 8,    # semanas por delante con citas ya generadas
+    'MAX_OCURRENCIAS': 104,  # tope de citas por serie
+}
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'SERIES_CITAS', {}) or {})
+    return config
+
+
+def semanas_ventana():
+    return _config()['SEMANAS_VENTANA']
+
+
+def max_ocurrencias():
+    return _config()['MAX_OCURRENCIAS']
+
+
+def fechas_de_serie(serie, desde=None, hasta=None):
+    """Fechas de las ocurrencias de la serie, opcionalmente solo las de [desde, hasta]."""
+    dia = DIAS_SEMANA.index(serie.bloque_horario.dia_semana)
+    fecha = serie.fecha_inicio + timedelta(days=(dia - serie.fecha_inicio.weekday()) % 7)
+    paso = timedelta(weeks=serie.intervalo_semanas or 1)
+    limite = max_ocurrencias()
+    if serie.repeticiones is not None:
+        limite = min(limite, serie.repeticiones)
+    for _ in range(limite):
+        if (serie.fecha_fin and fecha > serie.fecha_fin) or (hasta and fecha > hasta):
+            return
+        if desde is None or fecha >= desde:
+            yield fecha
+        fecha += paso
+
+
+def conflictos(serie):
+    """
+    Valida todas las ocurrencias en una pasada. Devuelve ``[(fecha, error)]``
+    de las que chocan con una cita existente o encuentran el cupo lleno.
+    """
+    fechas = list(fechas_de_serie(serie))
+    if not fechas:
+        return []
+    instantanea = Instantanea([serie.bloque_horario], fechas)
+    resultado = []
+    for fecha in fechas:
+        error = instantanea.error(serie.bloque_horario, fecha, serie.hora_inicio)
+        if error:
+            resultado.append((fecha, error))
+    return resultado
+
+
+def materializar(serie, hasta=None):
+    """
+    Genera las citas de la serie que falten hasta ``hasta`` (por defecto el
+    fin de la ventana contada desde hoy). Devuelve ``(creadas, omitidas)``.
+    """
+    hasta = hasta or timezone.localdate() + timedelta(weeks=semanas_ventana())
+    with transaction.atomic():
+        # Bloquea la serie: el comando y la acción "extender" no deben generar dos veces
+        serie = SerieCitas.objects.select_for_update().select_related('bloque_horario', 'grupo').get(pk=serie.pk)
+        if not serie.estado or serie.completa:
+            return [], []
+        desde = serie.materializada_hasta + timedelta(days=1) if serie.materializada_hasta else None
+        fechas = list(fechas_de_serie(serie, desde, hasta))
+
+        creadas, omitidas = [], []
+        if fechas:
+            items = [
+                {
+                    'paciente': serie.paciente_id,
+                    'bloque_horario': serie.bloque_horario_id,
+                    'fecha': fecha,
+                    'hora_inicio': serie.hora_inicio,
+                    'tipo': serie.tipo,
+                    'notas': serie.notas,
+                }
+                for fecha in fechas
+            ]
+            resultados = crear_citas(items, grupo=serie.grupo, serie=serie)
+            for fecha, resultado in zip(fechas, resultados):
+                if isinstance(resultado, Cita_Medica):
+                    creadas.append(resultado)
+                else:
+                    omitidas.append(fecha.isoformat())
+            serie.materializada_hasta = fechas[-1]
+            serie.omitidas = serie.omitidas + omitidas
+
+        siguiente = serie.materializada_hasta + timedelta(days=1) if serie.materializada_hasta else None
+        serie.completa = next(fechas_de_serie(serie, siguiente), None) is None
+        serie.save(update_fields=['materializada_hasta', 'omitidas', 'completa', 'fecha_modificacion'])
+    return creadas, omitidas
+
+
+def series_pendientes(hasta):
+    """Series activas cuya ventana todavía no llega a ``hasta``."""
+    return (
+        SerieCitas.objects
+        .filter(estado=True, completa=False)
+        .filter(Q(materializada_hasta__isnull=True) | Q(materializada_hasta__lt=hasta))
+    )
+
+
+def extender_series(hoy=None):
+    """
+    Corre la ventana de todas las series activas. Cada serie va en su propia
+    transacción; devuelve ``[(serie_id, creadas, omitidas)]``.
+    """
+    hasta = (hoy or timezone.localdate()) + timedelta(weeks=semanas_ventana())
+    resultado = []
+    for serie_id in series_pendientes(hasta).values_list('id', flat=True).iterator():
+        try:
+            creadas, omitidas = materializar(SerieCitas(pk=serie_id), hasta)
+        except Exception as e:
+            print(f"Error al extender la serie {serie_id}: {e}")
+            continue
+        resultado.append((serie_id, len(creadas), len(omitidas)))
+    return resultado
+
+
+def cancelar_serie(serie, motivo=None):
+    """
+    Desactiva la serie y cancela sus citas futuras que sigan pendientes o
+    confirmadas. Devuelve los resultados de ``lotes.cambiar_estados``.
+    """
+    with transaction.atomic():
+        serie.estado = False
+        serie.save(update_fields=['estado', 'fecha_modificacion'])
+        citas = (
+            serie.citas
+            .filter(fecha__gte=timezone.localdate(), estado_cita__in=['PENDIENTE', 'CONFIRMADA'])
+            .select_related('paciente__usuario', 'bloque_horario__medico')
+        )
+        items = [
+            {'id': pk, 'estado_cita': 'CANCELADA', 'motivo_cancelacion': motivo or 'Serie de citas cancelada.'}
+            for pk in citas.values_list('id', flat=True)
+        ]
+        return cambiar_estados(citas, items) if items else []
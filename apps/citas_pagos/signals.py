@@ -0,0 +1,38 @@
+# apps/citas_pagos/signals.py
+"""Mantiene la caché de ocupación de turnos al escribir citas y bloques."""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from apps.doctores.models import Bloque_Horario
+
+from . import ocupacion
+from .models import Cita_Medica
+
+
+_SIN_DATO = object()
+
+
+@receiver(post_save, sender=Cita_Medica, dispatch_uid='ocupacion_cita_save')
+def _cita_guardada(sender, instance, created, **kwargs):
+    actual = instance.turno_ocupado()
+    anterior = None if created else getattr(instance, '_turno_original', _SIN_DATO)
+    if anterior is _SIN_DATO:
+        # Instancia sin turno original conocido (p. ej. cargada con .only()): se
+        # invalida en lugar de actualizar
+        if actual is not None:
+            ocupacion.invalidar(actual[0], actual[1])
+    else:
+        ocupacion.registrar_cambio(anterior, actual)
+    instance._turno_original = actual
+
+
+@receiver(post_delete, sender=Cita_Medica, dispatch_uid='ocupacion_cita_delete')
+def _cita_eliminada(sender, instance, **kwargs):
+    anterior = getattr(instance, '_turno_original', instance.turno_ocupado())
+    ocupacion.registrar_cambio(anterior, None)
+
+
+@receiver(post_save, sender=Bloque_Horario, dispatch_uid='ocupacion_bloque_save')
+@receiver(post_delete, sender=Bloque_Horario, dispatch_uid='ocupacion_bloque_delete')
+def _bloque_cambiado(sender, instance, **kwargs):
+    ocupacion.invalidar_bloque(instance.pk, instance.medico_id)
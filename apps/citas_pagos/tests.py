@@ -1,3 +1,196 @@
-from django.test import TestCase
+import threading
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from unittest import skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.db import connection
+from django.test import TestCase, TransactionTestCase
+from rest_framework.test import APIClient
+
+from apps.cuentas.models import Grupo, Rol, Usuario
+from apps.doctores.models import Bloque_Horario, Medico
+from apps.historiasDiagnosticos.models import Paciente
+
+from . import ocupacion
+from .models import Cita_Medica, OcupacionBloque
+from .reservas import TurnoNoDisponible, guardar_cita
+
+
+class SerieCitasApiTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        roles = {n: Rol.objects.create(nombre=n) for n in ('administrador', 'medico', 'paciente')}
+        cls.grupo = Grupo.objects.create(nombre='Clínica A')
+        otro = Grupo.objects.create(nombre='Clínica B')
+        Usuario.objects.create(
+            grupo=cls.grupo, nombre='Admin', password='x', correo='admin@serie.com', sexo='M',
+            fecha_nacimiento=date(1990, 1, 1), rol=roles['administrador'],
+        )
+        cls.admin = User.objects.create_user(username='admin@serie.com', email='admin@serie.com', password='x')
+        for grupo, sufijo in ((cls.grupo, 'a'), (otro, 'b')):
+            medico = Medico.objects.create(
+                grupo=grupo, nombre=f'Dr {sufijo}', password='x', correo=f'medico-{sufijo}@serie.com', sexo='M',
+                fecha_nacimiento=date(1980, 1, 1), rol=roles['medico'], numero_colegiado=f'C-{sufijo}',
+            )
+            usuario = Usuario.objects.create(
+                grupo=grupo, nombre=f'Paciente {sufijo}', password='x', correo=f'paciente-{sufijo}@serie.com',
+                sexo='F', fecha_nacimiento=date(2000, 1, 1), rol=roles['paciente'],
+            )
+            paciente = Paciente.objects.create(usuario=usuario, numero_historia_clinica=f'HC-SERIE-{sufijo}')
+            bloque = Bloque_Horario.objects.create(
+                dia_semana='LUNES', hora_inicio=time(9), hora_fin=time(12), duracion_cita_minutos=30,
+                max_citas_por_bloque=6, medico=medico, grupo=grupo,
+            )
+            if grupo == otro:
+                cls.paciente_ajeno, cls.bloque_ajeno = paciente, bloque
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.admin)
+
+    def test_listar_series(self):
+        respuesta = self.client.get('/api/citas_pagos/series/')
+        self.assertEqual(respuesta.status_code, 200)
+
+    def test_crear_serie_con_ids_de_otra_clinica(self):
+        respuesta = self.client.post('/api/citas_pagos/series/', {
+            'paciente': self.paciente_ajeno.id,
+            'bloque_horario': self.bloque_ajeno.id,
+            'hora_inicio': '09:00',
+            'fecha_inicio': date.today().isoformat(),
+            'repeticiones': 4,
+        }, format='json')
+        self.assertEqual(respuesta.status_code, 400)
+        self.assertIn('paciente', respuesta.data)
+        self.assertIn('bloque_horario', respuesta.data)
+
+
+class OcupacionCacheTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        rol = Rol.objects.create(nombre='medico')
+        grupo = Grupo.objects.create(nombre='Clínica Ocupación')
+        medico = Medico.objects.create(
+            grupo=grupo, nombre='Dr Ocupación', password='x', correo='medico@ocupacion.com', sexo='M',
+            fecha_nacimiento=date(1980, 1, 1), rol=rol, numero_colegiado='C-OCUP',
+        )
+        usuario = Usuario.objects.create(
+            grupo=grupo, nombre='Paciente', password='x', correo='paciente@ocupacion.com', sexo='F',
+            fecha_nacimiento=date(2000, 1, 1), rol=rol,
+        )
+        cls.paciente = Paciente.objects.create(usuario=usuario, numero_historia_clinica='HC-OCUP')
+        cls.bloque = Bloque_Horario.objects.create(
+            dia_semana='LUNES', hora_inicio=time(9), hora_fin=time(12), duracion_cita_minutos=30,
+            max_citas_por_bloque=6, medico=medico, grupo=grupo,
+        )
+        hoy = date.today()
+        cls.fecha = hoy + timedelta(days=7 - hoy.weekday())
+
+    def setUp(self):
+        caches[ocupacion._config()['ALIAS']].clear()
+        self.plantilla = ocupacion.plantilla_de_bloque(self.bloque.pk)
+
+    def _crear_cita(self):
+        return Cita_Medica.objects.create(
+            fecha=self.fecha, hora_inicio=time(9), hora_fin=time(9, 30), paciente=self.paciente,
+            bloque_horario=self.bloque, grupo_id=self.bloque.grupo_id,
+        )
+
+    def test_la_cita_se_suma_a_la_entrada_existente(self):
+        self.assertEqual(ocupacion.ocupacion_de(self.plantilla, self.fecha), (0, 0))
+        with self.captureOnCommitCallbacks(execute=True):
+            self._crear_cita()
+        with self.assertNumQueries(0):
+            self.assertEqual(ocupacion.ocupacion_de(self.plantilla, self.fecha), (1, 1))
+
+    def test_entrada_armada_despues_de_la_escritura_no_cuenta_dos_veces(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            self._crear_cita()
+        # Otra lectura reconstruye la entrada antes de que corra el on_commit
+        self.assertEqual(ocupacion.ocupacion_de(self.plantilla, self.fecha), (1, 1))
+        for callback in callbacks:
+            callback()
+        self.assertEqual(ocupacion.ocupacion_de(self.plantilla, self.fecha), (1, 1))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Las reservas concurrentes solo se prueban en PostgreSQL")
+class ReservasConcurrentesTests(TransactionTestCase):
+    """Muchos hilos reservando los mismos turnos: ninguna doble reserva ni sobrecupo."""
+
+    HILOS = 8
+
+    def setUp(self):
+        rol = Rol.objects.create(nombre='medico')
+        grupo = Grupo.objects.create(nombre='Clínica Concurrente')
+        medico = Medico.objects.create(
+            grupo=grupo, nombre='Dr Concurrente', password='x', correo='medico@concurrente.com', sexo='M',
+            fecha_nacimiento=date(1980, 1, 1), rol=rol, numero_colegiado='C-CONC',
+        )
+        usuario = Usuario.objects.create(
+            grupo=grupo, nombre='Paciente', password='x', correo='paciente@concurrente.com', sexo='F',
+            fecha_nacimiento=date(2000, 1, 1), rol=rol,
+        )
+        self.paciente = Paciente.objects.create(usuario=usuario, numero_historia_clinica='HC-CONC')
+        # 6 turnos de 30 minutos pero cupo para 4: el contador tiene que cortar
+        self.bloque = Bloque_Horario.objects.create(
+            dia_semana='LUNES', hora_inicio=time(9), hora_fin=time(12), duracion_cita_minutos=30,
+            max_citas_por_bloque=4, medico=medico, grupo=grupo,
+        )
+        hoy = date.today()
+        self.fecha = hoy + timedelta(days=7 - hoy.weekday())
+        self.horas = [time(9 + i // 2, 30 * (i % 2)) for i in range(6)]
+
+    def _reservar(self, hora):
+        fin = (datetime.combine(self.fecha, hora) + timedelta(minutes=30)).time()
+        datos = dict(
+            fecha=self.fecha, hora_inicio=hora, hora_fin=fin, paciente=self.paciente,
+            bloque_horario=self.bloque, grupo_id=self.bloque.grupo_id,
+        )
+        try:
+            guardar_cita(
+                lambda: Cita_Medica.objects.create(**datos),
+                None, (self.bloque.pk, self.fecha, hora), self.bloque,
+            )
+        except TurnoNoDisponible:
+            return 'rechazada'
+        return 'ok'
+
+    def test_sin_dobles_reservas_ni_sobrecupo(self):
+        resultados = Counter()
+        errores = []
+        lock = threading.Lock()
+        barrera = threading.Barrier(self.HILOS)
+
+        def trabajar(desplazamiento):
+            locales = Counter()
+            try:
+                barrera.wait()
+                # Cada hilo recorre los turnos desde un punto distinto
+                for i in range(len(self.horas)):
+                    locales[self._reservar(self.horas[(i + desplazamiento) % len(self.horas)])] += 1
+            except Exception as e:
+                errores.append(e)
+            finally:
+                connection.close()
+                with lock:
+                    resultados.update(locales)
+
+        hilos = [threading.Thread(target=trabajar, args=(i,)) for i in range(self.HILOS)]
+        for hilo in hilos:
+            hilo.start()
+        for hilo in hilos:
+            hilo.join()
+
+        self.assertEqual(errores, [])
+        activas = Cita_Medica.objects.filter(bloque_horario=self.bloque, fecha=self.fecha).exclude(estado_cita='CANCELADA')
+        por_turno = Counter(activas.values_list('hora_inicio', flat=True))
+        self.assertTrue(all(n == 1 for n in por_turno.values()), por_turno)
+        self.assertEqual(len(por_turno), self.bloque.max_citas_por_bloque)
+        self.assertEqual(resultados['ok'], len(por_turno))
+        contador = OcupacionBloque.objects.get(bloque_horario=self.bloque, fecha=self.fecha).citas
+        self.assertEqual(contador, len(por_turno))
+        self.assertLessEqual(contador, self.bloque.max_citas_por_bloque)
@@ -1,11 +1,12 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from . import views
-from .views import CitaMedicaViewSet
+from .views import CitaMedicaViewSet, SerieCitasViewSet
 
 
 router = DefaultRouter()
 router.register('citas', CitaMedicaViewSet, basename='cita-medica')
+router.register('series', SerieCitasViewSet, basename='serie-citas')
 
 
 
@@ -4,7 +4,8 @@ from django.shortcuts import get_object_or_404
 from rest_framework import viewsets, status
 from rest_framework.decorators import action, api_view
 from rest_framework.exceptions import ValidationError
-from apps.cuentas.utils import get_actor_usuario_from_request, log_action
+from apps.cuentas.utils import get_actor_usuario_from_request, log_action, log_actions
+from apps.cuentas.tenant import get_tenant_context
 from apps.cuentas.models import Usuario, Grupo
 from apps.doctores.models import Medico
 from rest_framework.response import Response
@@ -14,11 +15,14 @@ from rest_framework import permissions
 from config import settings
 from .models import *
 from .serializers import *
+from django.db import transaction
 from django.db.models import Q
 from apps.historiasDiagnosticos.models import Paciente
 
 # Importamos la función de nuestro servicio de IA
 from .ia_services import generar_informe_con_ia
+from .reservas import TurnoNoDisponible, guardar_cita, guardar_instancia, turno_de_datos
+from . import lotes, series
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 @api_view(['POST'])
@@ -47,40 +51,22 @@ class MultiTenantMixin:
     """Mixin para filtrar datos por grupo del usuario actual"""
     permission_classes = [permissions.IsAuthenticated]
 
+    def get_tenant(self):
+        """Contexto del usuario actual (perfil, rol, grupo, plan), resuelto una vez por request"""
+        return get_tenant_context(self.request)
+
     def get_user_grupo(self):
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                usuario = Usuario.objects.get(correo=self.request.user.email)
-                return usuario.grupo
-            except Usuario.DoesNotExist:
-                pass
-        return None
+        return self.get_tenant().grupo
 
     def get_user_medico(self):
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                medico = Medico.objects.get(correo=self.request.user.email)
-                return medico
-            except Medico.DoesNotExist:
-                pass
-        return None
+        return self.get_tenant().medico
 
     def is_super_admin(self):
         # Implementa tu lógica real aquí si es necesario
         return False
 
     def get_user_paciente(self):
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                from apps.historiasDiagnosticos.models import Paciente # Importación local
-                from apps.cuentas.models import Usuario # Importación local
-
-                usuario = Usuario.objects.get(correo=self.request.user.email)
-                paciente = Paciente.objects.get(usuario=usuario)
-                return paciente
-            except (Usuario.DoesNotExist, Paciente.DoesNotExist):
-                pass
-        return None
+        return self.get_tenant().paciente
 
     def filter_by_grupo(self, queryset):
         grupo = self.get_user_grupo()
@@ -119,8 +105,10 @@ class CitaMedicaViewSet(MultiTenantMixin, viewsets.ModelViewSet):
         # if paciente.usuario.grupo != bloque.medico.grupo:
         #     raise ValidationError('El paciente y el médico no pertenecen a la misma clínica/grupo.')
 
-        # El serializer.create ya asigna el grupo
-        cita = serializer.save() # No es necesario pasar 'grupo' aquí si el serializer lo hace
+        # El serializer.create ya asigna el grupo; la reserva del turno y del
+        # cupo se confirma en la base dentro de la misma transacción
+        turno, bloque = turno_de_datos(serializer.validated_data)
+        cita = self._guardar(lambda: serializer.save(), None, turno, bloque)
 
         actor = get_actor_usuario_from_request(self.request)
         log_action(
@@ -130,6 +118,18 @@ class CitaMedicaViewSet(MultiTenantMixin, viewsets.ModelViewSet):
             usuario=actor
         )
 
+    def _guardar(self, guardar, anterior, turno, bloque):
+        try:
+            return guardar_cita(guardar, anterior, turno, bloque)
+        except TurnoNoDisponible as e:
+            raise ValidationError(e.detalle)
+
+    def _guardar_instancia(self, cita):
+        try:
+            return guardar_instancia(cita)
+        except TurnoNoDisponible as e:
+            raise ValidationError(e.detalle)
+
     @action(detail=False, methods=['get'], url_path='paciente/(?P<paciente_id>[^/.]+)')
     def citas_por_paciente(self, request, paciente_id=None):
         try:
@@ -145,7 +145,10 @@ class CitaMedicaViewSet(MultiTenantMixin, viewsets.ModelViewSet):
             )
 
     def perform_update(self, serializer):
-        cita_actualizada = serializer.save()
+        instancia = serializer.instance
+        turno, bloque = turno_de_datos(serializer.validated_data, instancia)
+        anterior = getattr(instancia, '_turno_original', instancia.turno_ocupado())
+        cita_actualizada = self._guardar(lambda: serializer.save(), anterior, turno, bloque)
         actor = get_actor_usuario_from_request(self.request)
         log_action(
             request=self.request,
@@ -160,7 +163,7 @@ class CitaMedicaViewSet(MultiTenantMixin, viewsets.ModelViewSet):
         if instance.estado_cita not in ['COMPLETADA', 'CANCELADA']:
             instance.estado_cita = 'CANCELADA'
             instance.motivo_cancelacion = "Cancelada por el sistema/personal."
-        instance.save()
+        self._guardar_instancia(instance)
 
         actor = get_actor_usuario_from_request(self.request)
         log_action(
@@ -184,7 +187,7 @@ class CitaMedicaViewSet(MultiTenantMixin, viewsets.ModelViewSet):
         if nuevo_estado == 'CANCELADA':
             cita.motivo_cancelacion = request.data.get('motivo_cancelacion', 'Sin motivo especificado.')
 
-        cita.save()
+        self._guardar_instancia(cita)
 
         actor = get_actor_usuario_from_request(self.request)
         log_action(
@@ -197,6 +200,87 @@ class CitaMedicaViewSet(MultiTenantMixin, viewsets.ModelViewSet):
         serializer = self.get_serializer(cita)
         return Response(serializer.data)
 
+    def _elementos_del_lote(self, clave):
+        """Acepta una lista o un objeto {clave: [...]} como cuerpo del request."""
+        items = self.request.data
+        if isinstance(items, dict):
+            items = items.get(clave)
+        if not isinstance(items, list) or not items:
+            raise ValidationError({clave: "Debe enviar una lista no vacía."})
+        if len(items) > lotes.MAX_LOTE:
+            raise ValidationError({clave: f"El lote no puede tener más de {lotes.MAX_LOTE} elementos."})
+        return items
+
+    def _respuesta_lote(self, resultados, exito):
+        """200/201 si todo salió bien, 207 si hubo fallos parciales, 400 si falló todo."""
+        detalle = []
+        for i, resultado in enumerate(resultados):
+            if isinstance(resultado, Cita_Medica):
+                detalle.append({"indice": i, "ok": True, "cita": self.get_serializer(resultado).data})
+            else:
+                detalle.append({"indice": i, "ok": False, "errores": resultado})
+        exitosas = sum(1 for d in detalle if d["ok"])
+        if exitosas == len(detalle):
+            codigo = exito
+        elif exitosas:
+            codigo = status.HTTP_207_MULTI_STATUS
+        else:
+            codigo = status.HTTP_400_BAD_REQUEST
+        return Response({
+            "total": len(detalle),
+            "exitosas": exitosas,
+            "fallidas": len(detalle) - exitosas,
+            "resultados": detalle,
+        }, status=codigo)
+
+    @action(detail=False, methods=['post'], url_path='bulk-create')
+    def crear_en_lote(self, request):
+        """
+        Crea varias citas en una transacción. Cuerpo: lista de citas (o
+        {"citas": [...]}) con los mismos campos que el alta individual.
+        """
+        items = self._elementos_del_lote('citas')
+        resultados = lotes.crear_citas(items, grupo=self.get_user_grupo(), medico=self.get_user_medico())
+
+        creadas = [r for r in resultados if isinstance(r, Cita_Medica)]
+        log_actions(request, [
+            (f"Creó cita (lote) para {cita.paciente.usuario.nombre} el {cita.fecha} a las {cita.hora_inicio.strftime('%H:%M')}",
+             f"Cita ID: {cita.id}")
+            for cita in creadas
+        ])
+        return self._respuesta_lote(resultados, status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path='bulk-cambiar-estado')
+    def cambiar_estado_en_lote(self, request):
+        """
+        Cambia el estado de varias citas en una transacción. Cuerpo:
+        {"ids": [...], "estado_cita": ..., "motivo_cancelacion": ...} para
+        aplicar el mismo cambio a todas, o {"citas": [{"id", "estado_cita",
+        "motivo_cancelacion"}, ...]}.
+        """
+        if isinstance(request.data, dict) and 'ids' in request.data:
+            ids = request.data.get('ids')
+            if not isinstance(ids, list) or not ids:
+                raise ValidationError({"ids": "Debe enviar una lista no vacía."})
+            comun = {k: request.data[k] for k in ('estado_cita', 'motivo_cancelacion') if k in request.data}
+            items = [{"id": pk, **comun} for pk in ids]
+            if len(items) > lotes.MAX_LOTE:
+                raise ValidationError({"ids": f"El lote no puede tener más de {lotes.MAX_LOTE} elementos."})
+        else:
+            items = self._elementos_del_lote('citas')
+
+        resultados = lotes.cambiar_estados(self.get_queryset(), items)
+
+        cambios = [r for r in resultados if isinstance(r, tuple)]
+        log_actions(request, [
+            (f"Cambió estado de cita ID {cita.id} de '{estado_anterior}' a '{cita.estado_cita}' (lote)",
+             f"Cita ID: {cita.id}")
+            for cita, estado_anterior in cambios
+        ])
+        return self._respuesta_lote(
+            [r[0] if isinstance(r, tuple) else r for r in resultados], status.HTTP_200_OK
+        )
+
     @action(detail=False, methods=['get'])
     def eliminadas(self, request):
         queryset = self.get_queryset().filter(estado=False)
@@ -211,7 +295,7 @@ class CitaMedicaViewSet(MultiTenantMixin, viewsets.ModelViewSet):
              cita.estado = True
              # Decidir a qué estado restaurar, ¿CONFIRMADA siempre?
              cita.estado_cita = 'CONFIRMADA'
-             cita.save()
+             self._guardar_instancia(cita)
 
              actor = get_actor_usuario_from_request(self.request)
              log_action(
@@ -287,3 +371,105 @@ class CitaMedicaViewSet(MultiTenantMixin, viewsets.ModelViewSet):
                 {"error": e.detail},
                 status=e.status_code
             )
+
+
+class SerieCitasViewSet(MultiTenantMixin, viewsets.ModelViewSet):
+    """
+    Series de citas recurrentes. Al crear una serie se validan todas sus
+    fechas y se generan las citas de las próximas semanas; el resto las va
+    generando el comando ``extender_series`` (ver series.py).
+    """
+    queryset = SerieCitas.objects.all().select_related('paciente__usuario', 'bloque_horario__medico', 'grupo')
+    serializer_class = SerieCitasSerializer
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        queryset = self.filter_by_grupo(super().get_queryset())
+        medico = self.get_user_medico()
+        if medico:
+            queryset = queryset.filter(bloque_horario__medico=medico)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        """
+        Limita paciente y bloque horario a la clínica del usuario (y a sus
+        propios bloques si es médico): un id ajeno responde 400 como inexistente.
+        """
+        serializer = super().get_serializer(*args, **kwargs)
+        # En list (many=True) los campos cuelgan del serializer hijo
+        campos = getattr(serializer, 'child', serializer).fields
+        grupo = self.get_user_grupo()
+        if grupo:
+            campos['paciente'].queryset = campos['paciente'].queryset.filter(usuario__grupo=grupo)
+            campos['bloque_horario'].queryset = campos['bloque_horario'].queryset.filter(medico__grupo=grupo)
+        medico = self.get_user_medico()
+        if medico:
+            campos['bloque_horario'].queryset = campos['bloque_horario'].queryset.filter(medico=medico)
+        return serializer
+
+    def _validar_fechas(self, serializer):
+        """Lista de conflictos de todas las ocurrencias, sin guardar nada."""
+        datos = {k: v for k, v in serializer.validated_data.items() if k != 'omitir_conflictos'}
+        return [
+            {"fecha": fecha.isoformat(), "errores": error}
+            for fecha, error in series.conflictos(SerieCitas(**datos))
+        ]
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        conflictos = self._validar_fechas(serializer)
+        if conflictos and not serializer.validated_data.get('omitir_conflictos'):
+            raise ValidationError({
+                "detail": "Algunas fechas de la serie ya están ocupadas. Envíe omitir_conflictos=true para saltarlas.",
+                "conflictos": conflictos,
+            })
+
+        with transaction.atomic():
+            serie = serializer.save()
+            creadas, omitidas = series.materializar(serie)
+
+        log_action(
+            request=request,
+            accion=f"Creó serie de citas para {serie.paciente.usuario.nombre} ({len(creadas)} citas generadas)",
+            objeto=f"Serie ID: {serie.id}",
+        )
+        serie.refresh_from_db()
+        data = self.get_serializer(serie).data
+        data['citas_generadas'] = len(creadas)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'])
+    def validar(self, request):
+        """Muestra las fechas de la serie y sus conflictos sin crearla."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        datos = {k: v for k, v in serializer.validated_data.items() if k != 'omitir_conflictos'}
+        fechas = [f.isoformat() for f in series.fechas_de_serie(SerieCitas(**datos))]
+        return Response({"fechas": fechas, "conflictos": self._validar_fechas(serializer)})
+
+    @action(detail=True, methods=['post'])
+    def extender(self, request, pk=None):
+        """Genera ya las citas que caen en la ventana actual."""
+        serie = self.get_object()
+        creadas, omitidas = series.materializar(serie)
+        serie.refresh_from_db()
+        data = self.get_serializer(serie).data
+        data['citas_generadas'] = len(creadas)
+        return Response(data)
+
+    @action(detail=True, methods=['get'])
+    def citas(self, request, pk=None):
+        serie = self.get_object()
+        citas = serie.citas.select_related('paciente__usuario', 'bloque_horario__medico').order_by('fecha')
+        return Response(CitaMedicaSerializer(citas, many=True).data)
+
+    def perform_destroy(self, instance):
+        resultados = series.cancelar_serie(instance, self.request.data.get('motivo_cancelacion'))
+        canceladas = sum(1 for r in resultados if isinstance(r, tuple))
+        log_action(
+            request=self.request,
+            accion=f"Canceló la serie de citas ID {instance.id} ({canceladas} citas futuras canceladas)",
+            objeto=f"Serie ID: {instance.id}",
+        )
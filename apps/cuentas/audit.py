@@ -0,0 +1,312 @@
+# apps/cuentas/audit.py
+"""
+Escritura diferida y por lotes de la bitácora.
+
+``log_action`` ya no hace un ``Bitacora.objects.create`` dentro del request:
+encola un registro liviano (ids + textos + timestamp) en un buffer acotado
+del proceso y un hilo de fondo lo vuelca con ``bulk_create`` cuando se junta
+un lote (``TAMANO_LOTE``) o pasa ``INTERVALO_FLUSH`` segundos, y también al
+apagar el proceso.
+
+Si el buffer está lleno se aplica ``POLITICA_LLENO``:
+
+- ``'sincrono'``: se escribe el registro en el mismo request (no se pierde nada).
+- ``'bloquear'``: se espera hasta ``TIMEOUT_BLOQUEO`` segundos por espacio y,
+  si no hay, se descarta.
+- ``'descartar'``: se descarta de inmediato.
+
+Con ``MODO='sincrono'`` (útil en tests) todo se escribe en el momento, como
+antes. Los contadores de ``estadisticas()`` permiten ver descartes y demoras.
+"""
+import atexit
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.utils import timezone
+
+
+_CONFIG_POR_DEFECTO = {
+    'MODO': 'async',              # 'async' | 'sincrono'
+    'CAPACIDAD': 10000,           # registros máximos en memoria
+    'TAMANO_LOTE': 200,           # registros por bulk_create
+    'INTERVALO_FLUSH': 1.0,       # segundos máximos que un registro espera en el buffer
+    'POLITICA_LLENO': 'sincrono', # 'sincrono' | 'bloquear' | 'descartar'
+    'TIMEOUT_BLOQUEO': 0.05,      # segundos de espera con POLITICA_LLENO='bloquear'
+    'UMBRAL_DEMORA': 5.0,         # segundos desde que se encola para contar como demorado
+}
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'BITACORA_BUFFER', {}) or {})
+    return config
+
+
+class BufferBitacora:
+    """Cola acotada + hilo escritor de registros de bitácora."""
+
+    CAMPOS = ('usuario_id', 'grupo_id', 'accion', 'ip', 'objeto', 'timestamp')
+
+    def __init__(self, capacidad, tamano_lote, intervalo_flush, politica_lleno,
+                 timeout_bloqueo, umbral_demora):
+        self.capacidad = capacidad
+        self.tamano_lote = tamano_lote
+        self.intervalo_flush = intervalo_flush
+        self.politica_lleno = politica_lleno
+        self.timeout_bloqueo = timeout_bloqueo
+        self.umbral_demora = umbral_demora
+
+        self._lock = threading.Lock()
+        self._contadores = dict.fromkeys(
+            ('encolados', 'escritos', 'descartados', 'demorados', 'sincronos', 'fallidos', 'lotes'), 0
+        )
+        self._pid = None
+        self._cola = None
+        self._hilo = None
+        self._detenido = False
+
+    # -- ciclo de vida -----------------------------------------------------
+
+    def _asegurar_hilo(self):
+        # Tras un fork (gunicorn --preload) la cola y el hilo del padre no sirven
+        if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._hilo is not None and self._hilo.is_alive():
+                return
+            if self._pid != os.getpid():
+                self._cola = queue.Queue(maxsize=self.capacidad)
+            self._pid = os.getpid()
+            self._detenido = False
+            self._hilo = threading.Thread(target=self._trabajar, name='bitacora-writer', daemon=True)
+            self._hilo.start()
+
+    def detener(self, timeout=5.0):
+        """Vacía el buffer y detiene el hilo escritor (se llama en atexit)."""
+        if self._hilo is None or self._pid != os.getpid():
+            return
+        self._detenido = True
+        self._cola.put(None)
+        self._hilo.join(timeout)
+
+    # -- productor -----------------------------------------------------------
+
+    def registrar(self, registro):
+        self._asegurar_hilo()
+        try:
+            self._cola.put_nowait(registro)
+        except queue.Full:
+            if self.politica_lleno == 'sincrono':
+                self._escribir([registro])
+                self._incrementar('sincronos')
+                return
+            if self.politica_lleno == 'bloquear':
+                try:
+                    self._cola.put(registro, timeout=self.timeout_bloqueo)
+                except queue.Full:
+                    self._incrementar('descartados')
+                    return
+                self._incrementar('demorados')
+            else:
+                self._incrementar('descartados')
+                return
+        self._incrementar('encolados')
+
+    def flush(self):
+        """Escribe en el hilo actual todo lo pendiente."""
+        if self._cola is None or self._pid != os.getpid():
+            return
+        pendientes = []
+        while True:
+            try:
+                registro = self._cola.get_nowait()
+            except queue.Empty:
+                break
+            if registro is not None:
+                pendientes.append(registro)
+        for i in range(0, len(pendientes), self.tamano_lote):
+            self._escribir(pendientes[i:i + self.tamano_lote])
+
+    # -- consumidor ------------------------------------------------------------
+
+    def _trabajar(self):
+        lote = []
+        limite = None
+        while True:
+            espera = self.intervalo_flush if limite is None else max(0.0, limite - time.monotonic())
+            try:
+                registro = self._cola.get(timeout=espera)
+            except queue.Empty:
+                registro = False
+
+            if registro is None:
+                lote.extend(r for r in self._drenar() if r is not None)
+                break
+            if registro:
+                lote.append(registro)
+                if limite is None:
+                    limite = time.monotonic() + self.intervalo_flush
+
+            if lote and (len(lote) >= self.tamano_lote or time.monotonic() >= limite):
+                self._escribir(lote)
+                lote, limite = [], None
+
+        for i in range(0, len(lote), self.tamano_lote):
+            self._escribir(lote[i:i + self.tamano_lote])
+        close_old_connections()
+
+    def _drenar(self):
+        while True:
+            try:
+                yield self._cola.get_nowait()
+            except queue.Empty:
+                return
+
+    def _escribir(self, registros):
+        from .models import Bitacora
+
+        ahora = timezone.now()
+        demorados = sum(
+            1 for r in registros
+            if (ahora - r['timestamp']).total_seconds() > self.umbral_demora
+        )
+        try:
+            Bitacora.objects.bulk_create([Bitacora(**r) for r in registros])
+            escritos = len(registros)
+        except Exception as e:
+            # Un usuario borrado entre el encolado y el flush invalida todo el lote;
+            # se reintenta fila por fila para no perder el resto.
+            print(f"Error al volcar lote de bitácora ({len(registros)} registros): {e}")
+            escritos = 0
+            for registro in registros:
+                try:
+                    with transaction.atomic():
+                        Bitacora.objects.create(**registro)
+                    escritos += 1
+                except Exception:
+                    try:
+                        with transaction.atomic():
+                            Bitacora.objects.create(**{**registro, 'usuario_id': None})
+                        escritos += 1
+                    except Exception as e2:
+                        print(f"Error al registrar en bitácora: {e2}")
+        finally:
+            if threading.current_thread() is self._hilo:
+                close_old_connections()
+
+        with self._lock:
+            self._contadores['escritos'] += escritos
+            self._contadores['fallidos'] += len(registros) - escritos
+            self._contadores['demorados'] += demorados
+            self._contadores['lotes'] += 1
+
+    # -- métricas ----------------------------------------------------------------
+
+    def _incrementar(self, contador):
+        with self._lock:
+            self._contadores[contador] += 1
+
+    def estadisticas(self):
+        with self._lock:
+            datos = dict(self._contadores)
+        datos.update({
+            'pendientes': self._cola.qsize() if self._cola is not None and self._pid == os.getpid() else 0,
+            'capacidad': self.capacidad,
+            'hilo_activo': bool(self._hilo and self._hilo.is_alive() and self._pid == os.getpid()),
+            'politica_lleno': self.politica_lleno,
+        })
+        return datos
+
+
+_buffer = None
+_buffer_lock = threading.Lock()
+
+
+def get_buffer():
+    global _buffer
+    if _buffer is None:
+        with _buffer_lock:
+            if _buffer is None:
+                config = _config()
+                _buffer = BufferBitacora(
+                    capacidad=config['CAPACIDAD'],
+                    tamano_lote=config['TAMANO_LOTE'],
+                    intervalo_flush=config['INTERVALO_FLUSH'],
+                    politica_lleno=config['POLITICA_LLENO'],
+                    timeout_bloqueo=config['TIMEOUT_BLOQUEO'],
+                    umbral_demora=config['UMBRAL_DEMORA'],
+                )
+                atexit.register(_buffer.detener)
+    return _buffer
+
+
+def modo_sincrono():
+    return _config()['MODO'] == 'sincrono'
+
+
+def encolar(usuario_id, grupo_id, accion, ip=None, objeto=None):
+    """
+    Registra una entrada de bitácora. Se encola recién al confirmar la
+    transacción en curso, así las acciones revertidas no quedan registradas.
+    """
+    registro = {
+        'usuario_id': usuario_id,
+        'grupo_id': grupo_id,
+        'accion': accion,
+        'ip': ip,
+        'objeto': objeto,
+        'timestamp': timezone.now(),
+    }
+    if modo_sincrono():
+        from .models import Bitacora
+        Bitacora.objects.create(**registro)
+        return
+    transaction.on_commit(lambda: get_buffer().registrar(registro))
+
+
+def encolar_lote(usuario_id, grupo_id, acciones, ip=None):
+    """
+    Igual que ``encolar`` para varias acciones del mismo actor, por ejemplo una
+    operación en lote: ``acciones`` es una lista de ``(accion, objeto)`` y todas
+    comparten el timestamp. Se escriben juntas, sin un INSERT por acción.
+    """
+    ahora = timezone.now()
+    registros = [
+        {
+            'usuario_id': usuario_id,
+            'grupo_id': grupo_id,
+            'accion': accion,
+            'ip': ip,
+            'objeto': objeto,
+            'timestamp': ahora,
+        }
+        for accion, objeto in acciones
+    ]
+    if not registros:
+        return
+    if modo_sincrono():
+        from .models import Bitacora
+        Bitacora.objects.bulk_create([Bitacora(**r) for r in registros])
+        return
+
+    def _registrar():
+        buffer = get_buffer()
+        for registro in registros:
+            buffer.registrar(registro)
+    transaction.on_commit(_registrar)
+
+
+def flush():
+    """Fuerza la escritura de lo pendiente (tests, comandos de gestión)."""
+    if _buffer is not None:
+        _buffer.flush()
+
+
+def estadisticas():
+    if _buffer is None:
+        return {'modo': _config()['MODO'], 'pendientes': 0}
+    return {'modo': _config()['MODO'], **_buffer.estadisticas()}
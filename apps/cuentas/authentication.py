@@ -0,0 +1,233 @@
+# apps/cuentas/authentication.py
+"""
+Autenticación por token con caché de identidad.
+
+``TokenAuthentication`` consulta ``authtoken_token`` + ``auth_user`` en cada
+request y luego nuestro código vuelve a buscar ``cuentas_usuario`` por correo.
+Esta clase resuelve token -> User -> Usuario (con rol, grupo, suscripción y
+plan) una sola vez y guarda el resultado en:
+
+1. Un LRU local del proceso (TTL corto, sin red).
+2. Opcionalmente, una caché compartida de Django (Redis/Memcached) para que
+   los demás workers no tengan que ir a la base de datos.
+
+En el caso común un request autenticado no hace ninguna consulta de identidad.
+Las invalidaciones explícitas (logout, cambio de contraseña, suspensión del
+grupo, guardado de Usuario/Suscripción) borran la entrada del LRU del proceso
+actual y de la caché compartida; los LRU de otros procesos convergen al
+vencer su TTL local.
+"""
+import pickle
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+
+from .tenant import resolver_perfil, set_tenant_context
+
+
+_CONFIG_POR_DEFECTO = {
+    'TTL_LOCAL': 30,           # segundos en el LRU del proceso
+    'TTL_COMPARTIDA': 300,     # segundos en la caché compartida
+    'MAX_ENTRADAS': 2048,      # tamaño del LRU local
+    'ALIAS': None,             # alias de settings.CACHES; None = solo LRU local
+}
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'AUTH_PERFIL_CACHE', {}) or {})
+    return config
+
+
+class CacheLRU:
+    """LRU en memoria con TTL por entrada, seguro entre hilos."""
+
+    def __init__(self, max_entradas, ttl):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                return None
+            self._datos.move_to_end(clave)
+            return valor
+
+    def set(self, clave, valor):
+        with self._lock:
+            self._datos[clave] = (time.monotonic() + self.ttl, valor)
+            self._datos.move_to_end(clave)
+            while len(self._datos) > self.max_entradas:
+                self._datos.popitem(last=False)
+
+    def delete(self, clave):
+        with self._lock:
+            self._datos.pop(clave, None)
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+
+    def __len__(self):
+        return len(self._datos)
+
+
+_lru = None
+_lru_lock = threading.Lock()
+
+
+def _get_lru():
+    global _lru
+    if _lru is None:
+        with _lru_lock:
+            if _lru is None:
+                config = _config()
+                _lru = CacheLRU(config['MAX_ENTRADAS'], config['TTL_LOCAL'])
+    return _lru
+
+
+def _get_cache_compartida():
+    alias = _config()['ALIAS']
+    return caches[alias] if alias else None
+
+
+def _clave(token_key):
+    return f"auth:identidad:{token_key}"
+
+
+def obtener_identidad(token_key):
+    """Devuelve (token, usuario) desde caché o None si no está cacheado."""
+    clave = _clave(token_key)
+    lru = _get_lru()
+    datos = lru.get(clave)
+    if datos is None:
+        compartida = _get_cache_compartida()
+        if compartida is not None:
+            datos = compartida.get(clave)
+            if datos is not None:
+                lru.set(clave, datos)
+    if datos is None:
+        return None
+    # Se guarda serializado para que cada request reciba sus propias instancias
+    return pickle.loads(datos)
+
+
+def guardar_identidad(token, usuario):
+    clave = _clave(token.key)
+    datos = pickle.dumps((token, usuario), protocol=pickle.HIGHEST_PROTOCOL)
+    _get_lru().set(clave, datos)
+    compartida = _get_cache_compartida()
+    if compartida is not None:
+        compartida.set(clave, datos, _config()['TTL_COMPARTIDA'])
+
+
+# ---------------------------------------------------------------------------
+# Invalidación
+# ---------------------------------------------------------------------------
+
+def _borrar_claves(token_keys):
+    claves = [_clave(k) for k in token_keys]
+    if not claves:
+        return
+    lru = _get_lru()
+    for clave in claves:
+        lru.delete(clave)
+    compartida = _get_cache_compartida()
+    if compartida is not None:
+        compartida.delete_many(claves)
+
+
+def invalidar_tokens(token_keys):
+    """Invalida las identidades cacheadas para las claves de token dadas."""
+    token_keys = list(token_keys)
+    # Después del commit: así ningún request concurrente vuelve a cachear datos viejos
+    transaction.on_commit(lambda: _borrar_claves(token_keys))
+
+
+def invalidar_usuario(correo):
+    """Invalida todos los tokens del usuario con ese correo."""
+    if not correo:
+        return
+
+    def _invalidar():
+        from rest_framework.authtoken.models import Token
+        _borrar_claves(Token.objects.filter(user__email=correo).values_list('key', flat=True))
+
+    transaction.on_commit(_invalidar)
+
+
+def invalidar_grupo(grupo_id):
+    """Invalida los tokens de todos los usuarios de una clínica."""
+    if not grupo_id:
+        return
+
+    def _invalidar():
+        from rest_framework.authtoken.models import Token
+        from .models import Usuario
+        correos = Usuario.objects.filter(grupo_id=grupo_id).values('correo')
+        _borrar_claves(Token.objects.filter(user__email__in=correos).values_list('key', flat=True))
+
+    transaction.on_commit(_invalidar)
+
+
+def invalidar_plan(plan_id):
+    """Invalida los tokens de los usuarios cuyas clínicas usan ese plan."""
+
+    def _invalidar():
+        from rest_framework.authtoken.models import Token
+        from .models import Usuario
+        correos = Usuario.objects.filter(grupo__suscripcion_info__plan_id=plan_id).values('correo')
+        _borrar_claves(Token.objects.filter(user__email__in=correos).values_list('key', flat=True))
+
+    transaction.on_commit(_invalidar)
+
+
+def limpiar_cache_local():
+    _get_lru().clear()
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication que cachea token + User + perfil Usuario y deja el
+    perfil listo como contexto de tenant del request.
+    """
+
+    def authenticate(self, request):
+        self._perfil = None
+        resultado = super().authenticate(request)
+        if resultado is not None:
+            user, _token = resultado
+            set_tenant_context(request, user, self._perfil)
+        return resultado
+
+    def authenticate_credentials(self, key):
+        identidad = obtener_identidad(key)
+        if identidad is None:
+            model = self.get_model()
+            try:
+                token = model.objects.select_related('user').get(key=key)
+            except model.DoesNotExist:
+                raise exceptions.AuthenticationFailed('Invalid token.')
+            usuario = resolver_perfil(token.user) if token.user.is_active else None
+            guardar_identidad(token, usuario)
+        else:
+            token, usuario = identidad
+
+        if not token.user.is_active:
+            raise exceptions.AuthenticationFailed('User inactive or deleted.')
+
+        self._perfil = usuario
+        return (token.user, token)
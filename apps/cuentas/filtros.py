@@ -0,0 +1,56 @@
+# apps/cuentas/filtros.py
+"""
+Filtros de la bitácora escritos para poder usar índices.
+
+- Las fechas ``start``/``end`` se traducen a un rango semiabierto de
+  ``timestamp`` en la zona horaria del proyecto (America/La_Paz):
+  ``[start 00:00, end + 1 día 00:00)``. Filtrar con ``timestamp__date``
+  envuelve la columna en un cast y anula el índice (y el descarte de
+  particiones).
+- La búsqueda por nombre del actor se resuelve primero sobre
+  ``cuentas_usuario`` (índice trigram sobre ``UPPER(nombre)``) y luego se
+  filtra la bitácora por ``usuario_id``, en vez de un JOIN + LIKE sobre
+  toda la bitácora.
+"""
+from datetime import datetime, time, timedelta
+
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+
+def rango_fechas(start=None, end=None):
+    """
+    Convierte fechas 'YYYY-MM-DD' (inclusive) en límites ``(desde, hasta)``
+    aware para filtrar ``timestamp >= desde`` y ``timestamp < hasta``.
+    Un valor ausente o inválido devuelve None en su lado.
+    """
+    desde = hasta = None
+    sd = parse_date(start) if start else None
+    if sd:
+        desde = timezone.make_aware(datetime.combine(sd, time.min))
+    ed = parse_date(end) if end else None
+    if ed:
+        hasta = timezone.make_aware(datetime.combine(ed + timedelta(days=1), time.min))
+    return desde, hasta
+
+
+def filtrar_bitacora(qs, params, grupo=None):
+    """Aplica los filtros ``start``, ``end`` y ``usuario`` del query string."""
+    from .models import Usuario
+
+    desde, hasta = rango_fechas(params.get('start'), params.get('end'))
+    if desde:
+        qs = qs.filter(timestamp__gte=desde)
+    if hasta:
+        qs = qs.filter(timestamp__lt=hasta)
+
+    usuario = params.get('usuario')
+    if usuario:
+        if usuario.isdigit():
+            qs = qs.filter(usuario_id=int(usuario))
+        else:
+            actores = Usuario.objects.filter(nombre__icontains=usuario)
+            if grupo is not None:
+                actores = actores.filter(grupo=grupo)
+            qs = qs.filter(usuario_id__in=actores.values('id'))
+    return qs
@@ -0,0 +1,64 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from apps.cuentas.authentication import CachedTokenAuthentication, limpiar_cache_local
+from apps.cuentas.tenant import get_tenant_context, resolver_perfil
+
+
+class Command(BaseCommand):
+    help = (
+        "Compara la latencia de resolver token -> User -> Usuario con "
+        "TokenAuthentication + búsqueda del perfil contra CachedTokenAuthentication."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--token', help='Clave del token a usar (por defecto, el primero que exista)')
+        parser.add_argument('--iteraciones', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        token_key = options['token'] or Token.objects.values_list('key', flat=True).first()
+        if not token_key:
+            raise CommandError('No hay tokens; inicia sesión una vez o pasa --token.')
+        iteraciones = options['iteraciones']
+        factory = APIRequestFactory()
+
+        def nuevo_request():
+            return Request(factory.get('/', HTTP_AUTHORIZATION=f'Token {token_key}'))
+
+        def sin_cache():
+            request = nuevo_request()
+            user, _ = TokenAuthentication().authenticate(request)
+            resolver_perfil(user)
+
+        def con_cache():
+            request = nuevo_request()
+            auth = CachedTokenAuthentication()
+            user, token = auth.authenticate(request)
+            request.user, request.auth = user, token
+            get_tenant_context(request).usuario
+
+        limpiar_cache_local()
+        con_cache()  # calienta la caché
+
+        for nombre, funcion in (('TokenAuthentication + perfil', sin_cache), ('CachedTokenAuthentication', con_cache)):
+            with CaptureQueriesContext(connection) as consultas:
+                funcion()
+            tiempos = []
+            for _ in range(iteraciones):
+                inicio = time.perf_counter()
+                funcion()
+                tiempos.append((time.perf_counter() - inicio) * 1000)
+            tiempos.sort()
+            p95 = tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))]
+            self.stdout.write(
+                f"{nombre:32} p50={statistics.median(tiempos):.3f} ms  "
+                f"p95={p95:.3f} ms  consultas={len(consultas)}"
+            )
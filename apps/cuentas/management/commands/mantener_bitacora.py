@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+
+from apps.cuentas import audit, particiones
+
+
+class Command(BaseCommand):
+    help = (
+        "Mantenimiento de la bitácora: crea particiones mensuales por adelantado, "
+        "separa y archiva las antiguas y aplica la retención de cada plan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--meses-adelante', type=int, default=3,
+                            help='Particiones futuras a crear (por defecto 3)')
+        parser.add_argument('--sin-retencion', action='store_true',
+                            help='No aplicar la retención por plan')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Solo mostrar lo que se haría')
+
+    def handle(self, *args, **options):
+        dry_run = options['dry_run']
+        audit.flush()
+
+        if particiones.es_postgres():
+            if not dry_run:
+                for nombre in particiones.asegurar_particiones(options['meses_adelante']):
+                    self.stdout.write(f"Partición creada: {nombre}")
+
+            corte = particiones.corte_global()
+            for nombre, ruta, total in particiones.separar_particiones_antiguas(corte, dry_run=dry_run):
+                if dry_run:
+                    self.stdout.write(f"Se archivaría la partición {nombre}")
+                else:
+                    self.stdout.write(f"Partición {nombre} archivada en {ruta} ({total} filas)")
+        else:
+            self.stdout.write("Motor sin particionado; solo se aplica la retención.")
+
+        if not options['sin_retencion']:
+            for meses, total, ruta in particiones.aplicar_retencion(dry_run=dry_run):
+                if dry_run:
+                    self.stdout.write(f"Retención {meses} meses: se archivarían {total} filas")
+                else:
+                    self.stdout.write(f"Retención {meses} meses: {total} filas archivadas en {ruta}")
+
+        self.stdout.write(self.style.SUCCESS("Mantenimiento de bitácora terminado."))
@@ -0,0 +1,85 @@
+"""
+Convierte cuentas_bitacora en una tabla particionada por mes (PostgreSQL).
+
+La clave primaria física pasa a ser (id, timestamp) porque PostgreSQL exige
+que incluya la columna de partición; el id sigue siendo único porque lo
+genera una única identidad en la tabla padre. En otros motores no hace nada.
+"""
+from datetime import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.db import migrations
+from django.utils import timezone
+
+
+def _inicio_de_mes(momento):
+    local = timezone.localtime(momento)
+    return local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def particionar(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('ALTER TABLE cuentas_bitacora RENAME TO cuentas_bitacora_legacy')
+        cursor.execute(
+            """
+            CREATE TABLE cuentas_bitacora (
+                id bigint GENERATED BY DEFAULT AS IDENTITY,
+                accion text NOT NULL,
+                ip inet NULL,
+                objeto varchar(200) NULL,
+                extra jsonb NULL,
+                "timestamp" timestamp with time zone NOT NULL,
+                grupo_id bigint NULL
+                    REFERENCES cuentas_grupo (id) DEFERRABLE INITIALLY DEFERRED,
+                usuario_id bigint NULL
+                    REFERENCES cuentas_usuario (id) DEFERRABLE INITIALLY DEFERRED,
+                PRIMARY KEY (id, "timestamp")
+            ) PARTITION BY RANGE ("timestamp")
+            """
+        )
+        cursor.execute('CREATE TABLE cuentas_bitacora_default PARTITION OF cuentas_bitacora DEFAULT')
+
+        cursor.execute('SELECT min("timestamp") FROM cuentas_bitacora_legacy')
+        minimo = cursor.fetchone()[0] or timezone.now()
+        mes = _inicio_de_mes(minimo)
+        hasta = _inicio_de_mes(timezone.now()) + relativedelta(months=3)
+        while mes <= hasta:
+            siguiente = mes + relativedelta(months=1)
+            cursor.execute(
+                f'CREATE TABLE "cuentas_bitacora_p{mes:%Y%m}" PARTITION OF cuentas_bitacora '
+                f"FOR VALUES FROM ('{mes.isoformat()}') TO ('{siguiente.isoformat()}')"
+            )
+            mes = siguiente
+
+        cursor.execute(
+            """
+            INSERT INTO cuentas_bitacora (id, accion, ip, objeto, extra, "timestamp", grupo_id, usuario_id)
+            SELECT id, accion, ip, objeto, extra, "timestamp", grupo_id, usuario_id
+            FROM cuentas_bitacora_legacy
+            """
+        )
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('cuentas_bitacora', 'id'), "
+            "COALESCE((SELECT max(id) FROM cuentas_bitacora), 0) + 1, false)"
+        )
+        cursor.execute('DROP TABLE cuentas_bitacora_legacy')
+
+        cursor.execute('CREATE INDEX cuentas_bitacora_timestamp_idx ON cuentas_bitacora ("timestamp")')
+        cursor.execute('CREATE INDEX cuentas_bitacora_grupo_id_idx ON cuentas_bitacora (grupo_id)')
+        cursor.execute('CREATE INDEX cuentas_bitacora_usuario_id_idx ON cuentas_bitacora (usuario_id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0004_bitacora_timestamp_default'),
+    ]
+
+    operations = [
+        # Irreversible en PostgreSQL: la tabla particionada es compatible con
+        # el modelo, así que revertir solo deshace el registro de la migración.
+        migrations.RunPython(particionar, migrations.RunPython.noop),
+    ]
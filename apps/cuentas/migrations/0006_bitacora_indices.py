@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:40
+
+from django.db import migrations, models
+
+
+def crear_indice_trigram(apps, schema_editor):
+    # Búsqueda por nombre del actor: icontains en PostgreSQL genera
+    # UPPER("nombre"::text) LIKE UPPER(...), que este índice GIN cubre.
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS cuentas_usuario_nombre_trgm_idx '
+        'ON cuentas_usuario USING gin ((UPPER(nombre::text)) gin_trgm_ops)'
+    )
+
+
+def eliminar_indice_trigram(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS cuentas_usuario_nombre_trgm_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cuentas', '0005_particionar_bitacora'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='bitacora',
+            index=models.Index(fields=['grupo', '-timestamp', '-id'], name='bitacora_grupo_ts_id_idx'),
+        ),
+        migrations.RunPython(crear_indice_trigram, eliminar_indice_trigram),
+    ]
@@ -292,6 +292,14 @@ class Usuario(models.Model):
 
     token_reset_password = models.CharField(max_length=64, null=True, blank=True)
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instancia = super().from_db(db, field_names, values)
+        # Si cambia de clínica, la versión de datos de la anterior también cambia (signals.py)
+        if 'grupo_id' not in instancia.get_deferred_fields():
+            instancia._grupo_original = instancia.grupo_id
+        return instancia
+
     def set_password(self, raw_password):
         self.password = make_password(raw_password)
         self.save()
@@ -363,10 +371,15 @@ class Bitacora(models.Model):
         help_text="Información adicional en JSON (opcional)"
     )
     
-    timestamp = models.DateTimeField(auto_now_add=True, db_index=True)
+    # default (no auto_now_add) para conservar la hora del evento al escribir por lotes
+    timestamp = models.DateTimeField(default=timezone.now, db_index=True)
 
     class Meta:
         ordering = ['-timestamp']
+        indexes = [
+            # Listado por clínica en el orden de BitacoraCursorPagination
+            models.Index(fields=['grupo', '-timestamp', '-id'], name='bitacora_grupo_ts_id_idx'),
+        ]
         verbose_name = 'Registro de bitácora'
         verbose_name_plural = 'Bitácoras'
 
@@ -374,3 +387,20 @@ class Bitacora(models.Model):
         user = self.usuario.nombre if self.usuario else "Anónimo"
         grupo_info = f" ({self.grupo.nombre})" if self.grupo else ""
         return f"{self.timestamp.isoformat()} — {user}{grupo_info} — {self.accion[:80]}"
+
+
+class VersionDatos(models.Model):
+    """
+    Contador monotónico de escrituras por clínica (ver versiones.py). Forma
+    parte de la clave de la caché de reportes: mientras no cambie, los
+    datos de la clínica tampoco cambiaron.
+    """
+    ambito = models.CharField(max_length=30, primary_key=True, help_text="'grupo:<id>' o 'sin-grupo'")
+    version = models.PositiveBigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Versión de datos'
+        verbose_name_plural = 'Versiones de datos'
+
+    def __str__(self):
+        return f"{self.ambito} v{self.version}"
@@ -5,5 +5,6 @@ class BitacoraCursorPagination(CursorPagination):
     page_size = 50
     page_size_query_param = "page_size"
     max_page_size = 200
-    ordering = "-timestamp"  # cursor ordena según este campo
+    # timestamp + id: orden total y mismo orden que el índice (grupo, -timestamp, -id)
+    ordering = ("-timestamp", "-id")
     cursor_query_param = "cursor"
\ No newline at end of file
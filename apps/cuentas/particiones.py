@@ -0,0 +1,269 @@
+# apps/cuentas/particiones.py
+"""
+Particionado mensual, retención y archivado de la bitácora.
+
+En PostgreSQL ``cuentas_bitacora`` es una tabla particionada por rango de
+``timestamp`` (ver migración 0005): una partición por mes calendario en la
+zona horaria del proyecto (``cuentas_bitacora_pAAAAMM``) más una partición
+``cuentas_bitacora_default`` para lo que caiga fuera de rango.
+
+El mantenimiento (comando ``mantener_bitacora``) hace tres cosas:
+
+1. Crea por adelantado las particiones de los próximos meses.
+2. Separa (DETACH) las particiones más viejas que la retención más larga de
+   cualquier plan, las archiva en JSONL comprimido y las elimina.
+3. Aplica la retención de cada plan (``Plan.retencion_bitacora_meses``):
+   archiva y borra las filas de cada clínica más viejas que su corte.
+
+El paso 3 funciona con cualquier motor; los pasos 1 y 2 solo en PostgreSQL.
+"""
+import gzip
+import json
+import os
+import re
+from datetime import datetime
+from pathlib import Path
+
+from dateutil.relativedelta import relativedelta
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+from django.utils import timezone
+
+
+TABLA = 'cuentas_bitacora'
+PARTICION_DEFAULT = f'{TABLA}_default'
+_PATRON_PARTICION = re.compile(rf'^{TABLA}_p(\d{{4}})(\d{{2}})$')
+
+COLUMNAS = ('id', 'grupo_id', 'usuario_id', 'accion', 'ip', 'objeto', 'extra', 'timestamp')
+
+
+def es_postgres():
+    return connection.vendor == 'postgresql'
+
+
+def inicio_de_mes(momento):
+    """Primer instante del mes de ``momento`` en la zona horaria del proyecto."""
+    local = timezone.localtime(momento)
+    return local.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def nombre_particion(inicio_mes):
+    return f'{TABLA}_p{inicio_mes:%Y%m}'
+
+
+def _inicio_desde_nombre(nombre):
+    coincidencia = _PATRON_PARTICION.match(nombre)
+    if not coincidencia:
+        return None
+    anio, mes = int(coincidencia.group(1)), int(coincidencia.group(2))
+    return timezone.make_aware(datetime(anio, mes, 1))
+
+
+def directorio_archivo():
+    destino = Path(getattr(settings, 'BITACORA_ARCHIVO_DIR', settings.BASE_DIR / 'archivo' / 'bitacora'))
+    destino.mkdir(parents=True, exist_ok=True)
+    return destino
+
+
+def _escribir_jsonl(ruta, filas):
+    """Escribe filas (tuplas en el orden de COLUMNAS) en un .jsonl.gz de forma atómica."""
+    temporal = ruta.with_suffix(ruta.suffix + '.tmp')
+    total = 0
+    with gzip.open(temporal, 'wt', encoding='utf-8') as archivo:
+        for fila in filas:
+            archivo.write(json.dumps(dict(zip(COLUMNAS, fila)), cls=DjangoJSONEncoder, ensure_ascii=False))
+            archivo.write('\n')
+            total += 1
+    os.replace(temporal, ruta)
+    return total
+
+
+# ---------------------------------------------------------------------------
+# Particiones (solo PostgreSQL)
+# ---------------------------------------------------------------------------
+
+def listar_particiones():
+    """Nombres de las particiones mensuales adjuntas a la tabla."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            JOIN pg_class p ON p.oid = i.inhparent
+            WHERE p.relname = %s
+            """,
+            [TABLA],
+        )
+        return sorted(n for (n,) in cursor.fetchall() if _PATRON_PARTICION.match(n))
+
+
+def listar_separadas():
+    """Particiones mensuales separadas que quedaron sin archivar (p. ej. por un fallo)."""
+    adjuntas = set(listar_particiones())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT tablename FROM pg_tables WHERE schemaname = current_schema() AND tablename LIKE %s",
+            [f'{TABLA}\\_p%'],
+        )
+        return sorted(
+            n for (n,) in cursor.fetchall()
+            if _PATRON_PARTICION.match(n) and n not in adjuntas
+        )
+
+
+def crear_particion(inicio_mes):
+    """
+    Crea la partición del mes si no existe. Las filas que hubieran caído en
+    la partición default para ese rango se mueven a la nueva antes de adjuntarla.
+    """
+    nombre = nombre_particion(inicio_mes)
+    desde = inicio_mes.isoformat()
+    hasta = (inicio_mes + relativedelta(months=1)).isoformat()
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s)", [nombre])
+        if cursor.fetchone()[0] is not None:
+            return False
+        cursor.execute(f'CREATE TABLE "{nombre}" (LIKE "{TABLA}" INCLUDING DEFAULTS)')
+        cursor.execute(
+            f"""
+            WITH movidas AS (
+                DELETE FROM "{PARTICION_DEFAULT}"
+                WHERE "timestamp" >= %s AND "timestamp" < %s
+                RETURNING *
+            )
+            INSERT INTO "{nombre}" SELECT * FROM movidas
+            """,
+            [desde, hasta],
+        )
+        cursor.execute(
+            f"""ALTER TABLE "{TABLA}" ATTACH PARTITION "{nombre}" """
+            f"""FOR VALUES FROM ('{desde}') TO ('{hasta}')"""
+        )
+    return True
+
+
+def asegurar_particiones(meses_adelante=3, ahora=None):
+    """Crea las particiones del mes actual y de los ``meses_adelante`` siguientes."""
+    inicio = inicio_de_mes(ahora or timezone.now())
+    creadas = []
+    for i in range(meses_adelante + 1):
+        mes = inicio + relativedelta(months=i)
+        if crear_particion(mes):
+            creadas.append(nombre_particion(mes))
+    return creadas
+
+
+def archivar_tabla(nombre, destino=None):
+    """Vuelca una partición separada a ``<nombre>.jsonl.gz`` y la elimina."""
+    ruta = (destino or directorio_archivo()) / f'{nombre}.jsonl.gz'
+    columnas = ', '.join(f'"{c}"' for c in COLUMNAS)
+
+    def filas():
+        # chunked_cursor usa un cursor de servidor: no carga la partición en memoria
+        cursor = connection.chunked_cursor()
+        try:
+            cursor.execute(f'SELECT {columnas} FROM "{nombre}" ORDER BY id')
+            while True:
+                lote = cursor.fetchmany(2000)
+                if not lote:
+                    break
+                yield from lote
+        finally:
+            cursor.close()
+
+    with transaction.atomic():
+        total = _escribir_jsonl(ruta, filas())
+    with connection.cursor() as cursor:
+        cursor.execute(f'DROP TABLE "{nombre}"')
+    return ruta, total
+
+
+def separar_particiones_antiguas(corte, destino=None, dry_run=False):
+    """
+    Separa, archiva y elimina las particiones cuyo rango termina antes de
+    ``corte``. También retoma las que quedaron separadas en una corrida anterior.
+    """
+    resultado = []
+    candidatas = []
+    for nombre in listar_particiones():
+        inicio = _inicio_desde_nombre(nombre)
+        if inicio + relativedelta(months=1) <= corte:
+            candidatas.append(nombre)
+
+    for nombre in candidatas:
+        if dry_run:
+            resultado.append((nombre, None, None))
+            continue
+        with connection.cursor() as cursor:
+            cursor.execute(f'ALTER TABLE "{TABLA}" DETACH PARTITION "{nombre}"')
+
+    for nombre in (listar_separadas() if not dry_run else []):
+        ruta, total = archivar_tabla(nombre, destino)
+        resultado.append((nombre, ruta, total))
+    return resultado
+
+
+# ---------------------------------------------------------------------------
+# Retención por plan (cualquier motor)
+# ---------------------------------------------------------------------------
+
+def retencion_por_defecto():
+    return int(getattr(settings, 'BITACORA_RETENCION_MESES', 12))
+
+
+def retenciones_por_grupo():
+    """
+    Devuelve ``{meses: [grupo_id, ...]}``. Las clínicas sin suscripción (y los
+    registros sin grupo, bajo la clave ``None`` de la lista) usan el valor por defecto.
+    """
+    from .models import Grupo
+
+    por_defecto = retencion_por_defecto()
+    grupos = {}
+    for grupo_id, meses in Grupo.objects.values_list('id', 'suscripcion_info__plan__retencion_bitacora_meses'):
+        grupos.setdefault(meses or por_defecto, []).append(grupo_id)
+    grupos.setdefault(por_defecto, []).append(None)
+    return grupos
+
+
+def aplicar_retencion(ahora=None, destino=None, dry_run=False):
+    """
+    Archiva y borra, por cada retención distinta, las filas de sus clínicas
+    anteriores al corte. Devuelve una lista de (meses, filas, ruta).
+    """
+    from django.db.models import Q
+    from .models import Bitacora
+
+    inicio = inicio_de_mes(ahora or timezone.now())
+    destino = destino or directorio_archivo()
+    resultado = []
+
+    for meses, grupo_ids in sorted(retenciones_por_grupo().items()):
+        corte = inicio - relativedelta(months=meses)
+        ids = [g for g in grupo_ids if g is not None]
+        filtro = Q(grupo_id__in=ids)
+        if None in grupo_ids:
+            filtro |= Q(grupo_id__isnull=True)
+        qs = Bitacora.objects.filter(filtro, timestamp__lt=corte)
+
+        if dry_run:
+            resultado.append((meses, qs.count(), None))
+            continue
+
+        ultimo_id = qs.order_by('-id').values_list('id', flat=True).first()
+        if ultimo_id is None:
+            continue
+        qs = qs.filter(id__lte=ultimo_id)
+        ruta = destino / f'retencion_{meses}m_{timezone.localtime():%Y%m%d%H%M%S}.jsonl.gz'
+        total = _escribir_jsonl(ruta, qs.order_by('id').values_list(*COLUMNAS).iterator(chunk_size=2000))
+        qs.delete()
+        resultado.append((meses, total, ruta))
+    return resultado
+
+
+def corte_global(ahora=None):
+    """Inicio del mes más antiguo que todavía debe conservarse para alguna clínica."""
+    meses = max(retenciones_por_grupo())
+    return inicio_de_mes(ahora or timezone.now()) - relativedelta(months=meses)
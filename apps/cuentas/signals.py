@@ -0,0 +1,85 @@
+# apps/cuentas/signals.py
+"""
+Invalidación de la caché de identidad de CachedTokenAuthentication cuando
+cambia algo que forma parte del perfil cacheado, y de la versión de datos
+de cada clínica (versiones.py) cuando se escriben citas, pacientes o usuarios.
+"""
+from django.contrib.auth.models import User
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from apps.suscripciones.models import Plan, Suscripcion
+
+from . import versiones
+from .authentication import invalidar_grupo, invalidar_plan, invalidar_tokens, invalidar_usuario
+from .models import Grupo, Usuario
+
+
+def _usuario_cambiado(sender, instance, **kwargs):
+    invalidar_usuario(instance.correo)
+
+
+def _usuario_escrito(sender, instance, **kwargs):
+    # Al moverse de clínica, la anterior deja de listarlo en sus reportes
+    anterior = getattr(instance, '_grupo_original', instance.grupo_id)
+    versiones.incrementar({anterior, instance.grupo_id})
+    instance._grupo_original = instance.grupo_id
+
+
+# Medico hereda de Usuario: post_save se emite con sender=Medico, no Usuario
+for _modelo in (Usuario, 'doctores.Medico'):
+    post_save.connect(_usuario_cambiado, sender=_modelo, dispatch_uid=f'auth_cache_usuario_save_{_modelo}')
+    post_delete.connect(_usuario_cambiado, sender=_modelo, dispatch_uid=f'auth_cache_usuario_delete_{_modelo}')
+    post_save.connect(_usuario_escrito, sender=_modelo, dispatch_uid=f'version_usuario_save_{_modelo}')
+    post_delete.connect(_usuario_escrito, sender=_modelo, dispatch_uid=f'version_usuario_delete_{_modelo}')
+
+
+@receiver(post_save, sender=User, dispatch_uid='auth_cache_user_save')
+def _user_cambiado(sender, instance, **kwargs):
+    invalidar_tokens(Token.objects.filter(user=instance).values_list('key', flat=True))
+
+
+@receiver(post_delete, sender=Token, dispatch_uid='auth_cache_token_delete')
+def _token_eliminado(sender, instance, **kwargs):
+    invalidar_tokens([instance.key])
+
+
+@receiver(post_save, sender=Grupo, dispatch_uid='auth_cache_grupo_save')
+def _grupo_cambiado(sender, instance, created, **kwargs):
+    if not created:
+        invalidar_grupo(instance.pk)
+
+
+@receiver(post_save, sender=Suscripcion, dispatch_uid='auth_cache_suscripcion_save')
+@receiver(post_delete, sender=Suscripcion, dispatch_uid='auth_cache_suscripcion_delete')
+def _suscripcion_cambiada(sender, instance, **kwargs):
+    invalidar_grupo(instance.grupo_id)
+
+
+@receiver(post_save, sender=Plan, dispatch_uid='auth_cache_plan_save')
+def _plan_cambiado(sender, instance, created, **kwargs):
+    if not created:
+        invalidar_plan(instance.pk)
+
+
+# ---------------------------------------------------------------------------
+# Versión de datos por clínica
+# ---------------------------------------------------------------------------
+
+def _cita_escrita(sender, instance, **kwargs):
+    versiones.incrementar([instance.grupo_id])
+
+
+def _paciente_escrito(sender, instance, **kwargs):
+    usuario = instance._meta.get_field('usuario')
+    if usuario.is_cached(instance):
+        grupo_id = instance.usuario.grupo_id
+    else:
+        grupo_id = Usuario.objects.filter(pk=instance.usuario_id).values_list('grupo_id', flat=True).first()
+    versiones.incrementar([grupo_id])
+
+
+for _modelo, _receptor in (('citas_pagos.Cita_Medica', _cita_escrita), ('historiasDiagnosticos.Paciente', _paciente_escrito)):
+    post_save.connect(_receptor, sender=_modelo, dispatch_uid=f'version_save_{_modelo}')
+    post_delete.connect(_receptor, sender=_modelo, dispatch_uid=f'version_delete_{_modelo}')
@@ -0,0 +1,138 @@
+# apps/cuentas/tenant.py
+"""
+Contexto de tenant (clínica) resuelto una sola vez por request.
+
+Antes cada mixin/vista volvía a buscar el perfil con
+``Usuario.objects.get(correo=request.user.email)`` (y luego ``usuario.rol``
+de forma perezosa), por lo que un solo listado disparaba 2-4 consultas
+idénticas. Aquí se resuelve Usuario + rol + grupo + suscripción + plan con un
+único ``select_related`` y se guarda en el request.
+
+La autenticación por token de DRF se ejecuta dentro de la vista (después de
+los middlewares), así que el contexto se resuelve de forma perezosa la primera
+vez que alguien lo pide y queda memorizado en el ``HttpRequest`` subyacente
+para el usuario autenticado de ese momento.
+"""
+from django.utils.functional import cached_property
+
+
+class TenantContext:
+    """Perfil del usuario actual y la información de su clínica."""
+
+    def __init__(self, usuario=None):
+        self.usuario = usuario
+
+    @property
+    def rol(self):
+        return self.usuario.rol if self.usuario else None
+
+    @property
+    def rol_nombre(self):
+        rol = self.rol
+        return rol.nombre if rol else None
+
+    @property
+    def grupo(self):
+        return self.usuario.grupo if self.usuario else None
+
+    @property
+    def es_super_admin(self):
+        return self.rol_nombre == 'superAdmin'
+
+    @property
+    def suscripcion(self):
+        grupo = self.grupo
+        if grupo is None:
+            return None
+        # select_related sobre la relación inversa deja la suscripción en caché
+        # (o marca que no existe), así que esto no hace consultas extra.
+        return getattr(grupo, 'suscripcion_info', None)
+
+    @property
+    def plan(self):
+        suscripcion = self.suscripcion
+        return suscripcion.plan if suscripcion else None
+
+    @property
+    def suscripcion_activa(self):
+        suscripcion = self.suscripcion
+        return bool(suscripcion and suscripcion.esta_activa)
+
+    @cached_property
+    def medico(self):
+        """Perfil de médico del usuario (o None). Se consulta solo si se pide."""
+        if not self.usuario:
+            return None
+        from apps.doctores.models import Medico
+        return Medico.objects.select_related('grupo', 'rol').filter(usuario_ptr_id=self.usuario.id).first()
+
+    @cached_property
+    def paciente(self):
+        """Perfil de paciente del usuario (o None). Se consulta solo si se pide."""
+        if not self.usuario:
+            return None
+        from apps.historiasDiagnosticos.models import Paciente
+        return Paciente.objects.filter(usuario_id=self.usuario.id).first()
+
+    def __bool__(self):
+        return self.usuario is not None
+
+
+PERFIL_SELECT_RELATED = (
+    'rol',
+    'grupo',
+    'grupo__suscripcion_info',
+    'grupo__suscripcion_info__plan',
+)
+
+
+def resolver_perfil(user):
+    """Devuelve el Usuario (con rol, grupo, suscripción y plan) de un auth.User."""
+    if user is None or not getattr(user, 'is_authenticated', False):
+        return None
+    email = getattr(user, 'email', None)
+    if not email:
+        return None
+    from .models import Usuario
+    return (
+        Usuario.objects
+        .select_related(*PERFIL_SELECT_RELATED)
+        .filter(correo=email)
+        .first()
+    )
+
+
+def _http_request(request):
+    # DRF envuelve el HttpRequest de Django; guardamos el contexto en el original
+    # para que lo compartan la vista, los serializers y las utilidades.
+    return getattr(request, '_request', request)
+
+
+def set_tenant_context(request, user, usuario):
+    """Registra un perfil ya resuelto (p. ej. por la clase de autenticación)."""
+    http_request = _http_request(request)
+    contexto = TenantContext(usuario)
+    http_request._tenant_context = (getattr(user, 'pk', None), contexto)
+    return contexto
+
+
+def get_tenant_context(request):
+    """
+    Devuelve el TenantContext del request, resolviéndolo como máximo una vez
+    por usuario autenticado.
+    """
+    if request is None:
+        return TenantContext()
+
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return TenantContext()
+
+    http_request = _http_request(request)
+    cacheado = getattr(http_request, '_tenant_context', None)
+    if cacheado is not None and cacheado[0] == user.pk:
+        return cacheado[1]
+
+    contexto = TenantContext(resolver_perfil(user))
+    http_request._tenant_context = (user.pk, contexto)
+    return contexto
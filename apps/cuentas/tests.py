@@ -1,3 +1,74 @@
+from datetime import date, timedelta
+from unittest import skipUnless
+
+from django.db import connection
 from django.test import TestCase
+from django.utils import timezone
+
+from apps.doctores.models import Medico
+
+from . import versiones
+from .filtros import filtrar_bitacora
+from .models import Bitacora, Grupo, Usuario
+
+
+@skipUnless(connection.vendor == 'postgresql', "El plan de consulta solo se verifica en PostgreSQL")
+class BitacoraIndicePlanTests(TestCase):
+    """La consulta de bitácora por clínica y ventana de tiempo usa el índice (grupo, timestamp, id)."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.grupo = Grupo.objects.create(nombre='Clínica A')
+        otro = Grupo.objects.create(nombre='Clínica B')
+        ahora = timezone.now()
+        Bitacora.objects.bulk_create([
+            Bitacora(grupo=grupo, accion=f'acción {i}', timestamp=ahora - timedelta(hours=i))
+            for grupo in (cls.grupo, otro)
+            for i in range(200)
+        ])
+
+    def _indices_del_plan(self):
+        # En la tabla particionada cada partición tiene su propia copia del índice
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT relid::regclass::text FROM pg_partition_tree('bitacora_grupo_ts_id_idx')")
+            return [fila[0] for fila in cursor.fetchall()]
+
+    def test_filtro_por_grupo_y_fechas_usa_el_indice(self):
+        hoy = timezone.localdate()
+        params = {'start': (hoy - timedelta(days=2)).isoformat(), 'end': hoy.isoformat()}
+        consulta = filtrar_bitacora(
+            Bitacora.objects.filter(grupo=self.grupo), params, grupo=self.grupo
+        ).order_by('-timestamp', '-id')
+
+        with connection.cursor() as cursor:
+            # Con tan pocas filas el planificador preferiría leer la tabla entera
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        plan = consulta.explain()
+
+        indices = self._indices_del_plan()
+        self.assertTrue(
+            any(indice in plan for indice in indices),
+            f"El plan no usa bitacora_grupo_ts_id_idx:\n{plan}",
+        )
+
+
+class VersionDatosUsuarioTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.origen = Grupo.objects.create(nombre='Clínica Origen')
+        cls.destino = Grupo.objects.create(nombre='Clínica Destino')
+        datos = dict(grupo=cls.origen, password='x', sexo='F', fecha_nacimiento=date(1990, 1, 1))
+        Usuario.objects.create(nombre='Usuaria', correo='usuaria@version.com', **datos)
+        Medico.objects.create(nombre='Médica', correo='medica@version.com', numero_colegiado='C-V', **datos)
 
-# Create your tests here.
+    def test_cambio_de_clinica_incrementa_ambas_versiones(self):
+        for modelo, correo in ((Usuario, 'usuaria@version.com'), (Medico, 'medica@version.com')):
+            with self.subTest(modelo=modelo.__name__):
+                instancia = modelo.objects.get(correo=correo)
+                antes = {g.id: versiones.version(g.id) for g in (self.origen, self.destino)}
+                instancia.grupo = self.destino
+                with self.captureOnCommitCallbacks(execute=True):
+                    instancia.save()
+                for grupo_id, version in antes.items():
+                    self.assertGreater(versiones.version(grupo_id), version)
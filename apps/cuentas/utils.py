@@ -4,46 +4,39 @@ def get_actor_usuario_from_request(request):
     Retorna None si no se puede obtener.
     """
     try:
-        # Si tienes autenticación por token
-        if hasattr(request, 'user') and request.user.is_authenticated:
-            # Buscar el Usuario correspondiente por email
-            from .models import Usuario
-            return Usuario.objects.filter(correo=request.user.email).first()
-        return None
-    except:
+        # El perfil se resuelve una sola vez por request (ver tenant.py)
+        from .tenant import get_tenant_context
+        return get_tenant_context(request).usuario
+    except Exception:
         return None
 
 
+def _grupo_id_de(request, usuario):
+    # Si tenemos usuario, tomamos su grupo (sin cargar el objeto Grupo)
+    if usuario and getattr(usuario, 'grupo_id', None):
+        return usuario.grupo_id
+    # Si no hay usuario (login, anon, etc.), intentar tomar el grupo del request
+    from .tenant import get_tenant_context
+    grupo = get_tenant_context(request).grupo
+    return grupo.id if grupo else None
+
+
 def log_action(request, accion, objeto=None, usuario=None):
     """
     Registra una acción en la bitácora, asegurando grupo_id.
+    La escritura se hace por lotes fuera del request (ver audit.py).
     """
     try:
-        from .models import Bitacora
+        from .audit import encolar
 
         ip = get_client_ip(request)
 
         if not usuario:
             usuario = get_actor_usuario_from_request(request)
 
-        grupo = None
-        # Si tenemos usuario, tomamos su grupo
-        if usuario and hasattr(usuario, 'grupo') and usuario.grupo:
-            grupo = usuario.grupo
-        else:
-            # Si no hay usuario (login, anon, etc.), intentar tomar el grupo del request
-            # Por ejemplo, si usas MultiTenantMixin, podrías agregar:
-            if hasattr(request, 'user') and request.user.is_authenticated:
-                from .models import Usuario
-                try:
-                    perfil = Usuario.objects.get(correo=request.user.email)
-                    grupo = perfil.grupo
-                except Usuario.DoesNotExist:
-                    pass
-
-        Bitacora.objects.create(
-            usuario=usuario,
-            grupo=grupo,
+        encolar(
+            usuario_id=usuario.pk if usuario else None,
+            grupo_id=_grupo_id_de(request, usuario),
             accion=accion,
             ip=ip,
             objeto=objeto
@@ -52,6 +45,28 @@ def log_action(request, accion, objeto=None, usuario=None):
     except Exception as e:
         print(f"Error al registrar en bitácora: {e}")
 
+
+def log_actions(request, acciones, usuario=None):
+    """
+    Registra varias acciones del mismo request de una vez.
+    ``acciones`` es una lista de tuplas (accion, objeto).
+    """
+    try:
+        from .audit import encolar_lote
+
+        if not usuario:
+            usuario = get_actor_usuario_from_request(request)
+
+        encolar_lote(
+            usuario_id=usuario.pk if usuario else None,
+            grupo_id=_grupo_id_de(request, usuario),
+            acciones=acciones,
+            ip=get_client_ip(request),
+        )
+
+    except Exception as e:
+        print(f"Error al registrar en bitácora: {e}")
+
 def get_client_ip(request):
     """
     Obtiene la IP del cliente desde el request.
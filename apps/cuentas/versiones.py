@@ -0,0 +1,55 @@
+# apps/cuentas/versiones.py
+"""
+Versión de los datos de cada clínica.
+
+Cada escritura de ``Cita_Medica``, ``Paciente`` o ``Usuario`` (señales en
+signals.py; las escrituras en lote de citas lo llaman a mano) incrementa el
+contador de su clínica al confirmar la transacción. Quien cachea algo
+derivado de esos datos incluye la versión en la clave: la entrada sirve
+hasta la próxima escritura y nunca hace falta borrarla.
+
+Incrementar después del commit es seguro: una lectura que vio la versión
+vieja pudo haber leído datos nuevos, pero su entrada queda bajo una clave
+que ya no se vuelve a pedir. La versión "global" (reportes de superAdmin)
+es la suma de todos los contadores.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+
+from .models import VersionDatos
+
+
+SIN_GRUPO = 'sin-grupo'
+
+
+def ambito_de(grupo_id):
+    return f'grupo:{grupo_id}' if grupo_id else SIN_GRUPO
+
+
+def _aplicar(ambitos):
+    for ambito in ambitos:
+        if VersionDatos.objects.filter(ambito=ambito).update(version=F('version') + 1):
+            continue
+        try:
+            with transaction.atomic():
+                VersionDatos.objects.create(ambito=ambito, version=1)
+        except IntegrityError:
+            # Otro proceso creó la fila entre el UPDATE y el INSERT
+            VersionDatos.objects.filter(ambito=ambito).update(version=F('version') + 1)
+
+
+def incrementar(grupo_ids):
+    """Incrementa, al confirmar la transacción, la versión de las clínicas dadas."""
+    ambitos = {ambito_de(grupo_id) for grupo_id in grupo_ids}
+    if ambitos:
+        transaction.on_commit(lambda: _aplicar(sorted(ambitos)))
+
+
+def version(grupo_id=None, es_global=False):
+    """Versión actual de una clínica, o de todas si ``es_global``."""
+    if es_global:
+        return VersionDatos.objects.aggregate(total=Sum('version'))['total'] or 0
+    return (
+        VersionDatos.objects.filter(ambito=ambito_de(grupo_id)).values_list('version', flat=True).first()
+        or 0
+    )
@@ -18,30 +18,26 @@ from django.utils import timezone
 from rest_framework.exceptions import ValidationError
 from apps.suscripciones.models import PagoSuscripcion,Plan,Suscripcion
 from .pagination import BitacoraCursorPagination
+from .filtros import filtrar_bitacora
+from .tenant import get_tenant_context, PERFIL_SELECT_RELATED
+from . import audit
+from .authentication import invalidar_grupo, invalidar_tokens, invalidar_usuario
 
 
 class MultiTenantMixin:
     """Mixin para filtrar datos por grupo del usuario actual"""
     
+    def get_tenant(self):
+        """Contexto del usuario actual (perfil, rol, grupo, plan), resuelto una vez por request"""
+        return get_tenant_context(self.request)
+    
     def get_user_grupo(self):
         """Obtiene el grupo del usuario actual"""
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                usuario = Usuario.objects.get(correo=self.request.user.email)
-                return usuario.grupo
-            except Usuario.DoesNotExist:
-                pass
-        return None
+        return self.get_tenant().grupo
     
     def is_super_admin(self):
         """Verifica si el usuario actual es super admin"""
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                usuario = Usuario.objects.get(correo=self.request.user.email)
-                return usuario.rol and usuario.rol.nombre == 'superAdmin'  # Cambiar aquí también
-            except Usuario.DoesNotExist:
-                pass
-        return False
+        return self.get_tenant().es_super_admin
     
     def filter_by_grupo(self, queryset):
         """Filtra el queryset por el grupo del usuario actual"""
@@ -80,22 +76,10 @@ class GrupoViewSet(viewsets.ModelViewSet):
             return Grupo.objects.none()
     
     def is_super_admin(self):
-        if not self.request.user.is_authenticated:
-            return False
-        try:
-            usuario = Usuario.objects.get(correo=self.request.user.email)
-            return usuario.rol and usuario.rol.nombre == 'superAdmin'
-        except Usuario.DoesNotExist:
-            return False
+        return get_tenant_context(self.request).es_super_admin
     
     def get_user_grupo(self):
-        if not self.request.user.is_authenticated:
-            return None
-        try:
-            usuario = Usuario.objects.get(correo=self.request.user.email)
-            return usuario.grupo
-        except Usuario.DoesNotExist:
-            return None
+        return get_tenant_context(self.request).grupo
     
     def perform_create(self, serializer):
         grupo = serializer.save()
@@ -143,6 +127,7 @@ class GrupoViewSet(viewsets.ModelViewSet):
         grupo.estado = 'SUSPENDIDO'
         grupo.fecha_suspension = timezone.now()
         grupo.save()
+        invalidar_grupo(grupo.id)
         
         return Response({'message': 'Grupo suspendido correctamente'})
     
@@ -159,6 +144,7 @@ class GrupoViewSet(viewsets.ModelViewSet):
         grupo.estado = 'ACTIVO'
         grupo.fecha_suspension = None
         grupo.save()
+        invalidar_grupo(grupo.id)
         
         return Response({'message': 'Grupo activado correctamente'})
 
@@ -237,6 +223,7 @@ class UsuarioViewSet(MultiTenantMixin, viewsets.ModelViewSet):
 
         usuario.set_password(nuevo_password)
         usuario.save()
+        invalidar_usuario(usuario.correo)
         
         return Response({'message': 'Contraseña actualizada correctamente'}, status=status.HTTP_200_OK)
 
@@ -314,7 +301,7 @@ class UsuarioViewSet(MultiTenantMixin, viewsets.ModelViewSet):
             )
         
         try:
-            usuario_perfil = Usuario.objects.get(correo=correo)
+            usuario_perfil = Usuario.objects.select_related(*PERFIL_SELECT_RELATED).get(correo=correo)
         except Usuario.DoesNotExist:
             return Response(
                 {"error": "Perfil de usuario no encontrado"},
@@ -368,7 +355,9 @@ class UsuarioViewSet(MultiTenantMixin, viewsets.ModelViewSet):
     @permission_classes([IsAuthenticated])
     def logout(self, request):
         try:
-            Token.objects.filter(user=request.user).delete()
+            tokens = Token.objects.filter(user=request.user)
+            invalidar_tokens(tokens.values_list('key', flat=True))
+            tokens.delete()
 
             actor = get_actor_usuario_from_request(request)
             log_action(
@@ -448,6 +437,7 @@ class UsuarioViewSet(MultiTenantMixin, viewsets.ModelViewSet):
             user=User.objects.get(email=correo)
             user.set_password(nueva_password)
             user.save()
+            invalidar_usuario(correo)
 
             return Response(
                 {"message": "Contraseña actualizada correctamente"},
@@ -470,24 +460,8 @@ class BitacoraListAPIView(MultiTenantMixin, generics.ListAPIView):
         qs = Bitacora.objects.select_related("usuario", "grupo").all()
         qs = self.filter_by_grupo(qs)
 
-        # Filtros adicionales
-        start = self.request.query_params.get('start')
-        end = self.request.query_params.get('end')
-        usuario = self.request.query_params.get('usuario')
-
-        if start:
-            sd = parse_date(start)
-            if sd:
-                qs = qs.filter(timestamp__date__gte=sd)
-        if end:
-            ed = parse_date(end)
-            if ed:
-                qs = qs.filter(timestamp__date__lte=ed)
-        if usuario:
-            if usuario.isdigit():
-                qs = qs.filter(usuario__id=int(usuario))
-            else:
-                qs = qs.filter(usuario__nombre__icontains=usuario)
+        # Filtros adicionales (rangos e índices, ver filtros.py)
+        qs = filtrar_bitacora(qs, self.request.query_params, self.get_user_grupo())
 
         # Orden determinista (cursor pagination requiere ordering)
         qs = qs.order_by("-timestamp", "-id")
@@ -502,7 +476,10 @@ class BitacoraViewSet(MultiTenantMixin, viewsets.ModelViewSet):
         qs = Bitacora.objects.select_related("usuario", "grupo").all()
         # Asegurar un ordering determinista: timestamp DESC, id DESC (evita ambigüedad)
         qs = qs.order_by("-timestamp", "-id")
-        return self.filter_by_grupo(qs)
+        qs = self.filter_by_grupo(qs)
+        if self.action == 'list':
+            qs = filtrar_bitacora(qs, self.request.query_params, self.get_user_grupo())
+        return qs
 
     def get_serializer_class(self):
         # Usar serializer liviano en list para reducir payload;
@@ -511,6 +488,16 @@ class BitacoraViewSet(MultiTenantMixin, viewsets.ModelViewSet):
             return BitacoraListSerializer
         return BitacoraSerializer
 
+    @action(detail=False, methods=['get'], url_path='estado-buffer')
+    def estado_buffer(self, request):
+        """Contadores del escritor por lotes de la bitácora (solo super admin)"""
+        if not self.is_super_admin():
+            return Response(
+                {'error': 'No tienes permisos para esta acción'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        return Response(audit.estadisticas())
+
 #nueva view necesaria para los pagos de las suscripciones gaaaa
 
 
@@ -0,0 +1,179 @@
+# apps/doctores/disponibilidad.py
+"""
+Motor de disponibilidad de turnos.
+
+Cada ``Bloque_Horario`` activo se convierte en una plantilla: hora de inicio
+en minutos, duración del turno y cantidad de turnos (el último puede ser
+parcial, igual que el cálculo original con ``while hora < fin``). La
+ocupación de un bloque en una fecha es un entero usado como máscara de bits
+(bit i = turno i tomado) más el total de citas del bloque ese día.
+
+Para un rango de fechas y uno o varios médicos se hacen como máximo dos
+consultas (bloques y citas no canceladas) y todo lo demás son operaciones
+con enteros en memoria. Las plantillas y la ocupación se leen primero de la
+caché de ``apps.citas_pagos.ocupacion``; solo lo que falta va a la base.
+"""
+from datetime import time, timedelta
+
+from django.db.models import Q
+
+from .models import Bloque_Horario
+
+
+# Índice = date.weekday()
+DIAS_SEMANA = ('LUNES', 'MARTES', 'MIERCOLES', 'JUEVES', 'VIERNES', 'SABADO', 'DOMINGO')
+
+# Tope de días por consulta, para que un rango enorme no genere respuestas gigantes
+MAX_DIAS_RANGO = 62
+
+CAMPOS_PLANTILLA = ('id', 'medico_id', 'dia_semana', 'hora_inicio', 'hora_fin',
+                    'duracion_cita_minutos', 'max_citas_por_bloque', 'fecha_modificacion')
+
+
+class PlantillaBloque:
+    """Forma fija de un bloque horario: cuándo empieza y cuántos turnos tiene."""
+
+    __slots__ = ('bloque_id', 'medico_id', 'dia', 'inicio', 'duracion', 'turnos', 'max_citas',
+                 'completa', 'version')
+
+    def __init__(self, bloque_id, medico_id, dia_semana, hora_inicio, hora_fin, duracion, max_citas,
+                 fecha_modificacion=None):
+        self.bloque_id = bloque_id
+        self.medico_id = medico_id
+        self.dia = DIAS_SEMANA.index(dia_semana) if dia_semana in DIAS_SEMANA else None
+        self.inicio = hora_inicio.hour * 60 + hora_inicio.minute
+        self.duracion = duracion or 1
+        fin = hora_fin.hour * 60 + hora_fin.minute
+        inicio_seg = self.inicio * 60 + hora_inicio.second
+        fin_seg = fin * 60 + hora_fin.second
+        total = fin_seg - inicio_seg
+        self.turnos = max(0, -(-total // (self.duracion * 60)))
+        self.max_citas = max_citas
+        self.completa = (1 << self.turnos) - 1
+        # Cambia cada vez que se edita el bloque: las cachés de ocupación la usan en la clave
+        self.version = int(fecha_modificacion.timestamp() * 1000) if fecha_modificacion else 0
+
+    @classmethod
+    def desde_bloque(cls, bloque):
+        return cls(*(getattr(bloque, campo) for campo in CAMPOS_PLANTILLA))
+
+    def indice(self, hora):
+        """Turno que empieza exactamente a ``hora`` o None si no coincide con ninguno."""
+        desplazamiento = (hora.hour * 60 + hora.minute - self.inicio) * 60 + hora.second
+        paso = self.duracion * 60
+        if desplazamiento < 0 or desplazamiento % paso:
+            return None
+        i = desplazamiento // paso
+        return i if i < self.turnos else None
+
+    def hora(self, i):
+        minutos = self.inicio + i * self.duracion
+        return time(minutos // 60 % 24, minutos % 60)
+
+    def libres(self, mascara, total_citas):
+        """Horas libres dada la ocupación del bloque en un día."""
+        if total_citas >= self.max_citas:
+            return []
+        libres = self.completa & ~mascara
+        horas = []
+        i = 0
+        while libres:
+            if libres & 1:
+                horas.append(self.hora(i))
+            libres >>= 1
+            i += 1
+        return horas
+
+
+def cargar_plantillas(medico_ids):
+    """Plantillas de los bloques activos de los médicos dados (1 consulta)."""
+    filas = (
+        Bloque_Horario.objects
+        .filter(medico_id__in=medico_ids, estado=True)
+        .order_by('medico_id', 'hora_inicio', 'id')
+        .values_list(*CAMPOS_PLANTILLA)
+    )
+    return [PlantillaBloque(*fila) for fila in filas]
+
+
+def cargar_ocupacion(plantillas, desde, hasta):
+    """
+    Devuelve ``{(bloque_id, fecha): [mascara, total_citas]}`` para las citas
+    no canceladas del rango (1 consulta).
+    """
+    from apps.citas_pagos.models import Cita_Medica
+
+    por_id = {p.bloque_id: p for p in plantillas}
+    ocupacion = {}
+    if not por_id:
+        return ocupacion
+    citas = (
+        Cita_Medica.objects
+        .filter(bloque_horario_id__in=por_id, fecha__gte=desde, fecha__lte=hasta)
+        .exclude(estado_cita='CANCELADA')
+        .values_list('bloque_horario_id', 'fecha', 'hora_inicio')
+    )
+    for bloque_id, fecha, hora in citas:
+        entrada = ocupacion.setdefault((bloque_id, fecha), [0, 0])
+        entrada[1] += 1
+        i = por_id[bloque_id].indice(hora)
+        if i is not None:
+            entrada[0] |= 1 << i
+    return ocupacion
+
+
+def calcular_disponibilidad(medico_ids, desde, hasta, usar_cache=True):
+    """
+    Turnos libres de los médicos entre ``desde`` y ``hasta`` (inclusive).
+
+    Devuelve ``{medico_id: [(fecha, plantilla, [horas libres]), ...]}``
+    ordenado por fecha y hora.
+    """
+    medico_ids = list(medico_ids)
+    if usar_cache:
+        from apps.citas_pagos import ocupacion as cache_ocupacion
+        plantillas = cache_ocupacion.plantillas_de_medicos(medico_ids)
+        ocupacion = cache_ocupacion.ocupacion_rango(plantillas, desde, hasta)
+    else:
+        plantillas = cargar_plantillas(medico_ids)
+        ocupacion = cargar_ocupacion(plantillas, desde, hasta)
+
+    por_dia = [[] for _ in DIAS_SEMANA]
+    for plantilla in plantillas:
+        if plantilla.dia is not None and plantilla.turnos:
+            por_dia[plantilla.dia].append(plantilla)
+
+    resultado = {medico_id: [] for medico_id in medico_ids}
+    fecha = desde
+    while fecha <= hasta:
+        for plantilla in por_dia[fecha.weekday()]:
+            mascara, total = ocupacion.get((plantilla.bloque_id, fecha), (0, 0))
+            horas = plantilla.libres(mascara, total)
+            if horas:
+                resultado[plantilla.medico_id].append((fecha, plantilla, horas))
+        fecha += timedelta(days=1)
+    return resultado
+
+
+def medicos_de_especialidad(queryset, especialidad_id=None, medico_ids=None):
+    """Filtra un queryset de médicos por especialidad y/o lista de ids."""
+    filtro = Q()
+    if especialidad_id:
+        filtro &= Q(especialidades__id=especialidad_id)
+    if medico_ids:
+        filtro &= Q(pk__in=medico_ids)
+    return queryset.filter(filtro).distinct()
+
+
+def serializar_dias(entradas):
+    """Agrupa las entradas de un médico por fecha en una estructura JSON compacta."""
+    dias = []
+    for fecha, plantilla, horas in entradas:
+        if not dias or dias[-1]['fecha'] != fecha.isoformat():
+            dias.append({'fecha': fecha.isoformat(), 'bloques': []})
+        dias[-1]['bloques'].append({
+            'bloque_horario_id': plantilla.bloque_id,
+            'duracion_cita_minutos': plantilla.duracion,
+            'horas': [h.strftime('%H:%M') for h in horas],
+        })
+    return dias
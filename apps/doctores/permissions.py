@@ -2,6 +2,7 @@ from rest_framework import permissions
 from datetime import date
 from .models import Medico 
 from apps.citas_pagos.models import Cita_Medica 
+from apps.cuentas.tenant import get_tenant_context
 
 # Mapeo de días de la semana para comparar con el weekday() de Python (Lunes=0, Domingo=6)
 DIAS_SEMANA_ORDEN = ['LUNES', 'MARTES', 'MIÉRCOLES', 'JUEVES', 'VIERNES', 'SÁBADO', 'DOMINGO']
@@ -22,15 +23,14 @@ class CanEditOrDeleteBloqueHorario(permissions.BasePermission):
         if request.method in permissions.SAFE_METHODS:
             return True
 
-        try:
-            # 1. Verificar que el usuario sea el médico dueño del bloque
-            medico_solicitante = Medico.objects.get(correo=request.user.email)
-            if obj.medico != medico_solicitante:
-                self.message = 'Solo puedes modificar tus propios bloques horarios.'
-                return False
-        except Medico.DoesNotExist:
+        # 1. Verificar que el usuario sea el médico dueño del bloque
+        medico_solicitante = get_tenant_context(request).medico
+        if medico_solicitante is None:
             self.message = 'Usuario no encontrado o no es un médico.'
             return False
+        if obj.medico_id != medico_solicitante.pk:
+            self.message = 'Solo puedes modificar tus propios bloques horarios.'
+            return False
 
         # 2. Lógica de días
         hoy_int = date.today().weekday()  # Lunes=0, Martes=1, ...
@@ -7,6 +7,7 @@ from .models import *
 from django.db.models import Q
 from apps.cuentas.models import Usuario, Rol
 from apps.citas_pagos.models import Cita_Medica
+from apps.cuentas.tenant import get_tenant_context
 #from apps.citas_pagos.serializers import HorarioDisponibleSerializer
 #from apps.doctores.serializers import MedicoSerializer as BaseMedicoSerializer
 
@@ -101,9 +102,8 @@ class BloqueHorarioSerializer(serializers.ModelSerializer):
         # Si el médico no viene en el formulario (porque el usuario logueado es médico),
         # lo obtenemos del contexto de la petición.
         if not medico_para_validar:
-            try:
-                medico_para_validar = Medico.objects.get(correo=self.context['request'].user.email)
-            except Medico.DoesNotExist:
+            medico_para_validar = get_tenant_context(self.context.get('request')).medico
+            if not medico_para_validar:
                 # Esto sucede si un admin intenta crear un bloque SIN seleccionar un médico
                 raise serializers.ValidationError({"medico": "Debe seleccionar un médico."})
         
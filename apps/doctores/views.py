@@ -5,6 +5,7 @@ from rest_framework.response import Response
 from rest_framework import generics
 from rest_framework import permissions
 from apps.cuentas.utils import get_actor_usuario_from_request, log_action
+from apps.cuentas.tenant import get_tenant_context
 from django.db.models import Q
 from apps.citas_pagos.models import Cita_Medica
 #lo coloco coemntado para colocar la importacion directo en la funcion
@@ -12,6 +13,7 @@ from apps.citas_pagos.models import Cita_Medica
 from .models import *
 from .serializers import *
 from .permissions import CanEditOrDeleteBloqueHorario
+from .disponibilidad import MAX_DIAS_RANGO, calcular_disponibilidad, medicos_de_especialidad, serializar_dias
 from django.contrib.auth.models import User
 from datetime import datetime, timedelta
 from rest_framework.exceptions import ValidationError
@@ -21,25 +23,17 @@ class MultiTenantMixin:
     
     permission_classes = [permissions.IsAuthenticated]  # Requiere autenticación
     
+    def get_tenant(self):
+        """Contexto del usuario actual (perfil, rol, grupo, plan), resuelto una vez por request"""
+        return get_tenant_context(self.request)
+    
     def get_user_grupo(self):
         """Obtiene el grupo del usuario actual"""
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                usuario = Usuario.objects.get(correo=self.request.user.email)
-                return usuario.grupo
-            except Usuario.DoesNotExist:
-                pass
-        return None
+        return self.get_tenant().grupo
     
     def is_super_admin(self):
         """Verifica si el usuario actual es super admin"""
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                usuario = Usuario.objects.get(correo=self.request.user.email)
-                return usuario.rol and usuario.rol.nombre == 'superAdmin'
-            except Usuario.DoesNotExist:
-                pass
-        return False
+        return self.get_tenant().es_super_admin
     
     def filter_by_grupo(self, queryset):
         """Filtra el queryset por el grupo del usuario actual"""
@@ -98,7 +92,9 @@ class MedicoViewSet(MultiTenantMixin, viewsets.ModelViewSet):
     def perform_create(self, serializer):
         # Asignar automáticamente el grupo del usuario que crea
         try:
-            usuario = Usuario.objects.get(correo=self.request.user.email)
+            usuario = self.get_tenant().usuario
+            if usuario is None:
+                raise Usuario.DoesNotExist
        
             
             # ASIGNAR ROL MÉDICO AUTOMÁTICAMENTE
@@ -223,62 +219,112 @@ class MedicoViewSet(MultiTenantMixin, viewsets.ModelViewSet):
         serializer = self.get_serializer(medico)
         return Response(serializer.data, status=status.HTTP_200_OK)
     
+    def _rango_fechas(self, request):
+        """
+        Lee ?fecha=YYYY-MM-DD (un día) o ?desde=...&hasta=... (rango inclusivo).
+        Devuelve (desde, hasta, error_response).
+        """
+        fecha_str = request.query_params.get('fecha')
+        desde_str = request.query_params.get('desde') or fecha_str
+        hasta_str = request.query_params.get('hasta') or desde_str
+
+        if not desde_str:
+            return None, None, Response(
+                {'error': 'Se requiere "fecha" o "desde"/"hasta" (YYYY-MM-DD).'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        try:
+            desde = datetime.strptime(desde_str, '%Y-%m-%d').date()
+            hasta = datetime.strptime(hasta_str, '%Y-%m-%d').date()
+        except ValueError:
+            return None, None, Response({'error': 'Formato de fecha inválido. Use AAAA-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if hasta < desde:
+            return None, None, Response({'error': '"hasta" no puede ser anterior a "desde".'}, status=status.HTTP_400_BAD_REQUEST)
+        if (hasta - desde).days >= MAX_DIAS_RANGO:
+            return None, None, Response(
+                {'error': f'El rango no puede superar {MAX_DIAS_RANGO} días.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        return desde, hasta, None
+
     @action(detail=True, methods=['get'], url_path='horarios-disponibles')
     def horarios_disponibles(self, request, pk=None):
         """
-        Calcula y devuelve los slots de tiempo disponibles para un médico en una fecha específica.
+        Calcula y devuelve los slots de tiempo disponibles para un médico.
         Uso: GET /api/doctores/medicos/{pk}/horarios-disponibles/?fecha=YYYY-MM-DD
+             GET /api/doctores/medicos/{pk}/horarios-disponibles/?desde=YYYY-MM-DD&hasta=YYYY-MM-DD
+        Con "fecha" devuelve la lista plana de siempre; con un rango, los días agrupados.
         """
         # 👇 IMPORTACIÓN LOCAL (rompe el ciclo)
         from apps.citas_pagos.serializers import HorarioDisponibleSerializer
-        
-        
+
         medico = self.get_object()
-        fecha_str = request.query_params.get('fecha')
-        
-        if not fecha_str:
-            return Response({'error': 'El parámetro "fecha" es requerido (YYYY-MM-DD).'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        try:
-            fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-        except ValueError:
-            return Response({'error': 'Formato de fecha inválido. Use AAAA-MM-DD.'}, status=status.HTTP_400_BAD_REQUEST)
+        desde, hasta, error = self._rango_fechas(request)
+        if error:
+            return error
 
-        DIAS_SEMANA_MAP = {0: 'LUNES', 1: 'MARTES', 2: 'MIERCOLES', 3: 'JUEVES', 4: 'VIERNES', 5: 'SABADO', 6: 'DOMINGO'}
-        dia_semana = DIAS_SEMANA_MAP.get(fecha.weekday())
-        
-        bloques_del_dia = Bloque_Horario.objects.filter(medico=medico, dia_semana=dia_semana, estado=True)
-        citas_ocupadas = Cita_Medica.objects.filter(bloque_horario__medico=medico, fecha=fecha).exclude(estado_cita='CANCELADA')
-
-        horas_ocupadas_por_bloque = {}
-        citas_por_bloque = {}
-        for cita in citas_ocupadas:
-            bloque_id = cita.bloque_horario_id
-            if bloque_id not in horas_ocupadas_por_bloque:
-                horas_ocupadas_por_bloque[bloque_id] = set()
-                citas_por_bloque[bloque_id] = 0
-            horas_ocupadas_por_bloque[bloque_id].add(cita.hora_inicio)
-            citas_por_bloque[bloque_id] += 1
-            
-        horarios_disponibles = []
-        for bloque in bloques_del_dia:
-            if citas_por_bloque.get(bloque.id, 0) >= bloque.max_citas_por_bloque:
-                continue
-            
-            hora_actual_dt = datetime.combine(fecha, bloque.hora_inicio)
-            hora_fin_dt = datetime.combine(fecha, bloque.hora_fin)
-            intervalo = timedelta(minutes=bloque.duracion_cita_minutos)
-            
-            horas_ocupadas_set = horas_ocupadas_por_bloque.get(bloque.id, set())
+        entradas = calcular_disponibilidad([medico.pk], desde, hasta)[medico.pk]
 
-            while hora_actual_dt < hora_fin_dt:
-                hora_slot = hora_actual_dt.time()
-                if hora_slot not in horas_ocupadas_set:
-                    horarios_disponibles.append({'bloque_horario_id': bloque.id, 'hora_inicio': hora_slot})
-                hora_actual_dt += intervalo
-        
-        serializer = HorarioDisponibleSerializer(horarios_disponibles, many=True)
-        return Response(serializer.data)
+        if 'desde' not in request.query_params:
+            horarios_disponibles = [
+                {'bloque_horario_id': plantilla.bloque_id, 'hora_inicio': hora}
+                for _fecha, plantilla, horas in entradas
+                for hora in horas
+            ]
+            serializer = HorarioDisponibleSerializer(horarios_disponibles, many=True)
+            return Response(serializer.data)
+
+        return Response({
+            'medico_id': medico.pk,
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'dias': serializar_dias(entradas),
+        })
+
+    @action(detail=False, methods=['get'], url_path='disponibilidad')
+    def disponibilidad(self, request):
+        """
+        Disponibilidad de varios médicos del grupo en un rango de fechas.
+        Uso: GET /api/doctores/medicos/disponibilidad/?desde=YYYY-MM-DD&hasta=YYYY-MM-DD
+             [&especialidad=<id>] [&medicos=1,2,3]
+        """
+        desde, hasta, error = self._rango_fechas(request)
+        if error:
+            return error
+
+        especialidad_id = request.query_params.get('especialidad', '').strip()
+        if especialidad_id and not especialidad_id.isdigit():
+            return Response({'error': '"especialidad" debe ser un id numérico.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        medicos_param = request.query_params.get('medicos', '').strip()
+        medico_ids = [int(m) for m in medicos_param.split(',') if m.strip().isdigit()]
+        if medicos_param and not medico_ids:
+            return Response(
+                {'error': '"medicos" debe ser una lista de ids numéricos separados por comas.'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+
+        medicos = medicos_de_especialidad(
+            self.filter_by_grupo(Medico.objects.filter(estado=True)),
+            especialidad_id=int(especialidad_id) if especialidad_id else None,
+            medico_ids=medico_ids,
+        ).values_list('pk', 'nombre')
+        nombres = dict(medicos)
+
+        por_medico = calcular_disponibilidad(nombres.keys(), desde, hasta)
+        return Response({
+            'desde': desde.isoformat(),
+            'hasta': hasta.isoformat(),
+            'medicos': [
+                {
+                    'medico_id': medico_id,
+                    'nombre': nombres[medico_id],
+                    'dias': serializar_dias(entradas),
+                }
+                for medico_id, entradas in por_medico.items()
+            ],
+        })
 
 
 class TipoAtencionViewSet(MultiTenantMixin, viewsets.ModelViewSet):
@@ -307,13 +353,12 @@ class BloqueHorarioViewSet(MultiTenantMixin, viewsets.ModelViewSet):
         # Primero, intenta obtener el perfil de médico del usuario.
         # Asumo que tienes un método 'get_user_medico' en tu MultiTenantMixin.
         # Si no, podemos añadirlo.
-        try:
-            medico_logueado = Medico.objects.get(correo=self.request.user.email)
+        medico_logueado = self.get_tenant().medico
+        if medico_logueado:
             return queryset.filter(medico=medico_logueado)
-        except Medico.DoesNotExist:
-            # Si no es un médico, se asume que es un rol administrativo
-            # y se aplica el filtro por grupo del mixin.
-            return self.filter_by_grupo(queryset)
+        # Si no es un médico, se asume que es un rol administrativo
+        # y se aplica el filtro por grupo del mixin.
+        return self.filter_by_grupo(queryset)
 
     def get_permissions(self):
         """
@@ -333,9 +378,8 @@ class BloqueHorarioViewSet(MultiTenantMixin, viewsets.ModelViewSet):
         
         # Si el médico no vino en el formulario (porque el usuario logueado es médico)
         if not medico_para_bloque:
-            try:
-                medico_para_bloque = Medico.objects.get(correo=self.request.user.email)
-            except Medico.DoesNotExist:
+            medico_para_bloque = self.get_tenant().medico
+            if not medico_para_bloque:
                 # Esto ocurre si un admin/recepcionista no selecciona un médico en el formulario
                 raise ValidationError({'medico': 'Debe seleccionar un médico para crear el bloque horario.'})
         
@@ -379,15 +423,11 @@ class BloqueHorarioViewSet(MultiTenantMixin, viewsets.ModelViewSet):
             return Response({'error': 'Médico no encontrado'}, status=status.HTTP_404_NOT_FOUND)
         
         # Verificar que el paciente pueda ver médicos de su clínica
-        usuario_actual = None
-        try:
-            usuario_actual = Usuario.objects.get(correo=self.request.user.email)
-        except Usuario.DoesNotExist:
-            pass
+        usuario_actual = self.get_tenant().usuario
         
         # Si el usuario es paciente, verificar que el médico sea de su misma clínica
         if usuario_actual and usuario_actual.rol and usuario_actual.rol.nombre == 'paciente':
-            if medico.grupo != usuario_actual.grupo:
+            if medico.grupo_id != usuario_actual.grupo_id:
                 return Response({'error': 'No tiene permisos para ver este médico'}, status=status.HTTP_403_FORBIDDEN)
         
         # Filtrar bloques activos del médico
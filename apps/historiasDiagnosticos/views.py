@@ -7,6 +7,7 @@ from .models import *
 from .serializers import *
 from apps.cuentas.models import Usuario,Rol
 from apps.cuentas.utils import get_actor_usuario_from_request, log_action
+from apps.cuentas.tenant import get_tenant_context
 from django.contrib.auth.models import User
 from apps.citas_pagos.serializers import CitaMedicaDetalleSerializer
 from apps.citas_pagos.models import Cita_Medica
@@ -21,25 +22,17 @@ class MultiTenantMixin:
     
     permission_classes = [permissions.IsAuthenticated]  # Requiere autenticación
     
+    def get_tenant(self):
+        """Contexto del usuario actual (perfil, rol, grupo, plan), resuelto una vez por request"""
+        return get_tenant_context(self.request)
+    
     def get_user_grupo(self):
         """Obtiene el grupo del usuario actual"""
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                usuario = Usuario.objects.get(correo=self.request.user.email)
-                return usuario.grupo
-            except Usuario.DoesNotExist:
-                pass
-        return None
+        return self.get_tenant().grupo
     
     def is_super_admin(self):
         """Verifica si el usuario actual es super admin"""
-        if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-            try:
-                usuario = Usuario.objects.get(correo=self.request.user.email)
-                return usuario.rol and usuario.rol.nombre == 'superAdmin'
-            except Usuario.DoesNotExist:
-                pass
-        return False
+        return self.get_tenant().es_super_admin
     
     def filter_by_grupo(self, queryset):
         """Filtra el queryset por el grupo del usuario actual"""
@@ -69,8 +62,7 @@ class PatologiasOViewSet(MultiTenantMixin, viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         # Asignar automáticamente el grupo del usuario que crea
-        usuario = Usuario.objects.get(correo=self.request.user.email)
-        patologia = serializer.save(grupo=usuario.grupo)
+        patologia = serializer.save(grupo=self.get_user_grupo())
         
         # Log de la acción
         actor = get_actor_usuario_from_request(self.request)
@@ -147,8 +139,7 @@ class TratamientoMedicacionViewSet(MultiTenantMixin, viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         # Asignar automáticamente el grupo del usuario que crea
-        usuario = Usuario.objects.get(correo=self.request.user.email)
-        tratamiento = serializer.save(grupo=usuario.grupo)
+        tratamiento = serializer.save(grupo=self.get_user_grupo())
         
         # Log de la acción
         actor = get_actor_usuario_from_request(self.request)
@@ -313,8 +304,7 @@ class ResultadoExamenesViewSet(MultiTenantMixin, viewsets.ModelViewSet):
                 print('DEBUG perform_create: archivo_url generado:', archivo_url)
             else:
                 print('DEBUG perform_create: No se recibió archivo')
-            usuario = Usuario.objects.get(correo=self.request.user.email)
-            resultado = serializer.save(grupo=usuario.grupo, archivo_url=archivo_url)
+            resultado = serializer.save(grupo=self.get_user_grupo(), archivo_url=archivo_url)
             print('DEBUG perform_create: resultado.archivo_url guardado:', resultado.archivo_url)
 
             # Log de la acción
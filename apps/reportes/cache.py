@@ -0,0 +1,150 @@
+# apps/reportes/cache.py
+"""
+Caché de reportes direccionada por contenido.
+
+La clave es un hash de ``(alcance, reporte, parámetros, versión de datos)``,
+donde la versión es el contador de escrituras de la clínica (o la suma de
+todas para superAdmin, ver ``apps.cuentas.versiones``). Mientras los datos
+no cambien, el mismo pedido devuelve los mismos bytes (JSON ya renderizado o
+el archivo PDF/Excel) sin tocar las tablas; al cambiar la versión las
+entradas viejas dejan de pedirse y el LRU las desaloja solo. Los PDF que
+nombran en el encabezado a quien los generó llevan además al usuario entre
+los parámetros.
+
+Es un LRU del proceso con presupuesto en bytes (``MAX_BYTES``); los reportes
+de más de ``MAX_BYTES_ENTRADA`` no se guardan y se sirven como antes. Los
+contadores de ``estadisticas()`` se exponen en ``/api/reportes/cache/``.
+"""
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+from django.conf import settings
+
+from apps.cuentas import versiones
+
+
+_CONFIG_POR_DEFECTO = {
+    'ACTIVA': True,
+    'MAX_BYTES': 64 * 1024 * 1024,         # presupuesto total del LRU
+    'MAX_BYTES_ENTRADA': 8 * 1024 * 1024,  # reportes más grandes no se cachean
+}
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'REPORTES_CACHE', {}) or {})
+    return config
+
+
+# contenido: bytes listos para la respuesta; nombre: archivo adjunto o None (JSON)
+Entrada = namedtuple('Entrada', 'contenido content_type nombre')
+
+
+class CacheReportes:
+    """LRU en memoria acotado por el tamaño total de sus entradas, seguro entre hilos."""
+
+    def __init__(self, max_bytes, max_bytes_entrada):
+        self.max_bytes = max_bytes
+        self.max_bytes_entrada = max_bytes_entrada
+        self._datos = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._contadores = dict.fromkeys(('aciertos', 'fallos', 'guardadas', 'desalojadas', 'rechazadas'), 0)
+
+    def get(self, clave):
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self._contadores['fallos'] += 1
+                return None
+            self._datos.move_to_end(clave)
+            self._contadores['aciertos'] += 1
+            return entrada
+
+    def set(self, clave, entrada):
+        """Guarda la entrada si entra en el presupuesto. Devuelve si se guardó."""
+        tamano = len(entrada.contenido)
+        with self._lock:
+            if tamano > self.max_bytes_entrada or tamano > self.max_bytes:
+                self._contadores['rechazadas'] += 1
+                return False
+            anterior = self._datos.pop(clave, None)
+            if anterior is not None:
+                self._bytes -= len(anterior.contenido)
+            self._datos[clave] = entrada
+            self._bytes += tamano
+            self._contadores['guardadas'] += 1
+            while self._bytes > self.max_bytes:
+                _, desalojada = self._datos.popitem(last=False)
+                self._bytes -= len(desalojada.contenido)
+                self._contadores['desalojadas'] += 1
+            return True
+
+    def cabe(self, tamano):
+        """Si una entrada de ``tamano`` bytes se puede guardar; si no, la cuenta como rechazada."""
+        if tamano <= min(self.max_bytes_entrada, self.max_bytes):
+            return True
+        with self._lock:
+            self._contadores['rechazadas'] += 1
+        return False
+
+    def clear(self):
+        with self._lock:
+            self._datos.clear()
+            self._bytes = 0
+
+    def estadisticas(self):
+        with self._lock:
+            consultas = self._contadores['aciertos'] + self._contadores['fallos']
+            return {
+                **self._contadores,
+                'tasa_aciertos': round(self._contadores['aciertos'] / consultas, 4) if consultas else None,
+                'entradas': len(self._datos),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'max_bytes_entrada': self.max_bytes_entrada,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache():
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                config = _config()
+                _cache = CacheReportes(config['MAX_BYTES'], config['MAX_BYTES_ENTRADA'])
+    return _cache
+
+
+def clave(alcance, reporte, **parametros):
+    """Clave del reporte para la versión actual de los datos de su alcance (una consulta)."""
+    grupo_id = alcance.grupo.id if alcance.grupo else None
+    version = versiones.version(grupo_id, alcance.es_global)
+    ambito = 'global' if alcance.es_global else versiones.ambito_de(grupo_id)
+    params = '&'.join(f'{k}={parametros[k]}' for k in sorted(parametros))
+    return hashlib.sha256(f'{ambito}|{reporte}|{params}|{version}'.encode()).hexdigest()
+
+
+def obtener(clave_reporte):
+    if not _config()['ACTIVA']:
+        return None
+    return get_cache().get(clave_reporte)
+
+
+def guardar(clave_reporte, entrada):
+    if not _config()['ACTIVA']:
+        return False
+    return get_cache().set(clave_reporte, entrada)
+
+
+def cabe(tamano):
+    return _config()['ACTIVA'] and get_cache().cabe(tamano)
+
+
+def estadisticas():
+    return {'activa': _config()['ACTIVA'], **get_cache().estadisticas()}
@@ -0,0 +1,330 @@
+# apps/reportes/generadores.py
+"""
+Generadores de los reportes descargables (PDF y Excel).
+
+Cada generador recibe el alcance (clínica o todas), el rango de fechas ya
+resuelto y un archivo binario de destino; no depende del request. Los usan
+tanto los endpoints síncronos de views.py como los trabajos en segundo plano
+de trabajos.py.
+"""
+from datetime import datetime, timedelta
+from itertools import chain, islice
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, PatternFill
+from openpyxl.utils import get_column_letter
+
+from apps.citas_pagos.models import Cita_Medica
+from apps.cuentas.models import Rol, Usuario
+from apps.historiasDiagnosticos.models import Paciente
+
+from . import respaldo
+from .pdf import ReportePDF
+
+
+CONTENT_TYPE_PDF = 'application/pdf'
+CONTENT_TYPE_EXCEL = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CONTENT_TYPE_ZIP = 'application/zip'
+
+
+class Alcance:
+    """Qué datos ve el reporte: los de una clínica o, para superAdmin, todos."""
+
+    def __init__(self, grupo=None, es_global=False, generado_por=''):
+        self.grupo = grupo
+        self.es_global = es_global
+        self.generado_por = generado_por
+
+    @classmethod
+    def de_usuario(cls, usuario):
+        rol = usuario.rol
+        return cls(usuario.grupo, bool(rol and rol.nombre == 'superAdmin'), usuario.nombre)
+
+    @property
+    def sufijo(self):
+        return self.grupo.id if self.grupo else "super"
+
+    def filtrar(self, queryset, campo_grupo):
+        if self.es_global:
+            return queryset
+        if self.grupo:
+            return queryset.filter(**{campo_grupo: self.grupo})
+        return queryset.none()
+
+
+def _intro(total, sustantivo, verbo, fecha_inicio, fecha_fin):
+    texto = f"Este reporte detalla <b>{total} {sustantivo}</b>"
+    if fecha_inicio and fecha_fin:
+        return texto + f" {verbo} entre las fechas <b>{fecha_inicio}</b> y <b>{fecha_fin}</b>."
+    return texto + " (histórico completo)."
+
+
+# ---------------------------------------------------------------------------
+# PDF
+# ---------------------------------------------------------------------------
+
+def pacientes_pdf(alcance, fecha_inicio, fecha_fin, destino=None):
+    pacientes_qs = Paciente.objects.order_by('usuario__nombre')
+    if fecha_inicio and fecha_fin:
+        pacientes_qs = pacientes_qs.filter(usuario__fecha_registro__date__range=[fecha_inicio, fecha_fin])
+    pacientes = alcance.filtrar(pacientes_qs, 'usuario__grupo')
+
+    if alcance.es_global:
+        titulo_reporte = "Listado General de Pacientes (Todos los Grupos)"
+    elif alcance.grupo:
+        titulo_reporte = f"Listado de Pacientes - Clínica: {alcance.grupo.nombre}"
+    else:
+        titulo_reporte = "Listado de Pacientes (Sin Grupo Asignado)"
+
+    filas = pacientes.values_list(
+        'numero_historia_clinica', 'usuario__nombre', 'usuario__correo', 'id'
+    ).iterator(chunk_size=2000)
+    reporte = ReportePDF(
+        titulo_reporte,
+        ["N° Historia Clínica", "Nombre Completo", "Correo Electrónico", "ID Paciente"],
+        [120, 150, 180, 80],
+        "#839DB8",
+        generado_por=alcance.generado_por,
+    )
+    archivo = reporte.generar(
+        filas,
+        _intro(pacientes.count(), "paciente(s)", "registrado(s)", fecha_inicio, fecha_fin),
+        "No se encontraron pacientes registrados para este grupo.",
+        destino=destino,
+    )
+    return archivo, f'listado_pacientes_{alcance.sufijo}.pdf', CONTENT_TYPE_PDF
+
+
+def medicos_pdf(alcance, fecha_inicio, fecha_fin, destino=None):
+    rol_medico = Rol.objects.get(nombre='medico')
+    medicos_qs = Usuario.objects.filter(rol=rol_medico).order_by('nombre')
+    if fecha_inicio and fecha_fin:
+        medicos_qs = medicos_qs.filter(fecha_registro__date__range=[fecha_inicio, fecha_fin])
+    medicos = alcance.filtrar(medicos_qs, 'grupo')
+
+    if alcance.es_global:
+        titulo_reporte = "Listado General de Médicos (Todos los Grupos)"
+    elif alcance.grupo:
+        titulo_reporte = f"Listado de Médicos - Clínica: {alcance.grupo.nombre}"
+    else:
+        titulo_reporte = "Listado de Médicos (Sin Grupo Asignado)"
+
+    filas = medicos.values_list('nombre', 'correo', 'telefono', 'id').iterator(chunk_size=2000)
+    reporte = ReportePDF(
+        titulo_reporte,
+        ["Nombre Completo", "Correo Electrónico", "Teléfono", "ID Médico"],
+        [180, 180, 80, 80],
+        "#318666",
+        generado_por=alcance.generado_por,
+    )
+    archivo = reporte.generar(
+        filas,
+        _intro(medicos.count(), "médico(s)", "registrado(s)", fecha_inicio, fecha_fin),
+        "No se encontraron médicos registrados para este grupo.",
+        destino=destino,
+    )
+    return archivo, f'listado_medicos_{alcance.sufijo}.pdf', CONTENT_TYPE_PDF
+
+
+def citas_pdf(alcance, fecha_inicio, fecha_fin, destino=None):
+    citas_qs = Cita_Medica.objects.order_by('-fecha', '-hora_inicio')
+    if fecha_inicio and fecha_fin:
+        citas_qs = citas_qs.filter(fecha__range=[fecha_inicio, fecha_fin])
+    citas = alcance.filtrar(citas_qs, 'grupo')
+
+    if alcance.es_global:
+        titulo_reporte = "Reporte General de Citas (Todos los Grupos)"
+    elif alcance.grupo:
+        titulo_reporte = f"Reporte de Citas - Clínica: {alcance.grupo.nombre}"
+    else:
+        titulo_reporte = "Reporte de Citas (Sin Grupo Asignado)"
+
+    estados = dict(Cita_Medica.ESTADOS_CITA)
+    filas = (
+        (fecha, str(hora_inicio)[:5], paciente_nombre, estados.get(estado, estado), cid)
+        for fecha, hora_inicio, paciente_nombre, estado, cid in citas.values_list(
+            'fecha', 'hora_inicio', 'paciente__usuario__nombre', 'estado_cita', 'id'
+        ).iterator(chunk_size=2000)
+    )
+    reporte = ReportePDF(
+        titulo_reporte,
+        ["Fecha", "Hora", "Paciente", "Estado", "ID Cita"],
+        [80, 60, 200, 100, 50],
+        "#8AD0E8",
+        generado_por=alcance.generado_por,
+    )
+    archivo = reporte.generar(
+        filas,
+        _intro(citas.count(), "cita(s)", "agendada(s)", fecha_inicio, fecha_fin),
+        "No se encontraron citas registradas para este grupo.",
+        destino=destino,
+    )
+    return archivo, f'reporte_citas_{alcance.sufijo}.pdf', CONTENT_TYPE_PDF
+
+
+# ---------------------------------------------------------------------------
+# Excel
+# ---------------------------------------------------------------------------
+
+FILAS_MUESTRA = 500  # filas que se miran para estimar el ancho de las columnas
+
+
+def _escribir_excel(destino, titulo, encabezados, filas, formatos=None, estilo_encabezado=None):
+    """
+    Escribe ``filas`` (tuplas) en un libro de openpyxl en modo write-only:
+    cada fila va directo al XML temporal de la hoja, así que la memoria no
+    crece con la cantidad de filas. El ancho de las columnas se estima con
+    las primeras ``FILAS_MUESTRA`` filas (en write-only hay que fijarlo antes
+    de escribir). ``formatos`` mapea índice de columna -> number_format.
+    """
+    formatos = formatos or {}
+    filas = iter(filas)
+    muestra = list(islice(filas, FILAS_MUESTRA))
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(titulo)
+    for col, encabezado in enumerate(encabezados):
+        largo = max([len(encabezado)] + [len(str(fila[col])) for fila in muestra if fila[col] is not None])
+        ws.column_dimensions[get_column_letter(col + 1)].width = min(largo, 60) + 2
+
+    if estilo_encabezado:
+        fila_encabezado = []
+        for encabezado in encabezados:
+            celda = WriteOnlyCell(ws, value=encabezado)
+            celda.font, celda.fill, celda.alignment = estilo_encabezado
+            fila_encabezado.append(celda)
+        ws.append(fila_encabezado)
+    else:
+        ws.append(encabezados)
+
+    if formatos:
+        # Una celda con formato por columna, reutilizada en cada fila
+        celdas = {col: WriteOnlyCell(ws) for col in formatos}
+        for col, formato in formatos.items():
+            celdas[col].number_format = formato
+
+        def _fila(valores):
+            valores = list(valores)
+            for col, celda in celdas.items():
+                celda.value = valores[col]
+                valores[col] = celda
+            return valores
+    else:
+        _fila = list
+
+    for fila in chain(muestra, filas):
+        ws.append(_fila(fila))
+    wb.save(destino)
+
+
+def citas_excel(alcance, fecha_inicio, fecha_fin, destino):
+    citas = alcance.filtrar(
+        Cita_Medica.objects.filter(fecha__range=[fecha_inicio, fecha_fin]), 'grupo'
+    ).order_by('-fecha', '-hora_inicio')
+
+    estados = dict(Cita_Medica.ESTADOS_CITA)
+    filas = (
+        (cid, fecha, hora_inicio, hora_fin, paciente_nombre or 'N/A', estados.get(estado, estado), notas)
+        for cid, fecha, hora_inicio, hora_fin, paciente_nombre, estado, notas in citas.values_list(
+            'id', 'fecha', 'hora_inicio', 'hora_fin', 'paciente__usuario__nombre', 'estado_cita', 'notas'
+        ).iterator(chunk_size=2000)
+    )
+    _escribir_excel(
+        destino,
+        "Reporte de Citas",
+        ["ID Cita", "Fecha", "Hora Inicio", "Hora Fin", "Paciente", "Estado", "Notas"],
+        filas,
+        formatos={1: 'YYYY-MM-DD', 2: 'hh:mm', 3: 'hh:mm'},
+        estilo_encabezado=(
+            Font(bold=True, color="FFFFFF"),
+            PatternFill(start_color="004A99", end_color="004A99", fill_type="solid"),
+            Alignment(horizontal="center", vertical="center"),
+        ),
+    )
+    nombre = f'reporte_citas_{alcance.sufijo}_{fecha_inicio}_a_{fecha_fin}.xlsx'
+    return destino, nombre, CONTENT_TYPE_EXCEL
+
+
+def pacientes_excel(alcance, fecha_inicio, fecha_fin, destino):
+    pacientes = alcance.filtrar(
+        Paciente.objects.filter(usuario__fecha_registro__date__range=[fecha_inicio, fecha_fin]),
+        'usuario__grupo',
+    ).order_by('-usuario__fecha_registro')
+
+    filas = (
+        (pid, historia, nombre, correo, telefono or '', fecha_registro.strftime('%Y-%m-%d %H:%M'))
+        for pid, historia, nombre, correo, telefono, fecha_registro in pacientes.values_list(
+            'id', 'numero_historia_clinica', 'usuario__nombre', 'usuario__correo',
+            'usuario__telefono', 'usuario__fecha_registro',
+        ).iterator(chunk_size=2000)
+    )
+    _escribir_excel(
+        destino,
+        "Pacientes Nuevos",
+        ["ID Paciente", "N° Historia Clínica", "Nombre Completo", "Correo", "Teléfono", "Fecha Registro"],
+        filas,
+    )
+    nombre = f'reporte_pacientes_nuevos_{fecha_inicio}_a_{fecha_fin}.xlsx'
+    return destino, nombre, CONTENT_TYPE_EXCEL
+
+
+# ---------------------------------------------------------------------------
+# Respaldo
+# ---------------------------------------------------------------------------
+
+def respaldo_zip(alcance, fecha_inicio, fecha_fin, destino):
+    """Respaldo de la base (superAdmin) o de la clínica del alcance; ignora las fechas."""
+    if not alcance.es_global and not alcance.grupo:
+        raise ValueError("El respaldo requiere una clínica asignada.")
+    respaldo.escribir_respaldo(destino, None if alcance.es_global else alcance.grupo.id)
+    nombre = f'backup_{alcance.sufijo}_{datetime.now().strftime("%Y%m%d_%H%M%S")}.zip'
+    return destino, nombre, CONTENT_TYPE_ZIP
+
+
+# ---------------------------------------------------------------------------
+# Catálogo
+# ---------------------------------------------------------------------------
+
+def _sin_rango(fecha_inicio, fecha_fin):
+    # Los PDF filtran solo si vienen ambas fechas; si no, es el histórico completo
+    if fecha_inicio and fecha_fin:
+        return fecha_inicio, fecha_fin
+    return None, None
+
+
+def _ultimos_30_dias(fecha_inicio, fecha_fin):
+    fecha_fin = fecha_fin or datetime.now().date()
+    return fecha_inicio or fecha_fin - timedelta(days=29), fecha_fin
+
+
+def _anio_en_curso(fecha_inicio, fecha_fin):
+    hoy = datetime.now().date()
+    return fecha_inicio or hoy.replace(month=1, day=1), fecha_fin or hoy
+
+
+# tipo -> (generador, resolución de fechas por defecto)
+REPORTES = {
+    'pacientes_pdf': (pacientes_pdf, _sin_rango),
+    'medicos_pdf': (medicos_pdf, _sin_rango),
+    'citas_pdf': (citas_pdf, _sin_rango),
+    'citas_excel': (citas_excel, _ultimos_30_dias),
+    'pacientes_excel': (pacientes_excel, _anio_en_curso),
+    'respaldo_zip': (respaldo_zip, _sin_rango),
+}
+
+# Solo superAdmin o el administrador de la clínica pueden pedirlos
+TIPOS_SOLO_ADMINISTRADOR = {'respaldo_zip'}
+
+# Llevan "Generado el: ... por <usuario>" en el encabezado (ver pdf.py)
+TIPOS_CON_AUTOR = {'pacientes_pdf', 'medicos_pdf', 'citas_pdf'}
+
+
+def resolver_fechas(tipo, fecha_inicio, fecha_fin):
+    """Rango efectivo del reporte, con los mismos valores por defecto que su endpoint."""
+    return REPORTES[tipo][1](fecha_inicio, fecha_fin)
+
+
+def generar(tipo, alcance, fecha_inicio, fecha_fin, destino):
+    """Escribe el reporte en ``destino``. Devuelve (destino, nombre de archivo, content type)."""
+    return REPORTES[tipo][0](alcance, fecha_inicio, fecha_fin, destino)
@@ -0,0 +1,52 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from apps.reportes import trabajos
+
+
+class Command(BaseCommand):
+    help = (
+        "Worker de la cola de reportes (REPORTES_JOBS['MODO']='proceso'). Toma los "
+        "trabajos pendientes con SELECT FOR UPDATE SKIP LOCKED, así que se pueden "
+        "correr varios a la vez."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--una-vez', action='store_true',
+                            help="Procesa lo pendiente y termina (para cron).")
+        parser.add_argument('--intervalo', type=float, default=None,
+                            help="Segundos entre consultas cuando la cola está vacía.")
+
+    def _mantenimiento(self):
+        reencolados, fallidos = trabajos.recuperar_colgados()
+        purgados = trabajos.purgar_vencidos()
+        if reencolados or fallidos or purgados:
+            self.stdout.write(
+                f"Colgados: {reencolados} reencolados, {fallidos} fallidos. Vencidos purgados: {purgados}."
+            )
+
+    def handle(self, *args, **options):
+        intervalo = options['intervalo'] or trabajos._config()['INTERVALO_SONDEO']
+        self._mantenimiento()
+        if options['una_vez']:
+            procesados = trabajos.procesar_pendientes()
+            self.stdout.write(self.style.SUCCESS(f"{procesados} trabajos procesados."))
+            return
+
+        self.stdout.write(f"Esperando trabajos de reportes (cada {intervalo}s)...")
+        ultimo_mantenimiento = time.monotonic()
+        try:
+            while True:
+                close_old_connections()
+                procesados = trabajos.procesar_pendientes()
+                if procesados:
+                    self.stdout.write(f"{procesados} trabajos procesados.")
+                if time.monotonic() - ultimo_mantenimiento > 60:
+                    self._mantenimiento()
+                    ultimo_mantenimiento = time.monotonic()
+                if not procesados:
+                    time.sleep(intervalo)
+        except KeyboardInterrupt:
+            self.stdout.write("Worker detenido.")
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.reportes import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Restaura los datos de una clínica desde sus snapshots: el último completo "
+        "y los incrementales siguientes, en una sola transacción."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--grupo', type=int, required=True, help="ID de la clínica.")
+        parser.add_argument('--hasta', default=None,
+                            help="Nombre del snapshot al que restaurar (por defecto el último).")
+        parser.add_argument('--directorio', default=None,
+                            help="Carpeta de snapshots (por defecto SNAPSHOTS['DIRECTORIO']).")
+        parser.add_argument('--verificar', action='store_true',
+                            help="Solo comprueba la cadena y los sha256, sin escribir.")
+        parser.add_argument('--no-input', action='store_true', help="No pide confirmación.")
+
+    def handle(self, *args, **options):
+        grupo_id = options['grupo']
+        try:
+            pasos = snapshots.cadena(grupo_id, options['directorio'], options['hasta'])
+        except snapshots.SnapshotInvalido as e:
+            raise CommandError(str(e))
+        for ruta, manifiesto in pasos:
+            self.stdout.write(f"  {ruta.name} ({manifiesto['tipo']}, {manifiesto['total_filas']} filas)")
+
+        if not options['verificar'] and not options['no_input']:
+            respuesta = input(
+                f"Se reemplazarán los datos de la clínica {grupo_id}. Escribe 'si' para continuar: "
+            )
+            if respuesta.strip().lower() not in ('si', 'sí'):
+                raise CommandError("Restauración cancelada.")
+
+        try:
+            resultado = snapshots.restaurar(
+                grupo_id, options['directorio'], options['hasta'], solo_verificar=options['verificar']
+            )
+        except snapshots.SnapshotInvalido as e:
+            raise CommandError(str(e))
+
+        if options['verificar']:
+            self.stdout.write(self.style.SUCCESS(f"{len(resultado['snapshots'])} snapshots verificados."))
+            return
+        borradas = sum(resultado['borradas'].values())
+        self.stdout.write(self.style.SUCCESS(
+            f"Clínica {grupo_id} restaurada: {resultado['filas']} filas aplicadas, {borradas} borradas."
+        ))
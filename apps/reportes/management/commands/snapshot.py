@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from apps.cuentas.models import Grupo
+from apps.reportes import snapshots
+
+
+class Command(BaseCommand):
+    help = (
+        "Snapshot de los datos de una clínica. El primero es completo; los "
+        "siguientes solo llevan las filas modificadas desde el anterior."
+    )
+
+    def add_arguments(self, parser):
+        destino = parser.add_mutually_exclusive_group(required=True)
+        destino.add_argument('--grupo', type=int, help="ID de la clínica.")
+        destino.add_argument('--todas', action='store_true', help="Un snapshot por cada clínica.")
+        parser.add_argument('--completo', action='store_true',
+                            help="Vuelca todas las filas aunque haya un snapshot anterior.")
+        parser.add_argument('--directorio', default=None,
+                            help="Carpeta de snapshots (por defecto SNAPSHOTS['DIRECTORIO']).")
+
+    def handle(self, *args, **options):
+        if options['todas']:
+            grupo_ids = list(Grupo.objects.order_by('id').values_list('id', flat=True))
+        else:
+            if not Grupo.objects.filter(id=options['grupo']).exists():
+                raise CommandError(f"No existe la clínica {options['grupo']}.")
+            grupo_ids = [options['grupo']]
+
+        for grupo_id in grupo_ids:
+            ruta, manifiesto = snapshots.snapshot(grupo_id, options['directorio'], options['completo'])
+            self.stdout.write(self.style.SUCCESS(
+                f"Clínica {grupo_id}: snapshot {manifiesto['tipo']} {ruta} "
+                f"({manifiesto['total_filas']} filas, {ruta.stat().st_size} bytes)"
+            ))
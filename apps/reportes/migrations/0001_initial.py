@@ -0,0 +1,46 @@
+# Generated by Django 5.2.6 on 2026-10-17 05:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('cuentas', '0006_bitacora_indices'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrabajoReporte',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('pacientes_pdf', 'Listado de pacientes (PDF)'), ('medicos_pdf', 'Listado de médicos (PDF)'), ('citas_pdf', 'Reporte de citas (PDF)'), ('citas_excel', 'Reporte de citas (Excel)'), ('pacientes_excel', 'Pacientes nuevos (Excel)')], max_length=30)),
+                ('estado', models.CharField(choices=[('PENDIENTE', 'Pendiente'), ('EN_PROCESO', 'En proceso'), ('COMPLETADO', 'Completado'), ('FALLIDO', 'Fallido')], default='PENDIENTE', max_length=20)),
+                ('clave', models.CharField(help_text='Alcance, tipo y rango; identifica pedidos iguales', max_length=120)),
+                ('alcance_global', models.BooleanField(default=False, help_text='Reporte de todas las clínicas (superAdmin)')),
+                ('fecha_inicio', models.DateField(blank=True, null=True)),
+                ('fecha_fin', models.DateField(blank=True, null=True)),
+                ('ruta_archivo', models.CharField(blank=True, max_length=255)),
+                ('nombre_archivo', models.CharField(blank=True, max_length=150)),
+                ('content_type', models.CharField(blank=True, max_length=100)),
+                ('tamano', models.PositiveBigIntegerField(blank=True, help_text='Tamaño del archivo en bytes', null=True)),
+                ('intentos', models.PositiveSmallIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('fecha_creacion', models.DateTimeField(auto_now_add=True)),
+                ('fecha_inicio_proceso', models.DateTimeField(blank=True, null=True)),
+                ('fecha_fin_proceso', models.DateTimeField(blank=True, null=True)),
+                ('grupo', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='trabajos_reporte', to='cuentas.grupo')),
+                ('solicitado_por', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='trabajos_reporte', to='cuentas.usuario')),
+            ],
+            options={
+                'verbose_name': 'Trabajo de reporte',
+                'verbose_name_plural': 'Trabajos de reporte',
+                'ordering': ['-fecha_creacion'],
+                'indexes': [models.Index(fields=['estado', 'fecha_creacion'], name='reportes_tr_estado_b191d5_idx'), models.Index(fields=['clave', 'estado'], name='reportes_tr_clave_257ab7_idx')],
+                'constraints': [models.UniqueConstraint(condition=models.Q(('estado__in', ['PENDIENTE', 'EN_PROCESO'])), fields=('clave',), name='trabajo_reporte_activo_unico')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 05:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('reportes', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='trabajoreporte',
+            name='tipo',
+            field=models.CharField(choices=[('pacientes_pdf', 'Listado de pacientes (PDF)'), ('medicos_pdf', 'Listado de médicos (PDF)'), ('citas_pdf', 'Reporte de citas (PDF)'), ('citas_excel', 'Reporte de citas (Excel)'), ('pacientes_excel', 'Pacientes nuevos (Excel)'), ('respaldo_zip', 'Respaldo de la base de datos (zip)')], max_length=30),
+        ),
+    ]
@@ -1,3 +1,64 @@
 from django.db import models
 
-# Create your models here.
+from apps.cuentas.models import Grupo, Usuario
+
+
+class TrabajoReporte(models.Model):
+    """
+    Reporte descargable generado en segundo plano (ver trabajos.py). Los
+    pedidos iguales (mismo alcance, tipo y rango de fechas) comparten
+    ``clave`` y se resuelven con un único trabajo.
+    """
+    TIPOS = [
+        ('pacientes_pdf', 'Listado de pacientes (PDF)'),
+        ('medicos_pdf', 'Listado de médicos (PDF)'),
+        ('citas_pdf', 'Reporte de citas (PDF)'),
+        ('citas_excel', 'Reporte de citas (Excel)'),
+        ('pacientes_excel', 'Pacientes nuevos (Excel)'),
+        ('respaldo_zip', 'Respaldo de la base de datos (zip)'),
+    ]
+    ESTADOS = [
+        ('PENDIENTE', 'Pendiente'),
+        ('EN_PROCESO', 'En proceso'),
+        ('COMPLETADO', 'Completado'),
+        ('FALLIDO', 'Fallido'),
+    ]
+    ESTADOS_ACTIVOS = ('PENDIENTE', 'EN_PROCESO')
+
+    tipo = models.CharField(max_length=30, choices=TIPOS)
+    estado = models.CharField(max_length=20, choices=ESTADOS, default='PENDIENTE')
+    clave = models.CharField(max_length=120, help_text="Alcance, tipo y rango; identifica pedidos iguales")
+    grupo = models.ForeignKey(Grupo, on_delete=models.CASCADE, null=True, blank=True, related_name='trabajos_reporte')
+    alcance_global = models.BooleanField(default=False, help_text="Reporte de todas las clínicas (superAdmin)")
+    fecha_inicio = models.DateField(null=True, blank=True)
+    fecha_fin = models.DateField(null=True, blank=True)
+    solicitado_por = models.ForeignKey(Usuario, on_delete=models.SET_NULL, null=True, blank=True, related_name='trabajos_reporte')
+    ruta_archivo = models.CharField(max_length=255, blank=True)
+    nombre_archivo = models.CharField(max_length=150, blank=True)
+    content_type = models.CharField(max_length=100, blank=True)
+    tamano = models.PositiveBigIntegerField(null=True, blank=True, help_text="Tamaño del archivo en bytes")
+    intentos = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    fecha_creacion = models.DateTimeField(auto_now_add=True)
+    fecha_inicio_proceso = models.DateTimeField(null=True, blank=True)
+    fecha_fin_proceso = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Trabajo de reporte"
+        verbose_name_plural = "Trabajos de reporte"
+        ordering = ['-fecha_creacion']
+        constraints = [
+            # A lo sumo un trabajo activo por pedido: dos POST simultáneos no encolan dos veces
+            models.UniqueConstraint(
+                fields=['clave'],
+                condition=models.Q(estado__in=['PENDIENTE', 'EN_PROCESO']),
+                name='trabajo_reporte_activo_unico',
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['estado', 'fecha_creacion']),
+            models.Index(fields=['clave', 'estado']),
+        ]
+
+    def __str__(self):
+        return f"Trabajo {self.id} - {self.tipo} - {self.estado}"
@@ -0,0 +1,179 @@
+# apps/reportes/pdf.py
+"""
+Reportes PDF tabulares generados por partes.
+
+Los listados de superAdmin abarcan todas las clínicas, así que no se arma
+una única ``Table`` con un ``Paragraph`` por celda:
+
+- Las filas llegan de un iterador (``values_list(...).iterator()``), sin
+  instanciar modelos ni cargar el queryset entero.
+- Se agrupan en tablas de ``FILAS_POR_TABLA`` filas (aprox. una página) con
+  celdas de texto plano partidas en líneas al ancho de su columna (sin
+  recortar nada); el formato va en un único ``TableStyle`` compartido.
+- ``build`` recibe una lista que se rellena sola: cada tabla se crea recién
+  cuando la anterior ya se dibujó, así que en memoria hay una tabla a la vez
+  más las páginas ya emitidas (comprimidas) dentro del canvas.
+- El PDF se escribe en un ``SpooledTemporaryFile`` que pasa a disco al
+  superar ``MAX_EN_MEMORIA`` y se sirve con ``FileResponse`` sin copiarlo.
+"""
+import tempfile
+from datetime import datetime
+from itertools import islice
+
+from django.http import FileResponse, HttpResponse
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+
+FILAS_POR_TABLA = 40
+MAX_EN_MEMORIA = 5 * 1024 * 1024
+
+FUENTE = 'Helvetica'
+FUENTE_NEGRITA = 'Helvetica-Bold'
+TAMANO_FUENTE = 9
+# Relleno horizontal por defecto de una celda de Table (6 pt a cada lado)
+_RELLENO_CELDA = 12
+
+
+def ajustar(texto, ancho, fuente=FUENTE, tamano=TAMANO_FUENTE):
+    """
+    Parte ``texto`` en líneas unidas con '\n' (``Table`` las dibuja una
+    debajo de otra) para que entre en una columna de ``ancho`` puntos sin
+    perder contenido. Corta entre palabras y, si una palabra sola no entra
+    (un correo, por ejemplo), entre caracteres.
+    """
+    texto = '' if texto is None else str(texto)
+    disponible = ancho - _RELLENO_CELDA
+    if stringWidth(texto, fuente, tamano) <= disponible:
+        return texto
+
+    lineas = []
+    for parrafo in texto.split('\n'):
+        linea = ''
+        for palabra in parrafo.split(' '):
+            candidata = f'{linea} {palabra}' if linea else palabra
+            if stringWidth(candidata, fuente, tamano) <= disponible:
+                linea = candidata
+                continue
+            if linea:
+                lineas.append(linea)
+            linea = ''
+            for caracter in palabra:
+                if linea and stringWidth(linea + caracter, fuente, tamano) > disponible:
+                    lineas.append(linea)
+                    linea = caracter
+                else:
+                    linea += caracter
+        lineas.append(linea)
+    return '\n'.join(lineas)
+
+
+class _FlowablesPerezosos(list):
+    """
+    Lista de flowables que se rellena desde un generador cuando ``build``
+    la vacía. ``BaseDocTemplate.build`` consume la lista con ``len``,
+    ``[0]`` y ``del [0]``, y reinserta al principio lo que parte entre páginas.
+    """
+
+    def __init__(self, generador):
+        super().__init__()
+        self._generador = generador
+
+    def __len__(self):
+        if not super().__len__():
+            siguiente = next(self._generador, None)
+            if siguiente is not None:
+                self.append(siguiente)
+        return super().__len__()
+
+
+class ReportePDF:
+    """Listado tabular con el formato de los reportes de la clínica."""
+
+    def __init__(self, titulo, columnas, anchos, color_encabezado, generado_por=''):
+        self.titulo = titulo
+        self.columnas = columnas
+        self.anchos = anchos
+        self.generado_por = generado_por
+
+        styles = getSampleStyleSheet()
+        self.title_style = ParagraphStyle('title', parent=styles['Heading1'], alignment=TA_CENTER, fontName=FUENTE_NEGRITA)
+        self.normal_left = ParagraphStyle('normal_left', parent=styles['Normal'], alignment=TA_LEFT, fontName=FUENTE)
+        self.normal_right = ParagraphStyle('normal_right', parent=styles['Normal'], alignment=TA_RIGHT, fontName=FUENTE, fontSize=9)
+
+        self.table_style = TableStyle([
+            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor(color_encabezado)),
+            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
+            ('FONTNAME', (0, 0), (-1, 0), FUENTE_NEGRITA),
+            ('FONTNAME', (0, 1), (-1, -1), FUENTE),
+            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
+            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
+            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor("#E6F7FF")),
+            ('FONTSIZE', (0, 0), (-1, -1), TAMANO_FUENTE),
+        ])
+        self.encabezado = [ajustar(c, a, FUENTE_NEGRITA) for c, a in zip(columnas, anchos)]
+
+    def _tabla(self, filas):
+        datos = [self.encabezado]
+        datos.extend([ajustar(valor, ancho) for valor, ancho in zip(fila, self.anchos)] for fila in filas)
+        tabla = Table(datos, colWidths=self.anchos, repeatRows=1)
+        tabla.setStyle(self.table_style)
+        return tabla
+
+    def _flowables(self, filas, intro, mensaje_vacio):
+        fecha_gen = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        yield Paragraph(f"Generado el: {fecha_gen} por {self.generado_por}", self.normal_right)
+        yield Spacer(1, 12)
+        yield Paragraph(self.titulo, self.title_style)
+        yield Spacer(1, 24)
+        yield Paragraph(intro, self.normal_left)
+        yield Spacer(1, 24)
+
+        filas = iter(filas)
+        hubo_filas = False
+        while True:
+            lote = list(islice(filas, FILAS_POR_TABLA))
+            if not lote:
+                break
+            hubo_filas = True
+            yield self._tabla(lote)
+        if not hubo_filas:
+            tabla = Table([self.encabezado, [mensaje_vacio] + [''] * (len(self.anchos) - 1)],
+                          colWidths=self.anchos, repeatRows=1)
+            tabla.setStyle(self.table_style)
+            tabla.setStyle(TableStyle([('SPAN', (0, 1), (-1, 1))]))
+            yield tabla
+
+    def generar(self, filas, intro, mensaje_vacio, destino=None):
+        """
+        Dibuja el reporte con las ``filas`` (tuplas en el orden de las
+        columnas) en ``destino`` (por defecto un archivo temporal) y lo
+        devuelve posicionado al inicio.
+        """
+        archivo = destino if destino is not None else tempfile.SpooledTemporaryFile(max_size=MAX_EN_MEMORIA)
+        doc = SimpleDocTemplate(archivo, pagesize=letter, topMargin=72, bottomMargin=72,
+                                title=self.titulo, pageCompression=1)
+        try:
+            doc.build(_FlowablesPerezosos(self._flowables(filas, intro, mensaje_vacio)))
+        except Exception:
+            if destino is None:
+                archivo.close()
+            raise
+        archivo.seek(0)
+        return archivo
+
+
+def respuesta_pdf(archivo, nombre):
+    """FileResponse del PDF; valida la cabecera igual que antes sin leerlo entero."""
+    inicio = archivo.read(5)
+    archivo.seek(0)
+    if inicio != b'%PDF-':
+        print("[PDF] Error: El archivo no parece ser un PDF. Primeros bytes:", inicio)
+        archivo.close()
+        return HttpResponse("Error: El contenido generado no es un PDF válido. Revisa la consola.", status=500)
+    return FileResponse(archivo, as_attachment=True, filename=nombre, content_type='application/pdf')
@@ -0,0 +1,369 @@
+# apps/reportes/respaldo.py
+"""
+Respaldo de la base de datos en un zip escrito por partes.
+
+El respaldo anterior armaba cada tabla como ``INSERT`` en un ``StringIO``,
+lo copiaba a un ``ZipFile`` en memoria y después a la respuesta: tres
+copias de la base en RAM dentro de un request. Ahora:
+
+- Cada tabla se vuelca con ``COPY ... TO STDOUT`` (formato texto de
+  PostgreSQL: una línea por fila, ``\\N`` para NULL). En SQLite se recorre el
+  queryset con ``values_list().iterator()`` y se escribe el mismo formato,
+  así que ``restaurar_respaldo`` lee ambos igual.
+- La salida de COPY va a un ``SpooledTemporaryFile`` (pasa a disco si
+  supera ``_EN_MEMORIA``) y de ahí al zip en bloques; en memoria nunca hay
+  más que un bloque.
+- El zip se escribe sobre cualquier destino de escritura secuencial: un
+  archivo (trabajos en segundo plano, con descarga reanudable) o el
+  generador de ``iterar_respaldo`` para una ``StreamingHttpResponse``.
+- Con ``grupo_id`` solo se respaldan las filas de esa clínica: las tablas
+  que llegan a ``Grupo`` siguiendo sus claves foráneas. Las demás
+  (catálogos, auth) se listan como omitidas.
+- ``manifest.json`` registra por tabla las columnas, filas, bytes y
+  sha256 del volcado, y el orden de carga (dependencias primero).
+"""
+import hashlib
+import io
+import json
+import os
+import re
+import tempfile
+import uuid
+import zipfile
+from datetime import date, datetime, time
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import connection
+
+from apps.cuentas.models import Grupo
+
+
+FORMATO = 'copy-text'
+VERSION_FORMATO = 1
+_BLOQUE = 64 * 1024
+_EN_MEMORIA = 1024 * 1024
+_PROFUNDIDAD_MAXIMA = 4
+
+
+# ---------------------------------------------------------------------------
+# Tablas
+# ---------------------------------------------------------------------------
+
+def columnas_de(modelo):
+    """Columnas propias de la tabla (en herencia multi-tabla, sin las del padre)."""
+    return [f.column for f in modelo._meta.local_concrete_fields]
+
+
+def _atributos_de(modelo):
+    return [f.attname for f in modelo._meta.local_concrete_fields]
+
+
+def modelos_respaldables():
+    """Modelos con tabla propia (incluye las tablas intermedias M2M), dependencias primero."""
+    modelos, tablas = [], set()
+    for modelo in apps.get_models(include_auto_created=True):
+        opts = modelo._meta
+        if not opts.managed or opts.proxy or opts.db_table in tablas:
+            continue
+        tablas.add(opts.db_table)
+        modelos.append(modelo)
+    return _ordenar_por_dependencias(modelos)
+
+
+def _ordenar_por_dependencias(modelos):
+    presentes = set(modelos)
+    ordenados, visitados = [], set()
+
+    def visitar(modelo, camino):
+        if modelo in visitados or modelo in camino:
+            return
+        camino.add(modelo)
+        for campo in modelo._meta.local_concrete_fields:
+            destino = campo.related_model if campo.is_relation else None
+            if destino in presentes and destino is not modelo:
+                visitar(destino, camino)
+        camino.discard(modelo)
+        visitados.add(modelo)
+        ordenados.append(modelo)
+
+    for modelo in sorted(modelos, key=lambda m: m._meta.db_table):
+        visitar(modelo, set())
+    return ordenados
+
+
+def ruta_a_grupo(modelo):
+    """
+    Lookup que lleva de ``modelo`` a la clínica (``'grupo'``,
+    ``'usuario__grupo'``, ...) o None si la tabla no pertenece a ninguna.
+    """
+    if modelo is Grupo:
+        return 'pk'
+    pendientes = [(modelo, '')]
+    vistos = {modelo}
+    for _ in range(_PROFUNDIDAD_MAXIMA):
+        siguientes = []
+        for actual, prefijo in pendientes:
+            for campo in actual._meta.concrete_fields:
+                if not (campo.many_to_one or campo.one_to_one):
+                    continue
+                ruta = f'{prefijo}{campo.name}'
+                if campo.related_model is Grupo:
+                    return ruta
+                if campo.related_model not in vistos:
+                    vistos.add(campo.related_model)
+                    siguientes.append((campo.related_model, f'{ruta}__'))
+        pendientes = siguientes
+    return None
+
+
+# ---------------------------------------------------------------------------
+# Volcado
+# ---------------------------------------------------------------------------
+
+class _Conteo(io.RawIOBase):
+    """Destino de COPY que cuenta filas, bytes y sha256 mientras escribe en ``destino``."""
+
+    def __init__(self, destino):
+        self.destino = destino
+        self.sha256 = hashlib.sha256()
+        self.filas = 0
+        self.bytes = 0
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        if isinstance(datos, str):
+            datos = datos.encode('utf-8')
+        datos = bytes(datos)
+        self.destino.write(datos)
+        self.sha256.update(datos)
+        # En el formato texto de COPY los saltos de línea dentro de un valor van escapados
+        self.filas += datos.count(b'\n')
+        self.bytes += len(datos)
+        return len(datos)
+
+
+def _escapar(valor):
+    if valor is None:
+        return '\\N'
+    if isinstance(valor, bool):
+        return 't' if valor else 'f'
+    if isinstance(valor, (datetime, date, time)):
+        texto = valor.isoformat()
+    elif isinstance(valor, (dict, list)):
+        texto = json.dumps(valor, ensure_ascii=False)
+    elif isinstance(valor, (bytes, memoryview)):
+        return '\\\\x' + bytes(valor).hex()
+    elif isinstance(valor, (int, float, Decimal, uuid.UUID)):
+        return str(valor)
+    else:
+        texto = str(valor)
+    return (
+        texto.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+_ESCAPES = {'\\': '\\', 't': '\t', 'n': '\n', 'r': '\r', 'b': '\b', 'f': '\f', 'v': '\v'}
+_SECUENCIA = re.compile(r'\\(.)')
+
+
+def leer_fila(linea):
+    """Inversa de ``_escapar``: una línea del formato texto de COPY -> lista de str/None."""
+    linea = linea.rstrip('\n')
+    return [
+        None if valor == '\\N' else _SECUENCIA.sub(lambda m: _ESCAPES.get(m.group(1), m.group(1)), valor)
+        for valor in linea.split('\t')
+    ]
+
+
+def filas_de_grupo(modelo, grupo_id):
+    """Queryset de las filas de ``modelo`` que pertenecen a la clínica."""
+    return modelo._base_manager.filter(**{ruta_a_grupo(modelo): grupo_id})
+
+
+def _queryset(modelo, grupo_id, filtro=None):
+    queryset = modelo._base_manager.all() if grupo_id is None else filas_de_grupo(modelo, grupo_id)
+    if filtro is not None:
+        queryset = queryset.filter(filtro)
+    return queryset.order_by().values_list(*_atributos_de(modelo))
+
+
+def _volcar_orm(modelo, grupo_id, destino, filtro=None):
+    for fila in _queryset(modelo, grupo_id, filtro).iterator(chunk_size=2000):
+        destino.write(('\t'.join(_escapar(v) for v in fila) + '\n').encode('utf-8'))
+
+
+def _particionada(cursor, tabla):
+    cursor.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [tabla])
+    fila = cursor.fetchone()
+    return bool(fila and fila[0])
+
+
+def _volcar_copy(modelo, grupo_id, destino, filtro=None):
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        crudo = cursor.cursor
+        if grupo_id is None and filtro is None:
+            tabla = quote(modelo._meta.db_table)
+            columnas = ', '.join(quote(c) for c in columnas_de(modelo))
+            if _particionada(cursor, modelo._meta.db_table):
+                # COPY tabla TO no acepta tablas particionadas (p. ej. cuentas_bitacora)
+                sentencia = f'COPY (SELECT {columnas} FROM {tabla}) TO STDOUT'
+            else:
+                sentencia = f'COPY {tabla} ({columnas}) TO STDOUT'
+        else:
+            # COPY no admite parámetros: el filtro se interpola del lado del cliente
+            sql, params = _queryset(modelo, grupo_id, filtro).query.sql_with_params()
+            consulta = crudo.mogrify(sql, params)
+            if isinstance(consulta, bytes):
+                consulta = consulta.decode()
+            sentencia = f'COPY ({consulta}) TO STDOUT'
+        if hasattr(crudo, 'copy_expert'):
+            # psycopg2
+            crudo.copy_expert(sentencia, destino, size=_BLOQUE)
+        else:
+            # psycopg 3
+            with crudo.copy(sentencia) as copia:
+                for bloque in copia:
+                    destino.write(bloque)
+
+
+def volcar_tabla(modelo, grupo_id, destino, filtro=None):
+    """
+    Escribe las filas de ``modelo`` (de la clínica ``grupo_id`` y que cumplan
+    ``filtro``, si se dan) en formato texto de COPY. Devuelve el conteo.
+    """
+    conteo = _Conteo(destino)
+    if connection.vendor == 'postgresql':
+        _volcar_copy(modelo, grupo_id, conteo, filtro)
+    else:
+        _volcar_orm(modelo, grupo_id, conteo, filtro)
+    return conteo
+
+
+def _esquema():
+    """Descripción de columnas de cada tabla (solo PostgreSQL), como en el respaldo anterior."""
+    if connection.vendor != 'postgresql':
+        return None
+    esquema = io.StringIO()
+    esquema.write("-- Esquema de la base de datos\n\n")
+    with connection.cursor() as cur:
+        cur.execute("""
+            SELECT table_name, column_name, data_type, character_maximum_length, is_nullable, column_default
+            FROM information_schema.columns
+            WHERE table_schema='public'
+            ORDER BY table_name, ordinal_position
+        """)
+        tabla_actual = None
+        for tabla, col_name, dtype, max_len, nullable, default in cur.fetchall():
+            if tabla != tabla_actual:
+                if tabla_actual is not None:
+                    esquema.write("\n")
+                esquema.write(f"-- Tabla: {tabla}\n")
+                tabla_actual = tabla
+            len_str = f"({max_len})" if max_len else ""
+            null_str = "NULL" if nullable == "YES" else "NOT NULL"
+            def_str = f" DEFAULT {default}" if default else ""
+            esquema.write(f"--   {col_name}: {dtype}{len_str} {null_str}{def_str}\n")
+    return esquema.getvalue()
+
+
+# ---------------------------------------------------------------------------
+# Zip
+# ---------------------------------------------------------------------------
+
+def copiar_a_zip(zf, nombre, archivo):
+    """Copia ``archivo`` desde el inicio a la entrada ``nombre`` de ``zf``, cediendo tras cada bloque."""
+    archivo.seek(0)
+    with zf.open(nombre, 'w', force_zip64=True) as entrada:
+        while True:
+            bloque = archivo.read(_BLOQUE)
+            if not bloque:
+                break
+            entrada.write(bloque)
+            yield
+
+
+def _partes(zf, grupo_id):
+    """
+    Escribe el respaldo en ``zf`` y cede el control después de cada bloque,
+    para que ``iterar_respaldo`` pueda vaciar lo escrito.
+    """
+    tablas, omitidas = [], []
+    for modelo in modelos_respaldables():
+        if grupo_id is not None and ruta_a_grupo(modelo) is None:
+            omitidas.append(modelo._meta.db_table)
+            continue
+        with tempfile.SpooledTemporaryFile(max_size=_EN_MEMORIA) as volcado:
+            conteo = volcar_tabla(modelo, grupo_id, volcado)
+            archivo = f'datos/{modelo._meta.db_table}.copy'
+            yield from copiar_a_zip(zf, archivo, volcado)
+        tablas.append({
+            'tabla': modelo._meta.db_table,
+            'modelo': modelo._meta.label,
+            'archivo': archivo,
+            'columnas': columnas_de(modelo),
+            'filas': conteo.filas,
+            'bytes': conteo.bytes,
+            'sha256': conteo.sha256.hexdigest(),
+        })
+
+    esquema = _esquema()
+    if esquema is not None:
+        zf.writestr('schema.sql', esquema)
+
+    manifiesto = {
+        'formato': FORMATO,
+        'version_formato': VERSION_FORMATO,
+        'generated_at': datetime.now().strftime("%Y%m%d_%H%M%S"),
+        'engine': connection.vendor,
+        'db_name': os.getenv("DB_NAME"),
+        'db_host': os.getenv("DB_HOST"),
+        'grupo_id': grupo_id,
+        'total_filas': sum(t['filas'] for t in tablas),
+        'tablas': tablas,
+        'omitidas': omitidas,
+    }
+    zf.writestr('manifest.json', json.dumps(manifiesto, indent=2, ensure_ascii=False))
+    yield
+
+
+def escribir_respaldo(destino, grupo_id=None):
+    """Escribe el zip completo en ``destino`` (binario, basta con ``write``)."""
+    with zipfile.ZipFile(destino, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for _ in _partes(zf, grupo_id):
+            pass
+    return destino
+
+
+class _Sumidero(io.RawIOBase):
+    """Destino sin ``seek`` para ZipFile: acumula lo escrito hasta que se vacía."""
+
+    def __init__(self):
+        self.partes = []
+
+    def writable(self):
+        return True
+
+    def write(self, datos):
+        self.partes.append(bytes(datos))
+        return len(datos)
+
+    def vaciar(self):
+        datos, self.partes = b''.join(self.partes), []
+        return datos
+
+
+def iterar_respaldo(grupo_id=None):
+    """Genera el zip del respaldo por bloques, para ``StreamingHttpResponse``."""
+    sumidero = _Sumidero()
+    with zipfile.ZipFile(sumidero, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+        for _ in _partes(zf, grupo_id):
+            datos = sumidero.vaciar()
+            if datos:
+                yield datos
+    datos = sumidero.vaciar()
+    if datos:
+        yield datos
@@ -0,0 +1,33 @@
+from rest_framework import serializers
+from rest_framework.reverse import reverse
+
+from .models import TrabajoReporte
+
+
+class TrabajoReporteSerializer(serializers.ModelSerializer):
+    solicitado_por_nombre = serializers.CharField(source='solicitado_por.nombre', read_only=True, default=None)
+    url_descarga = serializers.SerializerMethodField()
+
+    class Meta:
+        model = TrabajoReporte
+        fields = [
+            'id', 'tipo', 'estado', 'alcance_global', 'fecha_inicio', 'fecha_fin',
+            'solicitado_por', 'solicitado_por_nombre', 'nombre_archivo', 'content_type', 'tamano',
+            'intentos', 'error', 'fecha_creacion', 'fecha_inicio_proceso', 'fecha_fin_proceso',
+            'url_descarga',
+        ]
+        read_only_fields = [
+            'estado', 'alcance_global', 'solicitado_por', 'nombre_archivo', 'content_type', 'tamano',
+            'intentos', 'error', 'fecha_creacion', 'fecha_inicio_proceso', 'fecha_fin_proceso',
+        ]
+
+    def get_url_descarga(self, obj):
+        if obj.estado != 'COMPLETADO':
+            return None
+        return reverse('trabajos-reporte-descargar', args=[obj.id], request=self.context.get('request'))
+
+    def validate(self, data):
+        fecha_inicio, fecha_fin = data.get('fecha_inicio'), data.get('fecha_fin')
+        if fecha_inicio and fecha_fin and fecha_inicio > fecha_fin:
+            raise serializers.ValidationError("fecha_inicio no puede ser posterior a fecha_fin.")
+        return data
@@ -0,0 +1,384 @@
+# apps/reportes/snapshots.py
+"""
+Snapshots incrementales de una clínica y su restauración.
+
+Un snapshot es un zip en ``DIRECTORIO/grupo_<id>/`` con el mismo formato de
+datos que ``respaldo.py`` (texto de COPY comprimido, una entrada por tabla)
+más:
+
+- ``ids/<tabla>.ids``: las claves primarias que la clínica tiene en ese
+  momento en cada tabla (una por línea). Es lo que permite restaurar
+  borrados a partir de deltas.
+- ``manifest.json``: tipo (``completo``/``incremental``), snapshot ``base``
+  del que parte, instante ``hasta`` y, por tabla, la columna de marca de
+  agua usada, columnas, filas, bytes y sha256.
+
+El primer snapshot (o con ``completo=True``) vuelca todas las filas. Los
+siguientes solo las modificadas desde el ``hasta`` del anterior menos
+``MARGEN_SEGUNDOS`` (transacciones que confirmaron tarde), según la columna
+``auto_now`` del modelo (``fecha_modificacion``, ``ultimo_login``...) o
+``timestamp`` en la bitácora. Las tablas sin marca de agua (``Grupo``, las
+intermedias M2M) van completas siempre; son pocas filas.
+
+``restaurar`` aplica el último completo y los incrementales siguientes, en
+orden de dependencias y con ``INSERT ... ON CONFLICT DO UPDATE`` por lotes
+sobre la clave primaria real de cada tabla, y borra las filas de la clínica
+que no están en los ``ids`` del último.
+Todo en una transacción: si un sha256 no coincide no se escribe nada.
+"""
+import hashlib
+import io
+import json
+import os
+import tempfile
+import zipfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.core.management.color import no_style
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from apps.cuentas import versiones
+
+from . import respaldo
+
+
+_CONFIG_POR_DEFECTO = {
+    'DIRECTORIO': Path(settings.BASE_DIR) / 'archivo' / 'snapshots',
+    'MARGEN_SEGUNDOS': 300,   # solapamiento entre deltas; el upsert absorbe los repetidos
+}
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'SNAPSHOTS', {}) or {})
+    return config
+
+
+FORMATO = 'snapshot-copy-text'
+VERSION_FORMATO = 1
+
+# Datos de una clínica. Tipo_Atencion y SerieCitas entran porque Bloque_Horario
+# y Cita_Medica las referencian; los catálogos globales (Rol, Especialidad)
+# deben existir en la base de destino.
+MODELOS = [
+    'cuentas.Grupo',
+    'cuentas.Usuario',
+    'doctores.Medico',
+    'historiasDiagnosticos.Paciente',
+    'doctores.Tipo_Atencion',
+    'doctores.Bloque_Horario',
+    'citas_pagos.SerieCitas',
+    'citas_pagos.Cita_Medica',
+    'historiasDiagnosticos.PatologiasO',
+    'historiasDiagnosticos.TratamientoMedicacion',
+    'historiasDiagnosticos.ResultadoExamenes',
+    'cuentas.Bitacora',
+]
+
+
+class SnapshotInvalido(Exception):
+    pass
+
+
+def modelos_snapshot():
+    """Modelos del snapshot y sus tablas intermedias M2M, dependencias primero."""
+    modelos = [apps.get_model(etiqueta) for etiqueta in MODELOS]
+    for modelo in list(modelos):
+        for campo in modelo._meta.local_many_to_many:
+            intermedia = campo.remote_field.through
+            if intermedia._meta.auto_created and intermedia not in modelos:
+                modelos.append(intermedia)
+    return respaldo._ordenar_por_dependencias(modelos)
+
+
+def campo_marca(modelo):
+    """Columna que cambia en cada escritura de la fila, o None."""
+    for campo in modelo._meta.concrete_fields:
+        if isinstance(campo, models.DateTimeField) and campo.auto_now:
+            return campo.name
+    if any(campo.name == 'timestamp' for campo in modelo._meta.concrete_fields):
+        return 'timestamp'
+    return None
+
+
+def directorio_de(grupo_id, directorio=None):
+    return Path(directorio or _config()['DIRECTORIO']) / f'grupo_{grupo_id}'
+
+
+def listar(grupo_id, directorio=None):
+    """Snapshots de la clínica, del más viejo al más nuevo."""
+    carpeta = directorio_de(grupo_id, directorio)
+    if not carpeta.exists():
+        return []
+    return sorted(carpeta.glob('*.zip'))
+
+
+def leer_manifiesto(ruta):
+    with zipfile.ZipFile(ruta) as zf:
+        return json.loads(zf.read('manifest.json'))
+
+
+# ---------------------------------------------------------------------------
+# Snapshot
+# ---------------------------------------------------------------------------
+
+def snapshot(grupo_id, directorio=None, completo=False):
+    """Escribe el siguiente snapshot de la clínica. Devuelve ``(ruta, manifiesto)``."""
+    anteriores = listar(grupo_id, directorio)
+    base = None if completo or not anteriores else anteriores[-1]
+    desde = None
+    if base is not None:
+        hasta_base = datetime.fromisoformat(leer_manifiesto(base)['hasta'])
+        desde = hasta_base - timedelta(seconds=_config()['MARGEN_SEGUNDOS'])
+
+    carpeta = directorio_de(grupo_id, directorio)
+    carpeta.mkdir(parents=True, exist_ok=True)
+    ahora = timezone.now()
+    tipo = 'incremental' if base else 'completo'
+    ruta = carpeta / f'{ahora.strftime("%Y%m%dT%H%M%S%f")}_{tipo}.zip'
+    parcial = ruta.with_suffix('.parcial')
+
+    tablas = []
+    try:
+        with transaction.atomic(), zipfile.ZipFile(parcial, 'w', compression=zipfile.ZIP_DEFLATED) as zf:
+            if connection.vendor == 'postgresql':
+                # Todas las tablas desde la misma foto de la base
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+            for modelo in modelos_snapshot():
+                tablas.append(_volcar(zf, modelo, grupo_id, desde))
+            manifiesto = {
+                'formato': FORMATO,
+                'version_formato': VERSION_FORMATO,
+                'grupo_id': grupo_id,
+                'tipo': tipo,
+                'base': base.name if base else None,
+                'desde': desde.isoformat() if desde else None,
+                'hasta': ahora.isoformat(),
+                'engine': connection.vendor,
+                'total_filas': sum(t['filas'] for t in tablas),
+                'tablas': tablas,
+            }
+            zf.writestr('manifest.json', json.dumps(manifiesto, indent=2, ensure_ascii=False))
+        os.replace(parcial, ruta)
+    finally:
+        if parcial.exists():
+            parcial.unlink()
+    return ruta, manifiesto
+
+
+def _volcar(zf, modelo, grupo_id, desde):
+    tabla = modelo._meta.db_table
+    marca = campo_marca(modelo)
+    filtro = models.Q(**{f'{marca}__gt': desde}) if desde and marca else None
+
+    with tempfile.SpooledTemporaryFile(max_size=respaldo._EN_MEMORIA) as volcado:
+        conteo = respaldo.volcar_tabla(modelo, grupo_id, volcado, filtro)
+        for _ in respaldo.copiar_a_zip(zf, f'datos/{tabla}.copy', volcado):
+            pass
+
+    with tempfile.SpooledTemporaryFile(max_size=respaldo._EN_MEMORIA) as ids:
+        total_ids = 0
+        for pk in respaldo.filas_de_grupo(modelo, grupo_id).order_by().values_list('pk', flat=True).iterator(chunk_size=5000):
+            ids.write(f'{pk}\n'.encode())
+            total_ids += 1
+        for _ in respaldo.copiar_a_zip(zf, f'ids/{tabla}.ids', ids):
+            pass
+
+    return {
+        'tabla': tabla,
+        'modelo': modelo._meta.label,
+        'archivo': f'datos/{tabla}.copy',
+        'marca': marca if filtro is not None else None,
+        'columnas': respaldo.columnas_de(modelo),
+        'filas': conteo.filas,
+        'bytes': conteo.bytes,
+        'sha256': conteo.sha256.hexdigest(),
+        'ids': total_ids,
+    }
+
+
+# ---------------------------------------------------------------------------
+# Restauración
+# ---------------------------------------------------------------------------
+
+def cadena(grupo_id, directorio=None, hasta=None):
+    """
+    Snapshots a aplicar para llegar a ``hasta`` (nombre de archivo; por
+    defecto el último): el último completo y los incrementales posteriores.
+    """
+    rutas = listar(grupo_id, directorio)
+    if hasta:
+        nombres = [r.name for r in rutas]
+        if hasta not in nombres:
+            raise SnapshotInvalido(f"No existe el snapshot {hasta} de la clínica {grupo_id}.")
+        rutas = rutas[:nombres.index(hasta) + 1]
+    manifiestos = [(ruta, leer_manifiesto(ruta)) for ruta in rutas]
+    inicio = max((i for i, (_, m) in enumerate(manifiestos) if m['tipo'] == 'completo'), default=None)
+    if inicio is None:
+        raise SnapshotInvalido(f"No hay un snapshot completo de la clínica {grupo_id}.")
+    resultado = manifiestos[inicio:]
+    for (ruta_anterior, _), (ruta, manifiesto) in zip(resultado, resultado[1:]):
+        if manifiesto['base'] != ruta_anterior.name:
+            raise SnapshotInvalido(f"{ruta.name} parte de {manifiesto['base']}, no de {ruta_anterior.name}.")
+    return resultado
+
+
+def _lineas(zf, nombre, sha256_esperado=None):
+    """Líneas de una entrada del zip; al terminar verifica su sha256."""
+    digest = hashlib.sha256()
+    with zf.open(nombre) as entrada:
+        for linea in io.TextIOWrapper(_Digerido(entrada, digest), encoding='utf-8', newline='\n'):
+            yield linea
+    if sha256_esperado and digest.hexdigest() != sha256_esperado:
+        raise SnapshotInvalido(f"El sha256 de {nombre} no coincide con el manifiesto.")
+
+
+class _Digerido(io.RawIOBase):
+    def __init__(self, origen, digest):
+        self.origen = origen
+        self.digest = digest
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        datos = self.origen.read(len(buffer))
+        self.digest.update(datos)
+        buffer[:len(datos)] = datos
+        return len(datos)
+
+
+def _convertir(campo, texto):
+    if texto is None:
+        return None
+    if isinstance(campo, models.JSONField):
+        valor = json.loads(texto)
+    else:
+        valor = campo.to_python(texto)
+    return campo.get_db_prep_save(valor, connection)
+
+
+def clave_primaria(modelo):
+    """
+    Columnas de la clave primaria real de la tabla. No siempre es ``pk.column``:
+    la bitácora particionada tiene ``PRIMARY KEY (id, timestamp)``.
+    """
+    tabla = modelo._meta.db_table
+    with connection.cursor() as cursor:
+        restricciones = connection.introspection.get_constraints(cursor, tabla)
+    for restriccion in restricciones.values():
+        if restriccion['primary_key'] and restriccion['columns']:
+            return list(restriccion['columns'])
+    return [modelo._meta.pk.column]
+
+
+def _upsert(modelo, columnas, filas, clave):
+    quote = connection.ops.quote_name
+    lista = ', '.join(quote(c) for c in columnas)
+    fila_sql = '(' + ', '.join(['%s'] * len(columnas)) + ')'
+    actualizar = ', '.join(f'{quote(c)} = EXCLUDED.{quote(c)}' for c in columnas if c not in clave)
+    conflicto = f'DO UPDATE SET {actualizar}' if actualizar else 'DO NOTHING'
+    sql = (
+        f'INSERT INTO {quote(modelo._meta.db_table)} ({lista}) VALUES {", ".join([fila_sql] * len(filas))} '
+        f'ON CONFLICT ({", ".join(quote(c) for c in clave)}) {conflicto}'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [valor for fila in filas for valor in fila])
+
+
+def _cargar_tabla(zf, modelo, tabla):
+    campos = {campo.column: campo for campo in modelo._meta.local_concrete_fields}
+    if tabla['columnas'] != respaldo.columnas_de(modelo):
+        raise SnapshotInvalido(
+            f"Las columnas de {tabla['tabla']} en el snapshot no coinciden con el esquema actual."
+        )
+    columnas = tabla['columnas']
+    clave = clave_primaria(modelo)
+    limite = connection.features.max_query_params or 30000
+    tamano_lote = max(1, min(1000, limite // len(columnas)))
+    lote = []
+    for linea in _lineas(zf, tabla['archivo'], tabla['sha256']):
+        valores = respaldo.leer_fila(linea)
+        lote.append([_convertir(campos[c], v) for c, v in zip(columnas, valores)])
+        if len(lote) >= tamano_lote:
+            _upsert(modelo, columnas, lote, clave)
+            lote = []
+    if lote:
+        _upsert(modelo, columnas, lote, clave)
+
+
+def _borrar_ausentes(zf, manifiesto, grupo_id, modelos_por_tabla):
+    """Borra las filas de la clínica que no figuran en los ids del snapshot."""
+    quote = connection.ops.quote_name
+    borradas = {}
+    for tabla in reversed(manifiesto['tablas']):
+        modelo = modelos_por_tabla[tabla['tabla']]
+        pk = modelo._meta.pk
+        vigentes = {pk.to_python(linea.strip()) for linea in _lineas(zf, f"ids/{tabla['tabla']}.ids") if linea.strip()}
+        sobrantes = [
+            valor for valor in respaldo.filas_de_grupo(modelo, grupo_id).values_list('pk', flat=True)
+            if valor not in vigentes
+        ]
+        for i in range(0, len(sobrantes), 500):
+            trozo = sobrantes[i:i + 500]
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f'DELETE FROM {quote(tabla["tabla"])} WHERE {quote(pk.column)} IN ({", ".join(["%s"] * len(trozo))})',
+                    trozo,
+                )
+        if sobrantes:
+            borradas[tabla['tabla']] = len(sobrantes)
+    return borradas
+
+
+def restaurar(grupo_id, directorio=None, hasta=None, solo_verificar=False):
+    """
+    Restaura la clínica al estado del snapshot ``hasta`` (por defecto el
+    último). Devuelve ``{'snapshots': [...], 'filas': n, 'borradas': {...}}``.
+    """
+    pasos = cadena(grupo_id, directorio, hasta)
+    modelos_por_tabla = {m._meta.db_table: m for m in modelos_snapshot()}
+    for _, manifiesto in pasos:
+        if manifiesto.get('formato') != FORMATO or manifiesto['grupo_id'] != grupo_id:
+            raise SnapshotInvalido("El archivo no es un snapshot de esta clínica.")
+        desconocidas = {t['tabla'] for t in manifiesto['tablas']} - set(modelos_por_tabla)
+        if desconocidas:
+            raise SnapshotInvalido(f"Tablas desconocidas en el snapshot: {', '.join(sorted(desconocidas))}")
+
+    if solo_verificar:
+        for ruta, manifiesto in pasos:
+            with zipfile.ZipFile(ruta) as zf:
+                for tabla in manifiesto['tablas']:
+                    for _ in _lineas(zf, tabla['archivo'], tabla['sha256']):
+                        pass
+        return {'snapshots': [r.name for r, _ in pasos], 'filas': 0, 'borradas': {}}
+
+    filas = 0
+    with transaction.atomic():
+        for ruta, manifiesto in pasos:
+            with zipfile.ZipFile(ruta) as zf:
+                for tabla in manifiesto['tablas']:
+                    _cargar_tabla(zf, modelos_por_tabla[tabla['tabla']], tabla)
+                    filas += tabla['filas']
+        ruta_final, manifiesto_final = pasos[-1]
+        with zipfile.ZipFile(ruta_final) as zf:
+            borradas = _borrar_ausentes(zf, manifiesto_final, grupo_id, modelos_por_tabla)
+
+        # Las claves se insertaron explícitas: las secuencias deben quedar por encima
+        sentencias = connection.ops.sequence_reset_sql(no_style(), list(modelos_por_tabla.values()))
+        if sentencias:
+            with connection.cursor() as cursor:
+                for sentencia in sentencias:
+                    cursor.execute(sentencia)
+
+        # Los contadores de cupo son derivados: se reconstruyen en la próxima reserva
+        OcupacionBloque = apps.get_model('citas_pagos', 'OcupacionBloque')
+        OcupacionBloque.objects.filter(bloque_horario__grupo_id=grupo_id).delete()
+        versiones.incrementar([grupo_id])
+
+    return {'snapshots': [r.name for r, _ in pasos], 'filas': filas, 'borradas': borradas}
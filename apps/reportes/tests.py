@@ -1,3 +1,74 @@
+import tempfile
+from datetime import date
+from unittest import skipUnless
+
+from django.db import connection
 from django.test import TestCase
 
-# Create your tests here.
+from apps.cuentas.models import Bitacora, Grupo, Rol, Usuario
+
+from . import cache as cache_reportes
+from . import snapshots
+from .generadores import Alcance
+from .views import _respuesta_reporte_archivo
+
+
+class SnapshotRestauracionTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        rol = Rol.objects.create(nombre='administrador')
+        cls.grupo = Grupo.objects.create(nombre='Clínica Snapshot')
+        cls.usuario = Usuario.objects.create(
+            grupo=cls.grupo, nombre='Admin', password='x', correo='admin@snapshot.com', sexo='M',
+            fecha_nacimiento=date(1990, 1, 1), rol=rol,
+        )
+        cls.bitacoras = [
+            Bitacora.objects.create(grupo=cls.grupo, usuario=cls.usuario, accion=f'acción {i}')
+            for i in range(3)
+        ]
+
+    def setUp(self):
+        directorio = tempfile.TemporaryDirectory()
+        self.addCleanup(directorio.cleanup)
+        self.directorio = directorio.name
+
+    def test_restaurar_deshace_cambios_y_borrados(self):
+        snapshots.snapshot(self.grupo.id, self.directorio)
+        Usuario.objects.filter(pk=self.usuario.pk).update(nombre='Cambiado')
+        Bitacora.objects.filter(pk=self.bitacoras[0].pk).delete()
+        Bitacora.objects.filter(pk=self.bitacoras[1].pk).update(accion='editada')
+
+        snapshots.restaurar(self.grupo.id, self.directorio)
+
+        self.assertEqual(Usuario.objects.get(pk=self.usuario.pk).nombre, 'Admin')
+        self.assertEqual(
+            sorted(Bitacora.objects.filter(grupo=self.grupo).values_list('accion', flat=True)),
+            ['acción 0', 'acción 1', 'acción 2'],
+        )
+
+    @skipUnless(connection.vendor == 'postgresql', "La bitácora solo está particionada en PostgreSQL")
+    def test_conflicto_de_la_bitacora_usa_su_clave_compuesta(self):
+        self.assertEqual(snapshots.clave_primaria(Bitacora), ['id', 'timestamp'])
+
+
+class CacheReportesArchivoTests(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.grupo = Grupo.objects.create(nombre='Clínica Cache')
+
+    def setUp(self):
+        cache_reportes.get_cache().clear()
+
+    def _pedir(self, usuario):
+        _respuesta_reporte_archivo('pacientes_pdf', Alcance(self.grupo, False, usuario), None, None)
+
+    def test_pdf_con_autor_no_se_comparte_entre_usuarios(self):
+        antes = cache_reportes.estadisticas()
+        self._pedir('Ana')
+        self._pedir('Beto')
+        self._pedir('Ana')
+        despues = cache_reportes.estadisticas()
+        self.assertEqual(despues['guardadas'] - antes['guardadas'], 2)
+        self.assertEqual(despues['aciertos'] - antes['aciertos'], 1)
@@ -0,0 +1,265 @@
+# apps/reportes/trabajos.py
+"""
+Cola de reportes en segundo plano.
+
+Los reportes grandes (listados de superAdmin, rangos de un año) tardan más
+que un request razonable, así que también se pueden pedir como trabajo:
+
+- ``encolar`` crea un ``TrabajoReporte`` PENDIENTE, o devuelve el que ya
+  resuelve el mismo pedido (misma ``clave``: alcance, tipo y rango). Un
+  trabajo activo se comparte siempre; uno completado, si tiene menos de
+  ``REUTILIZAR_SEGUNDOS`` y su archivo sigue en disco. La restricción única
+  parcial sobre ``clave`` cubre dos POST simultáneos.
+- Un worker toma el siguiente trabajo con ``SELECT ... FOR UPDATE SKIP
+  LOCKED`` (varios workers no se pisan ni se esperan), genera el archivo con
+  ``generadores.generar`` en ``DIRECTORIO`` y lo deja listo para descargar.
+- ``MODO``: ``'proceso'`` (comando ``procesar_reportes``, recomendado en
+  producción), ``'hilos'`` (un pool de ``HILOS`` hilos en el mismo proceso
+  web, que arranca al confirmar la transacción del encolado) o
+  ``'sincrono'`` (se genera en el mismo request; útil en tests).
+- Los trabajos que quedan EN_PROCESO más de ``TIMEOUT_PROCESO`` (worker
+  caído) vuelven a la cola hasta ``MAX_INTENTOS``; los archivos de más de
+  ``RETENCION_HORAS`` se borran junto con su trabajo.
+"""
+import os
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+from django.utils import timezone
+
+from . import generadores
+from .generadores import Alcance
+from .models import TrabajoReporte
+
+
+_CONFIG_POR_DEFECTO = {
+    'MODO': 'proceso',            # 'proceso' | 'hilos' | 'sincrono'
+    'HILOS': 2,                   # tamaño del pool con MODO='hilos'
+    'DIRECTORIO': Path(settings.BASE_DIR) / 'archivo' / 'reportes',
+    'REUTILIZAR_SEGUNDOS': 300,   # un reporte completado se reutiliza durante este tiempo
+    'RETENCION_HORAS': 24,        # luego se borra el archivo y el trabajo
+    'TIMEOUT_PROCESO': 600,       # segundos EN_PROCESO antes de darlo por colgado
+    'MAX_INTENTOS': 3,
+    'INTERVALO_SONDEO': 2.0,      # segundos entre consultas del comando procesar_reportes
+}
+
+
+def _config():
+    config = dict(_CONFIG_POR_DEFECTO)
+    config.update(getattr(settings, 'REPORTES_JOBS', {}) or {})
+    return config
+
+
+def directorio():
+    return Path(_config()['DIRECTORIO'])
+
+
+def ruta_absoluta(trabajo):
+    return directorio() / trabajo.ruta_archivo
+
+
+def clave_de(tipo, alcance, fecha_inicio, fecha_fin):
+    if alcance.es_global:
+        ambito = 'global'
+    else:
+        ambito = f'grupo{alcance.grupo.id}' if alcance.grupo else 'sin-grupo'
+    return f'{tipo}:{ambito}:{fecha_inicio or "-"}:{fecha_fin or "-"}'
+
+
+# ---------------------------------------------------------------------------
+# Encolado
+# ---------------------------------------------------------------------------
+
+def _reutilizable(clave):
+    """Trabajo activo, o completado hace poco con su archivo todavía en disco."""
+    activo = TrabajoReporte.objects.filter(clave=clave, estado__in=TrabajoReporte.ESTADOS_ACTIVOS).first()
+    if activo:
+        return activo
+    limite = timezone.now() - timedelta(seconds=_config()['REUTILIZAR_SEGUNDOS'])
+    reciente = (
+        TrabajoReporte.objects
+        .filter(clave=clave, estado='COMPLETADO', fecha_fin_proceso__gte=limite)
+        .order_by('-fecha_fin_proceso')
+        .first()
+    )
+    if reciente and ruta_absoluta(reciente).exists():
+        return reciente
+    return None
+
+
+def encolar(tipo, usuario, fecha_inicio=None, fecha_fin=None):
+    """
+    Pide el reporte ``tipo`` con el alcance de ``usuario``. Devuelve
+    ``(trabajo, creado)``; ``creado`` es False si se reutilizó uno existente.
+    """
+    alcance = Alcance.de_usuario(usuario)
+    fecha_inicio, fecha_fin = generadores.resolver_fechas(tipo, fecha_inicio, fecha_fin)
+    clave = clave_de(tipo, alcance, fecha_inicio, fecha_fin)
+
+    existente = _reutilizable(clave)
+    if existente:
+        return existente, False
+    try:
+        with transaction.atomic():
+            trabajo = TrabajoReporte.objects.create(
+                tipo=tipo,
+                clave=clave,
+                grupo=None if alcance.es_global else alcance.grupo,
+                alcance_global=alcance.es_global,
+                fecha_inicio=fecha_inicio,
+                fecha_fin=fecha_fin,
+                solicitado_por=usuario,
+            )
+    except IntegrityError:
+        # Otro request encoló el mismo pedido entre la consulta y el INSERT
+        existente = _reutilizable(clave)
+        if existente:
+            return existente, False
+        raise
+    transaction.on_commit(_despertar)
+    return trabajo, True
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _procesar_en_hilo():
+    try:
+        procesar_pendientes()
+    finally:
+        close_old_connections()
+
+
+def _despertar():
+    modo = _config()['MODO']
+    if modo == 'sincrono':
+        procesar_pendientes()
+    elif modo == 'hilos':
+        global _executor
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=_config()['HILOS'], thread_name_prefix='reportes')
+        _executor.submit(_procesar_en_hilo)
+
+
+# ---------------------------------------------------------------------------
+# Worker
+# ---------------------------------------------------------------------------
+
+def tomar_siguiente():
+    """Marca EN_PROCESO el trabajo pendiente más antiguo y lo devuelve (o None)."""
+    with transaction.atomic():
+        trabajo = (
+            TrabajoReporte.objects
+            .select_for_update(skip_locked=True)
+            .filter(estado='PENDIENTE')
+            .order_by('fecha_creacion', 'id')
+            .first()
+        )
+        if trabajo is None:
+            return None
+        trabajo.estado = 'EN_PROCESO'
+        trabajo.intentos += 1
+        trabajo.fecha_inicio_proceso = timezone.now()
+        trabajo.error = ''
+        trabajo.save(update_fields=['estado', 'intentos', 'fecha_inicio_proceso', 'error'])
+    return trabajo
+
+
+def procesar(trabajo):
+    """Genera el archivo de un trabajo EN_PROCESO y lo marca COMPLETADO o lo reintenta."""
+    solicitante = trabajo.solicitado_por
+    alcance = Alcance(trabajo.grupo, trabajo.alcance_global, solicitante.nombre if solicitante else '')
+    relativa = Path(str(trabajo.id))
+    carpeta = directorio() / relativa
+    parcial = None
+    try:
+        carpeta.mkdir(parents=True, exist_ok=True)
+        parcial = carpeta / 'reporte.parcial'
+        with open(parcial, 'wb') as destino:
+            _, nombre, content_type = generadores.generar(
+                trabajo.tipo, alcance, trabajo.fecha_inicio, trabajo.fecha_fin, destino
+            )
+        # Se publica con un rename: nunca se sirve un archivo a medio escribir
+        final = carpeta / nombre
+        os.replace(parcial, final)
+    except Exception as e:
+        traceback.print_exc()
+        if parcial is not None and parcial.exists():
+            parcial.unlink()
+        reintentar = trabajo.intentos < _config()['MAX_INTENTOS']
+        trabajo.estado = 'PENDIENTE' if reintentar else 'FALLIDO'
+        trabajo.error = str(e)[:2000]
+        trabajo.fecha_fin_proceso = None if reintentar else timezone.now()
+        trabajo.save(update_fields=['estado', 'error', 'fecha_fin_proceso'])
+        return trabajo
+
+    trabajo.estado = 'COMPLETADO'
+    trabajo.ruta_archivo = str(relativa / nombre)
+    trabajo.nombre_archivo = nombre
+    trabajo.content_type = content_type
+    trabajo.tamano = final.stat().st_size
+    trabajo.fecha_fin_proceso = timezone.now()
+    trabajo.save(update_fields=[
+        'estado', 'ruta_archivo', 'nombre_archivo', 'content_type', 'tamano', 'fecha_fin_proceso',
+    ])
+    return trabajo
+
+
+def procesar_pendientes(limite=None):
+    """Procesa trabajos hasta vaciar la cola (o hasta ``limite``). Devuelve cuántos tomó."""
+    procesados = 0
+    while limite is None or procesados < limite:
+        trabajo = tomar_siguiente()
+        if trabajo is None:
+            break
+        procesar(trabajo)
+        procesados += 1
+    return procesados
+
+
+# ---------------------------------------------------------------------------
+# Mantenimiento
+# ---------------------------------------------------------------------------
+
+def recuperar_colgados():
+    """Devuelve a la cola (o marca FALLIDO) los trabajos EN_PROCESO de un worker caído."""
+    config = _config()
+    limite = timezone.now() - timedelta(seconds=config['TIMEOUT_PROCESO'])
+    colgados = TrabajoReporte.objects.filter(estado='EN_PROCESO', fecha_inicio_proceso__lt=limite)
+    fallidos = colgados.filter(intentos__gte=config['MAX_INTENTOS']).update(
+        estado='FALLIDO', error='Tiempo de proceso agotado.', fecha_fin_proceso=timezone.now()
+    )
+    reencolados = colgados.update(estado='PENDIENTE')
+    return reencolados, fallidos
+
+
+def _borrar_archivo(trabajo):
+    if not trabajo.ruta_archivo:
+        return
+    ruta = ruta_absoluta(trabajo)
+    try:
+        ruta.unlink(missing_ok=True)
+        ruta.parent.rmdir()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"No se pudo borrar el archivo del trabajo {trabajo.id}: {e}")
+
+
+def purgar_vencidos():
+    """Borra los trabajos terminados hace más de ``RETENCION_HORAS`` y sus archivos."""
+    limite = timezone.now() - timedelta(hours=_config()['RETENCION_HORAS'])
+    vencidos = TrabajoReporte.objects.filter(estado__in=['COMPLETADO', 'FALLIDO'], fecha_fin_proceso__lt=limite)
+    total = 0
+    for trabajo in vencidos.only('id', 'ruta_archivo').iterator():
+        _borrar_archivo(trabajo)
+        total += 1
+    vencidos.delete()
+    return total
@@ -1,6 +1,11 @@
-from django.urls import path
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
 from . import views
 from .views import download_backup_json_zip
+
+router = DefaultRouter()
+router.register(r'jobs', views.TrabajoReporteViewSet, basename='trabajos-reporte')
+
 urlpatterns = [
     #esta api es /api/reportes/pacientes_oloquesea/pdf/
     path('pacientes/pdf/', 
@@ -36,6 +41,10 @@ urlpatterns = [
          name='procesar_comando_voz'),
          
      path("backup/json-zip", download_backup_json_zip, name="backup-json-zip"),
+
+     path('cache/', views.estado_cache_reportes, name='estado_cache_reportes'),
+
+     path('', include(router.urls)),
     
 
 ]
\ No newline at end of file
@@ -1,9 +1,11 @@
 import os
 from django.shortcuts import render
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
 from io import BytesIO
 import io
+import tempfile
 import json
+import re
 import zipfile
 import traceback
 from django.apps import apps
@@ -15,11 +17,12 @@ from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph,
 from reportlab.lib import colors
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.enums import TA_CENTER,TA_LEFT, TA_RIGHT
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
 from datetime import date, datetime,time,timedelta,timezone
 from rest_framework.response import Response
-from rest_framework import status
+from rest_framework.renderers import JSONRenderer
+from rest_framework import status, viewsets
 from django.db.models import Count
 from django.db.models.functions import TruncDate, TruncMonth
 from openpyxl import Workbook
@@ -41,6 +44,16 @@ except ImportError:
     class Usuario: objects = type('obj', (object,), {'select_related': lambda *a, **k: Usuario.objects, 'get': lambda *a, **k: None})()
     class Rol: pass
 
+from apps.cuentas.tenant import get_tenant_context
+from apps.cuentas.utils import log_action
+from apps.cuentas.views import MultiTenantMixin
+from . import cache as cache_reportes
+from . import generadores, respaldo, trabajos
+from .generadores import Alcance
+from .models import TrabajoReporte
+from .pdf import MAX_EN_MEMORIA, respuesta_pdf
+from .serializers import TrabajoReporteSerializer
+
 try:
     from apps.citas_pagos.models import Cita_Medica
 except ImportError:
@@ -77,6 +90,53 @@ def _get_optional_date_range(request):
     return fecha_inicio, fecha_fin
 
 
+def _respuesta_cacheada(entrada):
+    response = HttpResponse(entrada.contenido, content_type=entrada.content_type)
+    if entrada.nombre:
+        response['Content-Disposition'] = f'attachment; filename="{entrada.nombre}"'
+    return response
+
+
+def _respuesta_json(clave, data):
+    """Renderiza ``data`` una vez y lo guarda en la caché de reportes."""
+    entrada = cache_reportes.Entrada(JSONRenderer().render(data), 'application/json', None)
+    cache_reportes.guardar(clave, entrada)
+    return _respuesta_cacheada(entrada)
+
+
+def _respuesta_reporte_archivo(tipo, alcance, fecha_inicio, fecha_fin):
+    """Sirve un reporte de generadores.py desde la caché de reportes o lo genera."""
+    parametros = {'fecha_inicio': fecha_inicio, 'fecha_fin': fecha_fin}
+    if tipo in generadores.TIPOS_CON_AUTOR:
+        # El encabezado nombra a quien lo pidió: no se comparte entre usuarios
+        parametros['generado_por'] = alcance.generado_por
+    clave = cache_reportes.clave(alcance, tipo, **parametros)
+    entrada = cache_reportes.obtener(clave)
+    if entrada is not None:
+        return _respuesta_cacheada(entrada)
+
+    archivo, nombre, content_type = generadores.generar(
+        tipo, alcance, fecha_inicio, fecha_fin,
+        destino=tempfile.SpooledTemporaryFile(max_size=MAX_EN_MEMORIA),
+    )
+    archivo.seek(0, os.SEEK_END)
+    tamano = archivo.tell()
+    archivo.seek(0)
+    es_pdf = content_type == generadores.CONTENT_TYPE_PDF
+    valido = not es_pdf or archivo.read(5) == b'%PDF-'
+    archivo.seek(0)
+    if not valido or not cache_reportes.cabe(tamano):
+        # Los archivos grandes se sirven sin copiarlos a memoria; respuesta_pdf reporta el PDF inválido
+        if es_pdf:
+            return respuesta_pdf(archivo, nombre)
+        return FileResponse(archivo, as_attachment=True, filename=nombre, content_type=content_type)
+
+    entrada = cache_reportes.Entrada(archivo.read(), content_type, nombre)
+    archivo.close()
+    cache_reportes.guardar(clave, entrada)
+    return _respuesta_cacheada(entrada)
+
+
 
 @api_view(['GET']) 
 @permission_classes([IsAuthenticated])
@@ -84,7 +144,9 @@ def generar_reporte_pacientes_pdf(request):
     
     try:
         auth_user = request.user 
-        usuario_perfil = Usuario.objects.select_related('rol', 'grupo').get(correo=auth_user.email)
+        usuario_perfil = get_tenant_context(request).usuario
+        if usuario_perfil is None:
+            raise Usuario.DoesNotExist
         
         admin_grupo = usuario_perfil.grupo
         admin_rol = usuario_perfil.rol
@@ -95,143 +157,19 @@ def generar_reporte_pacientes_pdf(request):
         traceback.print_exc()
         return HttpResponse(f"Error obteniendo perfil de usuario: {e}", status=500)
     fecha_inicio, fecha_fin = _get_optional_date_range(request)
-#filtrar pacientes por grupo
-    try:
-        pacientes_qs = Paciente.objects.select_related('usuario', 'usuario__grupo').order_by('usuario__nombre')
-        
-        if fecha_inicio and fecha_fin:
-            
-            pacientes_qs = pacientes_qs.filter(usuario__fecha_registro__date__range=[fecha_inicio, fecha_fin])
-            print(f"[DEBUG] Filtrando PDF de Pacientes por fechas: {fecha_inicio} a {fecha_fin}")
-        
-
-        if admin_rol and admin_rol.nombre == 'superAdmin':
-            pacientes_filtrados = pacientes_qs.all()
-            titulo_reporte = "Listado General de Pacientes (Todos los Grupos)"
-        elif admin_grupo:
-            pacientes_filtrados = pacientes_qs.filter(usuario__grupo=admin_grupo)
-            titulo_reporte = f"Listado de Pacientes - Clínica: {admin_grupo.nombre}"
-        else:
-            pacientes_filtrados = Paciente.objects.none()
-            titulo_reporte = "Listado de Pacientes (Sin Grupo Asignado)"
-
-        try:
-            total = pacientes_filtrados.count()
-        except Exception:
-            total = len(list(pacientes_filtrados)) # Fallback para queries complejas
-
-    except Exception as e:
-        traceback.print_exc()
-        return HttpResponse("Error al consultar la base de datos (ver consola).", status=500)
-
-    styles = getSampleStyleSheet()
-    
-    # Estilo para el Título
-    title_style = ParagraphStyle('title', parent=styles['Heading1'], alignment=TA_CENTER, fontName=(FONT_NAME or 'Helvetica-Bold'))
-    
-    # Estilo para celdas normales (centradas)
-    normal_center = ParagraphStyle('normal_center', parent=styles['Normal'], alignment=TA_CENTER, fontName=(FONT_NAME or 'Helvetica'))
-    
-    # Estilo para encabezados de tabla
-    header_style = ParagraphStyle('header', parent=normal_center, fontName=(FONT_NAME or 'Helvetica-Bold'))
-
-    normal_left = ParagraphStyle('normal_left', parent=styles['Normal'], 
-                                 alignment=TA_LEFT, fontName=(FONT_NAME or 'Helvetica'))
-    normal_right = ParagraphStyle('normal_right', parent=styles['Normal'], 
-                                  alignment=TA_RIGHT, fontName=(FONT_NAME or 'Helvetica'), fontSize=9)
-   
-
-    data = [
-        [
-            Paragraph("<b>N° Historia Clínica</b>", header_style),
-            Paragraph("<b>Nombre Completo</b>", header_style),
-            Paragraph("<b>Correo Electrónico</b>", header_style),
-            Paragraph("<b>ID Paciente</b>", header_style),
-        ]
-    ]
-
-    try:
-        for paciente in pacientes_filtrados: 
-            numero = getattr(paciente, 'numero_historia_clinica', '')
-            nombre = getattr(getattr(paciente, 'usuario', None), 'nombre', 'N/A')
-            correo = getattr(getattr(paciente, 'usuario', None), 'correo', 'N/A')
-            pid = getattr(paciente, 'id', 'N/A')
-            
-            data.append([
-                Paragraph(str(numero), normal_center),
-                Paragraph(str(nombre), normal_center),
-                Paragraph(str(correo), normal_center),
-                Paragraph(str(pid), normal_center),
-            ])
-    except Exception as e:
-        traceback.print_exc()
-        return HttpResponse("Error al preparar datos del PDF (ver consola).", status=500)
-
-    try:
-        if len(data) == 1: 
-            data.append([Paragraph("No se encontraron pacientes registrados para este grupo.", normal_center), "", "", ""])
-    except Exception:
-        pass 
 
-    #construye el pdf
+    #construye el pdf por partes o lo sirve de la cache (ver generadores.py y cache.py)
     try:
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=72, bottomMargin=72,title=titulo_reporte)
-        elements = []
-        
-        fecha_gen=datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        elements.append(Paragraph(f"Generado el: {fecha_gen} por {usuario_perfil.nombre}", normal_right))
-        elements.append(Spacer(1, 12))
-
-        elements.append(Paragraph(titulo_reporte, title_style))
-        elements.append(Spacer(1, 24))
-
-        total_registros = len(data) - 1 # Restamos la fila de encabezado
-        intro_texto = f"Este reporte detalla <b>{total_registros} paciente(s)</b>"
-        if fecha_inicio and fecha_fin:
-            intro_texto += f" registrado(s) entre las fechas <b>{fecha_inicio}</b> y <b>{fecha_fin}</b>."
-        else:
-            intro_texto += " (histórico completo)."
-        elements.append(Paragraph(intro_texto, normal_left))
-        elements.append(Spacer(1, 24))
-
-        table = Table(data, colWidths=[120, 150, 180, 80], repeatRows=1)
-        table_style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#839DB8")), 
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor("#E6F7FF")), 
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ])
-        table.setStyle(table_style)
-        elements.append(table)
-
-        doc.build(elements)
-        
-        buffer.seek(0)
-        pdf_bytes = buffer.read()
-        buffer.close()
-
-        if len(pdf_bytes) == 0:
-            return HttpResponse("Error: PDF generado está vacío. Revisa la consola.", status=500)
-        
-        head = pdf_bytes[:10]
-        if not head.startswith(b'%PDF-'):
-            print("[PDF] Error: El archivo no parece ser un PDF. Primeros bytes:", head)
-            return HttpResponse("Error: El contenido generado no es un PDF válido. Revisa la consola.", status=500)
-
-        
-        response = HttpResponse(pdf_bytes, content_type='application/pdf')
-        response['Content-Disposition'] = f'attachment; filename="listado_pacientes_{admin_grupo.id if admin_grupo else "super"}.pdf"'
-        response['Content-Length'] = str(len(pdf_bytes))
-        return response
-
+        return _respuesta_reporte_archivo(
+            'pacientes_pdf',
+            Alcance.de_usuario(usuario_perfil),
+            *generadores.resolver_fechas('pacientes_pdf', fecha_inicio, fecha_fin),
+        )
     except Exception as e:
         traceback.print_exc()
         return HttpResponse("Error interno generando el PDF. Revisa la consola.", status=500)
 
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def generar_reporte_medicos_pdf(request):
@@ -239,7 +177,9 @@ def generar_reporte_medicos_pdf(request):
     #obetenerl el grupo
     try:
         auth_user = request.user
-        usuario_perfil = Usuario.objects.select_related('rol', 'grupo').get(correo=auth_user.email)
+        usuario_perfil = get_tenant_context(request).usuario
+        if usuario_perfil is None:
+            raise Usuario.DoesNotExist
         admin_grupo = usuario_perfil.grupo
         admin_rol = usuario_perfil.rol
     except Usuario.DoesNotExist:
@@ -248,139 +188,20 @@ def generar_reporte_medicos_pdf(request):
         traceback.print_exc()
         return HttpResponse(f"Error obteniendo perfil de usuario: {e}", status=500)
     fecha_inicio, fecha_fin = _get_optional_date_range(request)
-    #filtrar por grupo
-    try:
-        rol_medico = Rol.objects.get(nombre='medico')
-        medicos_qs = Usuario.objects.select_related('grupo', 'rol').filter(rol=rol_medico).order_by('nombre')
-
-        if fecha_inicio and fecha_fin:
-            # El campo de fecha está en el mismo modelo Usuario
-            medicos_qs = medicos_qs.filter(fecha_registro__date__range=[fecha_inicio, fecha_fin])
-            print(f"[DEBUG] Filtrando PDF de Médicos por fechas: {fecha_inicio} a {fecha_fin}")
-        
-
-        if admin_rol and admin_rol.nombre == 'superAdmin':
-            medicos_filtrados = medicos_qs.all()
-            titulo_reporte = "Listado General de Médicos (Todos los Grupos)"
-        elif admin_grupo:
-            medicos_filtrados = medicos_qs.filter(grupo=admin_grupo)
-            titulo_reporte = f"Listado de Médicos - Clínica: {admin_grupo.nombre}"
-        else:
-            medicos_filtrados = Usuario.objects.none()
-            titulo_reporte = "Listado de Médicos (Sin Grupo Asignado)"
-
-        try:
-            total = medicos_filtrados.count()
-        except Exception:
-            total = len(list(medicos_filtrados))
 
+    #construye el pdf por partes o lo sirve de la cache (ver generadores.py y cache.py)
+    try:
+        return _respuesta_reporte_archivo(
+            'medicos_pdf',
+            Alcance.de_usuario(usuario_perfil),
+            *generadores.resolver_fechas('medicos_pdf', fecha_inicio, fecha_fin),
+        )
     except Rol.DoesNotExist:
         return HttpResponse("Error: El Rol 'medico' no existe en la base de datos.", status=500)
-    except Exception as e:
-        traceback.print_exc()
-        return HttpResponse("Error al consultar la base de datos (ver consola).", status=500)
-
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('title', parent=styles['Heading1'], alignment=TA_CENTER, fontName=(FONT_NAME or 'Helvetica-Bold'))
-    normal_center = ParagraphStyle('normal_center', parent=styles['Normal'], alignment=TA_CENTER, fontName=(FONT_NAME or 'Helvetica'))
-    header_style = ParagraphStyle('header', parent=normal_center, fontName=(FONT_NAME or 'Helvetica-Bold'))
-    normal_left = ParagraphStyle('normal_left', parent=styles['Normal'], alignment=TA_LEFT, fontName=(FONT_NAME or 'Helvetica'))
-    normal_right = ParagraphStyle('normal_right', parent=styles['Normal'], alignment=TA_RIGHT, fontName=(FONT_NAME or 'Helvetica'), fontSize=9)
-    
-
-    data = [
-        [
-            Paragraph("<b>Nombre Completo</b>", header_style),
-            Paragraph("<b>Correo Electrónico</b>", header_style),
-            Paragraph("<b>Teléfono</b>", header_style),
-            Paragraph("<b>ID Médico</b>", header_style),
-        ]
-    ]
-
-    try:
-        for medico in medicos_filtrados: 
-            nombre = getattr(medico, 'nombre', 'N/A')
-            correo = getattr(medico, 'correo', 'N/A')
-            telefono = getattr(medico, 'telefono', '') 
-            mid = getattr(medico, 'id', 'N/A')
-            
-            data.append([
-                Paragraph(str(nombre), normal_center),
-                Paragraph(str(correo), normal_center),
-                Paragraph(str(telefono), normal_center),
-                Paragraph(str(mid), normal_center),
-            ])
-    except Exception as e:
-        traceback.print_exc()
-        return HttpResponse("Error al preparar datos del PDF (ver consola).", status=500)
-
-    # Mensaje si no hay datos
-    try:
-        if len(data) == 1:
-            data.append([Paragraph("No se encontraron médicos registrados para este grupo.", normal_center), "", "", ""])
-    except Exception:
-        pass
-
-    #construccion del documento solo pdf 
-    try:
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=72, bottomMargin=72,title=titulo_reporte)
-        elements = []
-        
-        fecha_gen = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        elements.append(Paragraph(f"Generado el: {fecha_gen} por {usuario_perfil.nombre}", normal_right))
-        elements.append(Spacer(1, 12))
-        elements.append(Paragraph(titulo_reporte, title_style))
-        elements.append(Spacer(1, 12))
-
-        total_registros = len(data) - 1 # Restamos la fila de encabezado
-        intro_texto = f"Este reporte detalla <b>{total_registros} médico(s)</b>"
-        if fecha_inicio and fecha_fin:
-            intro_texto += f" registrado(s) entre las fechas <b>{fecha_inicio}</b> y <b>{fecha_fin}</b>."
-        else:
-            intro_texto += " (histórico completo)."
-        elements.append(Paragraph(intro_texto, normal_left))
-        elements.append(Spacer(1, 24))
-
-        elements.append(Spacer(1, 24))
-
-        table = Table(data, colWidths=[180, 180, 80, 80], repeatRows=1)
-        table_style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#318666")), 
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor("#E6F7FF")),
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ])
-        table.setStyle(table_style)
-        elements.append(table)
-
-        doc.build(elements)
-        
-        buffer.seek(0)
-        pdf_bytes = buffer.read()
-        buffer.close()
-
-        if len(pdf_bytes) == 0:
-            return HttpResponse("Error: PDF generado está vacío. Revisa la consola.", status=500)
-        
-        head = pdf_bytes[:10]
-        if not head.startswith(b'%PDF-'):
-            print("[PDF] Error: El archivo no parece ser un PDF. Primeros bytes:", head)
-            return HttpResponse("Error: El contenido generado no es un PDF válido. Revisa la consola.", status=500)
-
-        response = HttpResponse(pdf_bytes, content_type='application/pdf')
-        filename = f'listado_medicos_{admin_grupo.id if admin_grupo else "super"}.pdf'
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Content-Length'] = str(len(pdf_bytes))
-        return response
-
     except Exception as e:
         traceback.print_exc()
         return HttpResponse("Error interno generando el PDF. Revisa la consola.", status=500)
-    
+
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -389,7 +210,9 @@ def generar_reporte_citas_pdf(request):
     #obtener el grupo
     try:
         auth_user = request.user
-        usuario_perfil = Usuario.objects.select_related('rol', 'grupo').get(correo=auth_user.email)
+        usuario_perfil = get_tenant_context(request).usuario
+        if usuario_perfil is None:
+            raise Usuario.DoesNotExist
         admin_grupo = usuario_perfil.grupo
         admin_rol = usuario_perfil.rol
     except Usuario.DoesNotExist:
@@ -398,151 +221,19 @@ def generar_reporte_citas_pdf(request):
         traceback.print_exc()
         return HttpResponse(f"Error obteniendo perfil de usuario: {e}", status=500)
     fecha_inicio, fecha_fin = _get_optional_date_range(request)
-    try:
-        citas_qs = Cita_Medica.objects.select_related(
-            'paciente__usuario',
-            'grupo'
-        ).order_by('-fecha', '-hora_inicio')
-
-        if fecha_inicio and fecha_fin:
-            # El campo de fecha está en el mismo modelo Cita_Medica
-            citas_qs = citas_qs.filter(fecha__range=[fecha_inicio, fecha_fin])
-            print(f"[DEBUG] Filtrando PDF de Citas por fechas: {fecha_inicio} a {fecha_fin}")
-        
-
-        if admin_rol and admin_rol.nombre == 'superAdmin':
-            citas_filtradas = citas_qs.all()
-            titulo_reporte = "Reporte General de Citas (Todos los Grupos)"
-        elif admin_grupo:
-            citas_filtradas = citas_qs.filter(grupo=admin_grupo)
-            titulo_reporte = f"Reporte de Citas - Clínica: {admin_grupo.nombre}"
-        else:
-            citas_filtradas = Cita_Medica.objects.none()
-            titulo_reporte = "Reporte de Citas (Sin Grupo Asignado)"
-
-        try:
-            total = citas_filtradas.count()
-        except Exception:
-            total = len(list(citas_filtradas))
-
-    except Exception as e:
-        traceback.print_exc()
-        return HttpResponse("Error al consultar la base de datos (ver consola).", status=500)
-
-
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle('title', parent=styles['Heading1'], alignment=TA_CENTER, fontName=(FONT_NAME or 'Helvetica-Bold'))
-    normal_center = ParagraphStyle('normal_center', parent=styles['Normal'], alignment=TA_CENTER, fontName=(FONT_NAME or 'Helvetica'))
-    header_style = ParagraphStyle('header', parent=normal_center, fontName=(FONT_NAME or 'Helvetica-Bold'))
-    normal_left = ParagraphStyle('normal_left', parent=styles['Normal'], alignment=TA_LEFT, fontName=(FONT_NAME or 'Helvetica'))
-    normal_right = ParagraphStyle('normal_right', parent=styles['Normal'], alignment=TA_RIGHT, fontName=(FONT_NAME or 'Helvetica'), fontSize=9)
-    
-    data = [
-        [
-            Paragraph("<b>Fecha</b>", header_style),
-            Paragraph("<b>Hora</b>", header_style),
-            Paragraph("<b>Paciente</b>", header_style),
-            Paragraph("<b>Estado</b>", header_style),
-            Paragraph("<b>ID Cita</b>", header_style),
-        ]
-    ]
-
-    try:
-        for cita in citas_filtradas:
-            fecha = getattr(cita, 'fecha', 'N/A')
-            hora_inicio = getattr(cita, 'hora_inicio', time(0,0))
-        
-            paciente_nombre = getattr(getattr(getattr(cita, 'paciente', None), 'usuario', None), 'nombre', 'N/A')
-            
-            estado = cita.get_estado_cita_display() if hasattr(cita, 'get_estado_cita_display') else getattr(cita, 'estado_cita', 'N/A')
-            
-            cid = getattr(cita, 'id', 'N/A')
-            
-            data.append([
-                Paragraph(str(fecha), normal_center),
-                Paragraph(str(hora_inicio)[:5], normal_center), 
-                Paragraph(str(paciente_nombre), normal_center),
-                Paragraph(str(estado), normal_center),
-                Paragraph(str(cid), normal_center),
-            ])
-    except Exception as e:
-        traceback.print_exc()
-        return HttpResponse("Error al preparar datos del PDF (ver consola).", status=500)
 
-    
-    try:
-        if len(data) == 1:
-            data.append([Paragraph("No se encontraron citas registradas para este grupo.", normal_center), "", "", "", ""])
-    except Exception:
-        pass
-
-    
+    #construye el pdf por partes o lo sirve de la cache (ver generadores.py y cache.py)
     try:
-        buffer = BytesIO()
-        doc = SimpleDocTemplate(buffer, pagesize=letter, topMargin=72, bottomMargin=72,title=titulo_reporte)
-        elements = []
-
-        fecha_gen = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        elements.append(Paragraph(f"Generado el: {fecha_gen} por {usuario_perfil.nombre}", normal_right))
-        elements.append(Spacer(1, 12))
-        
-        elements.append(Paragraph(titulo_reporte, title_style))
-        elements.append(Spacer(1, 12))
-
-        total_registros = len(data) - 1 # Restamos la fila de encabezado
-        intro_texto = f"Este reporte detalla <b>{total_registros} cita(s)</b>"
-        if fecha_inicio and fecha_fin:
-            intro_texto += f" agendada(s) entre las fechas <b>{fecha_inicio}</b> y <b>{fecha_fin}</b>."
-        else:
-            intro_texto += " (histórico completo)."
-        elements.append(Paragraph(intro_texto, normal_left))
-        elements.append(Spacer(1, 24))
-
-        elements.append(Spacer(1, 24))
-
-    
-        table = Table(data, colWidths=[80, 60, 200, 100, 50], repeatRows=1)
-        table_style = TableStyle([
-            ('BACKGROUND', (0, 0), (-1, 0), colors.HexColor("#8AD0E8")), 
-            ('TEXTCOLOR', (0, 0), (-1, 0), colors.whitesmoke),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('GRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('BACKGROUND', (0, 1), (-1, -1), colors.HexColor("#E6F7FF")), 
-            ('FONTSIZE', (0, 0), (-1, -1), 9),
-        ])
-        table.setStyle(table_style)
-        elements.append(table)
-
-        doc.build(elements)
-        
-        buffer.seek(0)
-        pdf_bytes = buffer.read()
-        buffer.close()
-
-        if len(pdf_bytes) == 0:
-            return HttpResponse("Error: PDF generado está vacío. Revisa la consola.", status=500)
-        
-        head = pdf_bytes[:10]
-        if not head.startswith(b'%PDF-'):
-            print("[PDF] Error: El archivo no parece ser un PDF. Primeros bytes:", head)
-            return HttpResponse("Error: El contenido generado no es un PDF válido. Revisa la consola.", status=500)
-
-        
-        response = HttpResponse(pdf_bytes, content_type='application/pdf')
-        filename = f'reporte_citas_{admin_grupo.id if admin_grupo else "super"}.pdf'
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Content-Length'] = str(len(pdf_bytes))
-        return response
-
+        return _respuesta_reporte_archivo(
+            'citas_pdf',
+            Alcance.de_usuario(usuario_perfil),
+            *generadores.resolver_fechas('citas_pdf', fecha_inicio, fecha_fin),
+        )
     except Exception as e:
         traceback.print_exc()
         return HttpResponse("Error interno generando el PDF. Revisa la consola.", status=500)
 
 
-
-
-
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def reporte_citas_por_dia(request):
@@ -550,7 +241,9 @@ def reporte_citas_por_dia(request):
     #usuario 
     try:
         auth_user = request.user
-        usuario_perfil = Usuario.objects.select_related('rol', 'grupo').get(correo=auth_user.email)
+        usuario_perfil = get_tenant_context(request).usuario
+        if usuario_perfil is None:
+            raise Usuario.DoesNotExist
         admin_grupo = usuario_perfil.grupo
         admin_rol = usuario_perfil.rol
     except Usuario.DoesNotExist:
@@ -587,6 +280,14 @@ def reporte_citas_por_dia(request):
     except Exception as e:
         return Response({"error": f"Error procesando fechas: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
+    #mismos datos y mismas fechas: se sirve de la cache (ver cache.py)
+    clave = cache_reportes.clave(
+        Alcance.de_usuario(usuario_perfil), 'citas_por_dia', fecha_inicio=fecha_inicio_dt, fecha_fin=fecha_fin_dt
+    )
+    entrada = cache_reportes.obtener(clave)
+    if entrada is not None:
+        return _respuesta_cacheada(entrada)
+
     #filtrar datos por grupos
     try:
         citas_qs_base = Cita_Medica.objects.filter(
@@ -643,7 +344,7 @@ def reporte_citas_por_dia(request):
             "lista_citas": lista_citas
         }
         
-        return Response(response_data, status=status.HTTP_200_OK)
+        return _respuesta_json(clave, response_data)
 
     except Exception as e:
         traceback.print_exc()
@@ -661,7 +362,9 @@ def generar_reporte_citas_excel(request):
     #obtener el grupo por el usuario
     try:
         auth_user = request.user
-        usuario_perfil = Usuario.objects.select_related('rol', 'grupo').get(correo=auth_user.email)
+        usuario_perfil = get_tenant_context(request).usuario
+        if usuario_perfil is None:
+            raise Usuario.DoesNotExist
         admin_grupo = usuario_perfil.grupo
         admin_rol = usuario_perfil.rol
     except Usuario.DoesNotExist:
@@ -687,99 +390,17 @@ def generar_reporte_citas_excel(request):
     except Exception as e:
         return HttpResponse(f"Error procesando fechas: {e}", status=400)
 
-    #filtrar datos
+    #generar el excel o servirlo de la cache (ver generadores.py y cache.py)
     try:
-        citas_qs_base = Cita_Medica.objects.filter(
-            fecha__range=[fecha_inicio_dt, fecha_fin_dt]
+        return _respuesta_reporte_archivo(
+            'citas_excel', Alcance.de_usuario(usuario_perfil), fecha_inicio_dt, fecha_fin_dt
         )
 
-        if admin_rol and admin_rol.nombre == 'superAdmin':
-            citas_filtrados = citas_qs_base.select_related(
-                'paciente__usuario', 'grupo'
-            ).order_by('-fecha', '-hora_inicio')
-            titulo_reporte = f"Reporte Citas {fecha_inicio_dt} a {fecha_fin_dt} (Todos)"
-        elif admin_grupo:
-            citas_filtrados = citas_qs_base.filter(grupo=admin_grupo).select_related(
-                'paciente__usuario'
-            ).order_by('-fecha', '-hora_inicio')
-            titulo_reporte = f"Reporte Citas {fecha_inicio_dt} a {fecha_fin_dt} ({admin_grupo.nombre})"
-        else:
-            citas_filtrados = Cita_Medica.objects.none()
-            titulo_reporte = "Reporte Citas (Sin Grupo)"
-
     except Exception as e:
         traceback.print_exc()
-        return HttpResponse("Error al consultar la base de datos (ver consola).", status=500)
+        return HttpResponse("Error interno generando el archivo Excel. Revisa la consola.", status=500)
 
-    #generar el archivo excel
-    try:
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Reporte de Citas"
-
-        #estilos del archivo(es solo una tabla gaaaaaaaa)
-        header_font = Font(bold=True, color="FFFFFF")
-        header_fill = PatternFill(start_color="004A99", end_color="004A99", fill_type="solid")  
-        center_align = Alignment(horizontal="center", vertical="center")
-        thin_border = Border(left=Side(style='thin'), right=Side(style='thin'),
-        top=Side(style='thin'), bottom=Side(style='thin'))
-        #encabezados
-        headers = ["ID Cita", "Fecha", "Hora Inicio", "Hora Fin", "Paciente", "Estado", "Notas"]
-        ws.append(headers)
-        
-        for col_num, header in enumerate(headers, 1):
-            cell = ws.cell(row=1, column=col_num)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = center_align
-
-        # datos
-        row_num = 2
-        for cita in citas_filtrados:
-            paciente_nombre = getattr(getattr(getattr(cita, 'paciente', None), 'usuario', None), 'nombre', 'N/A')
-            estado = cita.get_estado_cita_display() if hasattr(cita, 'get_estado_cita_display') else getattr(cita, 'estado_cita', 'N/A')
-            
-            ws.append([
-                cita.id,
-                cita.fecha,
-                cita.hora_inicio,
-                cita.hora_fin,
-                paciente_nombre,
-                estado,
-                getattr(cita, 'notas', '')
-            ])
-            
-            #formatos
-            ws[f'B{row_num}'].number_format = 'YYYY-MM-DD'
-            ws[f'C{row_num}'].number_format = 'hh:mm'
-            ws[f'D{row_num}'].number_format = 'hh:mm'
-            row_num += 1
-            
-        
-        for col in ws.columns:
-            max_length = 0
-            column = col[0].column_letter 
-            for cell in col:
-                try:
-                    if len(str(cell.value)) > max_length:
-                        max_length = len(cell.value)
-                except:
-                    pass
-            adjusted_width = (max_length + 2)
-            ws.column_dimensions[column].width = adjusted_width
-
-        response = HttpResponse(
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
-        )
-        filename = f'reporte_citas_{admin_grupo.id if admin_grupo else "super"}_{fecha_inicio_dt}_a_{fecha_fin_dt}.xlsx'
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        
-        wb.save(response)
-        return response
 
-    except Exception as e:
-        traceback.print_exc()
-        return HttpResponse("Error interno generando el archivo Excel. Revisa la consola.", status=500)
 
 
 
@@ -790,7 +411,9 @@ def reporte_pacientes_por_mes_json(request):
     #obtener grupo
     try:
         auth_user = request.user 
-        usuario_perfil = Usuario.objects.select_related('rol', 'grupo').get(correo=auth_user.email)
+        usuario_perfil = get_tenant_context(request).usuario
+        if usuario_perfil is None:
+            raise Usuario.DoesNotExist
         admin_grupo = usuario_perfil.grupo
         admin_rol = usuario_perfil.rol
     except Usuario.DoesNotExist:
@@ -813,6 +436,13 @@ def reporte_pacientes_por_mes_json(request):
     except Exception as e:
         return Response({"error": f"Formato de fecha inválido: {e}"}, status=status.HTTP_400_BAD_REQUEST)
 
+    clave = cache_reportes.clave(
+        Alcance.de_usuario(usuario_perfil), 'pacientes_por_mes', fecha_inicio=fecha_inicio, fecha_fin=fecha_fin
+    )
+    entrada = cache_reportes.obtener(clave)
+    if entrada is not None:
+        return _respuesta_cacheada(entrada)
+
     #Filtrar Pacientes
     try:
         pacientes_qs = Paciente.objects.filter(
@@ -856,10 +486,10 @@ def reporte_pacientes_por_mes_json(request):
             for p in lista_pacientes_detalle
         ]
         
-        return Response({
+        return _respuesta_json(clave, {
             "datos_grafico": datos_grafico_formato,
             "lista_pacientes": lista_pacientes_formato
-        }, status=status.HTTP_200_OK)
+        })
 
     except Exception as e:
         traceback.print_exc()
@@ -872,7 +502,9 @@ def generar_reporte_pacientes_excel(request):
     
     try:
         auth_user = request.user 
-        usuario_perfil = Usuario.objects.select_related('rol', 'grupo').get(correo=auth_user.email)
+        usuario_perfil = get_tenant_context(request).usuario
+        if usuario_perfil is None:
+            raise Usuario.DoesNotExist
         admin_grupo = usuario_perfil.grupo
         admin_rol = usuario_perfil.rol
     except Usuario.DoesNotExist:
@@ -894,60 +526,16 @@ def generar_reporte_pacientes_excel(request):
 
     
     try:
-        pacientes_qs = Paciente.objects.filter(
-            usuario__fecha_registro__date__range=[fecha_inicio, fecha_fin]
-        )
-
-        if admin_rol and admin_rol.nombre == 'superAdmin':
-            pacientes_filtrados = pacientes_qs.select_related('usuario').order_by('-usuario__fecha_registro')
-            titulo_reporte = "Reporte de Pacientes Nuevos (Todos los Grupos)"
-        elif admin_grupo:
-            pacientes_filtrados = pacientes_qs.filter(usuario__grupo=admin_grupo).select_related('usuario').order_by('-usuario__fecha_registro')
-            titulo_reporte = f"Reporte de Pacientes Nuevos - Clínica: {admin_grupo.nombre}"
-        else:
-            pacientes_filtrados = Paciente.objects.none() 
-            titulo_reporte = "Reporte de Pacientes Nuevos (Sin Grupo Asignado)"
-
-    except Exception as e:
-        traceback.print_exc()
-        return HttpResponse("Error al consultar la BD (ver consola).", status=500)
-
-    try:
-        workbook = Workbook()
-        sheet = workbook.active
-        sheet.title = "Pacientes Nuevos"
-        #encabezado
-        sheet.append(["ID Paciente", "N° Historia Clínica", "Nombre Completo", "Correo", "Teléfono", "Fecha Registro"])
-
-        #datos
-        for paciente in pacientes_filtrados:
-            sheet.append([
-                paciente.id,
-                paciente.numero_historia_clinica,
-                paciente.usuario.nombre,
-                paciente.usuario.correo,
-                paciente.usuario.telefono or '',
-                paciente.usuario.fecha_registro.strftime('%Y-%m-%d %H:%M')
-            ])
-        
-        buffer = BytesIO()
-        workbook.save(buffer)
-        buffer.seek(0)
-        excel_bytes = buffer.read()
-        buffer.close()
-
-        response = HttpResponse(
-            excel_bytes, 
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+        return _respuesta_reporte_archivo(
+            'pacientes_excel', Alcance.de_usuario(usuario_perfil), fecha_inicio, fecha_fin
         )
-        response['Content-Disposition'] = f'attachment; filename="reporte_pacientes_nuevos_{fecha_inicio_str}_a_{fecha_fin_str}.xlsx"'
-        return response
 
     except Exception as e:
         traceback.print_exc()
         return HttpResponse("Error interno generando el Excel. Revisa la consola.", status=500)
     
 
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def procesar_comando_voz_json(request):
@@ -1026,97 +614,137 @@ def procesar_comando_voz_json(request):
 #     resp["Content-Disposition"] = f'attachment; filename="backup_json_{ts}.zip"'
 #     return resp
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
 def download_backup_json_zip(request):
+    """
+    Respaldo en zip (COPY por tabla + manifest.json, ver respaldo.py) que se
+    envía mientras se genera. superAdmin respalda todo o una clínica con
+    ?grupo=<id>; el administrador de una clínica, solo la suya. Para una
+    descarga reanudable, pedirlo como trabajo ``respaldo_zip``.
+    """
+    tenant = get_tenant_context(request)
+    if tenant.es_super_admin:
+        grupo = request.query_params.get('grupo')
+        try:
+            grupo_id = int(grupo) if grupo else None
+        except ValueError:
+            return Response({"error": "grupo debe ser un id numérico."}, status=status.HTTP_400_BAD_REQUEST)
+    elif tenant.rol_nombre == 'administrador' and tenant.grupo:
+        grupo_id = tenant.grupo.id
+    else:
+        return Response({'error': 'No tienes permisos para esta acción'}, status=status.HTTP_403_FORBIDDEN)
+
     ts = datetime.now().strftime("%Y%m%d_%H%M%S")
-    buf = io.BytesIO()
+    resp = StreamingHttpResponse(respaldo.iterar_respaldo(grupo_id), content_type="application/zip")
+    resp["Content-Disposition"] = f'attachment; filename="backup_{grupo_id or "completo"}_{ts}.zip"'
+    return resp
 
-    with zipfile.ZipFile(buf, "w", compression=zipfile.ZIP_DEFLATED) as zf:
-        # 1) Datos de cada modelo en SQL (1 archivo por modelo)
-        for model in apps.get_models():
-            label = model._meta.label  # p.ej. "app.Modelo"
-            table_name = model._meta.db_table
-            
-            sql_buf = io.StringIO()
-            sql_buf.write(f"-- Backup de {label}\n")
-            sql_buf.write(f"-- Tabla: {table_name}\n\n")
-            
-            # Obtener nombres de columnas
-            fields = [f.column for f in model._meta.fields]
-            columns_str = ", ".join(fields)
-            
-            # Generar INSERTs
-            for row in model.objects.all().values().iterator(chunk_size=1000):
-                values = []
-                for field_name in fields:
-                    value = row.get(field_name)
-                    
-                    # Formatear el valor según su tipo
-                    if value is None:
-                        values.append("NULL")
-                    elif isinstance(value, bool):
-                        values.append("TRUE" if value else "FALSE")
-                    elif isinstance(value, (int, float)):
-                        values.append(str(value))
-                    elif isinstance(value, datetime):
-                        values.append(f"'{value.isoformat()}'")
-                    elif isinstance(value, date):
-                        values.append(f"'{value.isoformat()}'")
-                    else:
-                        # Escapar comillas simples
-                        escaped = str(value).replace("'", "''")
-                        values.append(f"'{escaped}'")
-                
-                values_str = ", ".join(values)
-                sql_buf.write(f"INSERT INTO {table_name} ({columns_str}) VALUES ({values_str});\n")
-            
-            sql_buf.write("\n")
-            zf.writestr(f"{label}.sql", sql_buf.getvalue())
-
-        # 2) Esquema completo (CREATE TABLE statements)
-        with connection.cursor() as cur:
-            cur.execute("""
-                SELECT table_name
-                FROM information_schema.tables
-                WHERE table_schema='public' AND table_type='BASE TABLE'
-                ORDER BY table_name
-            """)
-            tables = [row[0] for row in cur.fetchall()]
-            
-            schema_sql = io.StringIO()
-            schema_sql.write("-- Esquema de la base de datos\n\n")
-            
-            for table in tables:
-                cur.execute(f"""
-                    SELECT column_name, data_type, character_maximum_length, 
-                    is_nullable, column_default
-                    FROM information_schema.columns
-                    WHERE table_name = %s AND table_schema='public'
-                    ORDER BY ordinal_position
-                """, [table])
-                
-                schema_sql.write(f"-- Tabla: {table}\n")
-                for col_name, dtype, max_len, nullable, default in cur.fetchall():
-                    len_str = f"({max_len})" if max_len else ""
-                    null_str = "NULL" if nullable == "YES" else "NOT NULL"
-                    def_str = f" DEFAULT {default}" if default else ""
-                    schema_sql.write(f"--   {col_name}: {dtype}{len_str} {null_str}{def_str}\n")
-                schema_sql.write("\n")
-            
-            zf.writestr("schema.sql", schema_sql.getvalue())
-
-        # 3) Metadatos
-        meta = {
-            "generated_at": ts,
-            "db_name": os.getenv("DB_NAME"),
-            "db_user": os.getenv("DB_USER"),
-            "db_host": os.getenv("DB_HOST"),
-            "db_port": os.getenv("DB_PORT"),
-            "engine": "postgresql (via Django ORM)",
-            "format": "SQL INSERT statements"
-        }
-        zf.writestr("metadata.json", json.dumps(meta, indent=2))
 
-    buf.seek(0)
-    resp = HttpResponse(buf.getvalue(), content_type="application/zip")
-    resp["Content-Disposition"] = f'attachment; filename="backup_sql_{ts}.zip"'
-    return resp
\ No newline at end of file
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def estado_cache_reportes(request):
+    """Aciertos, fallos y ocupación de la caché de reportes de este proceso (solo super admin)"""
+    if not get_tenant_context(request).es_super_admin:
+        return Response({'error': 'No tienes permisos para esta acción'}, status=status.HTTP_403_FORBIDDEN)
+    return Response(cache_reportes.estadisticas())
+
+
+_RANGO = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def _respuesta_con_rango(request, ruta, nombre, content_type):
+    """
+    FileResponse que además atiende un único ``Range: bytes=a-b``, para que
+    una descarga grande interrumpida se pueda retomar.
+    """
+    tamano = ruta.stat().st_size
+    rango = _RANGO.match(request.headers.get('Range', '').strip())
+    if not rango or not any(rango.groups()):
+        response = FileResponse(open(ruta, 'rb'), as_attachment=True, filename=nombre, content_type=content_type)
+        response['Accept-Ranges'] = 'bytes'
+        return response
+
+    inicio, fin = rango.groups()
+    if inicio:
+        inicio, fin = int(inicio), min(int(fin), tamano - 1) if fin else tamano - 1
+    else:
+        # bytes=-N: los últimos N bytes
+        inicio, fin = max(tamano - int(fin), 0), tamano - 1
+    if inicio > fin or inicio >= tamano:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{tamano}'
+        return response
+
+    def _partes(archivo, pendiente):
+        with archivo:
+            archivo.seek(inicio)
+            while pendiente > 0:
+                bloque = archivo.read(min(64 * 1024, pendiente))
+                if not bloque:
+                    break
+                pendiente -= len(bloque)
+                yield bloque
+
+    response = StreamingHttpResponse(_partes(open(ruta, 'rb'), fin - inicio + 1), status=206, content_type=content_type)
+    response['Content-Range'] = f'bytes {inicio}-{fin}/{tamano}'
+    response['Content-Length'] = str(fin - inicio + 1)
+    response['Accept-Ranges'] = 'bytes'
+    response['Content-Disposition'] = f'attachment; filename="{nombre}"'
+    return response
+
+
+class TrabajoReporteViewSet(MultiTenantMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Reportes en segundo plano: POST encola (o reutiliza un pedido igual) y
+    responde 202; el cliente consulta el estado y, cuando está COMPLETADO,
+    descarga el archivo (ver trabajos.py).
+    """
+    queryset = TrabajoReporte.objects.all().select_related('solicitado_por')
+    serializer_class = TrabajoReporteSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.is_super_admin():
+            return queryset
+        grupo = self.get_user_grupo()
+        if not grupo:
+            return queryset.none()
+        return queryset.filter(grupo=grupo, alcance_global=False)
+
+    def create(self, request, *args, **kwargs):
+        usuario = get_tenant_context(request).usuario
+        if usuario is None:
+            return Response({"detail": "Perfil de usuario no encontrado."}, status=status.HTTP_403_FORBIDDEN)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if serializer.validated_data['tipo'] in generadores.TIPOS_SOLO_ADMINISTRADOR and \
+                get_tenant_context(request).rol_nombre not in ('superAdmin', 'administrador'):
+            return Response({'error': 'No tienes permisos para esta acción'}, status=status.HTTP_403_FORBIDDEN)
+        trabajo, creado = trabajos.encolar(
+            serializer.validated_data['tipo'],
+            usuario,
+            serializer.validated_data.get('fecha_inicio'),
+            serializer.validated_data.get('fecha_fin'),
+        )
+        if creado:
+            log_action(request=request, accion=f"Solicitó el reporte {trabajo.tipo}", objeto=f"Trabajo ID: {trabajo.id}")
+            # Con MODO 'sincrono' ya puede estar terminado
+            trabajo.refresh_from_db()
+        data = self.get_serializer(trabajo).data
+        data['reutilizado'] = not creado
+        return Response(data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=True, methods=['get'])
+    def descargar(self, request, pk=None):
+        trabajo = self.get_object()
+        if trabajo.estado != 'COMPLETADO':
+            return Response(
+                {"detail": f"El reporte todavía no está listo (estado: {trabajo.estado}).", "estado": trabajo.estado},
+                status=status.HTTP_409_CONFLICT,
+            )
+        ruta = trabajos.ruta_absoluta(trabajo)
+        if not ruta.exists():
+            return Response({"detail": "El archivo del reporte ya no está disponible."}, status=status.HTTP_410_GONE)
+        return _respuesta_con_rango(request, ruta, trabajo.nombre_archivo, trabajo.content_type)
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.6 on 2026-10-17 04:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('suscripciones', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='plan',
+            name='retencion_bitacora_meses',
+            field=models.PositiveSmallIntegerField(default=12, help_text='Meses de bitácora que se conservan antes de archivarla'),
+        ),
+    ]
@@ -12,6 +12,10 @@ class Plan(models.Model):
     limite_almacenamiento_gb = models.IntegerField(default=1)
     soporte_prioritario = models.BooleanField(default=False)
     reportes= models.BooleanField(default=False)
+    retencion_bitacora_meses = models.PositiveSmallIntegerField(
+        default=12,
+        help_text="Meses de bitácora que se conservan antes de archivarla"
+    )
     pagination_class=None
     
     def __str__(self):
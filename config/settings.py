@@ -124,13 +124,99 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'apps.cuentas.authentication.CachedTokenAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
 }
 
+# Caché de identidad para CachedTokenAuthentication (token -> User -> Usuario).
+# AUTH_CACHE_ALIAS apunta a un alias de CACHES compartido (Redis/Memcached);
+# sin él solo se usa el LRU local de cada proceso.
+AUTH_PERFIL_CACHE = {
+    'TTL_LOCAL': int(os.getenv('AUTH_CACHE_TTL_LOCAL', 30)),
+    'TTL_COMPARTIDA': int(os.getenv('AUTH_CACHE_TTL_COMPARTIDA', 300)),
+    'MAX_ENTRADAS': int(os.getenv('AUTH_CACHE_MAX_ENTRADAS', 2048)),
+    'ALIAS': os.getenv('AUTH_CACHE_ALIAS') or None,
+}
+
+# Escritura por lotes de la bitácora (apps/cuentas/audit.py).
+# BITACORA_MODO=sincrono escribe cada registro en el request (tests).
+BITACORA_BUFFER = {
+    'MODO': os.getenv('BITACORA_MODO', 'async'),
+    'CAPACIDAD': int(os.getenv('BITACORA_CAPACIDAD', 10000)),
+    'TAMANO_LOTE': int(os.getenv('BITACORA_TAMANO_LOTE', 200)),
+    'INTERVALO_FLUSH': float(os.getenv('BITACORA_INTERVALO_FLUSH', 1.0)),
+    'POLITICA_LLENO': os.getenv('BITACORA_POLITICA_LLENO', 'sincrono'),
+}
+
+# Retención y archivado de la bitácora (comando mantener_bitacora).
+# La retención de cada clínica sale de Plan.retencion_bitacora_meses.
+BITACORA_RETENCION_MESES = int(os.getenv('BITACORA_RETENCION_MESES', 12))
+BITACORA_ARCHIVO_DIR = os.getenv('BITACORA_ARCHIVO_DIR') or BASE_DIR / 'archivo' / 'bitacora'
+
+# Caché de ocupación de turnos (apps/citas_pagos/ocupacion.py). Para que la
+# compartan todos los workers, OCUPACION_CACHE_ALIAS debe apuntar a un backend
+# compartido (Redis/Memcached) declarado en CACHES.
+OCUPACION_CACHE = {
+    'ALIAS': os.getenv('OCUPACION_CACHE_ALIAS', 'default'),
+    'TTL': int(os.getenv('OCUPACION_CACHE_TTL', 300)),
+}
+
+# Series de citas recurrentes (apps/citas_pagos/series.py). Solo se generan
+# las citas de las próximas SEMANAS_VENTANA semanas; el comando
+# extender_series corre la ventana.
+SERIES_CITAS = {
+    'SEMANAS_VENTANA': int(os.getenv('SERIES_CITAS_SEMANAS_VENTANA', 8)),
+    'MAX_OCURRENCIAS': int(os.getenv('SERIES_CITAS_MAX_OCURRENCIAS', 104)),
+}
+
+# Cola de reportes en segundo plano (apps/reportes/trabajos.py). Con
+# MODO='proceso' los genera el comando procesar_reportes; 'hilos' usa un pool
+# dentro del proceso web y 'sincrono' los genera en el mismo request.
+REPORTES_JOBS = {
+    'MODO': os.getenv('REPORTES_JOBS_MODO', 'proceso'),
+    'HILOS': int(os.getenv('REPORTES_JOBS_HILOS', 2)),
+    'DIRECTORIO': os.getenv('REPORTES_JOBS_DIRECTORIO') or BASE_DIR / 'archivo' / 'reportes',
+    'REUTILIZAR_SEGUNDOS': int(os.getenv('REPORTES_JOBS_REUTILIZAR_SEGUNDOS', 300)),
+    'RETENCION_HORAS': int(os.getenv('REPORTES_JOBS_RETENCION_HORAS', 24)),
+}
+
+# Caché de reportes por versión de datos de la clínica (apps/reportes/cache.py).
+# Es un LRU de cada proceso con presupuesto en bytes.
+REPORTES_CACHE = {
+    'ACTIVA': os.getenv('REPORTES_CACHE_ACTIVA', 'true').lower() == 'true',
+    'MAX_BYTES': int(os.getenv('REPORTES_CACHE_MAX_BYTES', 64 * 1024 * 1024)),
+    'MAX_BYTES_ENTRADA': int(os.getenv('REPORTES_CACHE_MAX_BYTES_ENTRADA', 8 * 1024 * 1024)),
+}
+
+# Snapshots incrementales por clínica (apps/reportes/snapshots.py, comandos
+# snapshot y restore).
+SNAPSHOTS = {
+    'DIRECTORIO': os.getenv('SNAPSHOTS_DIRECTORIO') or BASE_DIR / 'archivo' / 'snapshots',
+    'MARGEN_SEGUNDOS': int(os.getenv('SNAPSHOTS_MARGEN_SEGUNDOS', 300)),
+}
+
+# ETL incremental del DataMart de BI (apps/business_intelligence/etl.py)
+BI_ETL = {
+    'MARGEN_SEGUNDOS': int(os.getenv('BI_ETL_MARGEN_SEGUNDOS', 300)),
+    'LOTE': int(os.getenv('BI_ETL_LOTE', 2000)),
+    'PARTICION': int(os.getenv('BI_ETL_PARTICION', 20000)),
+    'HILOS': int(os.getenv('BI_ETL_HILOS', 4)),
+    'MODO': os.getenv('BI_ETL_MODO', 'hilos'),
+    'CADA_MINUTOS': int(os.getenv('BI_ETL_CADA_MINUTOS', 60)),
+}
+
+# Cubo en memoria de /api/bi/analytics/cube/ (apps/business_intelligence/cubo.py).
+# Cada proceso guarda hasta MAX_CUBOS clínicas; las de más de MAX_FILAS hechos
+# no se cargan y siguen usando el dashboard.
+BI_CUBO = {
+    'ACTIVO': os.getenv('BI_CUBO_ACTIVO', 'true').lower() == 'true',
+    'MAX_CUBOS': int(os.getenv('BI_CUBO_MAX_CUBOS', 4)),
+    'MAX_FILAS': int(os.getenv('BI_CUBO_MAX_FILAS', 1000000)),
+}
+
 # API Keys
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 